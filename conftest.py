@@ -10,3 +10,11 @@ def pytest_addoption(parser):
 @pytest.fixture
 def longtests(request):
     return request.config.getoption('--longtests')
+
+
+@pytest.fixture(autouse=True)
+def map_cache_dir(tmp_path_factory, monkeypatch):
+    """Keep compiled chord map artifacts out of the user's cache directory."""
+    directory = tmp_path_factory.mktemp('map-cache')
+    monkeypatch.setenv('MELLOWCHORD_CACHE_DIR', str(directory))
+    return directory
@@ -1,13 +1,31 @@
 from .mellowchord import apply_inversion  # noqa: F401
 from .mellowchord import chord_in  # noqa: F401
+from .mellowchord import chord_numeral  # noqa: F401
 from .mellowchord import raise_or_lower_an_octave  # noqa: F401
 from .mellowchord import _split_bass  # noqa: F401
 from .mellowchord import scale_from_key_string  # noqa: F401
 from .mellowchord import string_to_chord  # noqa: F401
 from .mellowchord import string_to_keyed_chord  # noqa: F401
+from .mellowchord import sequence_keyed_chord  # noqa: F401
 from .mellowchord import Chord  # noqa: F401
 from .mellowchord import _ChordGraphNode  # noqa: F401
 from .mellowchord import ChordMap  # noqa: F401
+from .mellowchord import FrozenMapError  # noqa: F401
+from .mellowchord import ConcurrentModificationError  # noqa: F401
+from .mellowchord import Shard  # noqa: F401
+from .mellowchord import EnumerationCursor  # noqa: F401
+from .mellowchord import ChordMapFormatError  # noqa: F401
+from .mellowchord import BUILTIN_CHORD_MAP  # noqa: F401
+from .mellowchord import chord_map_definition_from_json  # noqa: F401
+from .mellowchord import load_chord_map_definition  # noqa: F401
+from .mellowchord import parse_chord_map_definition  # noqa: F401
+from .mellowchord import parse_map_chord  # noqa: F401
+from .mellowchord import third_degree  # noqa: F401
+from .mellowchord import fifth_degree  # noqa: F401
+from .mellowchord import ALL_KEYS  # noqa: F401
+from .mellowchord import MAJOR_KEYS  # noqa: F401
+from .mellowchord import MINOR_KEYS  # noqa: F401
+from .mellowchord import key_is_minor  # noqa: F401
 from .mellowchord import iiim  # noqa: F401
 from .mellowchord import iim  # noqa: F401
 from .mellowchord import IM  # noqa: F401
@@ -37,6 +55,81 @@ from .mellowchord import InvalidArgumentError  # noqa: F401
 from .mellowchord import MellowchordError  # noqa: F401
 from .mellowchord import write_chord_sequence_json  # noqa: F401
 from .mellowchord import read_chord_sequence_json  # noqa: F401
+from .mellowchord import write_chord_sequence_ndjson  # noqa: F401
+from .mellowchord import chord_sequence_ndjson_line  # noqa: F401
+from .mellowchord import melody_ndjson_line  # noqa: F401
+from .mellowchord import read_chord_sequence_ndjson  # noqa: F401
+from .mellowchord import read_chord_sequence_ndjson_batches  # noqa: F401
 from .mellowchord import MelodyGenerator  # noqa: F401
 from .mellowchord import write_midi_file  # noqa: F401
-from .cli import main  # noqa: F401
+from .instrument import instrumented  # noqa: F401
+from .instrument import profiler  # noqa: F401
+from .instrument import RecentSamples  # noqa: F401
+from .batch import find_chord_sequence_files  # noqa: F401
+from .batch import gen_melodies_for_file  # noqa: F401
+from .batch import gen_melodies_for_files  # noqa: F401
+from .batch import map_in_processes  # noqa: F401
+from .batch import MelodyFileResult  # noqa: F401
+from .codec import ChordSequenceCodec  # noqa: F401
+from .compose import compose_ndjson_line  # noqa: F401
+from .compose import ComposeBudget  # noqa: F401
+from .compose import Composer  # noqa: F401
+from .dedupe import find_near_duplicates  # noqa: F401
+from .dedupe import lsh_parameters  # noqa: F401
+from .dedupe import MinHasher  # noqa: F401
+from .dedupe import NearDuplicateIndex  # noqa: F401
+from .follow import ChordFollower  # noqa: F401
+from .follow import ScriptedInputPort  # noqa: F401
+from .library import ChordLibrary  # noqa: F401
+from .library import ChordLibraryWriter  # noqa: F401
+from .library import LibraryFormatError  # noqa: F401
+from .library import json_to_library  # noqa: F401
+from .library import library_to_json  # noqa: F401
+from .library import read_sequences  # noqa: F401
+from .library import slice_library  # noqa: F401
+from .library import write_library  # noqa: F401
+from .mapcache import cached_chord_map  # noqa: F401
+from .mapcache import MapArtifactError  # noqa: F401
+from .checkpoint import Checkpoint  # noqa: F401
+from .checkpoint import CheckpointError  # noqa: F401
+from .checkpoint import CheckpointWriter  # noqa: F401
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL  # noqa: F401
+from .analyze import analyze_files  # noqa: F401
+from .analyze import analyze_midi_file  # noqa: F401
+from .analyze import AnalysisError  # noqa: F401
+from .analyze import ChordTable  # noqa: F401
+from .analyze import detect_key  # noqa: F401
+from .analyze import find_midi_files  # noqa: F401
+from .analyze import MidiAnalysis  # noqa: F401
+from .analyze import pitch_class_mask  # noqa: F401
+from .archive import ArchiveError  # noqa: F401
+from .archive import rebuild_index  # noqa: F401
+from .archive import SequenceArchive  # noqa: F401
+from .archive import SequenceArchiveWriter  # noqa: F401
+from .catalog import parse_progression  # noqa: F401
+from .catalog import SequenceCatalog  # noqa: F401
+from .stream import ChordStream  # noqa: F401
+from .stream import EventRing  # noqa: F401
+from .stream import NullOutputPort  # noqa: F401
+from .stream import StreamError  # noqa: F401
+from .transitions import train_transition_counts  # noqa: F401
+from .transitions import TransitionCounts  # noqa: F401
+from .transitions import TransitionCountsError  # noqa: F401
+from .transpose import gen_sequence_all_keys  # noqa: F401
+from .transpose import Transposer  # noqa: F401
+from .trie import SequenceTrie  # noqa: F401
+from .validate import MelodyStreamValidator  # noqa: F401
+from .validate import MelodyValidationError  # noqa: F401
+from .validate import pack_melodies  # noqa: F401
+from .validate import slot_masks  # noqa: F401
+from .validate import validate_melodies  # noqa: F401
+from .validate import ValidationResult  # noqa: F401
+
+
+def __getattr__(name):
+    # The command line interface pulls in configargparse, so it is only
+    # imported when main is first looked up (e.g. by the mc entry point).
+    if name == 'main':
+        from .cli import main
+        return main
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,272 @@
+"""Chord recognition from MIDI files, the reverse of write_midi_file.
+
+Notes that start together are grouped, and each group is identified as a
+KeyedChord through a ChordTable: for one key, a list indexed by the 12-bit
+set of pitch classes in the group, each entry of which gives the chord
+(degree, type and inversion) for every possible bass note.  Identifying a
+chord is two list lookups however many chord types there are.
+
+When no key is given, the key is the one of ALL_KEYS whose table
+recognizes the most groups, preferring keys whose scale they are built
+from and then keys whose tonic chord is heard most often.
+"""
+import json
+import os
+
+from .batch import map_in_processes
+from .mellowchord import ALL_KEYS
+from .mellowchord import Chord
+from .mellowchord import InvalidArgumentError
+from .mellowchord import KeyedChord
+from .mellowchord import KeyedChordEncoder
+from .mellowchord import MellowchordError
+from .mellowchord import scale_from_key_string
+from .mellowchord import validate_key
+
+
+# Chord types recognized, in order of preference when two of them spell
+# the same pitch classes over the same bass (e.g. Csus2 and Gsus4/C)
+CHORD_TYPES = ('maj', 'min', 'dom7', 'min7', 'maj7', 'dim', 'm7dim5', 'sus4', 'sus2', 'aug', 'aug7', 'dim7')
+MIDI_EXTENSIONS = ('.mid', '.midi')
+# Notes starting within this many beats of the first note of a group
+# belong to the group
+DEFAULT_TOLERANCE = 1 / 16
+# write_midi_file puts melodies on a track of this name
+DEFAULT_EXCLUDE_TRACKS = ('melody',)
+PERCUSSION_CHANNEL = 9
+
+
+class AnalysisError(MellowchordError):
+    pass
+
+
+def pitch_class_mask(midi_notes):
+    """Return the set of pitch classes of midi_notes as a 12-bit int."""
+    mask = 0
+    for note in midi_notes:
+        mask |= 1 << (note % 12)
+    return mask
+
+
+class ChordTable(object):
+    """Table of the chords of one key by pitch class set and bass note."""
+    _tables = {}
+
+    def __init__(self, key):
+        validate_key(key)
+        self.key = key
+        self.scale_mask = pitch_class_mask(note.midi_note() for note in scale_from_key_string(key).notes)
+        self._keyed_chords = {}
+        # Entries for a mask map every bass pitch class to (degree,
+        # chord_type, inversion, midi note of the bass with no octave
+        # adjustment)
+        entries = {}
+        chords = []
+        for chord_type in CHORD_TYPES:
+            for degree in range(1, 8):
+                notes = KeyedChord(key, Chord(degree, chord_type)).notes
+                pitch_classes = [note.midi_note() % 12 for note in notes]
+                entries.setdefault(pitch_class_mask(pitch_classes), [None] * 12)
+                chords.append((degree, chord_type, notes, pitch_classes))
+        # Later passes overwrite earlier ones, and within a pass preferred
+        # chords overwrite the rest, so a chord in root position beats one
+        # in an inversion over the same bass.  A bass note that is none of
+        # root, third or fifth (e.g. the seventh) is taken as root position.
+        # Each pass is (inversion, index of the bass note in the chord,
+        # index of the lowest note without inversion, octaves it moves by).
+        passes = ((None, 3, 0, 0), (2, 2, 2, -1), (1, 1, 1, 0), (None, 0, 0, 0))
+        for inversion, bass_index, lowest_index, octave in passes:
+            for degree, chord_type, notes, pitch_classes in reversed(chords):
+                if bass_index < len(notes):
+                    entry = entries[pitch_class_mask(pitch_classes)]
+                    lowest = notes[lowest_index].midi_note() + 12 * octave
+                    entry[pitch_classes[bass_index]] = (degree, chord_type, inversion, lowest)
+        self._table = [None] * 4096
+        for mask, entry in entries.items():
+            self._table[mask] = tuple(entry)
+
+    @classmethod
+    def for_key(cls, key):
+        """Return the shared ChordTable for key, building it the first
+        time."""
+        try:
+            return cls._tables[key]
+        except KeyError:
+            table = cls._tables[key] = cls(key)
+            return table
+
+    def lookup(self, mask, bass_pitch_class):
+        """Return (degree, chord_type, inversion, bass midi note) of the
+        chord spelled by mask over bass_pitch_class, or None."""
+        entry = self._table[mask]
+        if entry is None:
+            return None
+        return entry[bass_pitch_class]
+
+    def entries(self):
+        """Return the set of every (degree, chord_type, inversion, bass midi
+        note) lookup can return."""
+        return {chord for entry in self._table if entry is not None for chord in entry if chord is not None}
+
+    def keyed_chord(self, degree, chord_type, inversion, octave_adjustment):
+        """Return the shared KeyedChord for these attributes in this key."""
+        attributes = (degree, chord_type, inversion, octave_adjustment)
+        try:
+            return self._keyed_chords[attributes]
+        except KeyError:
+            keyed_chord = KeyedChord(self.key, Chord(*attributes))
+            self._keyed_chords[attributes] = keyed_chord
+            return keyed_chord
+
+    def identify(self, midi_notes):
+        """Return the KeyedChord played by midi_notes, voiced in the octave
+        of its lowest note, or None if they aren't a chord in this key."""
+        bass = min(midi_notes)
+        found = self.lookup(pitch_class_mask(midi_notes), bass % 12)
+        if found is None:
+            return None
+        degree, chord_type, inversion, unadjusted_bass = found
+        return self.keyed_chord(degree, chord_type, inversion, round((bass - unadjusted_bass) / 12))
+
+
+def read_note_groups(path, tolerance=DEFAULT_TOLERANCE, exclude_tracks=DEFAULT_EXCLUDE_TRACKS):
+    """Return the MIDI notes of path grouped into lists of notes that start
+    together, in time order.  Percussion and tracks named in exclude_tracks
+    are left out."""
+    import mido
+    try:
+        midi_file = mido.MidiFile(path)
+    except (OSError, EOFError, ValueError, KeyError, IndexError) as e:
+        raise AnalysisError(f'{path} is not a MIDI file: {e}')
+    window = int(midi_file.ticks_per_beat * tolerance)
+    onsets = []
+    for track in midi_file.tracks:
+        if track.name in exclude_tracks:
+            continue
+        now = 0
+        for message in track:
+            now += message.time
+            if message.type == 'note_on' and message.velocity and message.channel != PERCUSSION_CHANNEL:
+                onsets.append((now, message.note))
+    onsets.sort()
+    groups = []
+    group_start = None
+    for time, note in onsets:
+        if group_start is None or time - group_start > window:
+            groups.append([])
+            group_start = time
+        groups[-1].append(note)
+    return groups
+
+
+def detect_key(groups, keys=ALL_KEYS):
+    """Return the key of keys in which the most groups of notes are chords,
+    or None if none of them are chords in any key."""
+    summaries = [(pitch_class_mask(group), min(group) % 12) for group in groups]
+    best_key = None
+    best_score = (0,)
+    for key in keys:
+        table = ChordTable.for_key(key)
+        recognized = 0
+        diatonic = []
+        for mask, bass in summaries:
+            found = table.lookup(mask, bass)
+            if found is not None:
+                recognized += 1
+                if not mask & ~table.scale_mask:
+                    diatonic.append(found[0])
+        # Every chord type is recognized on every degree, so ties go to
+        # the key with the most chords built only from its scale, and then
+        # (e.g. between relative major and minor) to the key whose tonic
+        # is heard most, is started on or is ended on
+        score = (recognized, len(diatonic), diatonic.count(1), diatonic[:1] == [1], diatonic[-1:] == [1])
+        if recognized and score > best_score:
+            best_key, best_score = key, score
+    return best_key
+
+
+class MidiAnalysis(object):
+    """The chord sequence found in one MIDI file.
+
+    num_groups counts every group of notes, recognized or not.  error is
+    set instead of key and seq if the file couldn't be read.
+    """
+    def __init__(self, path, key=None, seq=(), num_groups=0, error=None):
+        self.path = path
+        self.key = key
+        self.seq = list(seq)
+        self.num_groups = num_groups
+        self.error = error
+
+    @property
+    def num_unrecognized(self):
+        return self.num_groups - len(self.seq)
+
+    def ndjson_line(self):
+        """Return the sequence as a line of NDJSON like
+        chord_sequence_ndjson_line, with the file it came from as
+        source."""
+        return json.dumps({'source': self.path, 'key': self.key, 'seq': self.seq}, cls=KeyedChordEncoder) + '\n'
+
+    def __getstate__(self):
+        # Analyses come back from worker processes as plain tuples rather
+        # than pickled KeyedChords, which are large
+        state = dict(self.__dict__)
+        state['seq'] = [(c.degree, c.chord_type, c.inversion, c.octave_adjustment) for c in self.seq]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.seq:
+            table = ChordTable.for_key(self.key)
+            self.seq = [table.keyed_chord(*attributes) for attributes in self.seq]
+
+    def __repr__(self):
+        return f'MidiAnalysis({self.path!r}, {self.key!r}, {self.seq!r})'
+
+
+def analyze_midi_file(path, key=None, tolerance=DEFAULT_TOLERANCE, exclude_tracks=DEFAULT_EXCLUDE_TRACKS):
+    """Return a MidiAnalysis of the chords in path, in key or in the key
+    detected from the file."""
+    try:
+        groups = read_note_groups(path, tolerance, exclude_tracks)
+    except AnalysisError as e:
+        return MidiAnalysis(path, error=str(e))
+    key = key or detect_key(groups)
+    if key is None:
+        return MidiAnalysis(path, num_groups=len(groups))
+    table = ChordTable.for_key(key)
+    seq = [chord for chord in map(table.identify, groups) if chord is not None]
+    return MidiAnalysis(path, key, seq, len(groups))
+
+
+def find_midi_files(inputs):
+    """Return the paths of the MIDI files in inputs, which are MIDI files
+    or directories searched recursively for .mid and .midi files."""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, subdirectories, file_names in os.walk(path):
+                subdirectories.sort()
+                paths.extend(os.path.join(directory, file_name) for file_name in sorted(file_names)
+                             if os.path.splitext(file_name)[1].lower() in MIDI_EXTENSIONS)
+        elif os.path.exists(path):
+            paths.append(path)
+        else:
+            raise InvalidArgumentError(f'{path} does not exist')
+    return paths
+
+
+def _analyze_one(args):
+    return analyze_midi_file(*args)
+
+
+def analyze_files(paths, key=None, workers=None, tolerance=DEFAULT_TOLERANCE,
+                  exclude_tracks=DEFAULT_EXCLUDE_TRACKS):
+    """Generator of a MidiAnalysis of each of paths, in order.  Files are
+    analyzed by a pool of workers processes (default one per CPU) unless
+    workers is 1."""
+    if key is not None:
+        validate_key(key)
+    jobs = [(path, key, tolerance, tuple(exclude_tracks)) for path in paths]
+    yield from map_in_processes(_analyze_one, jobs, workers)
@@ -0,0 +1,231 @@
+"""Single-file archives of rendered chord sequences and melodies.
+
+Instead of a .mid and a .json file per sequence in the working directory,
+an archive is one uncompressed tar file that any tar tool can list or
+extract.  Members are streamed into it one at a time, with headers written
+here rather than by tarfile so nothing about earlier members is kept in
+memory.
+
+Next to the archive is an index (the archive path plus .idx), a SQLite
+table of member name, data offset and size, so a member can be read by
+name with one seek.  rebuild_index recreates it from the tar headers.
+"""
+import os
+import time
+
+from .codec import SHARED_CODEC
+from .mellowchord import make_file_name_from_chord_sequence
+from .mellowchord import MellowchordError
+from .mellowchord import write_midi_file
+
+
+INDEX_SUFFIX = '.idx'
+_BLOCK_SIZE = 512
+_RECORD_SIZE = 20 * _BLOCK_SIZE
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS members (
+    name TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+class ArchiveError(MellowchordError):
+    pass
+
+
+def index_path_for(archive_path):
+    return archive_path + INDEX_SUFFIX
+
+
+def melody_member_name(notes):
+    """Return the name of a melody in an archive.  Notes are written in
+    scientific notation, unlike make_file_name_from_melody, because melodies
+    that differ only in octave would otherwise share a name."""
+    return '_'.join(note.scientific_notation() for note in notes)
+
+
+class _IndexWriter(object):
+    """Write a new index, batch_size rows per transaction."""
+    def __init__(self, index_path, batch_size=5000):
+        import sqlite3
+        if os.path.exists(index_path):
+            os.unlink(index_path)
+        self._db = sqlite3.connect(index_path)
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.executescript(_SCHEMA)
+        self._batch_size = batch_size
+        self._rows = []
+
+    def add(self, name, offset, size):
+        self._rows.append((name, offset, size))
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?)', self._rows)
+        self._rows.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._db.close()
+
+
+class SequenceArchiveWriter(object):
+    """Write members to a new archive and its index.
+
+    Index rows are inserted batch_size at a time, one transaction per
+    batch.  A member with the same name as an earlier one replaces it in
+    the index, as it would when the tar file is extracted.
+    """
+    def __init__(self, path, index_path=None, batch_size=5000):
+        self.path = path
+        self._mtime = int(time.time())
+        self._count = 0
+        self._offset = 0
+        self._index = _IndexWriter(index_path or index_path_for(path), batch_size)
+        self._f = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, name, data):
+        """Add a member holding the bytes data."""
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self._mtime
+        info.mode = 0o644
+        header = info.tobuf(tarfile.PAX_FORMAT)
+        padding = -len(data) % _BLOCK_SIZE
+        self._f.write(header + data + bytes(padding))
+        self._index.add(name, self._offset + len(header), len(data))
+        self._offset += len(header) + len(data) + padding
+        self._count += 1
+
+    def add_chord_sequence(self, key, seq, program=0):
+        """Add seq as a MIDI file and a JSON file, with the same names and
+        contents chordgen saves them with."""
+        name = make_file_name_from_chord_sequence(seq)
+        self.add(name + '.mid', write_midi_file(seq, None, None, program).to_bytes())
+        self.add(name + '.json', SHARED_CODEC.encode(key, seq).encode())
+
+    def add_melody(self, seq, notes, program=0):
+        """Add a melody over seq as a MIDI file."""
+        self.add(melody_member_name(notes) + '.mid', write_midi_file(seq, notes, None, program).to_bytes())
+
+    def add_composition(self, seq, notes, program=0):
+        """Add a melody over seq as a MIDI file named after both, since
+        compositions with the same melody can have different chords."""
+        name = make_file_name_from_chord_sequence(seq) + '__' + melody_member_name(notes)
+        self.add(name + '.mid', write_midi_file(seq, notes, None, program).to_bytes())
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            # Two empty blocks end the archive, which is then padded out
+            # to a whole record as tar tools expect
+            end = self._offset + 2 * _BLOCK_SIZE
+            self._f.write(bytes(2 * _BLOCK_SIZE + -end % _RECORD_SIZE))
+            self._f.close()
+        finally:
+            self._index.close()
+
+
+class SequenceArchive(object):
+    """Read members of an archive by name through its index."""
+    def __init__(self, path, index_path=None):
+        import sqlite3
+        self.path = path
+        index_path = index_path or index_path_for(path)
+        if not os.path.exists(index_path):
+            raise ArchiveError(f'{path} has no index (expected {index_path})')
+        self._f = open(path, 'rb')
+        try:
+            self._db = sqlite3.connect(index_path)
+            self._db.execute('SELECT COUNT(*) FROM members')
+        except sqlite3.DatabaseError as e:
+            self._f.close()
+            raise ArchiveError(f'{index_path} is not an archive index: {e}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._db.close()
+        self._f.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM members').fetchone()[0]
+
+    def __contains__(self, name):
+        return self._db.execute('SELECT 1 FROM members WHERE name = ?', (name,)).fetchone() is not None
+
+    def names(self):
+        """Generator of member names in the order they were added."""
+        for (name,) in self._db.execute('SELECT name FROM members ORDER BY offset'):
+            yield name
+
+    def read(self, name):
+        """Return the bytes of the named member.  Raises KeyError if there is
+        no such member."""
+        row = self._db.execute('SELECT offset, size FROM members WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        offset, size = row
+        self._f.seek(offset)
+        data = self._f.read(size)
+        if len(data) != size:
+            raise ArchiveError(f'{self.path} is shorter than its index says')
+        return data
+
+    def read_chord_sequence(self, name):
+        """Return the (key, chord_sequence) saved as name (with or without
+        .json) by add_chord_sequence."""
+        if not name.endswith('.json'):
+            name += '.json'
+        data = self.read(name)
+        try:
+            return SHARED_CODEC.decode(data)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ArchiveError(f'{name} is not a chord sequence: {e!r}')
+
+
+def rebuild_index(path, index_path=None):
+    """Recreate the index of a tar archive from its headers and return the
+    number of members indexed."""
+    import tarfile
+    count = 0
+    index = _IndexWriter(index_path or index_path_for(path))
+    try:
+        with tarfile.open(path, 'r:') as tar:
+            while True:
+                info = tar.next()
+                if info is None:
+                    break
+                # tarfile keeps every member it has read, but only the
+                # current one is needed
+                tar.members.clear()
+                if info.isfile():
+                    index.add(info.name, info.offset_data, info.size)
+                    count += 1
+    except tarfile.TarError as e:
+        raise ArchiveError(f'{path} is not a tar archive: {e}')
+    finally:
+        index.close()
+    return count
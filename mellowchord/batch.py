@@ -0,0 +1,123 @@
+"""Melody generation over many saved chord sequences at once.
+
+gen_melodies_for_files runs melodygen over every chord sequence JSON file
+in a directory or matching a glob.  Each file's melodies go to NDJSON in an
+output directory.  Files are shared out between a pool of processes.
+Within each process, MelodyGenerators share one table of candidate notes
+per chord pair, so files that repeat the same chord pairs don't rebuild
+it.
+"""
+import glob
+import os
+import time
+
+from .mellowchord import InvalidArgumentError
+from .mellowchord import MelodyGenerator
+from .mellowchord import melody_ndjson_line
+from .mellowchord import read_chord_sequence_json
+
+
+MELODY_OUTPUT_SUFFIX = '.melodies.ndjson'
+_GLOB_CHARACTERS = '*?['
+
+
+class MelodyFileResult(object):
+    """How melody generation over one chord sequence file went.  error is
+    set instead of output_path if the file couldn't be read."""
+    def __init__(self, path, output_path=None, num_melodies=0, seconds=0.0, error=None):
+        self.path = path
+        self.output_path = output_path
+        self.num_melodies = num_melodies
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def melodies_per_second(self):
+        return self.num_melodies / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return f'MelodyFileResult({self.path!r}, {self.output_path!r}, {self.num_melodies!r})'
+
+
+def find_chord_sequence_files(inputs):
+    """Return the paths of the chord sequence files in inputs, each of which
+    is a JSON file, a directory (whose .json files are used) or a glob
+    pattern."""
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                                if os.path.splitext(name)[1].lower() == '.json'))
+        elif any(c in pattern for c in _GLOB_CHARACTERS):
+            matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+            if not matches:
+                raise InvalidArgumentError(f'No files match {pattern}')
+            paths.extend(matches)
+        elif os.path.exists(pattern):
+            paths.append(pattern)
+        else:
+            raise InvalidArgumentError(f'{pattern} does not exist')
+    return paths
+
+
+def melody_output_path(path, output_dir):
+    """Return the NDJSON file the melodies for path are written to."""
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + MELODY_OUTPUT_SUFFIX)
+
+
+def gen_melodies_for_file(path, notes_per_chord, output_dir, max_melodies=None):
+    """Write the melodies over the chord sequence in path (at most
+    max_melodies, if given) as NDJSON to melody_output_path, and return a
+    MelodyFileResult."""
+    start_time = time.perf_counter()
+    try:
+        key, seq = read_chord_sequence_json(path)
+        melody_gen = MelodyGenerator(key, seq, notes_per_chord)
+    except (OSError, ValueError, KeyError, TypeError, AssertionError) as e:
+        return MelodyFileResult(path, error=f'{path} is not a chord sequence: {e!r}')
+    output_path = melody_output_path(path, output_dir)
+    count = 0
+    with open(output_path, 'w') as f:
+        for notes in melody_gen.gen_sequence():
+            if count == max_melodies:
+                break
+            f.write(melody_ndjson_line(notes))
+            count += 1
+    return MelodyFileResult(path, output_path, count, time.perf_counter() - start_time)
+
+
+def map_in_processes(func, jobs, workers=None):
+    """Generator of func(job) for each of jobs (a list), in order.  Jobs
+    are run by a pool of workers processes (default one per CPU) unless
+    workers is 1 or there is only one job."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        yield from map(func, jobs)
+        return
+    import concurrent.futures
+    # Send jobs in chunks so thousands of small files don't cost a round
+    # trip each, while keeping every worker busy to the end
+    chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(func, jobs, chunksize=chunksize)
+
+
+def _gen_melodies_one(args):
+    return gen_melodies_for_file(*args)
+
+
+def gen_melodies_for_files(paths, notes_per_chord, output_dir, workers=None, max_melodies=None):
+    """Generator of a MelodyFileResult for each of paths, in order, after
+    writing its melodies (see gen_melodies_for_file).  Files are handled by
+    a pool of workers processes (default one per CPU) unless workers is
+    1."""
+    if notes_per_chord not in (1, 2, 3, 4):
+        raise InvalidArgumentError('notes_per_chord must be 1 to 4')
+    output_paths = {}
+    for path in paths:
+        output_path = melody_output_path(path, output_dir)
+        if output_path in output_paths:
+            raise InvalidArgumentError(f'{path} and {output_paths[output_path]} would both write {output_path}')
+        output_paths[output_path] = path
+    jobs = [(path, notes_per_chord, output_dir, max_melodies) for path in paths]
+    yield from map_in_processes(_gen_melodies_one, jobs, workers)
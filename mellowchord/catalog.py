@@ -0,0 +1,218 @@
+"""SQLite index over catalogs of generated chord sequences.
+
+Every sequence is stored once with one row per chord and one row per
+degree-level n-gram (degrees joined with spaces, e.g. "4 5 1" for
+IV -> V -> I), so questions like "every sequence containing IV V I" or
+"every sequence starting on vi in Amin" are answered from indexes rather
+than by scanning file names.
+"""
+import re
+
+from .mellowchord import Chord
+from .mellowchord import chord_numeral
+from .mellowchord import InvalidArgumentError
+from .mellowchord import KeyedChord
+from .mellowchord import make_file_name_from_chord_sequence
+from .mellowchord import roman_numerals
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sequences (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chords (
+    sequence_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    degree INTEGER NOT NULL,
+    chord_type TEXT NOT NULL,
+    inversion INTEGER,
+    octave_adjustment INTEGER NOT NULL,
+    numeral TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (sequence_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS transitions (
+    gram TEXT NOT NULL,
+    sequence_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (gram, sequence_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sequences_by_key ON sequences (key);
+CREATE INDEX IF NOT EXISTS chords_by_position ON chords (position, degree, sequence_id);
+CREATE INDEX IF NOT EXISTS chords_by_degree ON chords (degree, sequence_id);
+CREATE INDEX IF NOT EXISTS chords_by_name ON chords (name);
+'''
+
+
+def parse_progression(progression):
+    """Return the list of scale degrees in a progression string such as
+    "IV V I", "IV->V->I" or "ii-V-I".  Case is ignored."""
+    numerals = [numeral for numeral in re.split(r'[\s,>→-]+', progression) if numeral]
+    if not numerals:
+        raise InvalidArgumentError(f'Empty progression "{progression}"')
+    degrees = []
+    for numeral in numerals:
+        try:
+            degrees.append(roman_numerals.index(numeral.upper(), 1))
+        except ValueError:
+            raise InvalidArgumentError(f'Invalid roman numeral "{numeral}" in progression "{progression}"')
+    return degrees
+
+
+def _gram(degrees):
+    return ' '.join(str(degree) for degree in degrees)
+
+
+class SequenceCatalog(object):
+    """A catalog of chord sequences stored in a SQLite database.
+
+    Transitions are indexed as degree n-grams of length 2 up to max_gram,
+    which is fixed when the database is created.  Longer progressions are
+    matched from the index on their first max_gram chords and then checked
+    against the stored chords.
+    """
+    def __init__(self, path, max_gram=3):
+        import sqlite3
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA temp_store=MEMORY')
+        self._db.executescript(_SCHEMA)
+        self._db.execute('INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)', ('max_gram', max_gram))
+        self._db.commit()
+        (self.max_gram,) = self._db.execute('SELECT value FROM settings WHERE name = ?', ('max_gram',)).fetchone()
+        self._keyed_chords = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM sequences').fetchone()[0]
+
+    def ingest(self, sequences, batch_size=5000):
+        """Add an iterable of (key, chord_sequence) tuples to the catalog and
+        return the number added.  Rows are inserted in batches of batch_size
+        sequences, one transaction per batch."""
+        (next_id,) = self._db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM sequences').fetchone()
+        count = 0
+        sequence_rows = []
+        chord_rows = []
+        transition_rows = []
+        for key, seq in sequences:
+            sequence_id = next_id + count
+            sequence_rows.append((sequence_id, key, len(seq), make_file_name_from_chord_sequence(seq)))
+            degrees = []
+            for position, keyed_chord in enumerate(seq):
+                degrees.append(keyed_chord.degree)
+                chord_rows.append((sequence_id, position, keyed_chord.degree, keyed_chord.chord_type,
+                                   keyed_chord.inversion, keyed_chord.octave_adjustment,
+                                   chord_numeral(keyed_chord.degree, keyed_chord.chord_type), keyed_chord.name))
+            for n in range(2, self.max_gram + 1):
+                for position in range(len(degrees) - n + 1):
+                    transition_rows.append((_gram(degrees[position:position + n]), sequence_id, position))
+            count += 1
+            if len(sequence_rows) == batch_size:
+                self._insert(sequence_rows, chord_rows, transition_rows)
+        self._insert(sequence_rows, chord_rows, transition_rows)
+        return count
+
+    def _insert(self, sequence_rows, chord_rows, transition_rows):
+        with self._db:
+            self._db.executemany('INSERT INTO sequences VALUES (?, ?, ?, ?)', sequence_rows)
+            self._db.executemany('INSERT INTO chords VALUES (?, ?, ?, ?, ?, ?, ?, ?)', chord_rows)
+            self._db.executemany('INSERT INTO transitions VALUES (?, ?, ?)', transition_rows)
+        sequence_rows.clear()
+        chord_rows.clear()
+        transition_rows.clear()
+
+    def _keyed_chord(self, key, row):
+        keyed_chord = self._keyed_chords.get((key, row))
+        if keyed_chord is None:
+            keyed_chord = KeyedChord(key, Chord(*row))
+            self._keyed_chords[(key, row)] = keyed_chord
+        return keyed_chord
+
+    def _sequence(self, sequence_id, key):
+        rows = self._db.execute('SELECT degree, chord_type, inversion, octave_adjustment FROM chords '
+                                'WHERE sequence_id = ? ORDER BY position', (sequence_id,))
+        return [self._keyed_chord(key, row) for row in rows]
+
+    def query(self, key=None, start=None, contains=None, limit=None):
+        """Generator of (key, chord_sequence) tuples, in the order they were
+        added, for sequences in the given key that start on the given degree
+        and contain the given progression.  start and contains may be roman
+        numeral strings or degree numbers."""
+        if isinstance(start, str):
+            start_degrees = parse_progression(start)
+            if len(start_degrees) != 1:
+                raise InvalidArgumentError(f'Expected a single starting chord, not "{start}"')
+            start = start_degrees[0]
+        if isinstance(contains, str):
+            contains = parse_progression(contains)
+        conditions = []
+        params = []
+        if key is not None:
+            conditions.append('key = ?')
+            params.append(key)
+        if start is not None:
+            conditions.append('id IN (SELECT sequence_id FROM chords WHERE position = 0 AND degree = ?)')
+            params.append(start)
+        if contains:
+            if len(contains) == 1:
+                conditions.append('id IN (SELECT sequence_id FROM chords WHERE degree = ?)')
+                params.append(contains[0])
+            else:
+                conditions.append('id IN (SELECT sequence_id FROM transitions WHERE gram = ?)')
+                params.append(_gram(contains[:self.max_gram]))
+        sql = 'SELECT id, key FROM sequences'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id'
+        verify = contains is not None and len(contains) > self.max_gram
+        yielded = 0
+        cursor = self._db.execute(sql, params)
+        while limit is None or yielded < limit:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for sequence_id, sequence_key in rows:
+                seq = self._sequence(sequence_id, sequence_key)
+                if verify and not _contains_degrees(seq, contains):
+                    continue
+                yield (sequence_key, seq)
+                yielded += 1
+                if limit is not None and yielded == limit:
+                    break
+
+    def chord_counts(self, key=None):
+        """Return (chord name, count) tuples for every chord in the catalog,
+        most frequent first."""
+        sql = 'SELECT name, COUNT(*) AS n FROM chords'
+        params = []
+        if key is not None:
+            sql += ' WHERE sequence_id IN (SELECT id FROM sequences WHERE key = ?)'
+            params.append(key)
+        sql += ' GROUP BY name ORDER BY n DESC, name'
+        return self._db.execute(sql, params).fetchall()
+
+
+def _contains_degrees(seq, degrees):
+    seq_degrees = [keyed_chord.degree for keyed_chord in seq]
+    for position in range(len(seq_degrees) - len(degrees) + 1):
+        if seq_degrees[position:position + len(degrees)] == degrees:
+            return True
+    return False
@@ -0,0 +1,173 @@
+"""Checkpoints for long enumerations that write their output to a file.
+
+A checkpoint is a small JSON file holding the parameters of the run, the
+enumeration cursor (see EnumerationCursor) after the last item written and
+the size of the output file at that point.  Resuming a run truncates the
+output back to that size and restarts the enumeration from the cursor, so
+the finished output is the same as if the run had never been stopped.
+
+Checkpoints are replaced atomically, and only after the output they cover
+has been flushed to disk, so a run killed at any point can be resumed from
+its last checkpoint.
+"""
+import json
+import os
+import tempfile
+import time
+
+from .mellowchord import EnumerationCursor
+from .mellowchord import InvalidArgumentError
+from .mellowchord import MellowchordError
+
+
+CHECKPOINT_VERSION = 1
+# Seconds between checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 10.0
+# Items written between looks at the clock
+_CLOCK_CHECK_ITEMS = 256
+
+
+class CheckpointError(MellowchordError):
+    pass
+
+
+class Checkpoint(object):
+    def __init__(self, params, cursor, output_offset=0):
+        self.params = params
+        self.cursor = cursor
+        self.output_offset = output_offset
+
+    def save(self, path):
+        """Write the checkpoint to path, replacing it atomically."""
+        data = json.dumps({'version': CHECKPOINT_VERSION,
+                           'params': self.params,
+                           'cursor': self.cursor.to_dict(),
+                           'output_offset': self.output_offset})
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix='.checkpoint-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                checkpoint_dict = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CheckpointError(f'Can\'t read checkpoint {path}: {e}')
+        if not isinstance(checkpoint_dict, dict) or checkpoint_dict.get('version') != CHECKPOINT_VERSION:
+            raise CheckpointError(f'{path} is not a version {CHECKPOINT_VERSION} checkpoint')
+        try:
+            cursor = EnumerationCursor.from_dict(checkpoint_dict['cursor'])
+            output_offset = int(checkpoint_dict['output_offset'])
+            return cls(checkpoint_dict['params'], cursor, output_offset)
+        except (KeyError, TypeError, ValueError, InvalidArgumentError) as e:
+            raise CheckpointError(f'{path} is not a valid checkpoint: {e}')
+
+    def check_params(self, params):
+        """Raise CheckpointError unless params (normalized through JSON)
+        are the ones the checkpoint was made with."""
+        params = json.loads(json.dumps(params))
+        if params != self.params:
+            differences = sorted(name for name in set(params) | set(self.params)
+                                 if params.get(name) != self.params.get(name))
+            raise CheckpointError(f'Checkpoint is for a different run ({", ".join(differences)} differ)')
+
+
+class CheckpointWriter(object):
+    """Write the output of an enumeration to a text file, saving a
+    checkpoint every interval seconds and, if every is given, every that
+    many items, and once more when closed.
+
+    cursor is the EnumerationCursor the enumeration is moving on.  Call
+    write once for each item, after the item is produced, with all of that
+    item's output as a single string.  If resume is true the run carries
+    on from the checkpoint at checkpoint_path, which must have been made
+    with the same params, and cursor is moved to its position; otherwise
+    the output file is started afresh.
+    """
+    def __init__(self, output_path, checkpoint_path, params, cursor, resume=False,
+                 interval=DEFAULT_CHECKPOINT_INTERVAL, every=None):
+        self._checkpoint_path = checkpoint_path
+        self._params = params
+        self._cursor = cursor
+        self._interval = interval
+        self._every = every
+        if resume:
+            checkpoint = Checkpoint.load(checkpoint_path)
+            checkpoint.check_params(params)
+            try:
+                with open(output_path, 'r+b') as f:
+                    if f.seek(0, os.SEEK_END) < checkpoint.output_offset:
+                        raise CheckpointError(f'{output_path} is shorter than when {checkpoint_path} was saved')
+                    f.truncate(checkpoint.output_offset)
+            except OSError as e:
+                raise CheckpointError(f'Can\'t resume writing {output_path}: {e}')
+            cursor.position = checkpoint.cursor.position
+            self._file = open(output_path, 'a', encoding='utf-8', newline='')
+        else:
+            self._file = open(output_path, 'w', encoding='utf-8', newline='')
+        self._write = self._file.write
+        self.checkpoints_saved = 0
+        self._broken = False
+        self._position = cursor.position
+        self._since_checkpoint = 0
+        self._check_after = self._next_check = self._items_until_check()
+        self._deadline = time.monotonic() + interval
+        if not resume:
+            # Replace any checkpoint left by an earlier run straight away
+            self.save()
+
+    def _items_until_check(self):
+        if self._every:
+            return max(1, min(_CLOCK_CHECK_ITEMS, self._every - self._since_checkpoint))
+        return _CLOCK_CHECK_ITEMS
+
+    def write(self, text):
+        try:
+            self._write(text)
+        except BaseException:
+            # The output may now end part way through an item, so it must
+            # not be covered by a checkpoint
+            self._broken = True
+            raise
+        self._position = self._cursor.position
+        self._next_check -= 1
+        if not self._next_check:
+            self._since_checkpoint += self._check_after
+            if (self._every and self._since_checkpoint >= self._every) or time.monotonic() >= self._deadline:
+                self.save()
+            self._check_after = self._next_check = self._items_until_check()
+
+    def save(self):
+        """Save a checkpoint covering everything written so far."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        output_offset = self._file.buffer.tell()
+        Checkpoint(self._params, EnumerationCursor(self._position), output_offset).save(self._checkpoint_path)
+        self.checkpoints_saved += 1
+        self._since_checkpoint = 0
+        self._deadline = time.monotonic() + self._interval
+
+    def close(self):
+        """Save a final checkpoint and close the output.  If the run was
+        interrupted this is where a resumed run carries on from."""
+        if not self._file.closed:
+            try:
+                if not self._broken:
+                    self.save()
+            finally:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
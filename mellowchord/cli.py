@@ -1,19 +1,57 @@
 from configargparse import ArgumentParser
+import hashlib
+import itertools
+import random
+from mellowchord import analyze_files
 from mellowchord import apply_inversion
+from mellowchord import ChordLibrary
+from mellowchord import ChordLibraryWriter
 from mellowchord import ChordMap
+from mellowchord import gen_sequence_all_keys
+from mellowchord import CheckpointWriter
+from mellowchord import compose_ndjson_line
+from mellowchord import ComposeBudget
+from mellowchord import Composer
+from mellowchord import chord_sequence_ndjson_line
+from mellowchord import DEFAULT_CHECKPOINT_INTERVAL
+from mellowchord.dedupe import DEFAULT_NGRAM
+from mellowchord.dedupe import DEFAULT_NUM_PERM
+from mellowchord.dedupe import DEFAULT_THRESHOLD
+from mellowchord import EnumerationCursor
+from mellowchord import find_chord_sequence_files
+from mellowchord import find_midi_files
+from mellowchord import find_near_duplicates
+from mellowchord import gen_melodies_for_files
+from mellowchord import InvalidArgumentError
+from mellowchord import library_to_json
+from mellowchord import load_chord_map_definition
 from mellowchord import make_file_name_from_chord_sequence
 from mellowchord import make_file_name_from_melody
 from mellowchord import MellowchordError
 from mellowchord import MelodyGenerator
+from mellowchord import melody_ndjson_line
+from mellowchord import MelodyStreamValidator
+from mellowchord import profiler
 from mellowchord import raise_or_lower_an_octave
 from mellowchord import validate_key
 from mellowchord import validate_start
 from mellowchord import write_chord_sequence_json
+from mellowchord import write_chord_sequence_ndjson
 from mellowchord import read_chord_sequence_json
+from mellowchord import read_sequences
+from mellowchord import rebuild_index
+from mellowchord import SequenceArchive
+from mellowchord import SequenceArchiveWriter
+from mellowchord import SequenceCatalog
+from mellowchord.stream import DEFAULT_BARS_AHEAD
+from mellowchord.stream import DEFAULT_BPM
+from mellowchord import Shard
+from mellowchord import train_transition_counts
+from mellowchord import TransitionCounts
+from mellowchord import slice_library
 from mellowchord import write_midi_file
 import os
 from pathlib import Path
-import readchar
 import sys
 
 
@@ -32,32 +70,310 @@ def main():
                         type=int, help='MIDI program value', default=0)
     parser.add_argument('-a', '--autoplay',
                         action='store_true', help='New MIDI automatically plays')
+    parser.add_argument('--profile',
+                        action='store_true', help='Print a timing summary of each processing stage on exit')
+    parser.add_argument('--profile-output',
+                        type=str, help='JSON file to write the timing summary to (implies --profile)', default=None)
     subparsers = parser.add_subparsers(dest='command')
 
     chordgen_parser = subparsers.add_parser('chordgen', aliases=['c'], help='Generate a series of chord sequences')
     chordgen_parser.add_argument('key', type=str, help='Major or natural minor key to generate chords from')
     chordgen_parser.add_argument('start', type=str, help='Name of the chord to start from')
     chordgen_parser.add_argument('num', type=int, help='Number of chords in each sequence')
+    chordgen_parser.add_argument('-m', '--map', type=str, help='JSON chord map definition to use instead of the '
+                                 'built in map', default=None)
+    chordgen_parser.add_argument('--shard', type=str, metavar='INDEX/COUNT',
+                                 help='Only generate shard INDEX of COUNT (counting from 0)',
+                                 default=None)
+    chordgen_parser.add_argument('--all-keys', action='store_true',
+                                 help='Generate the same sequences in all 24 major and minor keys')
+    chordgen_parser.add_argument('--weights', type=str, help='Transition counts saved by mc train; the most likely '
+                                 'sequences come first', default=None)
+    chordgen_parser.add_argument('--sample', type=int, metavar='COUNT', help='Generate COUNT random sequences, '
+                                 'picking each chord by weight (uniformly without --weights)', default=None)
+    chordgen_parser.add_argument('--seed', type=int, help='Random seed for --sample', default=None)
+    add_output_arguments(chordgen_parser, 'sequence')
 
     melodygen_parser = subparsers.add_parser('melodygen',
                                              aliases=['m'],
                                              help='Generate a melody to match a chord sequence')
     melodygen_parser.add_argument('chord_sequence', type=str, help='Chord sequence JSON file that was '
-                                                                   'saved by chordgen')
+                                                                   'saved by chordgen, or a directory or glob of '
+                                                                   'them to write melodies for all at once')
+    melodygen_parser.add_argument('--shard', type=str, metavar='INDEX/COUNT',
+                                  help='Only generate shard INDEX of COUNT (counting from 0)',
+                                  default=None)
     melodygen_parser.add_argument('-n', '--notes_per_chord',
                                   type=int, help='Number of notes to generate for each chord', default=1)
+    melodygen_parser.add_argument('--workers', type=int, help='Number of processes for a directory or glob '
+                                  '(default one per CPU)', default=None)
+    melodygen_parser.add_argument('--max-melodies', type=int, help='Write at most this many melodies for each '
+                                  'file of a directory or glob', default=None)
+    add_output_arguments(melodygen_parser, 'melody')
+
+    compose_parser = subparsers.add_parser('compose', help='Generate chord sequences and melodies over them in '
+                                           'one pass, within a budget')
+    compose_parser.add_argument('key', type=str, help='Major or natural minor key to generate chords from')
+    compose_parser.add_argument('start', type=str, help='Name of the chord to start from')
+    compose_parser.add_argument('num', type=int, help='Number of chords in each sequence')
+    compose_parser.add_argument('-n', '--notes_per_chord',
+                                type=int, help='Number of notes to generate for each chord', default=1)
+    compose_parser.add_argument('-m', '--map', type=str, help='JSON chord map definition to use instead of the '
+                                'built in map', default=None)
+    compose_parser.add_argument('--weights', type=str, help='Transition counts saved by mc train; the most likely '
+                                'sequences come first', default=None)
+    compose_parser.add_argument('--sample', action='store_true', help='Pick sequences (by weight) and melodies at '
+                                'random instead of enumerating them; needs --max-results or --max-seconds')
+    compose_parser.add_argument('--seed', type=int, help='Random seed for --sample', default=None)
+    compose_parser.add_argument('--max-results', type=int, help='Stop after this many melodies in all',
+                                default=None)
+    compose_parser.add_argument('--max-seconds', type=float, help='Stop after this many seconds', default=None)
+    compose_parser.add_argument('--max-melodies', type=int, help='Generate at most this many melodies over '
+                                'each chord sequence', default=None)
+    compose_parser.add_argument('-o', '--ndjson', type=str, metavar='OUTPUT', help='Write every sequence and '
+                                'melody to this NDJSON file', default=None)
+    compose_parser.add_argument('--archive', type=str, help='Write every sequence and melody as MIDI into this '
+                                'tar archive', default=None)
+
+    library_parser = subparsers.add_parser('library',
+                                           aliases=['l'],
+                                           help='Build, inspect and slice binary chord sequence libraries')
+    library_subparsers = library_parser.add_subparsers(dest='library_command')
+    library_build_parser = library_subparsers.add_parser('build', help='Build a library from JSON files or a ChordMap')
+    library_build_parser.add_argument('library', type=str, help='Library file to create')
+    library_build_parser.add_argument('json_files', type=str, nargs='*', help='Chord sequence JSON files that were '
+                                                                              'saved by chordgen')
+    library_build_parser.add_argument('-g', '--generate', type=str, nargs=3, metavar=('KEY', 'START', 'NUM'),
+                                      help='Add every sequence of NUM chords starting from START in KEY')
+    library_build_parser.add_argument('--shard', type=str, metavar='INDEX/COUNT',
+                                      help='Only add shard INDEX of COUNT (counting from 0) of the generated sequences',
+                                      default=None)
+    library_info_parser = library_subparsers.add_parser('info', help='Describe a library')
+    library_info_parser.add_argument('library', type=str, help='Library file to inspect')
+    library_info_parser.add_argument('-s', '--show', type=int, help='Number of sequences to print', default=0)
+    library_slice_parser = library_subparsers.add_parser('slice', help='Copy a range of sequences into a new library')
+    library_slice_parser.add_argument('library', type=str, help='Library file to read')
+    library_slice_parser.add_argument('output', type=str, help='Library file to create')
+    library_slice_parser.add_argument('start', type=int, help='Index of the first sequence to copy')
+    library_slice_parser.add_argument('stop', type=int, help='Index after the last sequence to copy')
+    library_export_parser = library_subparsers.add_parser('export', help='Write sequences out as JSON files')
+    library_export_parser.add_argument('library', type=str, help='Library file to read')
+    library_export_parser.add_argument('--start', type=int, help='Index of the first sequence to export', default=0)
+    library_export_parser.add_argument('--stop', type=int, help='Index after the last sequence to export', default=None)
+
+    index_parser = subparsers.add_parser('index', help='Add chord sequences to a SQLite catalog')
+    index_parser.add_argument('catalog', type=str, help='SQLite catalog file')
+    index_parser.add_argument('inputs', type=str, nargs='*', help='Chord sequence JSON, NDJSON (.ndjson) or '
+                                                                  'library (.mcl) files')
+    index_parser.add_argument('-g', '--generate', type=str, nargs=3, metavar=('KEY', 'START', 'NUM'),
+                              help='Add every sequence of NUM chords starting from START in KEY')
+    index_parser.add_argument('--shard', type=str, metavar='INDEX/COUNT',
+                              help='Only add shard INDEX of COUNT (counting from 0) of the generated sequences',
+                              default=None)
+
+    query_parser = subparsers.add_parser('query', help='Find chord sequences in a SQLite catalog')
+    query_parser.add_argument('catalog', type=str, help='SQLite catalog file')
+    query_parser.add_argument('-k', '--key', type=str, help='Only sequences in this key', default=None)
+    query_parser.add_argument('-s', '--start', type=str, help='Only sequences starting on this roman numeral',
+                              default=None)
+    query_parser.add_argument('-c', '--contains', type=str, help='Only sequences containing this progression '
+                                                                 '(e.g. "IV V I")', default=None)
+    query_parser.add_argument('-l', '--limit', type=int, help='Maximum number of sequences to print', default=None)
+    query_parser.add_argument('--counts', action='store_true', help='Print how often each chord appears instead')
+    query_parser.add_argument('--ndjson', action='store_true', help='Print matches as NDJSON instead of names')
+
+    archive_parser = subparsers.add_parser('archive', help='List, extract and index sequence archives')
+    archive_subparsers = archive_parser.add_subparsers(dest='archive_command')
+    archive_list_parser = archive_subparsers.add_parser('list', help='List the members of an archive')
+    archive_list_parser.add_argument('archive', type=str, help='Archive written with --archive')
+    archive_extract_parser = archive_subparsers.add_parser('extract', help='Copy members of an archive to the '
+                                                           'working directory')
+    archive_extract_parser.add_argument('archive', type=str, help='Archive written with --archive')
+    archive_extract_parser.add_argument('names', type=str, nargs='+', help='Names of the members to extract')
+    archive_reindex_parser = archive_subparsers.add_parser('reindex', help='Rebuild the index of an archive')
+    archive_reindex_parser.add_argument('archive', type=str, help='Tar archive to index')
+
+    train_parser = subparsers.add_parser('train', help='Count chord transitions in a corpus of sequences')
+    train_parser.add_argument('inputs', type=str, nargs='+', help='Chord sequence JSON, NDJSON (.ndjson) or '
+                                                                  'library (.mcl) files')
+    train_parser.add_argument('-o', '--output', type=str, help='JSON file to save the counts to', required=True)
+    train_parser.add_argument('--workers', type=int, help='Number of counting processes (default one per CPU)',
+                              default=None)
+
+    dedupe_parser = subparsers.add_parser('dedupe', help='Find or drop chord sequences that are nearly the same '
+                                          'as an earlier one')
+    dedupe_parser.add_argument('inputs', type=str, nargs='+', help='Chord sequence JSON, NDJSON (.ndjson) or '
+                                                                   'library (.mcl) files')
+    dedupe_parser.add_argument('-t', '--threshold', type=float, help='Similarity of chord degree n-grams (0 to 1) '
+                               'from which sequences count as near-duplicates', default=DEFAULT_THRESHOLD)
+    dedupe_parser.add_argument('-n', '--ngram', type=int, help='Chords per n-gram', default=DEFAULT_NGRAM)
+    dedupe_parser.add_argument('--num-perm', type=int, help='Hash functions per MinHash signature; more is slower '
+                               'but estimates similarity better', default=DEFAULT_NUM_PERM)
+    dedupe_parser.add_argument('-o', '--ndjson', type=str, metavar='OUTPUT', help='Write the sequences that '
+                               'aren\'t near-duplicates to this NDJSON file', default=None)
+    dedupe_parser.add_argument('-s', '--show', type=int, help='Number of near-duplicates to print', default=20)
+    dedupe_parser.add_argument('--workers', type=int, help='Number of signing processes (default one per CPU)',
+                               default=None)
+
+    analyze_parser = subparsers.add_parser('analyze', help='Identify the chord sequences in MIDI files')
+    analyze_parser.add_argument('inputs', type=str, nargs='+', help='MIDI files, or directories to search for '
+                                                                    '.mid files')
+    analyze_parser.add_argument('-k', '--key', type=str, help='Key of the music (detected from each file by '
+                                'default)', default=None)
+    analyze_parser.add_argument('-o', '--ndjson', type=str, metavar='OUTPUT', help='Write the sequences to this '
+                                'NDJSON file instead of standard output', default=None)
+    analyze_parser.add_argument('--workers', type=int, help='Number of analysis processes (default one per CPU)',
+                                default=None)
+    analyze_parser.add_argument('--all-tracks', action='store_true', help='Include tracks named melody, which '
+                                'are left out by default')
+
+    validate_parser = subparsers.add_parser('validate', help='Check that melodies in NDJSON files fit their chord '
+                                            'sequences')
+    validate_parser.add_argument('inputs', type=str, nargs='+', help='NDJSON files written by mc compose, or by '
+                                 'mc melodygen with --chords')
+    validate_parser.add_argument('-c', '--chords', type=str, help='Chord sequence JSON file the melodies were '
+                                 'generated for, if the lines don\'t include it', default=None)
+    validate_parser.add_argument('-s', '--show', type=int, help='Number of failing melodies to print', default=20)
+
+    follow_parser = subparsers.add_parser('follow', help='Recognize chords played on a MIDI input and suggest '
+                                          'what could come next')
+    follow_parser.add_argument('key', type=str, help='Major or natural minor key to follow chords in')
+    follow_parser.add_argument('--port', type=str, help='MIDI input port to listen on (default the first one)',
+                               default=None)
+    follow_parser.add_argument('--play', type=str, metavar='PORT', help='MIDI output port to play the first '
+                               'suggestion on', default=None)
+    follow_parser.add_argument('--weights', type=str, help='Transition counts saved by mc train; the most likely '
+                               'suggestions come first', default=None)
+    follow_parser.add_argument('--list-ports', action='store_true', help='List the MIDI input ports and exit')
+
+    stream_parser = subparsers.add_parser('stream', help='Play an endless generated chord progression with a melody '
+                                          'on a MIDI output')
+    stream_parser.add_argument('key', type=str, help='Major or natural minor key to play in')
+    stream_parser.add_argument('start', type=str, help='Chord to start from')
+    stream_parser.add_argument('--port', type=str, help='MIDI output port to play on (default the first one)',
+                               default=None)
+    stream_parser.add_argument('-n', '--notes_per_chord', type=int, help='Number of melody notes over each chord',
+                               default=2)
+    stream_parser.add_argument('--bpm', type=float, help='Tempo in beats per minute, four beats to a chord',
+                               default=DEFAULT_BPM)
+    stream_parser.add_argument('--bars-ahead', type=int, help='Number of bars generated ahead of the one playing',
+                               default=DEFAULT_BARS_AHEAD)
+    stream_parser.add_argument('--weights', type=str, help='Transition counts saved by mc train; chords are picked '
+                               'by these weights', default=None)
+    stream_parser.add_argument('--seed', type=int, help='Seed for picking chords and melodies, to play the same '
+                               'progression again', default=None)
+    stream_parser.add_argument('--bars', type=int, help='Stop after this many bars', default=None)
+    stream_parser.add_argument('--seconds', type=float, help='Stop after this many seconds', default=None)
+    stream_parser.add_argument('--list-ports', action='store_true', help='List the MIDI output ports and exit')
+
+    serve_parser = subparsers.add_parser('serve', help='Run a local HTTP/JSON generation service')
+    serve_parser.add_argument('--host', type=str, help='Address to listen on', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, help='Port to listen on (0 picks a free one)', default=8765)
+    serve_parser.add_argument('--workers', type=int, help='Number of MIDI rendering processes (default one per CPU)',
+                              default=None)
 
     args = parser.parse_args()
+    if args.profile or args.profile_output:
+        profiler.enable(args.profile_output)
     try:
         if args.command in ('chordgen', 'c'):
-            chordgen(args.key, args.start, args.num, args.workingdir, args.program, args.autoplay)
+            chordgen(args.key, args.start, args.num, args.workingdir, args.program, args.autoplay, args.all_keys,
+                     args.map, args.shard, args.ndjson, args.checkpoint, args.resume, args.checkpoint_interval,
+                     args.archive, args.weights, args.sample, args.seed)
         elif args.command in ('melodygen', 'm'):
-            melodygen(args.chord_sequence, args.notes_per_chord, args.workingdir, args.program, args.autoplay)
+            melodygen(args.chord_sequence, args.notes_per_chord, args.workingdir, args.program, args.autoplay,
+                      args.shard, args.ndjson, args.checkpoint, args.resume, args.checkpoint_interval, args.archive,
+                      args.workers, args.max_melodies)
+        elif args.command == 'compose':
+            compose(args.key, args.start, args.num, args.notes_per_chord, args.ndjson, args.archive, args.program,
+                    args.map, args.weights, args.sample, args.seed, args.max_results, args.max_seconds,
+                    args.max_melodies)
+        elif args.command in ('library', 'l'):
+            if args.library_command == 'build':
+                library_build(args.library, args.json_files, args.generate, args.shard)
+            elif args.library_command == 'info':
+                library_info(args.library, args.show)
+            elif args.library_command == 'slice':
+                library_slice(args.library, args.output, args.start, args.stop)
+            elif args.library_command == 'export':
+                library_export(args.library, args.start, args.stop, args.workingdir)
+            else:
+                library_parser.print_help()
+        elif args.command == 'index':
+            index(args.catalog, args.inputs, args.generate, args.shard)
+        elif args.command == 'query':
+            query(args.catalog, args.key, args.start, args.contains, args.limit, args.counts, args.ndjson)
+        elif args.command == 'archive':
+            if args.archive_command == 'list':
+                archive_list(args.archive)
+            elif args.archive_command == 'extract':
+                archive_extract(args.archive, args.names, args.workingdir)
+            elif args.archive_command == 'reindex':
+                archive_reindex(args.archive)
+            else:
+                archive_parser.print_help()
+        elif args.command == 'train':
+            train(args.inputs, args.output, args.workers)
+        elif args.command == 'dedupe':
+            dedupe(args.inputs, args.threshold, args.ngram, args.num_perm, args.ndjson, args.show, args.workers)
+        elif args.command == 'analyze':
+            analyze(args.inputs, args.key, args.ndjson, args.workers, args.all_tracks)
+        elif args.command == 'validate':
+            validate(args.inputs, args.chords, args.show)
+        elif args.command == 'follow':
+            follow(args.key, args.port, args.play, args.weights, args.list_ports)
+        elif args.command == 'stream':
+            stream(args.key, args.start, args.port, args.notes_per_chord, args.bpm, args.bars_ahead, args.weights,
+                   args.seed, args.bars, args.seconds, args.program, args.list_ports)
+        elif args.command == 'serve':
+            serve(args.host, args.port, args.workers)
     except MellowchordError as e:
         print(e)
 
 
+def add_output_arguments(subparser, item_name):
+    subparser.add_argument('-o', '--ndjson', type=str, metavar='OUTPUT',
+                           help=f'Write every {item_name} to this NDJSON file instead of stepping through them',
+                           default=None)
+    subparser.add_argument('--archive', type=str, help=f'Write every {item_name} as MIDI into this tar archive, '
+                           'indexed by name, instead of stepping through them', default=None)
+    subparser.add_argument('--checkpoint', type=str, help='Save progress writing --ndjson output to this file '
+                           'so the run can be resumed', default=None)
+    subparser.add_argument('--resume', type=str, metavar='CHECKPOINT', help='Carry on an interrupted run from '
+                           'its checkpoint, with the same arguments', default=None)
+    subparser.add_argument('--checkpoint-interval', type=float, metavar='SECONDS',
+                           help='Seconds between checkpoints', default=DEFAULT_CHECKPOINT_INTERVAL)
+
+
+def write_ndjson(output_path, make_items, format_item, params, checkpoint=None, resume=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+    """Write format_item(item) for every item from make_items(cursor) to
+    output_path, with checkpoints if checkpoint or resume is given, and
+    return how many were written."""
+    checkpoint_path = resume or checkpoint
+    cursor = EnumerationCursor()
+    count = 0
+    if checkpoint_path is None:
+        with open(output_path, 'w') as f:
+            for item in make_items(None):
+                f.write(format_item(item))
+                count += 1
+        return count
+    with CheckpointWriter(output_path, checkpoint_path, params, cursor, resume is not None,
+                          checkpoint_interval) as writer:
+        for item in make_items(cursor):
+            writer.write(format_item(item))
+            count += 1
+    return count
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
 def get_command(prompt, valid_cmds=None):
+    import readchar
     while True:
         sys.stdout.write(prompt)
         sys.stdout.flush()
@@ -93,11 +409,62 @@ def print_melody(notes):
     sys.stdout.write('\n')
 
 
-def chordgen(key, start, num, workingdir, program, autoplay):
+def chordgen(key, start, num, workingdir, program, autoplay, all_keys=False, map_file=None, shard=None,
+             ndjson=None, checkpoint=None, resume=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+             archive=None, weights=None, sample=None, seed=None):
     validate_key(key)
-    cm = ChordMap(key, octave_adjustment=-1)
+    shard = Shard.parse(shard) if shard else None
+    definition = load_chord_map_definition(map_file) if map_file else None
+    cm = ChordMap(key, octave_adjustment=-1, definition=definition)
     validate_start(start, cm)
-    for seq in cm.gen_sequence(start, num):
+    if ndjson and archive:
+        raise InvalidArgumentError('--ndjson and --archive can\'t be used together')
+    if (checkpoint or resume) and not ndjson:
+        raise InvalidArgumentError('--checkpoint and --resume need --ndjson output')
+    if (weights or sample is not None) and all_keys:
+        raise InvalidArgumentError('--weights and --sample can\'t be used with --all-keys')
+    if sample is not None and (shard or checkpoint or resume):
+        raise InvalidArgumentError('--sample can\'t be used with --shard, --checkpoint or --resume')
+    if weights:
+        cm = cm.weighted(TransitionCounts.load(weights))
+
+    def chord_sequences(cursor=None):
+        if sample is not None:
+            return cm.sample_sequences(start, num, sample, random.Random(seed))
+        return cm.gen_sequence(start, num, shard=shard, cursor=cursor)
+    if ndjson:
+        if all_keys:
+            if checkpoint or resume:
+                raise InvalidArgumentError('--checkpoint and --resume can\'t be used with --all-keys')
+
+            def make_items(cursor):
+                return gen_sequence_all_keys(start, num, start_key=key, octave_adjustment=-1, definition=definition,
+                                             shard=shard)
+        else:
+            def make_items(cursor):
+                return ((key, seq) for seq in chord_sequences(cursor))
+        params = {'command': 'chordgen', 'key': key, 'start': start, 'num': num,
+                  'map': _file_digest(map_file) if map_file else None, 'shard': str(shard) if shard else None}
+        if weights:
+            params['weights'] = _file_digest(weights)
+        count = write_ndjson(ndjson, make_items, lambda item: chord_sequence_ndjson_line(*item), params,
+                             checkpoint, resume, checkpoint_interval)
+        print(f'Wrote {count} sequences to {ndjson}')
+        return
+    if all_keys:
+        sequences = gen_sequence_all_keys(start, num, start_key=key, octave_adjustment=-1, definition=definition,
+                                          shard=shard)
+    else:
+        sequences = ((key, seq) for seq in chord_sequences())
+    if archive:
+        with SequenceArchiveWriter(archive) as writer:
+            count = 0
+            for seq_key, seq in sequences:
+                writer.add_chord_sequence(seq_key, seq, program)
+                count += 1
+        print(f'Wrote {count} sequences to {archive}')
+        return
+    for key, seq in sequences:
         seq_name = make_file_name_from_chord_sequence(seq)
         print(seq_name)
         midi_filename = seq_name + '.mid'
@@ -148,11 +515,36 @@ def chordgen(key, start, num, workingdir, program, autoplay):
                 print('(n)ext (p)lay (i)nfo in(v)ert (o)ctave (j)son (m)idi (q)uit')
 
 
-def melodygen(chord_sequence_file, notes_per_chord, workingdir, program, autoplay):
+def melodygen(chord_sequence_file, notes_per_chord, workingdir, program, autoplay, shard=None,
+              ndjson=None, checkpoint=None, resume=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+              archive=None, workers=None, max_melodies=None):
+    if os.path.isdir(chord_sequence_file) or any(c in chord_sequence_file for c in '*?['):
+        if shard or ndjson or archive or checkpoint or resume:
+            raise InvalidArgumentError('--shard, --ndjson, --archive, --checkpoint and --resume can\'t be used '
+                                       'with a directory or glob')
+        return melodygen_files(chord_sequence_file, notes_per_chord, workingdir, workers, max_melodies)
+    shard = Shard.parse(shard) if shard else None
+    if ndjson and archive:
+        raise InvalidArgumentError('--ndjson and --archive can\'t be used together')
+    if (checkpoint or resume) and not ndjson:
+        raise InvalidArgumentError('--checkpoint and --resume need --ndjson output')
     key, seq = read_chord_sequence_json(chord_sequence_file)
-    print_chord_sequence(key, seq)
     melody_gen = MelodyGenerator(key, seq, notes_per_chord)
-    for notes in melody_gen.gen_sequence():
+    if ndjson:
+        params = {'command': 'melodygen', 'chord_sequence': _file_digest(chord_sequence_file),
+                  'notes_per_chord': notes_per_chord, 'shard': str(shard) if shard else None}
+        count = write_ndjson(ndjson, lambda cursor: melody_gen.gen_sequence(shard, cursor), melody_ndjson_line,
+                             params, checkpoint, resume, checkpoint_interval)
+        print(f'Wrote {count} melodies to {ndjson}')
+        return
+    if archive:
+        with SequenceArchiveWriter(archive) as writer:
+            for notes in melody_gen.gen_sequence(shard):
+                writer.add_melody(seq, notes, program)
+        print(f'Wrote {len(writer)} melodies to {archive}')
+        return
+    print_chord_sequence(key, seq)
+    for notes in melody_gen.gen_sequence(shard):
         print_melody(notes)
         melody_name = make_file_name_from_melody(notes)
         midi_filename = melody_name + '.mid'
@@ -177,5 +569,292 @@ def melodygen(chord_sequence_file, notes_per_chord, workingdir, program, autopla
                 print('(n)ext (p)lay (i)nfo (m)idi (q)uit')
 
 
+def compose(key, start, num, notes_per_chord, ndjson=None, archive=None, program=0, map_file=None, weights=None,
+            sample=False, seed=None, max_results=None, max_seconds=None, max_melodies=None):
+    import time
+    validate_key(key)
+    if not ndjson and not archive:
+        raise InvalidArgumentError('compose needs --ndjson or --archive output')
+    definition = load_chord_map_definition(map_file) if map_file else None
+    cm = ChordMap(key, octave_adjustment=-1, definition=definition)
+    if weights:
+        cm = cm.weighted(TransitionCounts.load(weights))
+    budget = ComposeBudget(max_results, max_seconds, max_melodies)
+    composer = Composer(cm, start, num, notes_per_chord, budget, sample, random.Random(seed))
+    start_time = time.perf_counter()
+    f = open(ndjson, 'w') if ndjson else None
+    writer = SequenceArchiveWriter(archive) if archive else None
+    try:
+        for seq, notes in composer:
+            if f is not None:
+                f.write(compose_ndjson_line(key, seq, notes))
+            if writer is not None:
+                writer.add_composition(seq, notes, program)
+    finally:
+        if f is not None:
+            f.close()
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - start_time
+    outputs = ' and '.join(path for path in (ndjson, archive) if path)
+    print(f'Wrote {composer.num_results} melodies over {composer.num_sequences} sequences to {outputs} '
+          f'({composer.num_results / elapsed:.0f} melodies/s), stopped by {composer.stop_reason}')
+    return composer
+
+
+def melodygen_files(pattern, notes_per_chord, output_dir, workers=None, max_melodies=None):
+    import time
+    paths = find_chord_sequence_files([pattern])
+    start_time = time.perf_counter()
+    num_melodies = 0
+    num_errors = 0
+    for result in gen_melodies_for_files(paths, notes_per_chord, output_dir, workers, max_melodies):
+        if result.error:
+            num_errors += 1
+            print(f'Skipped {result.error}')
+            continue
+        num_melodies += result.num_melodies
+        print(f'{result.path}: {result.num_melodies} melodies in {result.seconds:.3f} s '
+              f'({result.melodies_per_second:.0f} melodies/s)')
+    elapsed = time.perf_counter() - start_time
+    print(f'Wrote {num_melodies} melodies for {len(paths) - num_errors} files to {output_dir} in {elapsed:.3f} s '
+          f'({num_melodies / elapsed:.0f} melodies/s, {len(paths) / elapsed:.1f} files/s), {num_errors} errors')
+    return num_melodies
+
+
+def library_build(library_path, json_files, generate, shard=None):
+    shard = Shard.parse(shard) if shard else None
+    if generate:
+        key, start, num = generate
+        validate_key(key)
+        cm = ChordMap(key, octave_adjustment=-1)
+        validate_start(start, cm)
+    with ChordLibraryWriter(library_path) as writer:
+        for json_file in json_files:
+            writer.append(read_chord_sequence_json(json_file)[1])
+        if generate:
+            for seq in cm.gen_sequence(start, int(num), shard=shard):
+                writer.append(seq)
+    print(f'Wrote {len(writer)} sequences to {library_path}')
+
+
+def library_info(library_path, show):
+    with ChordLibrary(library_path) as library:
+        size = os.path.getsize(library_path)
+        print(f'sequences = {len(library)}')
+        if library.chords_per_record is None:
+            print('chords per sequence = variable')
+        else:
+            print(f'chords per sequence = {library.chords_per_record}')
+        print(f'keys = {library.keys}')
+        print(f'chord types = {library.chord_types}')
+        print(f'size = {size} bytes')
+        for index in range(min(show, len(library))):
+            print(f'{index}: {make_file_name_from_chord_sequence(library[index])}')
+
+
+def library_slice(library_path, output_path, start, stop):
+    count = slice_library(library_path, output_path, start, stop)
+    print(f'Wrote {count} sequences to {output_path}')
+
+
+def library_export(library_path, start, stop, workingdir):
+    for path in library_to_json(library_path, workingdir, start, stop):
+        print(f'Saved {path} to disk')
+
+
+def index(catalog_path, inputs, generate, shard=None):
+    shard = Shard.parse(shard) if shard else None
+    sequences = read_sequences(inputs)
+    if generate:
+        key, start, num = generate
+        validate_key(key)
+        cm = ChordMap(key, octave_adjustment=-1)
+        validate_start(start, cm)
+        sequences = itertools.chain(sequences, ((key, seq) for seq in cm.gen_sequence(start, int(num), shard=shard)))
+    with SequenceCatalog(catalog_path) as catalog:
+        count = catalog.ingest(sequences)
+    print(f'Added {count} sequences to {catalog_path}')
+
+
+def query(catalog_path, key, start, contains, limit, counts, ndjson):
+    with SequenceCatalog(catalog_path) as catalog:
+        if counts:
+            for chord_name, count in catalog.chord_counts(key):
+                print(f'{chord_name}: {count}')
+            return
+        for seq_key, seq in catalog.query(key, start, contains, limit):
+            if ndjson:
+                write_chord_sequence_ndjson(sys.stdout, seq_key, seq)
+            else:
+                print(make_file_name_from_chord_sequence(seq))
+
+
+def archive_list(archive_path):
+    with SequenceArchive(archive_path) as archive:
+        for name in archive.names():
+            print(name)
+
+
+def archive_extract(archive_path, names, workingdir):
+    with SequenceArchive(archive_path) as archive:
+        for name in names:
+            try:
+                data = archive.read(name)
+            except KeyError:
+                raise InvalidArgumentError(f'{archive_path} has no member {name}')
+            path = os.path.join(workingdir, os.path.basename(name))
+            with open(path, 'wb') as f:
+                f.write(data)
+            print(f'Saved {path} to disk')
+
+
+def archive_reindex(archive_path):
+    count = rebuild_index(archive_path)
+    print(f'Indexed {count} members of {archive_path}')
+
+
+def train(inputs, output_path, workers):
+    import time
+    start_time = time.perf_counter()
+    counts = train_transition_counts(inputs, workers)
+    elapsed = time.perf_counter() - start_time
+    counts.save(output_path)
+    print(f'Counted {counts.num_transitions} transitions in {counts.num_sequences} sequences '
+          f'({counts.num_sequences / elapsed:.0f} sequences/s), saved to {output_path}')
+    return counts
+
+
+def dedupe(inputs, threshold=DEFAULT_THRESHOLD, ngram=DEFAULT_NGRAM, num_perm=DEFAULT_NUM_PERM, output_path=None,
+           show=20, workers=None):
+    import time
+    start_time = time.perf_counter()
+    kept_sequences = {}
+    counts = {'sequences': 0, 'duplicates': 0}
+    f = open(output_path, 'w') if output_path else None
+    try:
+        for index, key, seq, duplicate_of, similarity in find_near_duplicates(
+                read_sequences(inputs), threshold, num_perm, ngram, workers=workers):
+            counts['sequences'] += 1
+            if duplicate_of is None:
+                # Kept sequences are only needed to say what a duplicate
+                # is like
+                if counts['duplicates'] < show:
+                    kept_sequences[index] = seq
+                if f:
+                    write_chord_sequence_ndjson(f, key, seq)
+                continue
+            counts['duplicates'] += 1
+            if counts['duplicates'] <= show:
+                print(f'Sequence {index + 1} ({" ".join(map(str, seq))}) is like sequence {duplicate_of + 1} '
+                      f'({" ".join(map(str, kept_sequences[duplicate_of]))}), similarity {similarity:.2f}')
+    finally:
+        if f:
+            f.close()
+    elapsed = time.perf_counter() - start_time
+    kept = counts['sequences'] - counts['duplicates']
+    print(f'Checked {counts["sequences"]} sequences in {elapsed:.3f} s ({counts["sequences"] / elapsed:.0f} '
+          f'sequences/s): {counts["duplicates"]} near-duplicates at similarity {threshold} or more, {kept} kept'
+          + (f' and written to {output_path}' if output_path else ''))
+    return counts
+
+
+def analyze(inputs, key, output_path, workers, all_tracks=False):
+    paths = find_midi_files(inputs)
+    exclude_tracks = () if all_tracks else ('melody',)
+    counts = {'sequences': 0, 'chords': 0, 'unrecognized': 0, 'errors': 0}
+    f = open(output_path, 'w') if output_path else sys.stdout
+    # With the sequences on standard output, everything else goes to
+    # standard error
+    messages = sys.stdout if output_path else sys.stderr
+    try:
+        for analysis in analyze_files(paths, key, workers, exclude_tracks=exclude_tracks):
+            if analysis.error:
+                counts['errors'] += 1
+                print(f'Skipped {analysis.error}', file=messages)
+                continue
+            counts['unrecognized'] += analysis.num_unrecognized
+            if analysis.seq:
+                f.write(analysis.ndjson_line())
+                counts['sequences'] += 1
+                counts['chords'] += len(analysis.seq)
+    finally:
+        if output_path:
+            f.close()
+    print(f'Analyzed {len(paths)} files: {counts["sequences"]} sequences of {counts["chords"]} chords in total, '
+          f'{counts["unrecognized"]} groups of notes not recognized, {counts["errors"]} errors', file=messages)
+    return counts
+
+
+def validate(inputs, chords_file=None, show=20):
+    import time
+    key, seq = read_chord_sequence_json(chords_file) if chords_file else (None, None)
+    validator = MelodyStreamValidator(key, seq)
+    start_time = time.perf_counter()
+    shown = 0
+    for path in inputs:
+        with open(path, 'r') as f:
+            for line_number, slot, note, chord in validator.check(f, path):
+                if shown < show:
+                    print(f'{path} line {line_number}: note {slot + 1} ({note}) doesn\'t fit {chord}')
+                    shown += 1
+    elapsed = time.perf_counter() - start_time
+    print(f'Checked {validator.num_checked} melodies in {elapsed:.3f} s '
+          f'({validator.num_checked / elapsed:.0f} melodies/s): {validator.num_failed} failed')
+    return validator
+
+
+def follow(key, port_name, play_port_name, weights, list_ports=False):
+    from mellowchord.follow import follow
+    if list_ports:
+        import mido
+        try:
+            names = mido.get_input_names()
+        except (IOError, OSError, ImportError) as e:
+            raise MellowchordError(f'Can\'t list MIDI ports: {e}')
+        for name in names:
+            print(name)
+        return
+    validate_key(key)
+    chord_map = ChordMap.for_key(key).weighted(TransitionCounts.load(weights)) if weights else None
+    follower = follow(key, port_name, chord_map, play_port_name)
+    if follower.num_changes:
+        print(f'{follower.num_changes} chord changes, latency p50 {follower.latency_percentile(0.5) * 1000:.3f} ms, '
+              f'p99 {follower.latency_percentile(0.99) * 1000:.3f} ms')
+
+
+def stream(key, start, port_name=None, notes_per_chord=2, bpm=DEFAULT_BPM, bars_ahead=DEFAULT_BARS_AHEAD,
+           weights=None, seed=None, max_bars=None, max_seconds=None, program=0, list_ports=False):
+    from mellowchord.stream import stream
+    if list_ports:
+        import mido
+        try:
+            names = mido.get_output_names()
+        except (IOError, OSError, ImportError) as e:
+            raise MellowchordError(f'Can\'t list MIDI ports: {e}')
+        for name in names:
+            print(name)
+        return
+    validate_key(key)
+    chord_map = ChordMap.for_key(key, -1)
+    validate_start(start, chord_map)
+    if weights:
+        chord_map = chord_map.weighted(TransitionCounts.load(weights))
+    chord_stream = stream(key, start, chord_map, port_name, sys.stdout, max_bars, max_seconds,
+                          notes_per_chord=notes_per_chord, bpm=bpm, bars_ahead=bars_ahead, rng=random.Random(seed),
+                          program=program)
+    if chord_stream.num_messages:
+        print(f'{chord_stream.num_bars} bars, {chord_stream.num_messages} messages, lateness p50 '
+              f'{chord_stream.lateness_percentile(0.5) * 1000:.3f} ms, p99 '
+              f'{chord_stream.lateness_percentile(0.99) * 1000:.3f} ms, max {chord_stream.max_lateness * 1000:.3f} ms')
+    return chord_stream
+
+
+def serve(host, port, workers):
+    # asyncio is only imported when the service is actually started
+    from mellowchord.server import serve
+    serve(host, port, workers)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,148 @@
+"""Fast JSON encoding and decoding of chord sequences.
+
+Chord sequence files and NDJSON lines are {"key": ..., "seq": [...]} with
+every chord an object of six fields, and a catalog of them repeats the
+same few chords over and over.  A ChordSequenceCodec remembers the JSON
+text of every chord it has encoded, so encoding a sequence is joining
+strings.  It also remembers the KeyedChord for the text of every chord it
+has decoded, so decoding a sequence laid out the way json.dumps writes it
+is splitting the text and looking each chord up.  Anything else goes
+through json.loads and keyed_chord_decoder as before.
+
+The text written is exactly what json.dumps with KeyedChordEncoder
+writes, and whatever keyed_chord_decoder reads is read the same.
+"""
+import itertools
+import json
+import re
+
+from .mellowchord import keyed_chord_decoder
+from .mellowchord import KeyedChordEncoder
+
+
+# Chords a codec remembers the text or KeyedChord of, each way
+DEFAULT_MAX_CHORDS = 1 << 16
+# Sequences read_batches decodes at once
+DEFAULT_BATCH_SIZE = 1024
+
+_KEYED_CHORD_TYPE = '__keyed_chord__'
+# A sequence as json.dumps lays it out, with a key that needs no escapes
+_SEQUENCE_RE = re.compile(r'\{"key": "([^"\\]*)", "seq": \[(.*)\]\}\s*\Z', re.DOTALL)
+_CHORD_SEPARATOR = '}, {'
+
+
+class ChordSequenceCodec(object):
+    """Encodes and decodes (key, chord_sequence) in the chord sequence file
+    format, remembering up to max_chords chords each way.
+
+    Decoded chords are shared between the sequences decoded, as they are
+    between the sequences ChordMap.gen_sequence produces, so they mustn't
+    be changed.
+    """
+    def __init__(self, max_chords=DEFAULT_MAX_CHORDS):
+        self.max_chords = max_chords
+        # JSON text by chord attributes
+        self._fragments = {}
+        # KeyedChord by the text between a chord's braces
+        self._chords = {}
+
+    def _encode_chord(self, chord):
+        try:
+            attributes = (chord.key, chord.degree, chord.chord_type, chord.inversion, chord.octave_adjustment)
+        except AttributeError:
+            # Not a KeyedChord, so let the encoder say what's wrong with it
+            return json.dumps(chord, cls=KeyedChordEncoder)
+        fragment = json.dumps(chord, cls=KeyedChordEncoder)
+        if len(self._fragments) < self.max_chords:
+            self._fragments[attributes] = fragment
+        return fragment
+
+    def encode(self, key, chord_sequence):
+        """Return the JSON text of a chord sequence file for key and
+        chord_sequence (KeyedChord objects)."""
+        fragments = self._fragments
+        parts = []
+        for chord in chord_sequence:
+            try:
+                parts.append(fragments[(chord.key, chord.degree, chord.chord_type, chord.inversion,
+                                        chord.octave_adjustment)])
+            except (KeyError, AttributeError):
+                parts.append(self._encode_chord(chord))
+        return '{"key": ' + json.dumps(key) + ', "seq": [' + ', '.join(parts) + ']}'
+
+    def encode_line(self, key, chord_sequence):
+        """Return key and chord_sequence as a line of NDJSON."""
+        return self.encode(key, chord_sequence) + '\n'
+
+    def _decode_chord(self, fragment):
+        try:
+            fields = json.loads('{' + fragment + '}')
+        except ValueError:
+            return None
+        if not isinstance(fields, dict) or fields.get('type') != _KEYED_CHORD_TYPE:
+            return None
+        chord = keyed_chord_decoder(fields)
+        if len(self._chords) < self.max_chords:
+            self._chords[fragment] = chord
+        return chord
+
+    def _decode_fast(self, text):
+        m = _SEQUENCE_RE.match(text)
+        if m is None:
+            return None
+        key, body = m.groups()
+        if not body:
+            return key, []
+        if body[0] != '{' or body[-1] != '}':
+            return None
+        fragments = body[1:-1].split(_CHORD_SEPARATOR)
+        chords = self._chords
+        try:
+            return key, [chords[fragment] for fragment in fragments]
+        except KeyError:
+            pass
+        seq = []
+        for fragment in fragments:
+            chord = chords.get(fragment)
+            if chord is None:
+                chord = self._decode_chord(fragment)
+                if chord is None:
+                    return None
+            seq.append(chord)
+        return key, seq
+
+    def decode(self, text):
+        """Return (key, chord_sequence) from the JSON text (str or bytes)
+        of a chord sequence file or NDJSON line."""
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode()
+        decoded = self._decode_fast(text)
+        if decoded is None:
+            sequence_dict = json.loads(text, object_hook=keyed_chord_decoder)
+            decoded = (sequence_dict['key'], sequence_dict['seq'])
+        return decoded
+
+    def read_lines(self, f):
+        """Generator of (key, chord_sequence) tuples from the lines of an
+        open NDJSON stream, skipping blank lines."""
+        decode = self.decode
+        for line in f:
+            if line.strip():
+                yield decode(line)
+
+    def read_batches(self, f, batch_size=DEFAULT_BATCH_SIZE):
+        """Generator of lists of up to batch_size (key, chord_sequence)
+        tuples from an open NDJSON stream, skipping blank lines."""
+        decode = self.decode
+        while True:
+            lines = list(itertools.islice(f, batch_size))
+            if not lines:
+                return
+            batch = [decode(line) for line in lines if line.strip()]
+            if batch:
+                yield batch
+
+
+# Shared by write_chord_sequence_json, read_chord_sequence_json and the
+# NDJSON readers and writers
+SHARED_CODEC = ChordSequenceCodec()
@@ -0,0 +1,202 @@
+"""Chord sequences and melodies generated together, within a budget.
+
+A Composer runs chordgen and melodygen as one pipeline.  Chord sequences
+come from a ChordMap, either enumerated with gen_sequence or drawn with
+sample_sequences.  Each one is handed to a MelodyGenerator, and every
+(sequence, melody) pair is a result.  The chord and melody stages run on
+their own threads and are connected by bounded queues.  However large the
+nested space is, only a few sequences and results are held at once.
+Generation stops as soon as the ComposeBudget runs out.
+"""
+import json
+import queue
+import random
+import threading
+import time
+
+from .mellowchord import InvalidArgumentError
+from .mellowchord import KeyedChordEncoder
+from .mellowchord import MelodyGenerator
+from .mellowchord import validate_start
+
+
+# Items each queue between stages holds
+DEFAULT_QUEUE_SIZE = 64
+# Seconds a stage waits on a full queue before checking whether to stop
+_POLL_INTERVAL = 0.05
+
+# Why a Composer stopped
+EXHAUSTED = 'exhausted'
+MAX_RESULTS = 'max_results'
+MAX_SECONDS = 'max_seconds'
+_DONE = object()
+
+
+class ComposeBudget(object):
+    """Limits on how much a Composer generates.
+
+    max_results caps the (sequence, melody) pairs produced and max_seconds
+    the wall time from the first one being asked for.  max_melodies caps
+    the melodies tried over each chord sequence, so one sequence can't use
+    up the whole budget.  None means no limit.
+    """
+    def __init__(self, max_results=None, max_seconds=None, max_melodies=None):
+        for name, value in (('max_results', max_results), ('max_seconds', max_seconds),
+                            ('max_melodies', max_melodies)):
+            if value is not None and value <= 0:
+                raise InvalidArgumentError(f'{name} must be positive')
+        self.max_results = max_results
+        self.max_seconds = max_seconds
+        self.max_melodies = max_melodies
+
+    @property
+    def bounded(self):
+        """True if the budget stops an endless stream of results."""
+        return self.max_results is not None or self.max_seconds is not None
+
+
+class _StageError(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q, item, stop):
+    """Put item on q, waiting while it is full, unless stop is set first.
+    Returns False if it was."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class Composer(object):
+    """Iterable of (chord_sequence, melody) tuples from chord_map.
+
+    Sequences are of num_chords chords starting from start.  Each melody
+    has notes_per_chord notes for each chord.  With sample true, sequences
+    and melodies are drawn at random from rng (a random.Random) instead of
+    enumerated in order.  The budget must then limit the results or the
+    time, since there is no end to them.  Iterating again starts over.
+
+    After iterating, num_results and num_sequences say how many results
+    were produced and over how many chord sequences, and stop_reason says
+    why it stopped: EXHAUSTED, MAX_RESULTS or MAX_SECONDS.
+    """
+    def __init__(self, chord_map, start, num_chords, notes_per_chord, budget=None, sample=False, rng=None,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        validate_start(start, chord_map)
+        if notes_per_chord not in (1, 2, 3, 4):
+            raise InvalidArgumentError('notes_per_chord must be 1 to 4')
+        self.chord_map = chord_map
+        self.start = start
+        self.num_chords = num_chords
+        self.notes_per_chord = notes_per_chord
+        self.budget = budget or ComposeBudget()
+        if sample and not self.budget.bounded:
+            raise InvalidArgumentError('Sampling needs a limit on the results or the time')
+        self.sample = sample
+        self.rng = rng or random.Random()
+        self.queue_size = queue_size
+        self.num_sequences = 0
+        self.num_results = 0
+        self.stop_reason = None
+
+    def _chord_stage(self, sequences, stop, rng):
+        try:
+            if self.sample:
+                source = self.chord_map.sample_sequences(self.start, self.num_chords, rng=rng)
+            else:
+                source = self.chord_map.gen_sequence(self.start, self.num_chords)
+            for seq in source:
+                if not _put(sequences, seq, stop):
+                    return
+            _put(sequences, _DONE, stop)
+        except Exception as e:
+            _put(sequences, _StageError(e), stop)
+
+    def _melody_stage(self, sequences, results, stop, rng):
+        try:
+            max_melodies = self.budget.max_melodies
+            while True:
+                seq = sequences.get()
+                if seq is _DONE or isinstance(seq, _StageError):
+                    _put(results, seq, stop)
+                    return
+                melody_gen = MelodyGenerator(self.chord_map.key, seq, self.notes_per_chord)
+                if self.sample:
+                    melodies = melody_gen.sample_melodies(max_melodies, rng)
+                else:
+                    melodies = melody_gen.gen_sequence()
+                for index, notes in enumerate(melodies):
+                    if max_melodies is not None and index >= max_melodies:
+                        break
+                    if not _put(results, (seq, notes), stop):
+                        return
+        except Exception as e:
+            _put(results, _StageError(e), stop)
+
+    def __iter__(self):
+        self.num_sequences = 0
+        self.num_results = 0
+        self.stop_reason = None
+        sequences = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        # Each stage draws from its own generator, so the results for a
+        # seed don't depend on how the threads are scheduled
+        chord_rng = random.Random(self.rng.getrandbits(64))
+        melody_rng = random.Random(self.rng.getrandbits(64))
+        stages = [threading.Thread(target=self._chord_stage, args=(sequences, stop, chord_rng), daemon=True),
+                  threading.Thread(target=self._melody_stage, args=(sequences, results, stop, melody_rng),
+                                   daemon=True)]
+        budget = self.budget
+        deadline = None if budget.max_seconds is None else time.monotonic() + budget.max_seconds
+        for stage in stages:
+            stage.start()
+        last_seq = None
+        try:
+            while True:
+                if budget.max_results is not None and self.num_results >= budget.max_results:
+                    self.stop_reason = MAX_RESULTS
+                    return
+                try:
+                    if deadline is None:
+                        item = results.get()
+                    else:
+                        item = results.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+                if deadline is not None and (item is None or time.monotonic() >= deadline):
+                    self.stop_reason = MAX_SECONDS
+                    return
+                if item is _DONE:
+                    self.stop_reason = EXHAUSTED
+                    return
+                if isinstance(item, _StageError):
+                    raise item.error
+                self.num_results += 1
+                if item[0] is not last_seq:
+                    last_seq = item[0]
+                    self.num_sequences += 1
+                yield item
+        finally:
+            stop.set()
+            # A stage waiting for a sequence that will never come is woken
+            # by the end marker
+            try:
+                sequences.put_nowait(_DONE)
+            except queue.Full:
+                pass
+            for stage in stages:
+                stage.join()
+
+
+def compose_ndjson_line(key, chord_sequence, notes):
+    """Return a chord sequence and a melody over it as a line of NDJSON:
+    the fields of chord_sequence_ndjson_line and melody_ndjson_line
+    together."""
+    return json.dumps({'key': key, 'seq': chord_sequence,
+                       'melody': [note.scientific_notation() for note in notes]}, cls=KeyedChordEncoder) + '\n'
@@ -0,0 +1,263 @@
+"""Near-duplicate chord sequences, found with MinHash and LSH.
+
+Sequences are compared by degree alone, so sequences that differ only in
+inversions or chord variants (Imaj against Imaj7) are the same.  Each
+sequence is cut into n-grams of degrees (shingles), marked where it starts
+and ends, and the similarity of two sequences is the Jaccard similarity
+of their shingles.
+
+A MinHash signature estimates that similarity without the shingles: it
+keeps, for each of num_perm hash functions, the smallest hash of any
+shingle, and two signatures agree in about the fraction of positions that
+the shingle sets are similar.  Degree n-grams are few, so every shingle's
+hashes are worked out once as a row, and a signature is the column minima
+of its shingles' rows.  Batches of sequences are signed by a pool of
+processes.
+
+A NearDuplicateIndex cuts signatures into bands and buckets each band, so
+only sequences that agree on a whole band (locality sensitive hashing)
+are compared.  The bands are chosen so that pairs right at the similarity
+threshold are very likely to share one.
+"""
+from array import array
+import collections
+import itertools
+import operator
+import os
+import random
+
+from .mellowchord import InvalidArgumentError
+
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_NGRAM = 3
+DEFAULT_THRESHOLD = 0.8
+# Sequences signed at once by each worker
+DEFAULT_BATCH_SIZE = 4096
+
+# Hashes are (a * shingle + b) % _PRIME, so they fit in 32 bits
+_PRIME = (1 << 32) - 5
+# Degrees are 1 to 7 and 0 marks the start and end of a sequence, so a
+# shingle of up to this many fits below _PRIME as an octal number
+MAX_NGRAM = 9
+# Chance of sharing a band that the bands are chosen for, for a pair of
+# sequences exactly at the threshold
+_LSH_RECALL = 0.9
+
+
+def degrees(chord_sequence):
+    """Return the degrees of the chords of chord_sequence, which is all
+    that is compared."""
+    return tuple(chord.degree for chord in chord_sequence)
+
+
+def lsh_parameters(num_perm, threshold):
+    """Return (bands, rows): the most selective way of cutting num_perm
+    signature positions into bands of rows that still puts a pair of
+    sequences with similarity threshold in the same bucket of some band
+    with probability at least _LSH_RECALL."""
+    if not 0 < threshold <= 1:
+        raise InvalidArgumentError('The similarity threshold must be above 0 and at most 1')
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= _LSH_RECALL:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher(object):
+    """Shingles and MinHash signatures of degree sequences.
+
+    Hashers with the same num_perm, ngram and seed give the same
+    signatures, in any process.
+    """
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, ngram=DEFAULT_NGRAM, seed=0):
+        if not 1 <= ngram <= MAX_NGRAM:
+            raise InvalidArgumentError(f'The n-gram length must be 1 to {MAX_NGRAM}')
+        if num_perm < 1:
+            raise InvalidArgumentError('There must be at least one hash function')
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self.seed = seed
+        rng = random.Random(seed)
+        self._hashes = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME)) for _ in range(num_perm)]
+        # Hashes of each shingle under every hash function
+        self._rows = {}
+
+    def shingles(self, degree_sequence):
+        """Return the set of shingles of degree_sequence, each an n-gram
+        of degrees (with 0 before the first and after the last) as an
+        octal number."""
+        tokens = (0,) + tuple(degree_sequence) + (0,)
+        length = min(self.ngram, len(tokens))
+        shingles = set()
+        for start in range(len(tokens) - length + 1):
+            shingle = 1
+            for degree in tokens[start:start + length]:
+                shingle = shingle << 3 | degree
+            shingles.add(shingle)
+        return frozenset(shingles)
+
+    def _row(self, shingle):
+        try:
+            return self._rows[shingle]
+        except KeyError:
+            row = self._rows[shingle] = array('I', [(a * shingle + b) % _PRIME for a, b in self._hashes])
+            return row
+
+    def signature_of_shingles(self, shingles):
+        """Return the MinHash signature of a set of shingles, an array of
+        num_perm hashes."""
+        rows = [self._row(shingle) for shingle in shingles]
+        if len(rows) == 1:
+            return array('I', rows[0])
+        return array('I', map(min, *rows))
+
+    def signatures(self, degree_sequences):
+        """Return the signature of each of degree_sequences.  Sequences
+        with the same shingles share one signature."""
+        by_shingles = {}
+        retval = []
+        for degree_sequence in degree_sequences:
+            shingles = self.shingles(degree_sequence)
+            signature = by_shingles.get(shingles)
+            if signature is None:
+                signature = by_shingles[shingles] = self.signature_of_shingles(shingles)
+            retval.append(signature)
+        return retval
+
+
+def signature_similarity(signature, other):
+    """Return the fraction of positions in which two signatures agree, an
+    estimate of the similarity of their sequences."""
+    return sum(map(operator.eq, signature, other)) / len(signature)
+
+
+class NearDuplicateIndex(object):
+    """LSH buckets of the signatures of the sequences kept so far.
+
+    check returns the kept sequence most like a new one, if they are at
+    least threshold similar, and otherwise keeps the new one.
+    """
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, threshold=DEFAULT_THRESHOLD):
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.bands, self.rows = lsh_parameters(num_perm, threshold)
+        self._buckets = [{} for _ in range(self.bands)]
+        # Kept signatures and their ids, by kept number
+        self._signatures = []
+        self._ids = []
+        # Kept number by whole signature
+        self._exact = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def query(self, signature):
+        """Return (id, similarity) of the kept sequence most like the one
+        with signature, or None if none is at least threshold similar."""
+        kept = self._exact.get(signature.tobytes())
+        if kept is not None:
+            return self._ids[kept], 1.0
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+        best = None
+        for kept in sorted(candidates):
+            similarity = signature_similarity(signature, self._signatures[kept])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self._ids[kept], similarity)
+        return best
+
+    def add(self, signature, item_id):
+        """Keep the sequence with signature under item_id."""
+        if len(signature) != self.num_perm:
+            raise InvalidArgumentError(f'Signatures must have {self.num_perm} hashes, not {len(signature)}')
+        kept = len(self._ids)
+        self._signatures.append(signature)
+        self._ids.append(item_id)
+        self._exact.setdefault(signature.tobytes(), kept)
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(kept)
+
+    def check(self, signature, item_id):
+        """Return query(signature), keeping the sequence under item_id if
+        that is None."""
+        match = self.query(signature)
+        if match is None:
+            self.add(signature, item_id)
+        return match
+
+
+_worker_hashers = {}
+
+
+def _sign_batch(args):
+    num_perm, ngram, seed, degree_sequences = args
+    # Each worker process keeps its hasher, and its rows, between batches
+    hasher_key = (num_perm, ngram, seed)
+    if hasher_key not in _worker_hashers:
+        _worker_hashers[hasher_key] = MinHasher(num_perm, ngram, seed)
+    return [signature.tobytes() for signature in _worker_hashers[hasher_key].signatures(degree_sequences)]
+
+
+def _from_bytes(data):
+    signature = array('I')
+    signature.frombytes(data)
+    return signature
+
+
+def signed_batches(sequences, hasher, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Generator of (batch, signatures) for successive batches of up to
+    batch_size (key, chord_sequence) tuples from sequences, in order.
+    Unless workers is 1, batches are signed by a pool of workers processes
+    (default one per CPU), a few batches ahead of the one yielded."""
+    sequences = iter(sequences)
+    batches = iter(lambda: list(itertools.islice(sequences, batch_size)), [])
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for batch in batches:
+            yield batch, hasher.signatures(degrees(seq) for _, seq in batch)
+        return
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for batch in batches:
+            job = (hasher.num_perm, hasher.ngram, hasher.seed, [degrees(seq) for _, seq in batch])
+            pending.append((batch, pool.submit(_sign_batch, job)))
+            # Only a few batches are held at once, however many there are
+            if len(pending) > workers * 2:
+                batch, future = pending.popleft()
+                yield batch, [_from_bytes(data) for data in future.result()]
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, [_from_bytes(data) for data in future.result()]
+
+
+def find_near_duplicates(sequences, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM, ngram=DEFAULT_NGRAM,
+                         seed=0, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Generator of (index, key, chord_sequence, duplicate_of, similarity)
+    for every (key, chord_sequence) tuple of sequences, in order.
+
+    A sequence at least threshold similar to an earlier one that was kept
+    is a near-duplicate: duplicate_of is the index of the most similar
+    such sequence and similarity the estimated similarity.  Other
+    sequences are kept, with duplicate_of and similarity None.
+    Signatures are computed as signed_batches does.
+    """
+    hasher = MinHasher(num_perm, ngram, seed)
+    index = NearDuplicateIndex(num_perm, threshold)
+    counter = itertools.count()
+    for batch, signatures in signed_batches(sequences, hasher, workers, batch_size):
+        for (key, seq), signature in zip(batch, signatures):
+            item_index = next(counter)
+            match = index.check(signature, item_index)
+            if match is None:
+                yield item_index, key, seq, None, None
+            else:
+                yield (item_index, key, seq) + match
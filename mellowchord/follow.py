@@ -0,0 +1,200 @@
+"""Live chord following over MIDI input.
+
+ChordFollower keeps track of the notes held on an input port, recognizes
+the chord they make through a ChordTable and, whenever it changes, reports
+the chord and its ChordMap.next_chords suggestions.  Everything a change
+needs (the chord's name, the suggestions, the line to print and the
+messages to play) is worked out for every chord of the key when the
+follower is made, so handling a message only updates the held notes and
+does one table lookup.
+
+Any iterable of mido messages can be the input, so the loop runs the same
+over a hardware port (mido.open_input) and a ScriptedInputPort.
+"""
+import sys
+import time
+
+from .analyze import ChordTable
+from .analyze import PERCUSSION_CHANNEL
+from .instrument import RecentSamples
+from .mellowchord import Chord
+from .mellowchord import ChordMap
+from .mellowchord import KeyedChord
+from .mellowchord import MellowchordError
+
+
+class ScriptedInputPort(object):
+    """In-memory input port that yields a fixed list of messages, waiting
+    each message's time in seconds first if realtime is true (as
+    mido.MidiFile.play does)."""
+    def __init__(self, messages, realtime=False, name='scripted'):
+        self.name = name
+        self._messages = list(messages)
+        self._realtime = realtime
+        self.closed = False
+
+    def __iter__(self):
+        for message in self._messages:
+            if self.closed:
+                return
+            if self._realtime and message.time:
+                time.sleep(message.time)
+            yield message
+
+    def close(self):
+        self.closed = True
+
+
+class ChordFollower(object):
+    """Follow the chords played in key and suggest what could come next.
+
+    chord_map defaults to the shared map for key; pass a weighted map (see
+    ChordMap.weighted) to list the most likely suggestions first.  Each
+    change is written as a line to output (a text stream, if given),
+    passed to on_change(name, suggestions) (if given) and, if output_port
+    is given, the first suggestion is played on it until the next change.
+    Latencies are measured with clock, which can be replaced in tests.
+    """
+    def __init__(self, key, chord_map=None, output=None, on_change=None, output_port=None, velocity=64,
+                 clock=time.perf_counter):
+        self.key = key
+        self.chord_map = chord_map or ChordMap.for_key(key)
+        self._table = ChordTable.for_key(key)
+        self._output = output
+        self._on_change = on_change
+        self._output_port = output_port
+        self._clock = clock
+        # For every chord lookup can return: (name, suggestions, line to
+        # print, messages to start and stop playing the first suggestion)
+        self._responses = {}
+        in_map = set(self.chord_map.chord_strings)
+        for entry in self._table.entries():
+            degree, chord_type, inversion, _ = entry
+            chord = Chord(degree, chord_type, inversion)
+            name = KeyedChord(key, chord).name
+            if name in in_map:
+                suggestions = self.chord_map.next_chords(chord)
+            else:
+                suggestions = []
+            names = tuple(suggestion.name for suggestion in suggestions)
+            line = f'{name} -> {" ".join(names)}\n' if names else f'{name} (not in map)\n'
+            self._responses[entry] = (name, names, line) + self._play_messages(suggestions[:1], velocity)
+        self._held = set()
+        self._pitch_class_counts = [0] * 12
+        self._mask = 0
+        self._current = None
+        self.num_messages = 0
+        self.num_changes = 0
+        self.latencies = RecentSamples()
+
+    def _play_messages(self, suggestions, velocity):
+        if self._output_port is None or not suggestions:
+            return ((), ())
+        import mido
+        notes = [note.midi_note() for note in suggestions[0].adjusted_notes.values()]
+        return (tuple(mido.Message('note_on', note=note, velocity=velocity) for note in notes),
+                tuple(mido.Message('note_off', note=note) for note in notes))
+
+    @property
+    def current_chord(self):
+        """Name of the chord last recognized, or None."""
+        return self._responses[self._current][0] if self._current else None
+
+    def handle(self, message, received=None):
+        """Update the held notes with message, received at clock time
+        received (default now), and report the chord if it changed.
+        Returns True if it did."""
+        if received is None:
+            received = self._clock()
+        self.num_messages += 1
+        message_type = message.type
+        if message_type != 'note_on' and message_type != 'note_off' or message.channel == PERCUSSION_CHANNEL:
+            return False
+        note = message.note
+        pitch_class = note % 12
+        if message_type == 'note_off' or not message.velocity:
+            # Releasing notes never changes the chord: what is left while a
+            # chord is let go of one note at a time isn't what was played
+            if note in self._held:
+                self._held.discard(note)
+                self._pitch_class_counts[pitch_class] -= 1
+                if not self._pitch_class_counts[pitch_class]:
+                    self._mask &= ~(1 << pitch_class)
+            return False
+        if note in self._held:
+            return False
+        self._held.add(note)
+        self._pitch_class_counts[pitch_class] += 1
+        self._mask |= 1 << pitch_class
+        # Until enough notes of the next chord are down they don't make a
+        # chord, so the last one recognized carries on
+        entry = self._table.lookup(self._mask, min(self._held) % 12)
+        if entry is None or entry == self._current:
+            return False
+        self._report(entry)
+        self.latencies.append(self._clock() - received)
+        return True
+
+    def _report(self, entry):
+        if self._output_port is not None and self._current is not None:
+            for stop_message in self._responses[self._current][4]:
+                self._output_port.send(stop_message)
+        self._current = entry
+        self.num_changes += 1
+        name, suggestions, line, start_messages, _ = self._responses[entry]
+        if self._output is not None:
+            self._output.write(line)
+            self._output.flush()
+        if self._on_change is not None:
+            self._on_change(name, suggestions)
+        for start_message in start_messages:
+            self._output_port.send(start_message)
+
+    def run(self, port):
+        """Handle every message from port (any iterable of mido messages)
+        until it ends, and return the number of chord changes."""
+        clock = self._clock
+        handle = self.handle
+        try:
+            for message in port:
+                handle(message, clock())
+        finally:
+            if self._output_port is not None and self._current is not None:
+                for stop_message in self._responses[self._current][4]:
+                    self._output_port.send(stop_message)
+        return self.num_changes
+
+    def latency_percentile(self, fraction):
+        """Return the fraction (0 to 1) percentile, by nearest rank, of the
+        seconds from receiving a message to reporting the change it made,
+        over the most recent changes."""
+        return self.latencies.percentile(fraction)
+
+
+def follow(key, port_name=None, chord_map=None, play_port_name=None, output=None):
+    """Follow the chords played on the MIDI input port_name (default the
+    first one) until interrupted, and return the ChordFollower."""
+    import mido
+    output = output or sys.stdout
+    try:
+        port = mido.open_input(port_name)
+    except (IOError, OSError, ImportError) as e:
+        raise MellowchordError(f'Can\'t open MIDI port: {e}')
+    output_port = None
+    try:
+        if play_port_name:
+            try:
+                output_port = mido.open_output(play_port_name)
+            except (IOError, OSError, ImportError) as e:
+                raise MellowchordError(f'Can\'t open MIDI port: {e}')
+        follower = ChordFollower(key, chord_map, output, output_port=output_port)
+        output.write(f'Following chords in {key} on {port.name}, Ctrl-C to stop\n')
+        try:
+            follower.run(port)
+        except KeyboardInterrupt:
+            pass
+    finally:
+        port.close()
+        if output_port is not None:
+            output_port.close()
+    return follower
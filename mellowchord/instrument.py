@@ -0,0 +1,190 @@
+"""Opt-in counters and timers for the hot paths.
+
+Instrumentation is off by default.  Turn it on with ``mc --profile`` or by
+setting the MELLOWCHORD_PROFILE environment variable to 1, or to the path
+of a file to write the JSON summary to.  When it is on, a per-stage
+summary (calls, total, p50 and p99 times) is printed to stderr at exit.
+When it is off an instrumented function costs one extra call and a flag
+check.
+
+Times are inclusive: a stage that calls another instrumented stage is
+charged for the time spent in both.  A generator is timed over every
+resumption and recorded as one call once it is exhausted or closed.
+"""
+import atexit
+import collections
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import time
+
+
+# Number of timings kept per stage for estimating percentiles
+MAX_SAMPLES = 10000
+
+
+def _nearest_rank(ordered, fraction):
+    # The fraction (0 to 1) percentile of a non-empty sorted list
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self._random = random.Random(0)
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.total = 0.0
+        self.samples = []
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            # Reservoir sampling keeps memory bounded for long runs
+            index = self._random.randrange(self.calls)
+            if index < MAX_SAMPLES:
+                self.samples[index] = elapsed
+
+    def summary(self):
+        samples = sorted(self.samples)
+
+        def percentile(p):
+            return _nearest_rank(samples, p / 100) if samples else 0.0
+        return {'calls': self.calls,
+                'total': self.total,
+                'mean': self.total / self.calls if self.calls else 0.0,
+                'p50': percentile(50),
+                'p99': percentile(99)}
+
+
+class RecentSamples(object):
+    """The most recent maxlen of a stream of measurements, such as
+    latencies, with their percentiles."""
+    def __init__(self, maxlen=MAX_SAMPLES):
+        self._samples = collections.deque(maxlen=maxlen)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __iter__(self):
+        return iter(self._samples)
+
+    def append(self, sample):
+        self._samples.append(sample)
+
+    def percentile(self, fraction):
+        """Return the fraction (0 to 1) percentile of the samples, by
+        nearest rank, or None if there are none."""
+        if not self._samples:
+            return None
+        return _nearest_rank(sorted(self._samples), fraction)
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.json_path = None
+        self._stages = {}
+        self._atexit_registered = False
+
+    def stage(self, name):
+        if name not in self._stages:
+            self._stages[name] = _Stage(name)
+        return self._stages[name]
+
+    def enable(self, json_path=None, report_at_exit=True):
+        self.enabled = True
+        if json_path is not None:
+            self.json_path = json_path
+        if report_at_exit and not self._atexit_registered:
+            atexit.register(self._report_at_exit)
+            self._atexit_registered = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        for stage in self._stages.values():
+            stage.reset()
+
+    def summary(self):
+        """Return a dict of stage name to statistics for every stage that
+        has been called."""
+        return {name: stage.summary() for name, stage in sorted(self._stages.items()) if stage.calls}
+
+    def format_summary(self):
+        lines = [f'{"stage":32} {"calls":>10} {"total ms":>12} {"p50 us":>10} {"p99 us":>10}']
+        for name, stats in self.summary().items():
+            lines.append(f'{name:32} {stats["calls"]:>10} {stats["total"] * 1e3:>12.3f} '
+                         f'{stats["p50"] * 1e6:>10.1f} {stats["p99"] * 1e6:>10.1f}')
+        return '\n'.join(lines)
+
+    def dump(self, file=None, json_path=None):
+        """Print the summary as text and, if json_path is given, write it
+        as JSON."""
+        print(self.format_summary(), file=file or sys.stderr)
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def _report_at_exit(self):
+        if self.enabled:
+            self.dump(json_path=self.json_path)
+
+
+profiler = Profiler()
+
+
+def _timed_generator(stage, gen):
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(gen)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        gen.close()
+        stage.record(elapsed)
+
+
+def instrumented(name):
+    """Decorator that times calls to a function, or to a generator
+    function, under the given stage name while profiling is enabled."""
+    def decorator(func):
+        stage = profiler.stage(name)
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return func(*args, **kwargs)
+                return _timed_generator(stage, func(*args, **kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stage.record(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+_env_setting = os.environ.get('MELLOWCHORD_PROFILE', '')
+if _env_setting not in ('', '0'):
+    profiler.enable(None if _env_setting == '1' else _env_setting)
@@ -0,0 +1,284 @@
+"""Compact binary container for libraries of chord sequences.
+
+A library file is laid out as
+
+    header | records | record index (variable width only) | string tables
+
+Every chord is packed into four bytes: key index, degree and inversion,
+chord type index and octave adjustment.  When all sequences have the same
+length the records are fixed width and located by arithmetic, otherwise
+an index of record offsets follows the records.  Libraries are read
+through mmap so opening one costs the same whatever its size.
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from .mellowchord import Chord
+from .mellowchord import InvalidArgumentError
+from .mellowchord import KeyedChord
+from .mellowchord import make_file_name_from_chord_sequence
+from .mellowchord import MellowchordError
+from .mellowchord import read_chord_sequence_json
+from .mellowchord import read_chord_sequence_ndjson
+from .mellowchord import write_chord_sequence_json
+
+
+LIBRARY_MAGIC = b'MCLB'
+LIBRARY_VERSION = 1
+
+# magic, version, flags, record count, chords per record, data offset,
+# index offset, tables offset, tables size
+_HEADER = struct.Struct('<4sHHQIQQQQ')
+# key index, degree << 4 | inversion, chord type index, octave adjustment
+_CHORD = struct.Struct('<BBBb')
+_OFFSET = struct.Struct('<Q')
+_FLAG_FIXED_WIDTH = 1
+
+
+class LibraryFormatError(MellowchordError):
+    pass
+
+
+class ChordLibraryWriter(object):
+    """Append chord sequences to a new library file.
+
+    Records are fixed width for as long as every sequence has the same
+    length.  The first sequence of a different length switches the writer
+    to an offset index, which is spooled to a temporary file so memory use
+    does not grow with the number of records.
+    """
+    def __init__(self, path, keys=None, chord_types=None):
+        self._keys = list(keys or [])
+        self._key_index = {key: index for index, key in enumerate(self._keys)}
+        self._chord_types = list(chord_types or [])
+        self._chord_type_index = {chord_type: index for index, chord_type in enumerate(self._chord_types)}
+        self._count = 0
+        self._chords_per_record = None
+        self._index = None
+        self._offset = _HEADER.size
+        self._f = open(path, 'wb')
+        self._f.write(bytes(_HEADER.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _intern(table, index, value, what):
+        if value not in index:
+            if len(table) == 256:
+                raise LibraryFormatError(f'A library can hold at most 256 distinct {what}')
+            index[value] = len(table)
+            table.append(value)
+        return index[value]
+
+    def pack_chord(self, keyed_chord):
+        key_index = self._intern(self._keys, self._key_index, keyed_chord.key, 'keys')
+        chord_type_index = self._intern(self._chord_types, self._chord_type_index,
+                                        keyed_chord.chord_type, 'chord types')
+        if not -128 <= keyed_chord.octave_adjustment <= 127:
+            raise LibraryFormatError(f'Octave adjustment {keyed_chord.octave_adjustment} is out of range')
+        return _CHORD.pack(key_index,
+                           keyed_chord.degree << 4 | (keyed_chord.inversion or 0),
+                           chord_type_index,
+                           keyed_chord.octave_adjustment)
+
+    def append(self, seq):
+        self.append_raw(b''.join(self.pack_chord(keyed_chord) for keyed_chord in seq))
+
+    def append_raw(self, record):
+        """Append an already packed record.  The record must have been packed
+        against the same key and chord type tables as this writer."""
+        num_chords = len(record) // _CHORD.size
+        if num_chords == 0:
+            raise InvalidArgumentError('Can\'t store an empty chord sequence')
+        if self._count == 0:
+            self._chords_per_record = num_chords
+        elif self._index is None and num_chords != self._chords_per_record:
+            self._index = tempfile.TemporaryFile()
+            record_size = self._chords_per_record * _CHORD.size
+            for record_index in range(self._count):
+                self._index.write(_OFFSET.pack(_HEADER.size + record_index * record_size))
+        if self._index is not None:
+            self._index.write(_OFFSET.pack(self._offset))
+        self._f.write(record)
+        self._offset += len(record)
+        self._count += 1
+
+    def close(self):
+        if self._f.closed:
+            return
+        index_offset = 0
+        if self._index is not None:
+            index_offset = self._offset
+            self._index.write(_OFFSET.pack(self._offset))
+            self._index.seek(0)
+            shutil.copyfileobj(self._index, self._f)
+            self._index.close()
+        tables = json.dumps({'keys': self._keys, 'chord_types': self._chord_types}).encode('utf-8')
+        tables_offset = self._f.tell()
+        self._f.write(tables)
+        flags = 0
+        chords_per_record = 0
+        if self._index is None and self._count:
+            flags |= _FLAG_FIXED_WIDTH
+            chords_per_record = self._chords_per_record
+        self._f.seek(0)
+        self._f.write(_HEADER.pack(LIBRARY_MAGIC, LIBRARY_VERSION, flags, self._count, chords_per_record,
+                                   _HEADER.size, index_offset, tables_offset, len(tables)))
+        self._f.close()
+
+
+class ChordLibrary(object):
+    """Read-only, random access view of a library file.
+
+    Indexing returns a list of KeyedChord objects.  Decoded chords are
+    cached by their packed form, so the same KeyedChord instance is shared
+    by every sequence that contains it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'rb')
+        try:
+            if os.fstat(self._f.fileno()).st_size < _HEADER.size:
+                raise LibraryFormatError(f'{path} is not a chord library')
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._f.close()
+            raise
+        (magic, version, flags, self._count, chords_per_record, self._data_offset,
+         self._index_offset, tables_offset, tables_size) = _HEADER.unpack_from(self._mm)
+        if magic != LIBRARY_MAGIC:
+            self.close()
+            raise LibraryFormatError(f'{path} is not a chord library')
+        if version != LIBRARY_VERSION:
+            self.close()
+            raise LibraryFormatError(f'{path} has unsupported library version {version}')
+        self.chords_per_record = chords_per_record if flags & _FLAG_FIXED_WIDTH else None
+        try:
+            tables = json.loads(self._mm[tables_offset:tables_offset + tables_size].decode('utf-8'))
+            self.keys = tables['keys']
+            self.chord_types = tables['chord_types']
+        except (ValueError, KeyError, TypeError) as e:
+            self.close()
+            raise LibraryFormatError(f'{path} has corrupt string tables: {e}')
+        self._chords = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if hasattr(self, '_mm'):
+            self._mm.close()
+        self._f.close()
+
+    def __len__(self):
+        return self._count
+
+    def _record_range(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('library index out of range')
+        if self.chords_per_record is not None:
+            record_size = self.chords_per_record * _CHORD.size
+            start = self._data_offset + index * record_size
+            return start, start + record_size
+        return struct.unpack_from('<QQ', self._mm, self._index_offset + index * _OFFSET.size)
+
+    def record_bytes(self, index):
+        start, stop = self._record_range(index)
+        return self._mm[start:stop]
+
+    def _unpack_chord(self, packed):
+        keyed_chord = self._chords.get(packed)
+        if keyed_chord is None:
+            key_index, degree_inversion, chord_type_index, octave_adjustment = _CHORD.unpack(packed)
+            chord = Chord(degree_inversion >> 4,
+                          self.chord_types[chord_type_index],
+                          degree_inversion & 0xf or None,
+                          octave_adjustment)
+            keyed_chord = KeyedChord(self.keys[key_index], chord)
+            self._chords[packed] = keyed_chord
+        return keyed_chord
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        record = self.record_bytes(index)
+        return [self._unpack_chord(record[i:i + _CHORD.size]) for i in range(0, len(record), _CHORD.size)]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def key_of(self, index):
+        """Return the key of the first chord of the given record."""
+        start, _ = self._record_range(index)
+        return self.keys[self._mm[start]]
+
+
+def write_library(library_path, sequences):
+    """Write an iterable of KeyedChord sequences to a new library and
+    return the number of sequences written."""
+    with ChordLibraryWriter(library_path) as writer:
+        for seq in sequences:
+            writer.append(seq)
+        return len(writer)
+
+
+def json_to_library(json_paths, library_path):
+    """Pack chord sequence JSON files (as written by
+    write_chord_sequence_json) into a new library."""
+    return write_library(library_path, (read_chord_sequence_json(path)[1] for path in json_paths))
+
+
+def library_to_json(library_path, output_dir, start=0, stop=None):
+    """Write records [start, stop) of a library out as chord sequence JSON
+    files and return their paths."""
+    paths = []
+    with ChordLibrary(library_path) as library:
+        for index in range(*slice(start, stop).indices(len(library))):
+            seq = library[index]
+            path = os.path.join(output_dir, make_file_name_from_chord_sequence(seq) + '.json')
+            write_chord_sequence_json(path, library.key_of(index), seq)
+            paths.append(path)
+    return paths
+
+
+def slice_library(library_path, output_path, start=0, stop=None):
+    """Copy records [start, stop) of a library into a new library without
+    decoding them."""
+    with ChordLibrary(library_path) as library:
+        with ChordLibraryWriter(output_path, library.keys, library.chord_types) as writer:
+            for index in range(*slice(start, stop).indices(len(library))):
+                writer.append_raw(library.record_bytes(index))
+            return len(writer)
+
+
+def read_sequences(paths):
+    """Generator of (key, chord_sequence) tuples from any mix of chord
+    sequence JSON files, NDJSON streams (.ndjson) and libraries (.mcl)."""
+    for path in paths:
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.ndjson':
+            with open(path, 'r') as f:
+                yield from read_chord_sequence_ndjson(f)
+        elif extension == '.mcl':
+            with ChordLibrary(path) as library:
+                for index in range(len(library)):
+                    yield (library.key_of(index), library[index])
+        else:
+            yield read_chord_sequence_json(path)
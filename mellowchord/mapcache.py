@@ -0,0 +1,257 @@
+"""On-disk cache of compiled chord maps.
+
+Parsing, validating and compiling a large chord map definition costs far
+more than reading back the result, so ChordMap.from_file saves each
+compiled map as a binary artifact and loads that on later runs.  An
+artifact is laid out as
+
+    header | chords | node variants | node successors | chord successors | tables
+
+The chord and graph arrays are little-endian uint32 (chords are three
+bytes each: degree, chord type index, inversion), and the JSON tables at
+the end hold the strings: chord types, node names, the name of every chord
+in the map's key and the definition itself.  An artifact is read with a
+single read call.
+
+Artifacts are kept in MELLOWCHORD_CACHE_DIR, or else mellowchord under
+XDG_CACHE_HOME or ~/.cache.  They are named for the definition file and
+key, and carry a digest of the definition, the key, the artifact format
+version and the mellowchord version.  An artifact whose digest no longer
+matches is stale: it is deleted and rebuilt, and writing a new artifact
+for a definition file removes the stale ones for the same key.
+"""
+import array
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+
+from .mellowchord import Chord
+from .mellowchord import chord_map_definition_from_json
+from .mellowchord import ChordMap
+from .mellowchord import KeyedChord
+from .mellowchord import MellowchordError
+from .mellowchord import _ChordGraph
+from .mellowchord import _ChordGraphNode
+from .version import __version__
+
+
+ARTIFACT_MAGIC = b'MCMP'
+ARTIFACT_VERSION = 1
+ARTIFACT_SUFFIX = '.mcm'
+
+# magic, version, flags, digest, chord count, node count, variant count,
+# edge count, chord edge count, tables size
+_HEADER = struct.Struct('<4sHH32sIIIIII')
+_UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+class MapArtifactError(MellowchordError):
+    pass
+
+
+def cache_dir():
+    """Return the directory compiled chord maps are cached in."""
+    directory = os.environ.get('MELLOWCHORD_CACHE_DIR')
+    if directory:
+        return directory
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mellowchord')
+
+
+def artifact_digest(definition_bytes, key=None):
+    """Return the digest that identifies the artifact compiled from
+    definition_bytes for key with this version of mellowchord."""
+    h = hashlib.sha256()
+    h.update(f'{ARTIFACT_VERSION}\0{__version__}\0{key or ""}\0'.encode())
+    h.update(definition_bytes)
+    return h.digest()
+
+
+def _artifact_prefix(source_path, key):
+    source = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()[:16]
+    key_tag = hashlib.sha256((key or '').encode()).hexdigest()[:8]
+    return f'{source}-{key_tag}-'
+
+
+def artifact_path(source_path, key, digest, directory=None):
+    """Return the path of the artifact for the definition file
+    source_path compiled for key, whose digest is digest."""
+    return os.path.join(directory or cache_dir(), _artifact_prefix(source_path, key) + digest.hex()[:32] + ARTIFACT_SUFFIX)
+
+
+def _uint32_bytes(values):
+    data = array.array(_UINT32, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _uint32_array(view, offset, count):
+    data = array.array(_UINT32)
+    data.frombytes(view[offset:offset + count * 4])
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data, offset + count * 4
+
+
+def _offsets(groups):
+    retval = [0]
+    for group in groups:
+        retval.append(retval[-1] + len(group))
+    return retval
+
+
+def write_artifact(path, chord_map, digest):
+    """Write chord_map to path as a compiled map artifact.  The file is
+    replaced atomically, so readers never see a partial artifact."""
+    successor_table = chord_map._successor_table()
+    chords = list(successor_table)
+    chord_ids = {chord: index for index, chord in enumerate(chords)}
+    nodes = chord_map._g.nodes
+    node_numbers = {node: number for number, node in enumerate(nodes)}
+    chord_types = sorted(set(chord.chord_type for chord in chords))
+    type_ids = {chord_type: index for index, chord_type in enumerate(chord_types)}
+    variants = [[chord_ids[chord] for chord in node.chords] for node in nodes]
+    successors = [[node_numbers[successor] for successor in chord_map._g.successors(node)] for node in nodes]
+    chord_successors = [[chord_ids[successor] for successor in successor_table[chord]] for chord in chords]
+    keyed_names = None
+    if chord_map.key:
+        keyed_names = [KeyedChord(chord_map.key, chord).name for chord in chords]
+    tables = json.dumps({'library_version': __version__,
+                         'key': chord_map.key,
+                         'chord_types': chord_types,
+                         'node_names': [node.name for node in nodes],
+                         'keyed_names': keyed_names,
+                         'definition': chord_map.definition}).encode()
+    parts = [_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, 0, digest, len(chords), len(nodes),
+                          sum(len(group) for group in variants), sum(len(group) for group in successors),
+                          sum(len(group) for group in chord_successors), len(tables)),
+             bytes(chord.degree for chord in chords),
+             bytes(type_ids[chord.chord_type] for chord in chords),
+             bytes(chord.inversion or 0 for chord in chords)]
+    for groups in (variants, successors, chord_successors):
+        parts.append(_uint32_bytes(_offsets(groups)))
+        parts.append(_uint32_bytes(value for group in groups for value in group))
+    parts.append(tables)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.', suffix=ARTIFACT_SUFFIX, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_artifact(path, digest=None, octave_adjustment=0, freeze=False):
+    """Return the ChordMap saved in the artifact at path.
+
+    Raises MapArtifactError if the file is not a complete artifact from
+    this version of mellowchord, or if digest is given and does not match.
+    If freeze is true the map is frozen with the successor table saved in
+    the artifact instead of working it out again.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise MapArtifactError(f'{path} is too short to be a chord map artifact')
+    (magic, version, _, saved_digest, num_chords, num_nodes,
+     num_variants, num_edges, num_chord_edges, tables_size) = _HEADER.unpack_from(data)
+    if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+        raise MapArtifactError(f'{path} is not a version {ARTIFACT_VERSION} chord map artifact')
+    if digest is not None and saved_digest != digest:
+        raise MapArtifactError(f'{path} is stale')
+    expected_size = (_HEADER.size + 3 * num_chords + 4 * (num_nodes + 1 + num_variants + num_nodes + 1 + num_edges +
+                                                          num_chords + 1 + num_chord_edges) + tables_size)
+    if len(data) != expected_size:
+        raise MapArtifactError(f'{path} is truncated or corrupt')
+    view = memoryview(data)
+    offset = _HEADER.size
+    degrees = data[offset:offset + num_chords]
+    type_ids = data[offset + num_chords:offset + 2 * num_chords]
+    inversions = data[offset + 2 * num_chords:offset + 3 * num_chords]
+    offset += 3 * num_chords
+    variant_offsets, offset = _uint32_array(view, offset, num_nodes + 1)
+    variants, offset = _uint32_array(view, offset, num_variants)
+    edge_offsets, offset = _uint32_array(view, offset, num_nodes + 1)
+    edges, offset = _uint32_array(view, offset, num_edges)
+    chord_edge_offsets, offset = _uint32_array(view, offset, num_chords + 1)
+    chord_edges, offset = _uint32_array(view, offset, num_chord_edges)
+    for values, limit in ((variants, num_chords), (edges, num_nodes), (chord_edges, num_chords)):
+        if values and max(values) >= limit:
+            raise MapArtifactError(f'{path} is corrupt')
+    try:
+        tables = json.loads(bytes(view[offset:]))
+        if tables['library_version'] != __version__:
+            raise MapArtifactError(f'{path} was written by mellowchord {tables["library_version"]}')
+        if len(tables['node_names']) != num_nodes:
+            raise MapArtifactError(f'{path} is corrupt')
+        chord_types = tables['chord_types']
+        chords = [Chord(degree, chord_types[type_id], inversion or None)
+                  for degree, type_id, inversion in zip(degrees, type_ids, inversions)]
+        nodes = [_ChordGraphNode([chords[chord_id] for chord_id in variants[start:stop]], name)
+                 for name, start, stop in zip(tables['node_names'], variant_offsets, variant_offsets[1:])]
+        successors = [edges[start:stop] for start, stop in zip(edge_offsets, edge_offsets[1:])]
+        keyed_names = None
+        if tables['keyed_names'] is not None:
+            keyed_names = dict(zip(chords, tables['keyed_names']))
+    except (ValueError, KeyError, IndexError, TypeError, AssertionError) as e:
+        raise MapArtifactError(f'{path} is corrupt: {e!r}')
+    chord_map = ChordMap.from_graph(_ChordGraph.from_tables(nodes, successors), tables['key'], octave_adjustment,
+                                    tables['definition'], keyed_names)
+    if freeze:
+        chord_map.freeze({chord: tuple(chords[chord_id] for chord_id in chord_edges[start:stop])
+                          for chord, start, stop in zip(chords, chord_edge_offsets, chord_edge_offsets[1:])})
+    return chord_map
+
+
+def _remove_stale_artifacts(path):
+    directory, name = os.path.split(path)
+    prefix = name[:name.rindex('-') + 1]
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for other in names:
+        if other != name and other.startswith(prefix) and other.endswith(ARTIFACT_SUFFIX):
+            try:
+                os.unlink(os.path.join(directory, other))
+            except OSError:
+                pass
+
+
+def cached_chord_map(path, key=None, octave_adjustment=0, directory=None, freeze=False):
+    """Return the ChordMap for the chord map definition file at path,
+    loading it from its artifact if there is an up to date one and
+    compiling it and saving the artifact otherwise.
+
+    The cache is best effort: a missing, stale or unreadable artifact is
+    rebuilt, and a cache directory that can't be written to is ignored.
+    """
+    with open(path, 'rb') as f:
+        definition_bytes = f.read()
+    digest = artifact_digest(definition_bytes, key)
+    artifact = artifact_path(path, key, digest, directory)
+    try:
+        return read_artifact(artifact, digest, octave_adjustment, freeze)
+    except FileNotFoundError:
+        pass
+    except (OSError, MapArtifactError):
+        try:
+            os.unlink(artifact)
+        except OSError:
+            pass
+    chord_map = ChordMap(key, octave_adjustment, chord_map_definition_from_json(definition_bytes, path))
+    try:
+        write_artifact(artifact, chord_map, digest)
+        _remove_stale_artifacts(artifact)
+    except OSError:
+        pass
+    if freeze:
+        chord_map.freeze()
+    return chord_map
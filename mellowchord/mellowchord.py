@@ -1,10 +1,14 @@
+import bisect
+import collections
 import copy
 import itertools
 import json
-import mido
 import musthe
-import networkx as nx
+import random
 import re
+import threading
+
+from .instrument import instrumented
 
 
 roman_numerals = (None, 'I', 'II', 'III', 'IV', 'V', 'VI', 'VII')
@@ -22,6 +26,18 @@ class InvalidArgumentError(MellowchordError):
     pass
 
 
+class FrozenMapError(MellowchordError):
+    pass
+
+
+class ChordMapFormatError(MellowchordError):
+    pass
+
+
+class ConcurrentModificationError(MellowchordError):
+    pass
+
+
 class Chord(object):
     def __init__(self, degree, chord_type, inversion=None, octave_adjustment=0):
         self.degree = int(degree)
@@ -31,23 +47,18 @@ class Chord(object):
         self.inversion = inversion
         self.octave_adjustment = octave_adjustment
 
+    @property
+    def numeral(self):
+        return chord_numeral(self.degree, self.chord_type)
+
     @property
     def name(self):
-        roman = roman_numerals[self.degree]
-        try:
-            recipe = musthe.Chord.recipes[self.chord_type]
-        except KeyError:
-            key = musthe.Chord.aliases[self.chord_type]
-            recipe = musthe.Chord.recipes[key]
-        if 'm3' in recipe:
-            chord_name = roman.lower()
-        else:
-            chord_name = roman.upper()
+        chord_name = self.numeral
         chord_name += self.chord_type
         if self.inversion == 1:
-            chord_name += f'/{(self.degree + 2) % 7}'
+            chord_name += f'/{third_degree(self.degree)}'
         elif self.inversion == 2:
-            chord_name += f'/{(self.degree + 4) % 7}'
+            chord_name += f'/{fifth_degree(self.degree)}'
         return chord_name
 
     def __repr__(self):
@@ -57,11 +68,7 @@ class Chord(object):
         return self.name
 
     def __hash__(self):
-        normalized_chord_type = self.chord_type
-        for alias in musthe.Chord.aliases:
-            if self.chord_type == alias:
-                normalized_chord_type = musthe.Chord.aliases[alias]
-                break
+        normalized_chord_type = musthe.Chord.aliases.get(self.chord_type, self.chord_type)
         return hash((self.degree, normalized_chord_type, self.inversion))
 
     def __eq__(self, other):
@@ -72,6 +79,30 @@ class Chord(object):
         return False
 
 
+def third_degree(degree):
+    """Return the scale degree a third above degree."""
+    return (degree + 1) % 7 + 1
+
+
+def fifth_degree(degree):
+    """Return the scale degree a fifth above degree."""
+    return (degree + 3) % 7 + 1
+
+
+def chord_numeral(degree, chord_type):
+    """Return the roman numeral for degree, in lower case if chord_type
+    has a minor third."""
+    roman = roman_numerals[degree]
+    try:
+        recipe = musthe.Chord.recipes[chord_type]
+    except KeyError:
+        key = musthe.Chord.aliases[chord_type]
+        recipe = musthe.Chord.recipes[key]
+    if 'm3' in recipe:
+        return roman.lower()
+    return roman.upper()
+
+
 def apply_inversion(keyed_chord, inversion):
     if inversion == 0:
         inversion = None
@@ -176,11 +207,22 @@ def keyed_chord_decoder(json_object):
     return json_object
 
 
+class _AllSoundsOff(object):
+    """Build MidiFile.ALL_SOUNDS_OFF on first access so that mido is only
+    imported once MIDI is actually needed."""
+    def __get__(self, obj, owner):
+        import mido
+        message = mido.Message('control_change', control=120, value=0, time=owner.BUFFER_TIME)
+        owner.ALL_SOUNDS_OFF = message
+        return message
+
+
 class MidiFile(object):
     BUFFER_TIME = 500
-    ALL_SOUNDS_OFF = mido.Message('control_change', control=120, value=0, time=BUFFER_TIME)
+    ALL_SOUNDS_OFF = _AllSoundsOff()
 
     def __init__(self, filename, program=0):
+        import mido
         self._filename = filename
         self._tracks = {}
         for track_name in ('root', 'third', 'fifth', 'seventh', 'melody'):
@@ -191,6 +233,7 @@ class MidiFile(object):
             track.append(MidiFile.ALL_SOUNDS_OFF)
 
     def _add_track_note(self, track_name, note, velocity, on_time, off_time):
+        import mido
         self._tracks[track_name].append(mido.Message('note_on',
                                                      note=note,
                                                      velocity=velocity,
@@ -216,6 +259,7 @@ class MidiFile(object):
         self.add_chord(keyed_chord, chord_velocity, chord_time)
 
     def add_chord(self, keyed_chord, velocity=64, time=1000):
+        import mido
         notes_dict = keyed_chord.adjusted_notes
         for track_name in ['root', 'third', 'fifth']:
             self._add_track_note(track_name, notes_dict[track_name].midi_note(), velocity, time, 5)
@@ -229,17 +273,27 @@ class MidiFile(object):
                                                         time=time+5))
 
     def _make_midi_file(self):
+        import mido
         midi_file = mido.MidiFile()
         tracks_copy = copy.copy(self._tracks)
         for track_name in ('root', 'third', 'fifth', 'seventh', 'melody'):
             midi_file.tracks.append(tracks_copy[track_name])
         return midi_file
 
+    @instrumented('MidiFile.write')
     def write(self):
         midi_file = self._make_midi_file()
         midi_file.save(self._filename)
 
+    def to_bytes(self):
+        """Return the contents of the MIDI file without writing it."""
+        import io
+        f = io.BytesIO()
+        self._make_midi_file().save(file=f)
+        return f.getvalue()
+
     def play(self, portname=None, raise_exceptions=False):
+        import mido
         midi_file = self._make_midi_file()
         try:
             with mido.open_output(portname=portname, autoreset=True) as port:
@@ -250,6 +304,7 @@ class MidiFile(object):
                 raise MellowchordError(str(e))
 
 
+@instrumented('write_midi_file')
 def write_midi_file(seq, melody, midi_file_path, program):
     midi_file = MidiFile(midi_file_path, program)
     if melody:
@@ -265,11 +320,8 @@ def write_midi_file(seq, melody, midi_file_path, program):
 
 
 def chords_types_are_equal(chord_type_1, chord_type_2):
-    for alias in musthe.Chord.aliases:
-        chord_type_set = set([alias, musthe.Chord.aliases[alias]])
-        if chord_type_1 in chord_type_set and chord_type_2 in chord_type_set:
-            return True
-    return False
+    aliases = musthe.Chord.aliases
+    return aliases.get(chord_type_1, chord_type_1) == aliases.get(chord_type_2, chord_type_2)
 
 
 def _split_bass(chord_string, key=None):
@@ -298,15 +350,16 @@ def _split_bass(chord_string, key=None):
     return (chord_string, None)
 
 
+@instrumented('string_to_chord')
 def string_to_chord(chord_string, key=None):
     (chord_string_minus_bass, bass) = _split_bass(chord_string, key)
 
     def bass_to_inversion(bass, degree):
         if bass is None:
             return None
-        elif bass == (degree + 2) % 7:
+        elif bass == third_degree(degree):
             return 1
-        elif bass == (degree + 4) % 7:
+        elif bass == fifth_degree(degree):
             return 2
         assert False, f'Unsupported slash chord {chord_string}'
 
@@ -339,6 +392,13 @@ def string_to_keyed_chord(chord_string, key, octave_adjustment):
     return raise_or_lower_an_octave(kc, octave_adjustment)
 
 
+def sequence_keyed_chord(key, chord, octave_adjustment):
+    """Return the KeyedChord that ChordMap.gen_sequence produces for chord
+    in key, which is the chord's name in that key parsed back again."""
+    kc = KeyedChord(key, chord)
+    return string_to_keyed_chord(kc.name, key, octave_adjustment)
+
+
 def make_file_name_from_chord_sequence(seq):
     name = ''
     for chord in seq:
@@ -389,6 +449,7 @@ def validate_start(start, chord_map):
                                    f'(valid chords = {all_chords_string})')
 
 
+@instrumented('scale_from_key_string')
 def scale_from_key_string(key_string):
     """Return musthe.Scale object that corresponds to the given key
     in string form."""
@@ -413,10 +474,87 @@ def scale_from_key_string(key_string):
     raise ChordParseError(f'invalid key_string "{key_string}"')
 
 
+MAJOR_KEYS = ('C', 'Db', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+MINOR_KEYS = ('Cmin', 'C#min', 'Dmin', 'Ebmin', 'Emin', 'Fmin', 'F#min', 'Gmin', 'G#min', 'Amin', 'Bbmin', 'Bmin')
+ALL_KEYS = MAJOR_KEYS + MINOR_KEYS
+
+
+def key_is_minor(key):
+    return scale_from_key_string(key).name == 'natural_minor'
+
+
+class Shard(object):
+    """Shard index (counting from 0) of count shards of an enumeration.
+
+    Shards split an enumeration into count contiguous runs whose sizes
+    differ by at most one, in order, so the shards' output put together
+    is the whole enumeration.
+    """
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise InvalidArgumentError(f'Invalid shard {index}/{count}, the shard must be from 0 to count - 1')
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec):
+        """Return the Shard for a string like "2/8"."""
+        m = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', spec)
+        if m is None:
+            raise InvalidArgumentError(f'Invalid shard "{spec}", expected INDEX/COUNT like 0/4')
+        return cls(int(m.group(1)), int(m.group(2)))
+
+    def range(self, total):
+        """Return (start, stop) of this shard's part of total items."""
+        return (total * self.index // self.count, total * (self.index + 1) // self.count)
+
+    def __eq__(self, other):
+        return isinstance(other, Shard) and (self.index, self.count) == (other.index, other.count)
+
+    def __hash__(self):
+        return hash((self.index, self.count))
+
+    def __repr__(self):
+        return f'Shard({self.index}, {self.count})'
+
+    def __str__(self):
+        return f'{self.index}/{self.count}'
+
+
+class EnumerationCursor(object):
+    """Position in an enumeration: the index, in the full unsharded order,
+    of the next item to produce.
+
+    Generators that are given a cursor start at its position and move it
+    on before producing each item, so once an item has been dealt with the
+    cursor can be saved (see to_dict) and passed back in later to carry on
+    from the next one.
+    """
+    def __init__(self, position=0):
+        self.position = position
+
+    def to_dict(self):
+        return {'position': self.position}
+
+    @classmethod
+    def from_dict(cls, cursor_dict):
+        position = cursor_dict.get('position') if isinstance(cursor_dict, dict) else None
+        if not isinstance(position, int) or isinstance(position, bool) or position < 0:
+            raise InvalidArgumentError(f'Invalid enumeration cursor {cursor_dict!r}')
+        return cls(position)
+
+    def __eq__(self, other):
+        return isinstance(other, EnumerationCursor) and self.position == other.position
+
+    def __repr__(self):
+        return f'EnumerationCursor({self.position})'
+
+
 class _ChordGraphNode(object):
-    def __init__(self, chords):
+    def __init__(self, chords, name=None):
         self.chords = chords
         self.primary = self.chords[0]
+        self.name = name
 
     def __repr__(self):
         retval = '('
@@ -447,109 +585,766 @@ IIM = Chord(2, 'maj')
 IIIM = Chord(3, 'maj')
 
 
-class ChordMap(nx.DiGraph):
-    def __init__(self, key=None, octave_adjustment=0):
+class _ChordGraph(object):
+    """Directed graph of _ChordGraphNode objects.
+
+    Nodes are numbered in insertion order and the successors of each node
+    are kept as node numbers in insertion order.  Every chord maps to the
+    numbers of the nodes it is a variant of, so finding a chord's node is
+    a dict lookup however big the map is.  Removing a node renumbers the
+    nodes after it.
+    """
+    def __init__(self):
+        self._nodes = []
+        self._numbers = {}
+        self._names = {}
+        self._successors = []
+        self._chord_nodes = {}
+        self.frozen = False
+
+    def _check_mutable(self, what):
+        if self.frozen:
+            raise FrozenMapError(f'Can\'t {what} a frozen chord map')
+
+    def freeze(self):
+        """Make the graph and its nodes immutable."""
+        for number, node in enumerate(self._nodes):
+            node.chords = tuple(node.chords)
+            self._successors[number] = tuple(self._successors[number])
+        for chord in self._chord_nodes:
+            self._chord_nodes[chord] = tuple(self._chord_nodes[chord])
+        self.frozen = True
+
+    @classmethod
+    def from_tables(cls, nodes, successors):
+        """Return a graph of nodes where successors[n] lists the numbers
+        of the successors of nodes[n], without checking for repeats."""
+        graph = cls()
+        graph.add_nodes_from(nodes)
+        graph._successors = [list(numbers) for numbers in successors]
+        return graph
+
+    def add_node(self, node):
+        self._check_mutable('add a node to')
+        if node in self._numbers:
+            return
+        number = len(self._nodes)
+        self._numbers[node] = number
+        if node.name is not None:
+            self._names.setdefault(node.name, number)
+        self._nodes.append(node)
+        self._successors.append([])
+        for chord in node.chords:
+            numbers = self._chord_nodes.setdefault(chord, [])
+            if number not in numbers:
+                numbers.append(number)
+
+    def add_nodes_from(self, nodes):
+        for node in nodes:
+            self.add_node(node)
+
+    def add_edge(self, from_node, to_node):
+        self._check_mutable('add an edge to')
+        self.add_node(from_node)
+        self.add_node(to_node)
+        successors = self._successors[self._numbers[from_node]]
+        to_number = self._numbers[to_node]
+        if to_number not in successors:
+            successors.append(to_number)
+
+    def remove_node(self, node):
+        """Remove node and every edge to or from it."""
+        self._check_mutable('remove a node from')
+        number = self._numbers.pop(node)
+        if self._names.get(node.name) == number:
+            del self._names[node.name]
+        del self._nodes[number]
+        del self._successors[number]
+        for index in range(number, len(self._nodes)):
+            later_node = self._nodes[index]
+            self._numbers[later_node] = index
+            if self._names.get(later_node.name) == index + 1:
+                self._names[later_node.name] = index
+        for successors in self._successors:
+            successors[:] = [n - (n > number) for n in successors if n != number]
+        for chord in list(self._chord_nodes):
+            numbers = [n - (n > number) for n in self._chord_nodes[chord] if n != number]
+            if numbers:
+                self._chord_nodes[chord] = numbers
+            else:
+                del self._chord_nodes[chord]
+
+    def remove_edge(self, from_node, to_node):
+        """Remove the edge from from_node to to_node.  Returns False if
+        there is no such edge."""
+        self._check_mutable('remove an edge from')
+        successors = self._successors[self._numbers[from_node]]
+        to_number = self._numbers[to_node]
+        if to_number not in successors:
+            return False
+        successors.remove(to_number)
+        return True
+
+    def add_chord(self, node, chord):
+        """Add chord as the last variant of node."""
+        self._check_mutable('add a chord to')
+        node.chords.append(chord)
+        bisect.insort(self._chord_nodes.setdefault(chord, []), self._numbers[node])
+
+    def remove_chord(self, node, chord):
+        """Remove chord from the variants of node, which must keep at least
+        one."""
+        self._check_mutable('remove a chord from')
+        assert len(node.chords) > 1
+        node.chords.remove(chord)
+        node.primary = node.chords[0]
+        numbers = self._chord_nodes[chord]
+        numbers.remove(self._numbers[node])
+        if not numbers:
+            del self._chord_nodes[chord]
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    def successors(self, node):
+        nodes = self._nodes
+        return (nodes[number] for number in self._successors[self._numbers[node]])
+
+    def predecessors(self, node):
+        """Return the nodes with an edge to node, in node order."""
+        number = self._numbers[node]
+        return [self._nodes[index] for index, successors in enumerate(self._successors) if number in successors]
+
+    def node_named(self, name):
+        """Return the first node called name, or None."""
+        number = self._names.get(name)
+        return None if number is None else self._nodes[number]
+
+    def nodes_with_chord(self, chord):
+        """Return the nodes that have chord as a variant, in node order."""
+        nodes = self._nodes
+        return [nodes[number] for number in self._chord_nodes.get(chord, ())]
+
+    @property
+    def num_edges(self):
+        return sum(len(successors) for successors in self._successors)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._numbers
+
+
+CHORD_MAP_FORMAT_VERSION = 1
+
+# The map from https://www.mugglinworks.com/chordmaps/chartmaps.htm in the
+# format read by load_chord_map_definition.
+BUILTIN_CHORD_MAP = {
+    'version': CHORD_MAP_FORMAT_VERSION,
+    'name': 'mugglinworks',
+    'major': {
+        'nodes': {
+            'I': ['Imaj', 'Imaj7'],
+            'I/3': ['Imaj/3'],
+            'I/5': ['Imaj/5'],
+            'ii': ['iimin'],
+            'iii': ['iiimin'],
+            'IV': ['IVmaj'],
+            'IV/1': ['IVmaj/1'],
+            'V': ['Vmaj'],
+            'V/2': ['Vmaj/2'],
+            'vi': ['vimin'],
+            'VI': ['VImaj'],
+            'VII': ['VIImaj'],
+            'II': ['IImaj'],
+            'III': ['IIImaj'],
+        },
+        'edges': [
+            ['I', 'IV/1'], ['I', 'V/2'],
+            ['I/3', 'ii'],
+            ['ii', 'I/5'], ['ii', 'iii'], ['ii', 'V'],
+            ['iii', 'I'], ['iii', 'IV'], ['iii', 'vi'],
+            ['IV', 'I'], ['IV', 'I/3'], ['IV', 'I/5'], ['IV', 'ii'], ['IV', 'V'],
+            ['IV/1', 'I'],
+            ['V', 'I'], ['V', 'iii'], ['V', 'vi'],
+            ['V/2', 'I'],
+            ['vi', 'IV'], ['vi', 'ii'],
+            ['VI', 'ii'],
+            ['VII', 'iii'],
+            ['I', 'IV'],
+            ['II', 'V'],
+            ['III', 'vi'],
+        ],
+    },
+    'minor': {
+        'nodes': {
+            'i': ['imin', 'imin7'],
+            'i/3': ['imin/3'],
+            'i/5': ['imin/5'],
+            'ii': ['iimin'],
+            'III': ['IIImaj'],
+            'iv': ['ivmin'],
+            'iv/1': ['ivmin/1'],
+            'v': ['vmin'],
+            'v/2': ['vmin/2'],
+            'VI': ['VImaj'],
+        },
+        'edges': [
+            ['i', 'iv/1'], ['i', 'v/2'],
+            ['i/3', 'ii'],
+            ['ii', 'i/5'], ['ii', 'III'], ['ii', 'v'],
+            ['III', 'i'], ['III', 'iv'], ['III', 'VI'],
+            ['iv', 'i'], ['iv', 'i/3'], ['iv', 'i/5'], ['iv', 'ii'], ['iv', 'v'],
+            ['iv/1', 'i'],
+            ['v', 'i'], ['v', 'III'], ['v', 'VI'],
+            ['v/2', 'i'],
+            ['VI', 'iv'], ['VI', 'ii'],
+        ],
+    },
+}
+
+
+def _check_format(condition, message):
+    if not condition:
+        raise ChordMapFormatError(message)
+
+
+def parse_map_chord(chord_string):
+    """Return the Chord for a chord in a map definition.
+
+    Map chords are key independent: a roman numeral, an optional chord type
+    (major for an upper case numeral and minor for lower case if it is
+    left out) and an optional bass degree, e.g. "V", "ii", "V7", "IVmaj/1".
+    """
+    _check_format(isinstance(chord_string, str), f'Map chord {chord_string!r} is not a string')
+    m = re.fullmatch(r'(VII|VI|V|IV|III|II|I)([^/]*)(?:/(\d))?', chord_string, re.IGNORECASE)
+    _check_format(m is not None, f'Can\'t parse map chord "{chord_string}"')
+    numeral, chord_type, bass = m.groups()
+    _check_format(numeral.isupper() or numeral.islower(), f'Mixed case numeral in map chord "{chord_string}"')
+    degree = roman_numerals.index(numeral.upper())
+    if not chord_type:
+        chord_type = 'maj' if numeral.isupper() else 'min'
+    _check_format(chord_type in musthe.Chord.valid_types, f'Unknown chord type in map chord "{chord_string}"')
+    inversion = None
+    if bass is not None:
+        if int(bass) == third_degree(degree):
+            inversion = 1
+        elif int(bass) == fifth_degree(degree):
+            inversion = 2
+        else:
+            raise ChordMapFormatError(f'Bass of map chord "{chord_string}" is not its third or fifth')
+    return Chord(degree, chord_type, inversion)
+
+
+def _parse_map_section(section, where):
+    _check_format(isinstance(section, dict), f'{where} is not an object')
+    unknown = set(section) - {'nodes', 'edges'}
+    _check_format(not unknown, f'Unknown fields in {where}: {", ".join(sorted(unknown))}')
+    nodes = section.get('nodes')
+    _check_format(isinstance(nodes, dict) and nodes, f'{where} needs a non-empty "nodes" object')
+    parsed_nodes = []
+    for name, chord_strings in nodes.items():
+        _check_format(isinstance(chord_strings, list) and chord_strings,
+                      f'Node "{name}" in {where} needs a non-empty list of chords')
+        chords = [parse_map_chord(chord_string) for chord_string in chord_strings]
+        _check_format(len(set(chords)) == len(chords), f'Node "{name}" in {where} repeats a chord')
+        parsed_nodes.append((name, chords))
+    edges = section.get('edges', [])
+    _check_format(isinstance(edges, list), f'"edges" in {where} is not a list')
+    parsed_edges = []
+    seen = set()
+    for edge in edges:
+        _check_format(isinstance(edge, list) and len(edge) == 2, f'Edge {edge!r} in {where} is not a [from, to] pair')
+        for name in edge:
+            _check_format(isinstance(name, str) and name in nodes, f'Edge {edge!r} in {where} names an unknown node')
+        _check_format(tuple(edge) not in seen, f'Edge {edge!r} appears more than once in {where}')
+        seen.add(tuple(edge))
+        parsed_edges.append(tuple(edge))
+    return (parsed_nodes, parsed_edges)
+
+
+def parse_chord_map_definition(definition):
+    """Validate a chord map definition and return it parsed.
+
+    A definition is a dict (usually read from a JSON file) like this:
+
+        {"version": 1,
+         "nodes": {"I": ["Imaj", "Imaj7"], "IV/1": ["IVmaj/1"], "V/2": ["Vmaj/2"]},
+         "edges": [["I", "IV/1"], ["I", "V/2"], ["IV/1", "I"], ["V/2", "I"]]}
+
+    Each node is a group of chord variants that are interchangeable in a
+    sequence, listed primary chord first.  Edges are [from, to] pairs of
+    node names, and successors are tried in the order their edges appear.
+    Instead of "nodes" and "edges" a definition can have "major" and
+    "minor" sections that each hold them, for maps that differ by mode.
+
+    The result maps the name of each section ("major" and "minor" are the
+    same section for a single-section definition) to a tuple of a list of
+    (node name, [Chord, ...]) and a list of (from name, to name).
+    Raises ChordMapFormatError if the definition is not valid.
+    """
+    _check_format(isinstance(definition, dict), 'Chord map definition is not an object')
+    version = definition.get('version', CHORD_MAP_FORMAT_VERSION)
+    _check_format(version == CHORD_MAP_FORMAT_VERSION, f'Unsupported chord map format version {version!r}')
+    if 'major' in definition or 'minor' in definition:
+        fields = {'major', 'minor'}
+    else:
+        fields = {'nodes', 'edges'}
+    unknown = set(definition) - fields - {'version', 'name', 'description'}
+    _check_format(not unknown, f'Unknown fields in chord map definition: {", ".join(sorted(unknown))}')
+    if fields == {'nodes', 'edges'}:
+        section = _parse_map_section({field: definition[field] for field in fields if field in definition},
+                                     'chord map definition')
+        return {'major': section, 'minor': section}
+    _check_format('major' in definition and 'minor' in definition,
+                  'Chord map definition needs both a "major" and a "minor" section')
+    return {mode: _parse_map_section(definition[mode], f'"{mode}" section') for mode in ('major', 'minor')}
+
+
+def _reject_duplicate_names(pairs):
+    retval = dict(pairs)
+    if len(retval) != len(pairs):
+        counts = collections.Counter(name for name, _ in pairs)
+        duplicates = sorted(name for name, count in counts.items() if count > 1)
+        raise ChordMapFormatError(f'Repeated names in chord map definition: {", ".join(duplicates)}')
+    return retval
+
+
+def chord_map_definition_from_json(text, source='chord map definition'):
+    """Return the chord map definition in the JSON string (or bytes) text,
+    checked with parse_chord_map_definition.  source names it in errors."""
+    try:
+        definition = json.loads(text, object_pairs_hook=_reject_duplicate_names)
+    except ValueError as e:
+        raise ChordMapFormatError(f'{source} is not valid JSON: {e}')
+    parse_chord_map_definition(definition)
+    return definition
+
+
+def load_chord_map_definition(path):
+    """Read a chord map definition from a JSON file and return it, checked
+    with parse_chord_map_definition."""
+    with open(path, 'rb') as f:
+        return chord_map_definition_from_json(f.read(), path)
+
+
+_EDITED_WHILE_GENERATING = 'The chord map was edited while its sequences were being generated'
+
+
+def _compile_map_section(section):
+    nodes, edges = section
+    graph = _ChordGraph()
+    graph_nodes = {}
+    for name, chords in nodes:
+        graph_nodes[name] = _ChordGraphNode(list(chords), name)
+        graph.add_node(graph_nodes[name])
+    for from_name, to_name in edges:
+        graph.add_edge(graph_nodes[from_name], graph_nodes[to_name])
+    return graph
+
+
+class ChordMap(object):
+    # Shared frozen maps handed out by for_key, least recently used first
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+    cache_size = 64
+
+    def __init__(self, key=None, octave_adjustment=0, definition=None):
+        """definition is a chord map definition (see
+        parse_chord_map_definition), BUILTIN_CHORD_MAP if not given."""
         self.key = key
         self.octave_adjustment = octave_adjustment
-        minor = False
-        chord_types = ['dummy', 'maj', 'min', 'min', 'maj', 'maj', 'min', 'min']
+        self.definition = BUILTIN_CHORD_MAP if definition is None else definition
+        mode = 'major'
         if self.key:
             self.scale = scale_from_key_string(self.key)
             if self.scale.name == 'natural_minor':
-                minor = True
-                chord_types = ['dummy', 'min', 'min', 'maj', 'min', 'min', 'maj', 'maj']
-
-        IM = Chord(1, chord_types[1])
-        IM_3 = Chord(1, chord_types[1], inversion=1)
-        IM_5 = Chord(1, chord_types[1], inversion=2)
-        IM7 = Chord(1, chord_types[1]+'7')
-        iim = Chord(2, chord_types[2])
-        iiim = Chord(3, chord_types[3])
-        IVM = Chord(4, chord_types[4])
-        IVM_1 = Chord(4, chord_types[4], inversion=2)
-        VM = Chord(5, chord_types[5])
-        VM_2 = Chord(5, chord_types[5], inversion=2)
-        vim = Chord(6, chord_types[6])
-
-        if not minor:
-            VIM = Chord(6, 'maj')
-            VIIM = Chord(7, 'maj')
-            IIM = Chord(2, 'maj')
-            IIIM = Chord(3, 'maj')
-
-        IM_gn = _ChordGraphNode([IM, IM7])
-        IM_3_gn = _ChordGraphNode([IM_3])
-        IM_5_gn = _ChordGraphNode([IM_5])
-        iim_gn = _ChordGraphNode([iim])
-        iiim_gn = _ChordGraphNode([iiim])
-        IVM_gn = _ChordGraphNode([IVM])
-        IVM_1_gn = _ChordGraphNode([IVM_1])
-        VM_gn = _ChordGraphNode([VM])
-        VM_2_gn = _ChordGraphNode([VM_2])
-        vim_gn = _ChordGraphNode([vim])
-
-        if not minor:
-            VIM_gn = _ChordGraphNode([VIM])
-            VIIM_gn = _ChordGraphNode([VIIM])
-            IIM_gn = _ChordGraphNode([IIM])
-            IIIM_gn = _ChordGraphNode([IIIM])
-
-        self._g = nx.DiGraph()
-
-        self._g.add_nodes_from([IM_gn, IM_3_gn, IM_5_gn, iim_gn, iiim_gn,
-                                IVM_gn, IVM_1_gn, VM_gn, VM_2_gn, vim_gn])
-
-        self._g.add_edge(IM_gn, IVM_1_gn)
-        self._g.add_edge(IM_gn, VM_2_gn)
-
-        self._g.add_edge(IM_3_gn, iim_gn)
-
-        self._g.add_edge(iim_gn, IM_5_gn)
-        self._g.add_edge(iim_gn, iiim_gn)
-        self._g.add_edge(iim_gn, VM_gn)
-
-        self._g.add_edge(iiim_gn, IM_gn)
-        self._g.add_edge(iiim_gn, IVM_gn)
-        self._g.add_edge(iiim_gn, vim_gn)
-
-        self._g.add_edge(IVM_gn, IM_gn)
-        self._g.add_edge(IVM_gn, IM_3_gn)
-        self._g.add_edge(IVM_gn, IM_5_gn)
-        self._g.add_edge(IVM_gn, iim_gn)
-        self._g.add_edge(IVM_gn, VM_gn)
-
-        self._g.add_edge(IVM_1_gn, IM_gn)
-
-        self._g.add_edge(VM_gn, IM_gn)
-        self._g.add_edge(VM_gn, iiim_gn)
-        self._g.add_edge(VM_gn, vim_gn)
-
-        self._g.add_edge(VM_2_gn, IM_gn)
-
-        self._g.add_edge(vim_gn, IVM_gn)
-        self._g.add_edge(vim_gn, iim_gn)
-
-        if not minor:
-            self._g.add_edge(VIM_gn, iim_gn)
-            self._g.add_edge(VIIM_gn, iiim_gn)
-            self._g.add_edge(IM_gn, IVM_gn)
-            self._g.add_edge(IIM_gn, VM_gn)
-            self._g.add_edge(IIIM_gn, vim_gn)
+                mode = 'minor'
+        self._g = _compile_map_section(parse_chord_map_definition(self.definition)[mode])
+        self._init_derived()
+
+    @classmethod
+    def from_file(cls, path, key=None, octave_adjustment=0, cache=True):
+        """Return a ChordMap built from the chord map definition in the
+        JSON file at path.
+
+        If cache is true the compiled map is saved to, and on later calls
+        loaded from, the artifact cache (see mellowchord.mapcache).
+        """
+        if cache:
+            from .mapcache import cached_chord_map
+            return cached_chord_map(path, key, octave_adjustment)
+        return cls(key, octave_adjustment, load_chord_map_definition(path))
+
+    @classmethod
+    def from_graph(cls, graph, key=None, octave_adjustment=0, definition=None, keyed_names=None):
+        """Return a ChordMap for an already compiled _ChordGraph.
+        keyed_names optionally maps every chord to its name in key."""
+        chord_map = cls.__new__(cls)
+        chord_map.key = key
+        chord_map.octave_adjustment = octave_adjustment
+        chord_map.definition = definition
+        if key:
+            chord_map.scale = scale_from_key_string(key)
+        chord_map._g = graph
+        if keyed_names is not None:
+            chord_map._keyed_names = keyed_names
+        chord_map._init_derived()
+        return chord_map
+
+    def _init_derived(self):
+        # Bumped by every edit, so generators can tell the map changed
+        # under them
+        self._version = 0
+        # Successor chords worked out so far for an unfrozen map, dropped
+        # chord by chord as edits change them
+        self._successor_entries = {}
+        # _sequence_counts of the successor table, until the next edit
+        self._counts_cache = {}
+
+    @classmethod
+    def for_key(cls, key=None, octave_adjustment=0):
+        """Return a shared, frozen ChordMap for key and octave_adjustment.
+
+        Maps are cached, up to cache_size of them with the least recently
+        used evicted first, and are safe to use from several threads at
+        once because nothing about them can change.
+        """
+        cache_key = (key, octave_adjustment)
+        with cls._cache_lock:
+            chord_map = cls._cache.get(cache_key)
+            if chord_map is not None:
+                cls._cache.move_to_end(cache_key)
+                return chord_map
+        chord_map = cls(key, octave_adjustment)
+        chord_map.freeze()
+        with cls._cache_lock:
+            chord_map = cls._cache.setdefault(cache_key, chord_map)
+            cls._cache.move_to_end(cache_key)
+            while len(cls._cache) > cls.cache_size:
+                cls._cache.popitem(last=False)
+        return chord_map
+
+    @classmethod
+    def warm_cache(cls, keys=ALL_KEYS, octave_adjustments=(0,)):
+        """Build the shared maps for every combination of keys and
+        octave_adjustments ahead of time."""
+        for key in keys:
+            for octave_adjustment in octave_adjustments:
+                cls.for_key(key, octave_adjustment)
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    def freeze(self, successor_table=None):
+        """Make this map immutable.  The successors of every chord are
+        worked out up front, unless successor_table already has them, so
+        frozen maps are only ever read."""
+        self._successor_cache = self._successor_table() if successor_table is None else successor_table
+        self._g.freeze()
+        self._frozen = True
+
+    @property
+    def frozen(self):
+        return getattr(self, '_frozen', False)
+
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise FrozenMapError(f'Can\'t set {name} on a frozen chord map')
+        object.__setattr__(self, name, value)
+
+    @property
+    def version(self):
+        """The number of edits made to this map."""
+        return self._version
+
+    def _node_named(self, name):
+        if self.frozen:
+            raise FrozenMapError('Can\'t edit a frozen chord map')
+        node = self._g.node_named(name)
+        if node is None:
+            raise InvalidArgumentError(f'There is no node "{name}" in this chord map')
+        return node
+
+    def _edited(self, chords):
+        """Forget everything worked out from the successors of chords, and
+        the sequence counts, after an edit."""
+        for chord in chords:
+            self._successor_entries.pop(chord, None)
+        self._counts_cache.clear()
+        self._version += 1
+        # The definition no longer describes the map, see to_definition
+        self.definition = None
+
+    def _name_chords(self, chords):
+        keyed_names = getattr(self, '_keyed_names', None)
+        if keyed_names is not None and any(chord not in keyed_names for chord in chords):
+            # Maps from the same artifact can share the names
+            keyed_names = dict(keyed_names)
+            for chord in chords:
+                if chord not in keyed_names:
+                    keyed_names[chord] = KeyedChord(self.key, chord).name
+            self._keyed_names = keyed_names
+
+    def add_node(self, name, chords):
+        """Add a node called name with chords as its variants, each a
+        Chord or a map chord (see parse_map_chord), and no edges."""
+        if self.frozen:
+            raise FrozenMapError('Can\'t edit a frozen chord map')
+        if self._g.node_named(name) is not None:
+            raise InvalidArgumentError(f'There is already a node "{name}" in this chord map')
+        chords = [chord if isinstance(chord, Chord) else parse_map_chord(chord) for chord in chords]
+        if not chords or len(set(chords)) != len(chords):
+            raise InvalidArgumentError(f'Node "{name}" needs a list of different chords')
+        self._g.add_node(_ChordGraphNode(chords, name))
+        self._name_chords(chords)
+        self._edited(chords)
+
+    def remove_node(self, name):
+        """Remove the node called name and every edge to or from it."""
+        node = self._node_named(name)
+        affected = list(node.chords)
+        for predecessor in self._g.predecessors(node):
+            affected.extend(predecessor.chords)
+        self._g.remove_node(node)
+        self._edited(affected)
+
+    def add_edge(self, from_name, to_name):
+        """Add an edge from the node called from_name to the one called
+        to_name."""
+        from_node = self._node_named(from_name)
+        to_node = self._node_named(to_name)
+        if to_node in self._g.successors(from_node):
+            raise InvalidArgumentError(f'There is already an edge from "{from_name}" to "{to_name}"')
+        self._g.add_edge(from_node, to_node)
+        self._edited(from_node.chords)
+
+    def remove_edge(self, from_name, to_name):
+        """Remove the edge from the node called from_name to the one called
+        to_name."""
+        from_node = self._node_named(from_name)
+        if not self._g.remove_edge(from_node, self._node_named(to_name)):
+            raise InvalidArgumentError(f'There is no edge from "{from_name}" to "{to_name}"')
+        self._edited(from_node.chords)
+
+    def add_variant(self, name, chord):
+        """Add chord (a Chord or a map chord) as the last variant of the
+        node called name."""
+        node = self._node_named(name)
+        chord = chord if isinstance(chord, Chord) else parse_map_chord(chord)
+        if chord in node.chords:
+            raise InvalidArgumentError(f'Node "{name}" already has {chord.name}')
+        self._g.add_chord(node, chord)
+        self._name_chords([chord])
+        self._edited([chord] + [c for predecessor in self._g.predecessors(node) for c in predecessor.chords])
+
+    def remove_variant(self, name, chord):
+        """Remove chord (a Chord or a map chord) from the variants of the
+        node called name."""
+        node = self._node_named(name)
+        chord = chord if isinstance(chord, Chord) else parse_map_chord(chord)
+        if chord not in node.chords:
+            raise InvalidArgumentError(f'Node "{name}" has no {chord.name}')
+        if len(node.chords) == 1:
+            raise InvalidArgumentError(f'Node "{name}" can\'t lose its only chord')
+        self._g.remove_chord(node, chord)
+        self._edited([chord] + [c for predecessor in self._g.predecessors(node) for c in predecessor.chords])
+
+    def to_definition(self):
+        """Return a chord map definition (with a single nodes and edges
+        section) of the map as it is now, e.g. to save it after edits."""
+        nodes = {}
+        for node in self._g:
+            if node.name is None or node.name in nodes:
+                raise InvalidArgumentError('Only maps with uniquely named nodes have a definition')
+            nodes[node.name] = [chord.name for chord in node.chords]
+        edges = [[node.name, successor.name] for node in self._g for successor in self._g.successors(node)]
+        return {'version': CHORD_MAP_FORMAT_VERSION, 'nodes': nodes, 'edges': edges}
 
     @property
     def chord_strings(self):
+        keyed_names = getattr(self, '_keyed_names', None)
         retval = set()
         for node in self._g.nodes:
             for chord in node.chords:
-                kc = KeyedChord(self.key, chord)
-                retval.add(kc.name)
+                if keyed_names is not None:
+                    retval.add(keyed_names[chord])
+                else:
+                    kc = KeyedChord(self.key, chord)
+                    retval.add(kc.name)
         return list(retval)
 
     def _find_node_by_chord(self, chord):
-        for node in self._g.nodes:
-            if chord in node.chords:
-                return node
-        return None
+        nodes = self._g.nodes_with_chord(chord)
+        return nodes[0] if nodes else None
+
+    def _successor_nodes(self, chord):
+        """Return the successors of every node that has chord as a variant,
+        in node order and then edge order, without repeats."""
+        weighted_nodes = getattr(self, '_weighted_nodes', None)
+        if weighted_nodes is not None and chord in weighted_nodes:
+            return list(weighted_nodes[chord])
+        nodes = self._g.nodes_with_chord(chord)
+        assert nodes
+        if len(nodes) == 1:
+            return list(self._g.successors(nodes[0]))
+        retval = []
+        seen = set()
+        for node in nodes:
+            for successor in self._g.successors(node):
+                if successor not in seen:
+                    seen.add(successor)
+                    retval.append(successor)
+        return retval
+
+    def weighted(self, counts, smoothing=1):
+        """Return a frozen copy of this map whose successors are ordered
+        and sampled by weight, the number of times counts (a
+        TransitionCounts) saw each transition plus smoothing, so
+        transitions never seen stay possible.
+
+        Sequences are enumerated with the most likely successors first and
+        next_chords lists the most likely nodes first, ties keeping map
+        order.
+        """
+        minor = bool(self.key) and key_is_minor(self.key)
+        table = {}
+        weights = {}
+        weighted_nodes = {}
+        for chord, successors in self._successor_table().items():
+            seen = {successor: counts.count(chord, successor, minor) for successor in successors}
+            table[chord] = tuple(sorted(successors, key=lambda successor: -seen[successor]))
+            weights[chord] = tuple(seen[successor] + smoothing for successor in table[chord])
+            node_weights = {node: sum(counts.count(chord, c, minor) for c in node.chords)
+                            for node in self._successor_nodes(chord)}
+            weighted_nodes[chord] = tuple(sorted(node_weights, key=lambda node: -node_weights[node]))
+        # The copy gets nodes of its own, so freezing it doesn't freeze this
+        # map's nodes and editing this map doesn't change the copy
+        nodes = {node: _ChordGraphNode(list(node.chords), node.name) for node in self._g}
+        weighted_nodes = {chord: tuple(nodes[node] for node in chord_nodes)
+                          for chord, chord_nodes in weighted_nodes.items()}
+        graph = _ChordGraph.from_tables(list(nodes.values()), self._g._successors)
+        weighted_map = ChordMap.from_graph(graph, self.key, self.octave_adjustment, self.definition,
+                                           getattr(self, '_keyed_names', None))
+        weighted_map._weights = weights
+        weighted_map._weighted_nodes = weighted_nodes
+        weighted_map.freeze(table)
+        return weighted_map
+
+    def sample_sequences(self, chord_string, num_chords, count=None, rng=None):
+        """Generator of count (or endlessly many) random sequences of
+        KeyedChord objects starting from chord_string.
+
+        Each chord is picked from the successors of the one before in
+        proportion to their weights if the map is weighted (see weighted)
+        and uniformly otherwise.  Successors that can't be followed by
+        enough chords to finish the sequence are never picked.  rng is a
+        random.Random to draw from.
+        """
+        assert num_chords >= 1
+        rng = rng or random.Random()
+        first_chord = string_to_chord(chord_string, self.key)
+        version = self._version
+        successors = self._successor_table()
+        if first_chord not in successors:
+            raise InvalidArgumentError(f'{chord_string} is not in this chord map')
+        completions = self._completion_counts(num_chords)
+        if not completions[num_chords][first_chord]:
+            raise InvalidArgumentError(f'No sequence of {num_chords} chords starts from {chord_string}')
+        weights = getattr(self, '_weights', {})
+        # (chord, chords still to pick) to the successors that can be picked
+        # and their cumulative weights
+        choices = {}
+
+        def choices_for(chord, remaining):
+            if (chord, remaining) not in choices:
+                chord_weights = weights.get(chord) or (1,) * len(successors[chord])
+                candidates = []
+                cumulative_weights = []
+                total = 0
+                for successor, weight in zip(successors[chord], chord_weights):
+                    if completions[remaining][successor]:
+                        total += weight
+                        candidates.append(successor)
+                        cumulative_weights.append(total)
+                choices[(chord, remaining)] = (candidates, cumulative_weights)
+            return choices[(chord, remaining)]
+
+        first_keyed_chord = string_to_keyed_chord(chord_string, self.key, self.octave_adjustment)
+        keyed_chords = {}
+        produced = 0
+        while count is None or produced < count:
+            chord = first_chord
+            seq = [first_keyed_chord]
+            for remaining in range(num_chords - 1, 0, -1):
+                candidates, cumulative_weights = choices_for(chord, remaining)
+                chord = rng.choices(candidates, cum_weights=cumulative_weights)[0]
+                if chord not in keyed_chords:
+                    keyed_chords[chord] = sequence_keyed_chord(self.key, chord, self.octave_adjustment)
+                seq.append(keyed_chords[chord])
+            produced += 1
+            if self._version != version:
+                raise ConcurrentModificationError(_EDITED_WHILE_GENERATING)
+            yield seq
+
+    def walk(self, chord_string, rng=None):
+        """Generator of an endless random walk of KeyedChord objects
+        starting from chord_string.
+
+        Chords are picked as sample_sequences picks them, except that the
+        successors never picked are those from which every walk comes to a
+        dead end.  Nothing is kept but a table of the map's chords, so the
+        walk can run for ever.
+        """
+        rng = rng or random.Random()
+        first_chord = string_to_chord(chord_string, self.key)
+        version = self._version
+        successors = self._successor_table()
+        if first_chord not in successors:
+            raise InvalidArgumentError(f'{chord_string} is not in this chord map')
+        # Chords an endless walk can go through: those with a successor
+        # that is one too
+        endless = set(successors)
+        changed = True
+        while changed:
+            changed = False
+            for chord in list(endless):
+                if not any(successor in endless for successor in successors[chord]):
+                    endless.discard(chord)
+                    changed = True
+        if first_chord not in endless:
+            raise InvalidArgumentError(f'Every walk from {chord_string} comes to a dead end')
+        weights = getattr(self, '_weights', {})
+        # Chord to the successors that can be picked, their cumulative
+        # weights and KeyedChord objects
+        choices = {}
+        chord = first_chord
+        keyed_chord = string_to_keyed_chord(chord_string, self.key, self.octave_adjustment)
+        while True:
+            if self._version != version:
+                raise ConcurrentModificationError(_EDITED_WHILE_GENERATING)
+            yield keyed_chord
+            if chord not in choices:
+                chord_weights = weights.get(chord) or (1,) * len(successors[chord])
+                candidates = []
+                cumulative_weights = []
+                total = 0
+                for successor, weight in zip(successors[chord], chord_weights):
+                    if successor in endless:
+                        total += weight
+                        candidates.append((successor, sequence_keyed_chord(self.key, successor,
+                                                                           self.octave_adjustment)))
+                        cumulative_weights.append(total)
+                choices[chord] = (candidates, cumulative_weights)
+            candidates, cumulative_weights = choices[chord]
+            chord, keyed_chord = rng.choices(candidates, cum_weights=cumulative_weights)[0]
 
     def find_node_by_chord_string(self, chord_root_note, chord_type):
         for node in self._g:
@@ -560,6 +1355,7 @@ class ChordMap(nx.DiGraph):
                         return node
         return None
 
+    @instrumented('ChordMap.next_chords')
     def next_chords(self, current_chord, all_variants=False):
         retval = []
         if isinstance(current_chord, str):
@@ -571,9 +1367,7 @@ class ChordMap(nx.DiGraph):
             assert self.key
             assert current_chord.key == self.key
             current_chord = Chord(current_chord.degree, current_chord.chord_type, current_chord.inversion)
-        node = self._find_node_by_chord(current_chord)
-        assert node is not None
-        for successor in self._g.successors(node):
+        for successor in self._successor_nodes(current_chord):
             if all_variants:
                 for chord in successor.chords:
                     self._append_chord(chord, self.key, retval)
@@ -593,32 +1387,270 @@ class ChordMap(nx.DiGraph):
             retval.append(successor)
         return retval
 
-    def gen_sequence(self, chord_string, num_chords, current_sequence=[], already_yielded=set()):
-        """Generator of sequences of KeyedChord objects"""
-        current_sequence.append(chord_string)
-        assert len(current_sequence) <= num_chords
-        if len(current_sequence) == num_chords:
-            if tuple(current_sequence) not in already_yielded:
-                already_yielded.add(tuple(current_sequence))
-                yield [string_to_keyed_chord(c, self.key, self.octave_adjustment) for c in current_sequence]
+    def _successor_chords(self, chord):
+        """Return every variant of every successor of chord in canonical
+        order (successors in the order they were added to the map, variants
+        in node order) with repeated chords removed."""
+        retval = []
+        seen = set()
+        for successor in self._successor_nodes(chord):
+            for successor_chord in successor.chords:
+                if successor_chord not in seen:
+                    seen.add(successor_chord)
+                    retval.append(successor_chord)
+        return retval
+
+    def _successor_table(self):
+        """Return a dict of every chord in the map to its successor chords,
+        in node order."""
+        if self.frozen:
+            return self._successor_cache
+        entries = self._successor_entries
+        table = {}
+        for node in self._g:
+            for chord in node.chords:
+                if chord not in table:
+                    if chord not in entries:
+                        entries[chord] = tuple(self._successor_chords(chord))
+                    table[chord] = entries[chord]
+        return table
+
+    def gen_chord_sequence(self, chord, num_chords, shard=None, cursor=None):
+        """Generator of key-independent sequences of Chord objects, as tuples
+
+        Sequences are walked depth first in canonical successor order and
+        every successor list is free of repeats, so each sequence is
+        produced exactly once without remembering what was yielded.
+
+        If shard (a Shard) is given only that shard's sequences are
+        produced, which are a contiguous run of the sequences in the order
+        above.  The walk goes straight to the first of them by skipping
+        whole subtrees of sequences using their exact counts (see
+        count_sequences), and stops after the last.
+
+        If cursor (an EnumerationCursor) is given, sequences before its
+        position are skipped the same way and it is moved on as sequences
+        are produced.
+
+        Editing the map while sequences are being produced raises
+        ConcurrentModificationError from the generator.
+        """
+        assert num_chords >= 1
+        if isinstance(chord, str):
+            chord = string_to_chord(chord, self.key)
+        version = self._version
+        # Frozen maps share a complete cache, otherwise the map fills in its
+        # entries as they are needed, and edits drop the ones they change.
+        # Sharding needs counts for every chord, so it needs the whole table
+        # anyway.
+        if shard is not None or cursor is not None:
+            successors = self._successor_table()
         else:
-            next_keyed_chords = self.next_chords(chord_string, all_variants=True)
-            for next_keyed_chord in next_keyed_chords:
-                next_chord_name = str(next_keyed_chord)
-                yield from self.gen_sequence(next_chord_name, num_chords, current_sequence)
-        current_sequence.pop()
+            successors = self._successor_cache if self.frozen else self._successor_entries
+
+        def successors_of(chord):
+            if chord not in successors:
+                successors[chord] = tuple(self._successor_chords(chord))
+            return successors[chord]
+
+        path = [chord]
+        stack = []
+        remaining = None
+        if shard is not None or cursor is not None:
+            assert chord in successors
+            counts = self._completion_counts(num_chords)
+            total = counts[num_chords][chord]
+            start, stop = shard.range(total) if shard is not None else (0, total)
+            if cursor is not None:
+                start = max(start, cursor.position)
+                cursor.position = start
+            remaining = stop - start
+            if remaining <= 0:
+                return
+            # Descend to the start'th sequence
+            while len(path) < num_chords:
+                chords = iter(successors_of(path[-1]))
+                subtree_counts = counts[num_chords - len(path)]
+                for next_chord in chords:
+                    if start < subtree_counts[next_chord]:
+                        break
+                    start -= subtree_counts[next_chord]
+                stack.append(chords)
+                path.append(next_chord)
+        elif num_chords > 1:
+            stack.append(iter(successors_of(chord)))
+        while True:
+            if len(path) == num_chords:
+                if self._version != version:
+                    raise ConcurrentModificationError(_EDITED_WHILE_GENERATING)
+                if remaining is None:
+                    yield tuple(path)
+                else:
+                    if cursor is not None:
+                        cursor.position += 1
+                    remaining -= 1
+                    yield tuple(path)
+                    if not remaining:
+                        return
+                path.pop()
+            if not stack:
+                return
+            next_chord = next(stack[-1], None)
+            if next_chord is None:
+                stack.pop()
+                path.pop()
+                continue
+            path.append(next_chord)
+            if len(path) < num_chords:
+                stack.append(iter(successors_of(next_chord)))
+
+    @staticmethod
+    def _sequence_counts(successors, num_chords, counts=None):
+        """Return a list whose item n (for n from 1 to num_chords) maps each
+        chord in the successors table to the number of sequences of n
+        chords that start with it, carrying on from counts (such a list
+        for fewer chords) if given."""
+        counts = list(counts) if counts else [None, dict.fromkeys(successors, 1)]
+        while len(counts) <= num_chords:
+            shorter = counts[-1]
+            counts.append({c: sum(shorter[s] for s in next_chords) for c, next_chords in successors.items()})
+        return counts
+
+    def _completion_counts(self, num_chords):
+        """Return _sequence_counts of the successor table for at least
+        num_chords, reusing the counts from earlier calls until the map is
+        edited."""
+        counts = self._counts_cache.get('counts')
+        if counts is None or len(counts) <= num_chords:
+            counts = self._sequence_counts(self._successor_table(), num_chords, counts)
+            # Replaced whole, so threads sharing a frozen map only ever see
+            # a complete list
+            self._counts_cache['counts'] = counts
+        return counts
+
+    def count_sequences(self, chord, num_chords):
+        """Return the number of sequences gen_chord_sequence(chord,
+        num_chords) would produce, without producing them.
+
+        Counts are worked out for every chord one length at a time, so this
+        takes time proportional to num_chords times the number of chord
+        transitions in the map rather than to the number of sequences.
+        """
+        assert num_chords >= 1
+        if isinstance(chord, str):
+            chord = string_to_chord(chord, self.key)
+        assert chord in self._successor_table()
+        return self._completion_counts(num_chords)[num_chords][chord]
+
+    @instrumented('ChordMap.gen_sequence')
+    def gen_sequence(self, chord_string, num_chords, dedupe_window=0, shard=None, cursor=None):
+        """Generator of sequences of KeyedChord objects
+
+        See gen_chord_sequence for the order of enumeration, shard and
+        cursor.
+        If dedupe_window is non-zero, sequences are additionally checked
+        against the last dedupe_window sequences produced by this call.
+        """
+        first_keyed_chord = string_to_keyed_chord(chord_string, self.key, self.octave_adjustment)
+        keyed_chords = {}
+        recent = collections.OrderedDict() if dedupe_window else None
+        for path in self.gen_chord_sequence(string_to_chord(chord_string, self.key), num_chords, shard, cursor):
+            if recent is not None:
+                if path in recent:
+                    continue
+                recent[path] = None
+                if len(recent) > dedupe_window:
+                    recent.popitem(last=False)
+            seq = [first_keyed_chord]
+            for chord in path[1:]:
+                if chord not in keyed_chords:
+                    keyed_chords[chord] = sequence_keyed_chord(self.key, chord, self.octave_adjustment)
+                seq.append(keyed_chords[chord])
+            yield seq
+
+
+_shared_codec = None
+
+
+def _sequence_codec():
+    # codec imports this module, so it can only be imported once this
+    # module has been
+    global _shared_codec
+    if _shared_codec is None:
+        from .codec import SHARED_CODEC
+        _shared_codec = SHARED_CODEC
+    return _shared_codec
 
 
 def write_chord_sequence_json(json_filename, key, chord_sequence):
-    output_dict = {'key': key, 'seq': chord_sequence}
     with open(json_filename, 'w') as f:
-        json.dump(output_dict, f, cls=KeyedChordEncoder)
+        f.write(_sequence_codec().encode(key, chord_sequence))
 
 
 def read_chord_sequence_json(json_filename):
     with open(json_filename, 'r') as f:
-        input_dict = json.load(f, object_hook=keyed_chord_decoder)
-    return (input_dict['key'], input_dict['seq'])
+        return _sequence_codec().decode(f.read())
+
+
+def chord_sequence_ndjson_line(key, chord_sequence):
+    """Return one chord sequence as a line of NDJSON, with the same content
+    as a file written by write_chord_sequence_json."""
+    return _sequence_codec().encode_line(key, chord_sequence)
+
+
+def write_chord_sequence_ndjson(f, key, chord_sequence):
+    """Append one chord sequence to an open NDJSON stream.  Each line has
+    the same content as a file written by write_chord_sequence_json."""
+    f.write(_sequence_codec().encode_line(key, chord_sequence))
+
+
+def melody_ndjson_line(notes):
+    """Return a melody as a line of NDJSON listing its notes in scientific
+    notation."""
+    return json.dumps({'melody': [note.scientific_notation() for note in notes]}) + '\n'
+
+
+def read_chord_sequence_ndjson(f):
+    """Generator of (key, chord_sequence) tuples from an open NDJSON stream"""
+    return _sequence_codec().read_lines(f)
+
+
+def read_chord_sequence_ndjson_batches(f, batch_size=1024):
+    """Generator of lists of up to batch_size (key, chord_sequence) tuples
+    from an open NDJSON stream"""
+    return _sequence_codec().read_batches(f, batch_size)
+
+
+def _product_range(pools, start, stop, prefix=()):
+    """Yield items start to stop - 1 of itertools.product(*pools), each
+    preceded by prefix, without producing the items before start.
+
+    Items are numbered in mixed radix with the last pool varying fastest,
+    so the range is split into runs that share their first item and each
+    whole run comes straight from itertools.product.
+    """
+    if start >= stop:
+        return
+    if not pools:
+        yield prefix
+        return
+    head, tail = pools[0], pools[1:]
+    run = 1
+    for pool in tail:
+        run *= len(pool)
+    for index in range(start // run, min(len(head), -(-stop // run))):
+        run_start = max(start - index * run, 0)
+        run_stop = min(stop - index * run, run)
+        if run_start == 0 and run_stop == run:
+            yield from itertools.product(*[(item,) for item in prefix], (head[index],), *tail)
+        else:
+            yield from _product_range(tail, run_start, run_stop, prefix + (head[index],))
+
+
+# Candidate melody notes over one chord, shared by every MelodyGenerator:
+# ((key, degree, chord_type) of the chord, the same of the next chord or
+# None, notes_per_chord) to one list of notes per melody position
+_melody_candidates = {}
 
 
 class MelodyGenerator(object):
@@ -629,23 +1661,80 @@ class MelodyGenerator(object):
         self.notes_per_chord = notes_per_chord
         self.scale = scale_from_key_string(key)
 
-    def gen_sequence(self):
+    def _candidates(self, chord, next_chord):
+        # Notes depend only on the key, degree and type of a chord, not on
+        # its inversion or octave
+        table_key = ((chord.key, chord.degree, chord.chord_type),
+                     None if next_chord is None else (next_chord.key, next_chord.degree, next_chord.chord_type),
+                     self.notes_per_chord)
+        try:
+            return _melody_candidates[table_key]
+        except KeyError:
+            pass
+        candidates = []
+        for melody_index in range(self.notes_per_chord):
+            very_first_note = melody_index == 0
+            last_note_before_new_chord = melody_index == self.notes_per_chord - 1
+            if not very_first_note and next_chord is not None and last_note_before_new_chord:
+                candidates.append(chord.notes + next_chord.notes)
+            else:
+                candidates.append(chord.notes)
+        retval = _melody_candidates[table_key] = tuple(candidates)
+        return retval
+
+    def _possible_notes(self):
         # This is a list of lists.
-        # Each index into possible_notes corresponds to a chord.
+        # Each index into possible_notes corresponds to a melody note.
         # Each entry is the contained lists are possible melody notes.
+        # The notes over each chord come from a table shared by every
+        # MelodyGenerator, since most sequences share most chord pairs.
         possible_notes = []
-
         num_chords = len(self.chord_sequence)
         for chord_index, chord in enumerate(self.chord_sequence):
-            last_chord = chord_index == num_chords - 1
-            for melody_index in range(self.notes_per_chord):
-                very_first_note = melody_index == 0
-                last_note_before_new_chord = melody_index % self.notes_per_chord == self.notes_per_chord - 1
-                if not very_first_note and not last_chord and last_note_before_new_chord:
-                    next_chord = self.chord_sequence[chord_index + 1]
-                    possible_notes.append(chord.notes + next_chord.notes)
-                else:
-                    possible_notes.append(chord.notes)
+            next_chord = self.chord_sequence[chord_index + 1] if chord_index < num_chords - 1 else None
+            possible_notes.extend(self._candidates(chord, next_chord))
+        return possible_notes
+
+    def count(self):
+        """Return the number of melodies gen_sequence produces."""
+        retval = 1
+        for notes in self._possible_notes():
+            retval *= len(notes)
+        return retval
 
-        for notes in itertools.product(*possible_notes):
+    @instrumented('MelodyGenerator.gen_sequence')
+    def gen_sequence(self, shard=None, cursor=None):
+        """Generator of melodies, each a tuple of one note per melody note
+        position, in itertools.product order.
+
+        If shard (a Shard) is given only that shard's melodies are
+        produced: a contiguous range of indexes into the full order, the
+        first of which is found directly from its index.  If cursor (an
+        EnumerationCursor) is given, melodies before its position are
+        skipped the same way and it is moved on as melodies are produced.
+        """
+        possible_notes = self._possible_notes()
+        if shard is None and cursor is None:
+            yield from itertools.product(*possible_notes)
+            return
+        total = self.count()
+        start, stop = shard.range(total) if shard is not None else (0, total)
+        if cursor is None:
+            yield from _product_range(possible_notes, start, stop)
+            return
+        start = max(start, cursor.position)
+        cursor.position = start
+        for notes in _product_range(possible_notes, start, stop):
+            cursor.position += 1
             yield notes
+
+    def sample_melodies(self, count=None, rng=None):
+        """Generator of count (or endlessly many) random melodies, each note
+        picked uniformly from the notes gen_sequence would try in its
+        position.  rng is a random.Random to draw from."""
+        rng = rng or random.Random()
+        possible_notes = self._possible_notes()
+        produced = 0
+        while count is None or produced < count:
+            produced += 1
+            yield tuple(rng.choice(notes) for notes in possible_notes)
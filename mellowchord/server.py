@@ -0,0 +1,346 @@
+"""Local HTTP/JSON service for generating chord sequences and melodies.
+
+Started with mc serve, it keeps one process running so tools that generate
+many small batches don't pay interpreter and import startup every time.
+Requests are POSTs with a JSON object body:
+
+    /chords    key, start, num, shard, all_keys, limit   NDJSON chord sequences
+    /count     key, start, num                           {"count": N}
+    /melodies  key, seq, notes_per_chord, shard, limit   NDJSON melodies
+    /midi      key, seq, melody, program                 audio/midi file
+
+and GET /health answers {"status": "ok"}.  seq is a list of chord names in
+key, or of chords as they appear in /chords output, and melody a list of
+notes in scientific notation as in /melodies output.  Chord maps are the
+shared frozen ones from ChordMap.for_key, built for every key when the
+server starts.
+
+NDJSON results are streamed with chunked transfer encoding as they are
+generated.  Generation runs on a thread pool a batch of lines at a time and
+MIDI rendering on a process pool, so the event loop only moves bytes.
+"""
+import asyncio
+import concurrent.futures
+from http import HTTPStatus
+import itertools
+import json
+import signal
+import urllib.parse
+
+import musthe
+
+from .mellowchord import ALL_KEYS
+from .mellowchord import chord_sequence_ndjson_line
+from .mellowchord import ChordMap
+from .mellowchord import InvalidArgumentError
+from .mellowchord import keyed_chord_decoder
+from .mellowchord import MellowchordError
+from .mellowchord import MelodyGenerator
+from .mellowchord import melody_ndjson_line
+from .mellowchord import Shard
+from .mellowchord import string_to_keyed_chord
+from .mellowchord import validate_key
+from .mellowchord import validate_start
+from .mellowchord import write_midi_file
+from .transpose import gen_sequence_all_keys
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# The octave adjustment chordgen uses, so output matches the command line
+OCTAVE_ADJUSTMENT = -1
+# NDJSON lines generated per trip to the thread pool
+STREAM_BATCH = 256
+MAX_BODY_SIZE = 1 << 20
+
+
+class HTTPError(MellowchordError):
+    def __init__(self, status, message):
+        MellowchordError.__init__(self, message)
+        self.status = status
+
+
+def _param(params, name, kind, default=None, required=True):
+    value = params.get(name, default)
+    if value is None:
+        if required and default is None:
+            raise InvalidArgumentError(f'Missing "{name}"')
+        return value
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        raise InvalidArgumentError(f'"{name}" must be {"an integer" if kind is int else f"a {kind.__name__}"}')
+    return value
+
+
+def _parse_sequence(key, seq):
+    if not isinstance(seq, list) or not seq:
+        raise InvalidArgumentError('"seq" must be a non-empty list of chords')
+    retval = []
+    for chord in seq:
+        if isinstance(chord, str):
+            retval.append(string_to_keyed_chord(chord, key, OCTAVE_ADJUSTMENT))
+        elif isinstance(chord, dict) and chord.get('type') == '__keyed_chord__':
+            try:
+                retval.append(keyed_chord_decoder(chord))
+            except (KeyError, TypeError, ValueError) as e:
+                raise InvalidArgumentError(f'Invalid chord {chord!r}: {e}')
+        else:
+            raise InvalidArgumentError(f'Invalid chord {chord!r}')
+    return retval
+
+
+def _parse_melody(melody):
+    if not isinstance(melody, list):
+        raise InvalidArgumentError('"melody" must be a list of notes')
+    try:
+        return [musthe.Note(note) for note in melody]
+    except (TypeError, ValueError) as e:
+        raise InvalidArgumentError(f'Invalid melody: {e}')
+
+
+def _chord_map(key):
+    validate_key(key)
+    return ChordMap.for_key(key, OCTAVE_ADJUSTMENT)
+
+
+def render_midi(key, seq, melody=None, program=0):
+    """Return the MIDI file for seq and melody, as accepted by /midi.  Runs
+    in the render worker processes."""
+    validate_key(key)
+    seq = _parse_sequence(key, seq)
+    melody = _parse_melody(melody) if melody else None
+    if not isinstance(program, int) or isinstance(program, bool) or not 0 <= program <= 127:
+        raise InvalidArgumentError('"program" must be an integer from 0 to 127')
+    if melody and len(melody) % len(seq):
+        raise InvalidArgumentError('"melody" must have the same number of notes for every chord')
+    return write_midi_file(seq, melody, None, program).to_bytes()
+
+
+def chord_lines(params):
+    key = _param(params, 'key', str)
+    start = _param(params, 'start', str)
+    num = _param(params, 'num', int)
+    limit = _param(params, 'limit', int, required=False)
+    shard = Shard.parse(_param(params, 'shard', str)) if params.get('shard') is not None else None
+    if num < 1:
+        raise InvalidArgumentError('"num" must be at least 1')
+    chord_map = _chord_map(key)
+    validate_start(start, chord_map)
+    if _param(params, 'all_keys', bool, False):
+        items = gen_sequence_all_keys(start, num, start_key=key, octave_adjustment=OCTAVE_ADJUSTMENT, shard=shard)
+    else:
+        items = ((key, seq) for seq in chord_map.gen_sequence(start, num, shard=shard))
+    return (chord_sequence_ndjson_line(seq_key, seq) for seq_key, seq in itertools.islice(items, limit))
+
+
+def count(params):
+    key = _param(params, 'key', str)
+    start = _param(params, 'start', str)
+    num = _param(params, 'num', int)
+    if num < 1:
+        raise InvalidArgumentError('"num" must be at least 1')
+    chord_map = _chord_map(key)
+    validate_start(start, chord_map)
+    return {'count': chord_map.count_sequences(start, num)}
+
+
+def melody_lines(params):
+    key = _param(params, 'key', str)
+    validate_key(key)
+    seq = _parse_sequence(key, params.get('seq'))
+    notes_per_chord = _param(params, 'notes_per_chord', int, 1)
+    limit = _param(params, 'limit', int, required=False)
+    shard = Shard.parse(_param(params, 'shard', str)) if params.get('shard') is not None else None
+    if notes_per_chord not in (1, 2, 3, 4):
+        raise InvalidArgumentError('"notes_per_chord" must be from 1 to 4')
+    melodies = MelodyGenerator(key, seq, notes_per_chord).gen_sequence(shard)
+    return (melody_ndjson_line(notes) for notes in itertools.islice(melodies, limit))
+
+
+def _next_lines(lines):
+    return ''.join(itertools.islice(lines, STREAM_BATCH))
+
+
+async def _read_request(reader):
+    """Return (method, path, keep_alive, body) for the next request, or
+    None if the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, 'Malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        if line in (b'\r\n', b'\n'):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HTTPError(411, 'Chunked request bodies are not supported')
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise HTTPError(400, 'Invalid Content-Length')
+    if not 0 <= length <= MAX_BODY_SIZE:
+        raise HTTPError(413, f'Request bodies are limited to {MAX_BODY_SIZE} bytes')
+    body = await reader.readexactly(length)
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+    return method, urllib.parse.urlsplit(target).path, keep_alive, body
+
+
+def _response_head(status, content_type, keep_alive, length=None):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}', f'Content-Type: {content_type}']
+    if length is None:
+        lines.append('Transfer-Encoding: chunked')
+    else:
+        lines.append(f'Content-Length: {length}')
+    lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class MellowchordServer(object):
+    """The HTTP service behind mc serve.
+
+    workers is the number of render processes (default one per CPU).  A
+    render_executor can be given instead, which the server then doesn't
+    shut down.
+    """
+    _STREAMS = {'/chords': chord_lines, '/melodies': melody_lines}
+
+    def __init__(self, workers=None, render_executor=None):
+        self._threads = concurrent.futures.ThreadPoolExecutor()
+        self._owns_render_executor = render_executor is None
+        self._render = render_executor or concurrent.futures.ProcessPoolExecutor(workers)
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, keys=ALL_KEYS):
+        """Build the chord maps for keys and start listening.  Returns the
+        (host, port) actually listened on."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._threads, ChordMap.warm_cache, keys, (OCTAVE_ADJUSTMENT,))
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+        self._threads.shutdown(wait=False)
+        if self._owns_render_executor:
+            self._render.shutdown()
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (HTTPError, ValueError, asyncio.LimitOverrunError) as e:
+                    status = e.status if isinstance(e, HTTPError) else 400
+                    await self._send_json(writer, status, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None or not await self._respond(writer, *request):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _send_json(self, writer, status, obj, keep_alive):
+        body = json.dumps(obj).encode()
+        writer.write(_response_head(status, 'application/json', keep_alive, len(body)) + body)
+        await writer.drain()
+
+    async def _respond(self, writer, method, path, keep_alive, body):
+        """Answer one request and return whether the connection stays
+        open."""
+        loop = asyncio.get_running_loop()
+        try:
+            if path == '/health':
+                if method != 'GET':
+                    raise HTTPError(405, 'Use GET')
+                await self._send_json(writer, 200, {'status': 'ok'}, keep_alive)
+                return keep_alive
+            if path not in self._STREAMS and path not in ('/count', '/midi'):
+                raise HTTPError(404, f'No such endpoint {path}')
+            if method != 'POST':
+                raise HTTPError(405, 'Use POST')
+            try:
+                params = json.loads(body or b'{}')
+            except ValueError as e:
+                raise HTTPError(400, f'Invalid JSON: {e}')
+            if not isinstance(params, dict):
+                raise HTTPError(400, 'The request body must be a JSON object')
+            if path == '/count':
+                result = await loop.run_in_executor(self._threads, count, params)
+                await self._send_json(writer, 200, result, keep_alive)
+                return keep_alive
+            if path == '/midi':
+                midi = await loop.run_in_executor(self._render, render_midi, params.get('key'), params.get('seq'),
+                                                  params.get('melody'), params.get('program', 0))
+                writer.write(_response_head(200, 'audio/midi', keep_alive, len(midi)) + midi)
+                await writer.drain()
+                return keep_alive
+            lines = await loop.run_in_executor(self._threads, self._STREAMS[path], params)
+            # Errors in the parameters often only show up once generation
+            # starts, so the first batch is made before the status is sent
+            chunk = await loop.run_in_executor(self._threads, _next_lines, lines)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {'error': str(e)}, keep_alive)
+            return keep_alive
+        except (MellowchordError, ValueError, TypeError) as e:
+            await self._send_json(writer, 400, {'error': str(e)}, keep_alive)
+            return keep_alive
+        except Exception as e:
+            await self._send_json(writer, 500, {'error': repr(e)}, False)
+            return False
+        writer.write(_response_head(200, 'application/x-ndjson', keep_alive))
+        while chunk:
+            data = chunk.encode()
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            await writer.drain()
+            try:
+                chunk = await loop.run_in_executor(self._threads, _next_lines, lines)
+            except Exception:
+                # Too late to send an error status, so end the response
+                # without its last chunk and the client sees it is incomplete
+                return False
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None):
+    """Run the service until interrupted or sent SIGTERM."""
+    async def run():
+        server = MellowchordServer(workers)
+        address = await server.start(host, port)
+        print(f'Serving on http://{address[0]}:{address[1]}', flush=True)
+        serving = asyncio.ensure_future(server.serve_forever())
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        except NotImplementedError:
+            pass
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await server.close()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
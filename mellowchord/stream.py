@@ -0,0 +1,271 @@
+"""Endless generative playback.
+
+A ChordStream walks a ChordMap for ever (ChordMap.walk), picks a melody
+over each chord the way MelodyGenerator.sample_melodies does, and renders
+each chord as a bar of timed MIDI messages into an EventRing.  Playback
+takes the messages off the ring as they fall due and sends them to an
+output port, and bars are only rendered to keep the ring a fixed number of
+bars ahead of playback.  The walk, the ring and the timing statistics are
+all fixed in size, so the stream runs in the same memory however long it
+plays.
+
+Times are measured from the start of playback, so a late message makes
+nothing after it late.  The output port is anything with a send method,
+and the clock and sleep functions can be replaced, so the stream can run
+headless on a simulated clock.
+"""
+import random
+import time
+
+from .instrument import RecentSamples
+from .mellowchord import ChordMap
+from .mellowchord import InvalidArgumentError
+from .mellowchord import MelodyGenerator
+from .mellowchord import MellowchordError
+
+
+DEFAULT_BPM = 120
+BEATS_PER_BAR = 4
+# Bars rendered ahead of the one playing
+DEFAULT_BARS_AHEAD = 4
+# Most messages a bar renders to: a note on and off for each of four
+# chord notes and four melody notes
+_MAX_EVENTS_PER_BAR = 16
+# Longest single sleep, so that stopping doesn't wait for a long bar
+_MAX_SLEEP = 0.05
+CHORD_CHANNEL = 0
+MELODY_CHANNEL = 1
+
+
+class StreamError(MellowchordError):
+    pass
+
+
+class EventRing(object):
+    """Fixed-capacity first in, first out buffer of (time, message)
+    events, held in preallocated lists."""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = [0.0] * capacity
+        self._messages = [None] * capacity
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, when, message):
+        if self._size == self.capacity:
+            raise StreamError(f'The event ring is full ({self.capacity} events)')
+        tail = (self._head + self._size) % self.capacity
+        self._times[tail] = when
+        self._messages[tail] = message
+        self._size += 1
+
+    def peek_time(self):
+        """Return the time of the first event, or None if there are none."""
+        return self._times[self._head] if self._size else None
+
+    def pop(self):
+        """Remove and return the first event as (time, message)."""
+        if not self._size:
+            raise StreamError('The event ring is empty')
+        head = self._head
+        event = (self._times[head], self._messages[head])
+        self._messages[head] = None
+        self._head = (head + 1) % self.capacity
+        self._size -= 1
+        return event
+
+    def clear(self):
+        while self._size:
+            self.pop()
+
+
+class NullOutputPort(object):
+    """Output port that only counts the messages sent to it."""
+    def __init__(self, name='null'):
+        self.name = name
+        self.num_messages = 0
+        self.closed = False
+
+    def send(self, message):
+        self.num_messages += 1
+
+    def close(self):
+        self.closed = True
+
+
+class ChordStream(object):
+    """Endless progression from the chord start of chord_map, played one
+    chord a bar on output_port with a melody of notes_per_chord notes.
+
+    rng (a random.Random) picks the chords and melodies, so a seeded rng
+    plays the same stream every time.  Each chord and its melody are
+    passed to on_bar(keyed_chord, melody_notes) (if given) when the bar is
+    rendered, bars_ahead bars before it is played.
+    """
+    def __init__(self, chord_map, start, output_port, notes_per_chord=2, bpm=DEFAULT_BPM,
+                 bars_ahead=DEFAULT_BARS_AHEAD, rng=None, program=0, chord_velocity=48, melody_velocity=64,
+                 on_bar=None, clock=time.perf_counter, sleep=time.sleep):
+        if notes_per_chord not in (1, 2, 3, 4):
+            raise InvalidArgumentError('There must be 1 to 4 melody notes per chord')
+        if bpm <= 0:
+            raise InvalidArgumentError('The tempo must be above 0 beats per minute')
+        if bars_ahead < 1:
+            raise InvalidArgumentError('At least one bar must be rendered ahead')
+        self.chord_map = chord_map
+        self.output_port = output_port
+        self.notes_per_chord = notes_per_chord
+        self.bar_seconds = BEATS_PER_BAR * 60 / bpm
+        self.bars_ahead = bars_ahead
+        self.program = program
+        self.chord_velocity = chord_velocity
+        self.melody_velocity = melody_velocity
+        self._rng = rng or random.Random()
+        self._on_bar = on_bar
+        self._clock = clock
+        self._sleep = sleep
+        self._walk = chord_map.walk(start, self._rng)
+        self._next_chord = next(self._walk)
+        self._ring = EventRing((bars_ahead + 1) * _MAX_EVENTS_PER_BAR)
+        # Notes playing, as (channel, note)
+        self._sounding = set()
+        # mido messages by (type, channel, note, velocity), shared by every
+        # bar that plays them
+        self._messages = {}
+        self.num_bars = 0
+        self.num_messages = 0
+        self.max_lateness = 0.0
+        self.lateness = RecentSamples()
+
+    def _message(self, message_type, channel, note, velocity=0):
+        message_key = (message_type, channel, note, velocity)
+        message = self._messages.get(message_key)
+        if message is None:
+            import mido
+            message = self._messages[message_key] = mido.Message(message_type, channel=channel, note=note,
+                                                                 velocity=velocity)
+        return message
+
+    def _render_bar(self, bar_start):
+        chord = self._next_chord
+        self._next_chord = next(self._walk)
+        generator = MelodyGenerator(self.chord_map.key, [chord, self._next_chord], self.notes_per_chord)
+        melody = next(generator.sample_melodies(1, self._rng))[:self.notes_per_chord]
+        if self._on_bar is not None:
+            self._on_bar(chord, melody)
+        # Notes stop just before the next ones start, so a repeated note is
+        # heard again
+        gap = min(0.01, self.bar_seconds / 20)
+        bar_end = bar_start + self.bar_seconds
+        events = []
+        for note in chord.adjusted_notes.values():
+            midi_note = note.midi_note()
+            events.append((bar_start, self._message('note_on', CHORD_CHANNEL, midi_note, self.chord_velocity)))
+            events.append((bar_end - gap, self._message('note_off', CHORD_CHANNEL, midi_note)))
+        note_seconds = self.bar_seconds / self.notes_per_chord
+        for index, note in enumerate(melody):
+            midi_note = note.midi_note()
+            note_start = bar_start + index * note_seconds
+            events.append((note_start, self._message('note_on', MELODY_CHANNEL, midi_note, self.melody_velocity)))
+            events.append((note_start + note_seconds - gap, self._message('note_off', MELODY_CHANNEL, midi_note)))
+        events.sort(key=lambda event: event[0])
+        for when, message in events:
+            self._ring.push(when, message)
+
+    def _send(self, message):
+        if message.type == 'note_on':
+            self._sounding.add((message.channel, message.note))
+        else:
+            self._sounding.discard((message.channel, message.note))
+        self.output_port.send(message)
+
+    def _release(self):
+        # Stop whatever is still playing, and drop what hasn't played yet
+        self._ring.clear()
+        for channel, note in sorted(self._sounding):
+            self.output_port.send(self._message('note_off', channel, note))
+        self._sounding.clear()
+
+    def run(self, max_bars=None, max_seconds=None, stop=None):
+        """Play until max_bars bars have been played, max_seconds have
+        passed or stop (a threading.Event) is set, or for ever if none is
+        given, and return the number of bars played.
+
+        Each call starts a new timeline, carrying on the same progression.
+        """
+        import mido
+        clock = self._clock
+        ring = self._ring
+        for channel in (CHORD_CHANNEL, MELODY_CHANNEL):
+            self.output_port.send(mido.Message('program_change', channel=channel, program=self.program))
+        start_time = clock()
+        bars_rendered = 0
+        last_due = None
+        ahead_seconds = self.bars_ahead * self.bar_seconds
+        try:
+            while True:
+                now = clock()
+                if max_seconds is not None and now - start_time >= max_seconds or stop is not None and stop.is_set():
+                    break
+                # If playback has fallen behind, bars wait for room
+                while (max_bars is None or bars_rendered < max_bars) and \
+                        len(ring) + _MAX_EVENTS_PER_BAR <= ring.capacity:
+                    bar_start = start_time + bars_rendered * self.bar_seconds
+                    if bar_start > now + ahead_seconds:
+                        break
+                    self._render_bar(bar_start)
+                    bars_rendered += 1
+                due = ring.peek_time()
+                if due is None:
+                    break
+                if due > now:
+                    self._sleep(min(due - now, _MAX_SLEEP))
+                    continue
+                last_due, message = ring.pop()
+                self._send(message)
+                self.num_messages += 1
+                lateness = now - due
+                self.lateness.append(lateness)
+                if lateness > self.max_lateness:
+                    self.max_lateness = lateness
+        finally:
+            self._release()
+        # Bars whose first messages have been played
+        if last_due is None:
+            return 0
+        played = min(bars_rendered, int((last_due - start_time) / self.bar_seconds + 1e-9) + 1)
+        self.num_bars += played
+        return played
+
+    def lateness_percentile(self, fraction):
+        """Return the fraction (0 to 1) percentile, by nearest rank, of the
+        seconds messages were sent after they were due, over the most
+        recent messages."""
+        return self.lateness.percentile(fraction)
+
+
+def stream(key, start, chord_map=None, port_name=None, output=None, max_bars=None, max_seconds=None, **kwargs):
+    """Play an endless progression in key from the chord start on the MIDI
+    output port_name (default the first one) until interrupted, or until
+    max_bars or max_seconds, and return the ChordStream.  chord_map
+    defaults to the shared map for key, and the other arguments are
+    ChordStream's."""
+    import mido
+    chord_map = chord_map or ChordMap.for_key(key, -1)
+    try:
+        port = mido.open_output(port_name)
+    except (IOError, OSError, ImportError) as e:
+        raise MellowchordError(f'Can\'t open MIDI port: {e}')
+    try:
+        chord_stream = ChordStream(chord_map, start, port, **kwargs)
+        if output is not None:
+            output.write(f'Playing chords in {key} from {start} on {port.name}, Ctrl-C to stop\n')
+        try:
+            chord_stream.run(max_bars, max_seconds)
+        except KeyboardInterrupt:
+            pass
+    finally:
+        port.close()
+    return chord_stream
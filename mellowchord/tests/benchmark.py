@@ -0,0 +1,613 @@
+"""Performance benchmarks for mellowchord.
+
+Run the suite and save the results as JSON:
+
+    python -m mellowchord.tests.benchmark run -o results.json
+
+Compare two runs, exiting non-zero if any benchmark got more than 10%
+slower:
+
+    python -m mellowchord.tests.benchmark compare before.json after.json --threshold 10
+
+A benchmark is a function registered with @benchmark that does any setup
+and returns a callable to be timed.  If the callable has a bytes_per_call
+attribute, throughput is reported too.  If it has a stats attribute, a
+function returning a dict of measurements taken while it ran (such as
+latency percentiles), they are reported as well, and any over the limits
+given to @benchmark make the run exit non-zero.
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import mido
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from mellowchord import ALL_KEYS
+from mellowchord import analyze_midi_file
+from mellowchord import cached_chord_map
+from mellowchord import CheckpointWriter
+from mellowchord import chord_sequence_ndjson_line
+from mellowchord import Chord
+from mellowchord import ChordFollower
+from mellowchord import ChordMap
+from mellowchord import ChordSequenceCodec
+from mellowchord import ChordStream
+from mellowchord import EnumerationCursor
+from mellowchord import find_near_duplicates
+from mellowchord import gen_melodies_for_files
+from mellowchord import gen_sequence_all_keys
+from mellowchord import KeyedChord
+from mellowchord import keyed_chord_decoder
+from mellowchord import KeyedChordEncoder
+from mellowchord import MelodyGenerator
+from mellowchord import NullOutputPort
+from mellowchord import pack_melodies
+from mellowchord import read_chord_sequence_json
+from mellowchord import ScriptedInputPort
+from mellowchord import SequenceArchiveWriter
+from mellowchord import SequenceCatalog
+from mellowchord import SequenceTrie
+from mellowchord import Shard
+from mellowchord import TransitionCounts
+from mellowchord import validate_melodies
+from mellowchord import slot_masks
+from mellowchord import string_to_chord
+from mellowchord import write_chord_sequence_json
+from mellowchord import write_midi_file
+from mellowchord.tests.maps import large_definition
+
+
+RESULTS_VERSION = 1
+BENCHMARKS = {}
+# Most each reported measurement may be, by benchmark
+LIMITS = {}
+
+# Callables that undo benchmark setup once a run is finished
+_cleanups = []
+
+
+def benchmark(name, limits=None):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        if limits:
+            LIMITS[name] = limits
+        return func
+    return decorator
+
+
+def _temp_dir():
+    temp_dir = tempfile.mkdtemp(prefix='mellowchord-benchmark-')
+    _cleanups.append(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+    return temp_dir
+
+
+def _test_sequence(length=4, key='C', start='Cmaj'):
+    return next(ChordMap(key).gen_sequence(start, length))
+
+
+for _key in ('C', 'Amin', 'F#'):
+    def _chord_map_construction(key=_key):
+        return lambda: ChordMap(key)
+    benchmark(f'chord_map_construction[{_key}]')(_chord_map_construction)
+
+
+@benchmark('chord_map_for_key_warm')
+def _chord_map_for_key_warm():
+    ChordMap.warm_cache()
+    return lambda: ChordMap.for_key('F#')
+
+
+@benchmark('chord_map_from_definition[500]', limits={'min': 2})
+def _chord_map_from_definition():
+    definition = large_definition()
+    return lambda: ChordMap(definition=definition)
+
+
+def _large_map_file():
+    temp_dir = _temp_dir()
+    path = os.path.join(temp_dir, 'map.json')
+    with open(path, 'w') as f:
+        json.dump(large_definition(), f)
+    return (path, os.path.join(temp_dir, 'cache'))
+
+
+@benchmark('chord_map_load_cold[500]')
+def _chord_map_load_cold():
+    path, cache_dir = _large_map_file()
+
+    def run():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cached_chord_map(path, 'C', directory=cache_dir)
+    return run
+
+
+@benchmark('chord_map_load_warm[500]')
+def _chord_map_load_warm():
+    path, cache_dir = _large_map_file()
+    cached_chord_map(path, 'C', directory=cache_dir)
+    return lambda: cached_chord_map(path, 'C', directory=cache_dir)
+
+
+@benchmark('chord_map_edit[500]')
+def _chord_map_edit():
+    # Compare with chord_map_from_definition[500], rebuilding the map
+    cm = ChordMap(definition=large_definition())
+    cm._successor_table()
+    successors = {successor.name for successor in cm._g.successors(cm._g.node_named('n0'))}
+    to_name = next(node.name for node in cm._g if node.name not in successors)
+
+    def run():
+        cm.add_edge('n0', to_name)
+        cm._successor_table()
+        cm.remove_edge('n0', to_name)
+        cm._successor_table()
+    return run
+
+
+@benchmark('next_chords_large_map[500]', limits={'min': 0.005})
+def _next_chords_large_map():
+    cm = ChordMap(definition=large_definition())
+    chord = cm._g.nodes[0].primary
+    return lambda: cm.next_chords(chord, all_variants=True)
+
+
+@benchmark('count_sequences_large_map[500, 20]', limits={'min': 2})
+def _count_sequences_large_map():
+    cm = ChordMap(definition=large_definition())
+    cm.freeze()
+    chord = cm._g.nodes[0].primary
+    return lambda: cm.count_sequences(chord, 20)
+
+
+@benchmark('gen_chord_sequence_large_map[500, 8]', limits={'min': 5})
+def _gen_chord_sequence_large_map():
+    # The first 100000 sequences of 8 chords
+    cm = ChordMap(definition=large_definition())
+    chord = cm._g.nodes[0].primary
+    return lambda: sum(1 for _ in itertools.islice(cm.gen_chord_sequence(chord, 8), 100000))
+
+
+@benchmark('gen_chord_sequence_shard_large_map[500, 20, 15/16]', limits={'min': 2})
+def _gen_chord_sequence_shard_large_map():
+    # Finding the first sequence of the last shard
+    cm = ChordMap(definition=large_definition())
+    chord = cm._g.nodes[0].primary
+    return lambda: next(cm.gen_chord_sequence(chord, 20, Shard(15, 16)))
+
+
+@benchmark('next_chords')
+def _next_chords():
+    cm = ChordMap('C')
+    return lambda: cm.next_chords('Cmaj', all_variants=True)
+
+
+for _length in range(3, 11):
+    def _gen_sequence(length=_length):
+        cm = ChordMap('C')
+        return lambda: sum(1 for _ in cm.gen_sequence('Cmaj', length))
+    benchmark(f'gen_sequence[{_length}]')(_gen_sequence)
+
+
+@benchmark('gen_chord_sequence_shard[10, 7/8]')
+def _gen_chord_sequence_shard():
+    cm = ChordMap.for_key('C')
+    shard = Shard(7, 8)
+    return lambda: sum(1 for _ in cm.gen_chord_sequence('Cmaj', 10, shard))
+
+
+@benchmark('melody_generator_shard[4, 7/8]')
+def _melody_generator_shard():
+    mg = MelodyGenerator('C', _test_sequence(), 4)
+    shard = Shard(7, 8)
+    return lambda: sum(1 for _ in itertools.islice(mg.gen_sequence(shard), 10000))
+
+
+@benchmark('gen_sequence_all_keys[6]')
+def _gen_sequence_all_keys():
+    return lambda: sum(1 for _ in gen_sequence_all_keys('Cmaj', 6))
+
+
+@benchmark('gen_sequence_per_key[6]')
+def _gen_sequence_per_key():
+    def run():
+        for key in ALL_KEYS:
+            cm = ChordMap(key)
+            start = KeyedChord(key, cm._g.nodes[0].primary).name
+            for _ in cm.gen_sequence(start, 6):
+                pass
+    return run
+
+
+for _notes_per_chord in range(1, 5):
+    def _melody_generator(notes_per_chord=_notes_per_chord):
+        seq = _test_sequence()
+        return lambda: sum(1 for _ in itertools.islice(MelodyGenerator('C', seq, notes_per_chord).gen_sequence(), 10000))
+    benchmark(f'melody_generator[{_notes_per_chord}]')(_melody_generator)
+
+
+@benchmark('string_to_chord')
+def _string_to_chord():
+    return lambda: string_to_chord('Fmaj/C', 'C')
+
+
+@benchmark('keyed_chord_construction')
+def _keyed_chord_construction():
+    chord = Chord(4, 'maj', inversion=2)
+    return lambda: KeyedChord('C', chord)
+
+
+@benchmark('write_midi_file')
+def _write_midi_file():
+    seq = _test_sequence(8)
+    path = os.path.join(_temp_dir(), 'benchmark.mid')
+    return lambda: write_midi_file(seq, None, path, 0).write()
+
+
+@benchmark('analyze_midi_file')
+def _analyze_midi_file():
+    path = os.path.join(_temp_dir(), 'analyze.mid')
+    write_midi_file(_test_sequence(8), None, path, 0).write()
+    # Detecting the key builds the tables of all 24 keys once
+    analyze_midi_file(path)
+    return lambda: analyze_midi_file(path)
+
+
+@benchmark('archive_output[5]')
+def _archive_output():
+    sequences = list(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 5))
+    path = os.path.join(_temp_dir(), 'benchmark.tar')
+
+    def run():
+        with SequenceArchiveWriter(path) as writer:
+            for seq in sequences:
+                writer.add_chord_sequence('C', seq)
+    return run
+
+
+@benchmark('json_round_trip')
+def _json_round_trip():
+    seq = _test_sequence(8)
+    path = os.path.join(_temp_dir(), 'benchmark.json')
+
+    def run():
+        write_chord_sequence_json(path, 'C', seq)
+        read_chord_sequence_json(path)
+    return run
+
+
+def _codec_sequences():
+    return list(itertools.islice(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 8), 2000))
+
+
+def _ndjson_text(sequences):
+    return ''.join(json.dumps({'key': 'C', 'seq': seq}, cls=KeyedChordEncoder) + '\n' for seq in sequences)
+
+
+@benchmark('chord_sequence_encode[2000]')
+def _chord_sequence_encode():
+    sequences = _codec_sequences()
+    codec = ChordSequenceCodec()
+
+    def run():
+        return [codec.encode_line('C', seq) for seq in sequences]
+    run.bytes_per_call = len(_ndjson_text(sequences))
+    return run
+
+
+@benchmark('chord_sequence_encode_json[2000]')
+def _chord_sequence_encode_json():
+    # Compare MB/s with chord_sequence_encode[2000]
+    sequences = _codec_sequences()
+
+    def run():
+        return [json.dumps({'key': 'C', 'seq': seq}, cls=KeyedChordEncoder) + '\n' for seq in sequences]
+    run.bytes_per_call = len(_ndjson_text(sequences))
+    return run
+
+
+@benchmark('chord_sequence_decode[2000]')
+def _chord_sequence_decode():
+    lines = _ndjson_text(_codec_sequences()).splitlines(True)
+    codec = ChordSequenceCodec()
+
+    def run():
+        return [batch for batch in codec.read_batches(iter(lines))]
+    run.bytes_per_call = sum(map(len, lines))
+    return run
+
+
+@benchmark('chord_sequence_decode_json[200]')
+def _chord_sequence_decode_json():
+    # Compare MB/s with chord_sequence_decode[2000]; building every chord
+    # afresh is too slow to time as many
+    lines = _ndjson_text(_codec_sequences()[:200]).splitlines(True)
+
+    def run():
+        return [json.loads(line, object_hook=keyed_chord_decoder) for line in lines]
+    run.bytes_per_call = sum(map(len, lines))
+    return run
+
+
+@benchmark('ndjson_output[8]')
+def _ndjson_output():
+    cm = ChordMap.for_key('C')
+    path = os.path.join(_temp_dir(), 'output.ndjson')
+
+    def run():
+        with open(path, 'w') as f:
+            for seq in cm.gen_sequence('Cmaj', 8, cursor=EnumerationCursor()):
+                f.write(chord_sequence_ndjson_line('C', seq))
+    return run
+
+
+@benchmark('ndjson_output_checkpointed[8]')
+def _ndjson_output_checkpointed():
+    cm = ChordMap.for_key('C')
+    temp_dir = _temp_dir()
+    path = os.path.join(temp_dir, 'output.ndjson')
+    checkpoint_path = os.path.join(temp_dir, 'checkpoint.json')
+
+    def run():
+        cursor = EnumerationCursor()
+        with CheckpointWriter(path, checkpoint_path, {}, cursor) as writer:
+            for seq in cm.gen_sequence('Cmaj', 8, cursor=cursor):
+                writer.write(chord_sequence_ndjson_line('C', seq))
+    return run
+
+
+@benchmark('transition_training[1000]')
+def _transition_training():
+    # Sequences per second is 1000 divided by the time per run
+    sequences = itertools.islice(itertools.cycle(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 8)), 1000)
+    path = os.path.join(_temp_dir(), 'corpus.ndjson')
+    with open(path, 'w') as f:
+        for seq in sequences:
+            f.write(chord_sequence_ndjson_line('C', seq))
+    return lambda: TransitionCounts().add_files([path])
+
+
+@benchmark('melodygen_files[100]')
+def _melodygen_files():
+    # 100 files of 8 chords, one melody each, so the time is mostly reading
+    # files and setting up their MelodyGenerators
+    temp_dir = _temp_dir()
+    paths = []
+    for index, seq in enumerate(itertools.islice(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 8), 100)):
+        paths.append(os.path.join(temp_dir, f'{index}.json'))
+        write_chord_sequence_json(paths[-1], 'C', seq)
+    output_dir = _temp_dir()
+    return lambda: sum(result.num_melodies for result in
+                       gen_melodies_for_files(paths, 4, output_dir, workers=1, max_melodies=1))
+
+
+@benchmark('validate_melodies[100000]')
+def _validate_melodies():
+    # Melodies per second is 100000 divided by the time per run
+    seq = _test_sequence(8)
+    masks = slot_masks('C', seq, 2)
+    melodies = itertools.islice(itertools.cycle(MelodyGenerator('C', seq, 2).gen_sequence()), 100000)
+    rows = bytearray(pack_melodies([[note.midi_note() for note in notes] for notes in melodies], len(masks)))
+    # One bad note in every 1000 melodies
+    for index in range(0, 100000, 1000):
+        rows[index * len(masks) + 5] += 1
+    return lambda: validate_melodies(masks, rows)
+
+
+@benchmark('find_near_duplicates[20000]')
+def _find_near_duplicates():
+    sequences = [('C', seq) for seq in itertools.islice(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 10), 20000)]
+    return lambda: sum(1 for _ in find_near_duplicates(sequences))
+
+
+@benchmark('chord_follower_latency[3000]', limits={'latency_p50': 0.0005, 'latency_p99': 0.005})
+def _chord_follower_latency():
+    # Seconds from receiving the note that completes a chord to reporting it
+    follower = ChordFollower('C', output=io.StringIO())
+    chords = ([60, 64, 67], [57, 60, 64], [53, 57, 60], [55, 59, 62], [52, 55, 59], [50, 53, 57])
+    messages = [mido.Message(message_type, note=note, velocity=70) for chord in chords * 500
+                for message_type in ('note_on', 'note_off') for note in chord]
+
+    def run():
+        follower.run(ScriptedInputPort(messages))
+    run.stats = lambda: {'latency_p50': follower.latency_percentile(0.5),
+                         'latency_p99': follower.latency_percentile(0.99)}
+    return run
+
+
+@benchmark('chord_stream[500]')
+def _chord_stream():
+    # 500 bars of an endless stream, played on a simulated clock
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+    chord_stream = ChordStream(ChordMap.for_key('C', -1), 'Cmaj', NullOutputPort(), clock=lambda: now[0], sleep=sleep)
+    return lambda: chord_stream.run(max_bars=500)
+
+
+@benchmark('chord_stream_realtime[5]', limits={'lateness_p50': 0.01, 'lateness_p99': 0.05})
+def _chord_stream_realtime():
+    # Five bars at 2400 bpm on the real clock, with how late messages were
+    # sent
+    chord_stream = ChordStream(ChordMap.for_key('C', -1), 'Cmaj', NullOutputPort(), bpm=2400)
+
+    def run():
+        chord_stream.run(max_bars=5)
+    run.stats = lambda: {'lateness_p50': chord_stream.lateness_percentile(0.5),
+                         'lateness_p99': chord_stream.lateness_percentile(0.99)}
+    return run
+
+
+@benchmark('catalog_ingest', limits={'seconds_per_sequence': 0.001})
+def _catalog_ingest():
+    sequences = [('C', seq) for seq in ChordMap('C').gen_sequence('Cmaj', 6)]
+    temp_dir = _temp_dir()
+    counter = itertools.count()
+    # Fastest ingest so far, in seconds per sequence
+    fastest = [float('inf')]
+
+    def run():
+        start = time.perf_counter()
+        with SequenceCatalog(os.path.join(temp_dir, f'{next(counter)}.db')) as catalog:
+            catalog.ingest(sequences)
+        fastest[0] = min(fastest[0], (time.perf_counter() - start) / len(sequences))
+    run.stats = lambda: {'seconds_per_sequence': fastest[0]}
+    return run
+
+
+@benchmark('catalog_query', limits={'min': 0.1})
+def _catalog_query():
+    catalog = SequenceCatalog(os.path.join(_temp_dir(), 'query.db'))
+    _cleanups.append(catalog.close)
+    catalog.ingest(('C', seq) for seq in ChordMap('C').gen_sequence('Cmaj', 8))
+    return lambda: sum(1 for _ in catalog.query(key='C', start='I', contains='IV V I', limit=100))
+
+
+@benchmark('sequence_trie_build[8]')
+def _sequence_trie_build():
+    cm = ChordMap.for_key('C')
+    return lambda: SequenceTrie(cm.gen_sequence('Cmaj', 8))
+
+
+@benchmark('sequence_trie_prefix_query[10]')
+def _sequence_trie_prefix_query():
+    trie = SequenceTrie(ChordMap.for_key('C').gen_sequence('Cmaj', 10))
+    prefix = next(iter(trie))[:4]
+    return lambda: sum(1 for _ in trie.with_prefix(prefix))
+
+
+def time_callable(run, repeat=5, min_time=0.1):
+    """Return timing statistics, in seconds per call, for run.  The number
+    of calls per sample is doubled until one sample takes min_time."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - start) / number)
+    return {'number': number,
+            'repeat': repeat,
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.mean(samples)}
+
+
+def run_benchmarks(names=None, repeat=5, min_time=0.1, progress=None):
+    """Run the named benchmarks (all of them by default) and return the
+    results as a JSON-serializable dict."""
+    results = {}
+    try:
+        for name in BENCHMARKS if names is None else names:
+            run = BENCHMARKS[name]()
+            results[name] = time_callable(run, repeat, min_time)
+            bytes_per_call = getattr(run, 'bytes_per_call', None)
+            if bytes_per_call:
+                results[name]['bytes_per_call'] = bytes_per_call
+                results[name]['mb_per_second'] = bytes_per_call / results[name]['min'] / 1e6
+            stats = getattr(run, 'stats', None)
+            if stats:
+                results[name].update(stats())
+            if name in LIMITS:
+                results[name]['over_limits'] = sorted(measurement for measurement, limit in LIMITS[name].items()
+                                                      if results[name][measurement] > limit)
+            if progress:
+                progress(name, results[name])
+    finally:
+        while _cleanups:
+            _cleanups.pop()()
+    return {'version': RESULTS_VERSION,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': results}
+
+
+def compare_results(baseline, current, threshold=10.0, metric='min'):
+    """Compare two sets of results and return a list of (name, baseline
+    time, current time, percent change, regressed) tuples for every
+    benchmark in both.  A benchmark has regressed if it is more than
+    threshold percent slower."""
+    comparison = []
+    for name, current_stats in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name][metric]
+        after = current_stats[metric]
+        change = (after - before) / before * 100 if before else 0.0
+        comparison.append((name, before, after, change, change > threshold))
+    return comparison
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return f'{seconds * scale:.3f} {unit}'
+    return f'{seconds * 1e9:.1f} ns'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run or compare mellowchord benchmarks.')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Run benchmarks')
+    run_parser.add_argument('-o', '--output', type=str, help='JSON file to write results to', default=None)
+    run_parser.add_argument('-k', '--filter', type=str, help='Only run benchmarks whose name contains this',
+                            default=None)
+    run_parser.add_argument('-r', '--repeat', type=int, help='Samples per benchmark', default=5)
+    run_parser.add_argument('-t', '--min-time', type=float, help='Minimum seconds per sample', default=0.1)
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline', type=str, help='Results of the earlier run')
+    compare_parser.add_argument('current', type=str, help='Results of the later run')
+    compare_parser.add_argument('--threshold', type=float, help='Percent slowdown that counts as a regression',
+                                default=10.0)
+    compare_parser.add_argument('--metric', type=str, choices=('min', 'median', 'mean'), default='min')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+
+        def progress(name, stats):
+            throughput = f' {stats["mb_per_second"]:.1f} MB/s' if 'mb_per_second' in stats else ''
+            print(f'{name:40} {_format_time(stats["min"]):>12} (x{stats["number"]}){throughput}')
+            for measurement in sorted(LIMITS.get(name, ())):
+                flag = ' OVER LIMIT' if measurement in stats['over_limits'] else ''
+                print(f'    {measurement:36} {_format_time(stats[measurement]):>12} '
+                      f'(limit {_format_time(LIMITS[name][measurement])}){flag}')
+        results = run_benchmarks(names, args.repeat, args.min_time, progress)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 1 if any(stats.get('over_limits') for stats in results['benchmarks'].values()) else 0
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = 0
+        for name, before, after, change, regressed in compare_results(baseline, current, args.threshold, args.metric):
+            flag = 'REGRESSION' if regressed else ''
+            print(f'{name:40} {_format_time(before):>12} {_format_time(after):>12} {change:+7.1f}% {flag}')
+            regressions += regressed
+        return 1 if regressions else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
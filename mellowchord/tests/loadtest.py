@@ -0,0 +1,172 @@
+"""Load test for the mc serve HTTP service.
+
+Start a server in a subprocess, drive it with concurrent keep-alive
+clients and report requests per second and latency percentiles:
+
+    python -m mellowchord.tests.loadtest --requests 2000 --concurrency 16
+
+Use --url to test a server that is already running, and -o to save the
+results as JSON.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import subprocess
+import sys
+import time
+import urllib.parse
+
+
+# (name, method, path, body) of each kind of request; clients cycle through them
+REQUESTS = {
+    'health': ('GET', '/health', None),
+    'count': ('POST', '/count', {'key': 'C', 'start': 'Cmaj', 'num': 10}),
+    'chords': ('POST', '/chords', {'key': 'C', 'start': 'Cmaj', 'num': 6, 'limit': 100}),
+    'melodies': ('POST', '/melodies', {'key': 'C', 'seq': ['Cmaj', 'Fmaj', 'Gmaj', 'Cmaj'], 'notes_per_chord': 2,
+                                       'limit': 100}),
+    'midi': ('POST', '/midi', {'key': 'C', 'seq': ['Cmaj', 'Amin', 'Fmaj', 'Gmaj'],
+                               'melody': ['C5', 'A4', 'F4', 'G4']}),
+}
+DEFAULT_MIX = ('count', 'chords', 'melodies', 'midi')
+
+
+async def _read_response(reader):
+    """Return (status, body) of the next response, decoding chunked
+    bodies."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Server closed the connection')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                break
+            chunks.append(chunk[:-2])
+        return status, b''.join(chunks)
+    return status, await reader.readexactly(int(headers.get('content-length', 0)))
+
+
+def _encode_request(host, method, path, body):
+    data = json.dumps(body).encode() if body is not None else b''
+    return (f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n').encode('latin-1') + data
+
+
+async def _client(host, port, jobs, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for name, request in jobs:
+            start = time.perf_counter()
+            writer.write(request)
+            status, _ = await _read_response(reader)
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+            if status != 200:
+                errors[name] = errors.get(name, 0) + 1
+    finally:
+        writer.close()
+
+
+def percentile(samples, fraction):
+    """Return the fraction (0 to 1) percentile of samples, by nearest
+    rank."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def _stats(samples, elapsed):
+    return {'requests': len(samples),
+            'requests_per_second': len(samples) / elapsed,
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p90_ms': percentile(samples, 0.9) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': max(samples) * 1000}
+
+
+async def run_load(host, port, requests=1000, concurrency=8, mix=DEFAULT_MIX):
+    """Send requests requests, cycling through the kinds in mix, over
+    concurrency connections and return the results as a dict."""
+    encoded = [(name, _encode_request(host, *REQUESTS[name])) for name in mix]
+    jobs = list(itertools.islice(itertools.cycle(encoded), requests))
+    latencies = {}
+    errors = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, jobs[index::concurrency], latencies, errors)
+                           for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    results = {'concurrency': concurrency,
+               'elapsed': elapsed,
+               'errors': sum(errors.values()),
+               'total': _stats([t for samples in latencies.values() for t in samples], elapsed),
+               'by_request': {name: _stats(samples, elapsed) for name, samples in latencies.items()}}
+    return results
+
+
+def start_server(workers=None):
+    """Start mc serve on a free port and return (process, host, port)."""
+    command = [sys.executable, '-m', 'mellowchord.cli', 'serve', '--port', '0']
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('Serving on '):
+        process.kill()
+        raise RuntimeError(f'mc serve did not start: {line!r}')
+    address = urllib.parse.urlsplit(line.split()[-1])
+    return process, address.hostname, address.port
+
+
+def print_results(results):
+    print(f'{results["total"]["requests"]} requests over {results["concurrency"]} connections in '
+          f'{results["elapsed"]:.2f} s, {results["errors"]} errors')
+    print(f'{"request":<12}{"req/s":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for name, stats in itertools.chain(sorted(results['by_request'].items()), [('total', results['total'])]):
+        print(f'{name:<12}{stats["requests_per_second"]:>10.1f}{stats["p50_ms"]:>10.2f}{stats["p90_ms"]:>10.2f}'
+              f'{stats["p99_ms"]:>10.2f}{stats["max_ms"]:>10.2f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the mc serve HTTP service.')
+    parser.add_argument('--url', type=str, help='Server to test instead of starting one', default=None)
+    parser.add_argument('-n', '--requests', type=int, help='Number of requests to send', default=1000)
+    parser.add_argument('-c', '--concurrency', type=int, help='Number of concurrent connections', default=8)
+    parser.add_argument('-m', '--mix', type=str, help=f'Comma separated request kinds from {sorted(REQUESTS)}',
+                        default=','.join(DEFAULT_MIX))
+    parser.add_argument('--workers', type=int, help='Render processes for the started server', default=None)
+    parser.add_argument('-o', '--output', type=str, help='JSON file to save the results to', default=None)
+    args = parser.parse_args(argv)
+    mix = [name for name in args.mix.split(',') if name]
+    unknown = set(mix) - set(REQUESTS)
+    if unknown or not mix:
+        parser.error(f'Unknown request kinds {sorted(unknown)}' if unknown else 'Empty --mix')
+    process = None
+    if args.url:
+        address = urllib.parse.urlsplit(args.url)
+        host, port = address.hostname, address.port
+    else:
+        process, host, port = start_server(args.workers)
+    try:
+        results = asyncio.run(run_load(host, port, args.requests, args.concurrency, mix))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
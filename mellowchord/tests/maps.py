@@ -0,0 +1,25 @@
+"""Chord map definitions shared by the tests and benchmarks."""
+import random
+
+from mellowchord import Chord
+
+
+SMALL_MAP = {'version': 1,
+             'nodes': {'I': ['I', 'Imaj7'], 'IV': ['IV'], 'V': ['V', 'V7'], 'V/2': ['V/2']},
+             'edges': [['I', 'IV'], ['I', 'V'], ['IV', 'V/2'], ['IV', 'I'], ['V', 'I'], ['V/2', 'I']]}
+
+
+def large_definition(num_nodes=500, edges_per_node=6, seed=0):
+    """Return a random map definition with num_nodes nodes and about
+    num_nodes * edges_per_node edges."""
+    rng = random.Random(seed)
+    chord_types = ('maj', 'min', 'dim', 'aug', 'dom7', 'maj7', 'min7', 'm7dim5', 'dim7', 'sus2', 'sus4')
+    pool = [Chord(degree, chord_type, inversion).name
+            for degree in range(1, 8) for chord_type in chord_types for inversion in (None, 1, 2)]
+    names = [f'n{index}' for index in range(num_nodes)]
+    nodes = {name: rng.sample(pool, rng.randint(1, 3)) for name in names}
+    edges = set()
+    for name in names:
+        for successor in rng.sample(names, edges_per_node):
+            edges.add((name, successor))
+    return {'version': 1, 'nodes': nodes, 'edges': [list(edge) for edge in sorted(edges)]}
@@ -0,0 +1,157 @@
+from mellowchord import analyze_files
+from mellowchord import analyze_midi_file
+from mellowchord import Chord
+from mellowchord import ChordMap
+from mellowchord import ChordTable
+from mellowchord import detect_key
+from mellowchord import find_midi_files
+from mellowchord import InvalidArgumentError
+from mellowchord import KeyedChord
+from mellowchord import MidiAnalysis
+from mellowchord import pitch_class_mask
+from mellowchord import read_sequences
+from mellowchord import string_to_keyed_chord
+from mellowchord import write_midi_file
+from mellowchord.cli import analyze
+import itertools
+import mido
+import musthe
+import os
+import pickle
+import pytest
+
+
+def write_sequence(path, seq, melody=None):
+    write_midi_file(seq, melody, str(path), 0).write()
+    return str(path)
+
+
+def write_groups(path, groups, channel=0):
+    """Write each list of MIDI notes in groups as a chord lasting a beat."""
+    midi_file = mido.MidiFile()
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    for group in groups:
+        for note in group:
+            track.append(mido.Message('note_on', note=note, velocity=64, channel=channel, time=0))
+        for index, note in enumerate(group):
+            track.append(mido.Message('note_off', note=note, channel=channel, time=480 if index == 0 else 0))
+    midi_file.save(str(path))
+    return str(path)
+
+
+def test_pitch_class_mask():
+    assert pitch_class_mask([60, 64, 67]) == pitch_class_mask([48, 76, 67, 60]) == 0b000010010001
+    assert pitch_class_mask([]) == 0
+
+
+@pytest.mark.parametrize('key', ['C', 'Amin', 'F#', 'Ebmin'])
+def test_round_trip(key, tmp_path):
+    cm = ChordMap.for_key(key, -1)
+    start = KeyedChord(key, cm._g.nodes[0].primary).name
+    for index, seq in enumerate(itertools.islice(cm.gen_sequence(start, 4), 0, None, 5)):
+        path = write_sequence(tmp_path / f'{index}.mid', seq)
+        analysis = analyze_midi_file(path, key)
+        assert (analysis.key, analysis.seq, analysis.num_unrecognized) == (key, seq, 0)
+        assert analyze_midi_file(path).key == key
+
+
+def test_inversions_and_sevenths():
+    table = ChordTable.for_key('C')
+    assert table.identify([60, 64, 67]) == string_to_keyed_chord('Cmaj', 'C', 0)
+    assert table.identify([52, 55, 60]) == KeyedChord('C', Chord(1, 'maj', 1, -1))
+    assert table.identify([55, 60, 64]) == KeyedChord('C', Chord(1, 'maj', 2, 0))
+    assert table.identify([67, 71, 74, 77]) == KeyedChord('C', Chord(5, 'dom7'))
+    # Root position wins over another chord's inversion with the same notes
+    assert table.identify([67, 72, 74]) == KeyedChord('C', Chord(5, 'sus4'))
+    assert table.identify([60, 62, 67]) == KeyedChord('C', Chord(1, 'sus2'))
+    assert table.identify([72, 76, 79, 81]) == KeyedChord('C', Chord(6, 'min7', 1))
+    # The seventh in the bass is taken as root position
+    assert table.identify([53, 55, 59, 62]).name == 'Gdom7'
+    assert table.identify([60, 64]) is None
+    assert table.identify([60, 61, 62]) is None
+    # Chords need a root on the scale, not notes from it
+    assert table.identify([58, 62, 65]) is None
+    assert ChordTable.for_key('F').identify([58, 62, 65]).name == 'Bbmaj'
+    with pytest.raises(InvalidArgumentError):
+        ChordTable('H')
+
+
+def test_detect_key():
+    c_major = [[60, 64, 67], [65, 69, 72], [55, 59, 62, 65], [60, 64, 67]]
+    assert detect_key(c_major) == 'C'
+    a_minor = [[57, 60, 64], [62, 65, 69], [52, 55, 59], [57, 60, 64]]
+    assert detect_key(a_minor) == 'Amin'
+    assert detect_key([[60, 61, 62]]) is None
+    assert detect_key([]) is None
+
+
+def test_melody_and_percussion(tmp_path):
+    seq = [string_to_keyed_chord(name, 'C', -1) for name in ('Cmaj', 'Fmaj', 'Gmaj')]
+    melody = [musthe.Note(name) for name in ('D5', 'B5', 'G5')]
+    path = write_sequence(tmp_path / 'melody.mid', seq, melody)
+    assert analyze_midi_file(path, 'C').seq == seq
+    # Melody notes sound at the same time as the chords, so with them the
+    # first two groups aren't chords any more
+    analysis = analyze_midi_file(path, 'C', exclude_tracks=())
+    assert (analysis.seq, analysis.num_unrecognized) == (seq[2:], 2)
+    drums = write_groups(tmp_path / 'drums.mid', [[60, 64, 67]], channel=9)
+    assert analyze_midi_file(drums).num_groups == 0
+
+
+def test_grouping(tmp_path):
+    path = write_groups(tmp_path / 'groups.mid', [[60, 64, 67], [60, 61], [53, 57, 60]])
+    analysis = analyze_midi_file(path, 'C')
+    assert analysis.num_groups == 3
+    assert analysis.num_unrecognized == 1
+    assert [chord.name for chord in analysis.seq] == ['Cmaj', 'Fmaj']
+    nothing = analyze_midi_file(write_groups(tmp_path / 'nothing.mid', [[60, 61]]))
+    assert (nothing.key, nothing.seq, nothing.error) == (None, [], None)
+
+
+def test_bad_file(tmp_path):
+    path = tmp_path / 'bad.mid'
+    path.write_bytes(b'not a midi file' * 10)
+    analysis = analyze_midi_file(str(path))
+    assert analysis.error and analysis.seq == []
+
+
+def test_analyze_files(tmp_path):
+    cm = ChordMap.for_key('Amin', -1)
+    sequences = list(itertools.islice(cm.gen_sequence('Amin', 4), 0, None, 3))
+    os.mkdir(str(tmp_path / 'sub'))
+    for index, seq in enumerate(sequences):
+        write_sequence(tmp_path / ('sub' if index % 2 else '') / f'{index:03}.mid', seq)
+    (tmp_path / 'notes.txt').write_text('not MIDI')
+    paths = find_midi_files([str(tmp_path)])
+    assert len(paths) == len(sequences)
+    with pytest.raises(InvalidArgumentError):
+        find_midi_files([str(tmp_path / 'missing')])
+    serial = list(analyze_files(paths, workers=1))
+    assert [analysis.seq for analysis in serial] == [analyze_midi_file(path).seq for path in paths]
+    pooled = list(analyze_files(paths, workers=2))
+    assert [(a.path, a.key, a.seq) for a in pooled] == [(a.path, a.key, a.seq) for a in serial]
+    with pytest.raises(InvalidArgumentError):
+        list(analyze_files(paths, key='H'))
+
+
+def test_pickle():
+    analysis = MidiAnalysis('a.mid', 'C', [string_to_keyed_chord('Fmaj/C', 'C', -1)], 2)
+    copy = pickle.loads(pickle.dumps(analysis))
+    assert (copy.path, copy.key, copy.seq, copy.num_unrecognized) == ('a.mid', 'C', analysis.seq, 1)
+    assert len(pickle.dumps(analysis)) < 300
+
+
+def test_cli(tmp_path, capsys):
+    seq = [string_to_keyed_chord(name, 'C', -1) for name in ('Cmaj', 'Amin', 'Fmaj', 'Gmaj')]
+    path = write_sequence(tmp_path / 'song.mid', seq)
+    (tmp_path / 'bad.mid').write_bytes(b'nonsense')
+    output_path = str(tmp_path / 'out.ndjson')
+    counts = analyze([str(tmp_path)], None, output_path, 1)
+    assert counts == {'sequences': 1, 'chords': 4, 'unrecognized': 0, 'errors': 1}
+    assert list(read_sequences([output_path])) == [('C', seq)]
+    assert 'Analyzed 2 files' in capsys.readouterr().out
+    analyze([path], 'C', None, 1)
+    captured = capsys.readouterr()
+    assert captured.out == analyze_midi_file(path).ndjson_line()
+    assert 'Analyzed 1 files' in captured.err
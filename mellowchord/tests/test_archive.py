@@ -0,0 +1,122 @@
+from mellowchord import ArchiveError
+from mellowchord import ChordMap
+from mellowchord import InvalidArgumentError
+from mellowchord import make_file_name_from_chord_sequence
+from mellowchord import MelodyGenerator
+from mellowchord import rebuild_index
+from mellowchord import SequenceArchive
+from mellowchord import SequenceArchiveWriter
+from mellowchord import write_chord_sequence_json
+from mellowchord import write_midi_file
+from mellowchord.archive import melody_member_name
+from mellowchord.cli import chordgen
+from mellowchord.cli import melodygen
+import itertools
+import os
+import pytest
+import tarfile
+import tracemalloc
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return list(ChordMap('C', octave_adjustment=-1).gen_sequence('Cmaj', 5))
+
+
+def test_chord_sequences(sequences, tmp_path):
+    path = str(tmp_path / 'out.tar')
+    with SequenceArchiveWriter(path) as writer:
+        for seq in sequences:
+            writer.add_chord_sequence('C', seq, program=3)
+    assert len(writer) == 2 * len(sequences)
+    with SequenceArchive(path) as archive:
+        assert len(archive) == len(writer)
+        names = list(archive.names())
+        assert names[:2] == [make_file_name_from_chord_sequence(sequences[0]) + ext for ext in ('.mid', '.json')]
+        for seq in sequences[::7]:
+            name = make_file_name_from_chord_sequence(seq)
+            assert name + '.mid' in archive
+            assert archive.read(name + '.mid') == write_midi_file(seq, None, None, 3).to_bytes()
+            key, archived_seq = archive.read_chord_sequence(name)
+            assert key == 'C' and archived_seq == seq
+            json_path = str(tmp_path / 'seq.json')
+            write_chord_sequence_json(json_path, 'C', seq)
+            with open(json_path, 'rb') as f:
+                assert archive.read(name + '.json') == f.read()
+        with pytest.raises(KeyError):
+            archive.read('nothing.mid')
+        with pytest.raises(KeyError):
+            archive.read_chord_sequence('nothing')
+    # Any tar reader sees the same members
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == names
+        assert tar.extractfile(names[5]).read() == SequenceArchive(path).read(names[5])
+    assert os.path.getsize(path) % (20 * 512) == 0
+
+
+def test_long_names_and_duplicates(tmp_path):
+    path = str(tmp_path / 'out.tar')
+    long_name = 'x' * 300 + '.mid'
+    with SequenceArchiveWriter(path) as writer:
+        writer.add(long_name, b'first')
+        writer.add('short.mid', b'')
+        writer.add(long_name, b'second')
+        writer.add('bad.json', b'{"not": "a sequence"}')
+    with SequenceArchive(path) as archive:
+        assert list(archive.names()) == ['short.mid', long_name, 'bad.json']
+        assert archive.read(long_name) == b'second'
+        assert archive.read('short.mid') == b''
+        with pytest.raises(ArchiveError):
+            archive.read_chord_sequence('bad')
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == [long_name, 'short.mid', long_name, 'bad.json']
+
+
+def test_rebuild_index(sequences, tmp_path):
+    path = str(tmp_path / 'out.tar')
+    with SequenceArchiveWriter(path) as writer:
+        for seq in sequences[:20]:
+            writer.add_chord_sequence('C', seq)
+    with SequenceArchive(path) as archive:
+        expected = {name: archive.read(name) for name in archive.names()}
+    os.unlink(path + '.idx')
+    with pytest.raises(ArchiveError):
+        SequenceArchive(path)
+    assert rebuild_index(path) == 40
+    with SequenceArchive(path) as archive:
+        assert {name: archive.read(name) for name in archive.names()} == expected
+    with open(str(tmp_path / 'bad.tar'), 'wb') as f:
+        f.write(b'not a tar file' * 100)
+    with pytest.raises(ArchiveError):
+        rebuild_index(str(tmp_path / 'bad.tar'))
+
+
+def test_memory_is_constant(sequences, tmp_path):
+    def peak(num_sequences):
+        tracemalloc.start()
+        with SequenceArchiveWriter(str(tmp_path / f'{num_sequences}.tar'), batch_size=50) as writer:
+            for seq in itertools.islice(itertools.cycle(sequences), num_sequences):
+                writer.add(make_file_name_from_chord_sequence(seq) + '.mid', bytes(1000))
+        retval = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return retval
+    assert peak(4000) < 1.5 * peak(500)
+
+
+def test_cli(sequences, tmp_path):
+    path = str(tmp_path / 'chords.tar')
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, archive=path)
+    with SequenceArchive(path) as archive:
+        assert len(archive) == 2 * len(sequences)
+        seq = archive.read_chord_sequence(make_file_name_from_chord_sequence(sequences[-1]))[1]
+    json_path = str(tmp_path / 'seq.json')
+    write_chord_sequence_json(json_path, 'C', seq)
+    melody_path = str(tmp_path / 'melodies.tar')
+    melodygen(json_path, 1, str(tmp_path), 0, False, archive=melody_path)
+    melodies = list(MelodyGenerator('C', seq, 1).gen_sequence())
+    with SequenceArchive(melody_path) as archive:
+        assert len(archive) == len(melodies)
+        notes = melodies[-1]
+        assert archive.read(melody_member_name(notes) + '.mid') == write_midi_file(seq, notes, None, 0).to_bytes()
+    with pytest.raises(InvalidArgumentError):
+        chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, ndjson=str(tmp_path / 'x.ndjson'), archive=path)
@@ -0,0 +1,112 @@
+from mellowchord import ChordMap
+from mellowchord import find_chord_sequence_files
+from mellowchord import gen_melodies_for_file
+from mellowchord import gen_melodies_for_files
+from mellowchord import InvalidArgumentError
+from mellowchord import map_in_processes
+from mellowchord import MelodyGenerator
+from mellowchord import melody_ndjson_line
+from mellowchord import write_chord_sequence_json
+from mellowchord.cli import melodygen
+import itertools
+import mellowchord.mellowchord
+import os
+import pytest
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return list(itertools.islice(ChordMap('C', -1).gen_sequence('Cmaj', 4), 12))
+
+
+@pytest.fixture
+def sequence_dir(sequences, tmp_path):
+    directory = tmp_path / 'seqs'
+    directory.mkdir()
+    for index, seq in enumerate(sequences):
+        write_chord_sequence_json(str(directory / f'{index:02}.json'), 'C', seq)
+    (directory / 'notes.txt').write_text('not a sequence')
+    return str(directory)
+
+
+def expected_lines(seq, notes_per_chord):
+    return [melody_ndjson_line(notes) for notes in
+            itertools.islice(MelodyGenerator('C', seq, notes_per_chord).gen_sequence(), 1000)]
+
+
+def test_find_files(sequence_dir, tmp_path):
+    paths = find_chord_sequence_files([sequence_dir])
+    assert [os.path.basename(path) for path in paths] == [f'{index:02}.json' for index in range(12)]
+    assert find_chord_sequence_files([os.path.join(sequence_dir, '0*.json')]) == paths[:10]
+    assert find_chord_sequence_files([paths[3]]) == [paths[3]]
+    with pytest.raises(InvalidArgumentError):
+        find_chord_sequence_files([os.path.join(sequence_dir, '*.mid')])
+    with pytest.raises(InvalidArgumentError):
+        find_chord_sequence_files([str(tmp_path / 'missing.json')])
+
+
+def test_shared_candidate_tables(sequences):
+    mellowchord.mellowchord._melody_candidates.clear()
+    first = MelodyGenerator('C', sequences[0], 2)._possible_notes()
+    num_tables = len(mellowchord.mellowchord._melody_candidates)
+    # Cmaj Fmaj/C Cmaj Fmaj/C repeats the pair I IV
+    assert num_tables == 3
+    # The same chord pairs in another sequence reuse the tables, whatever
+    # their inversions and octaves
+    assert MelodyGenerator('C', list(sequences[0]), 2)._possible_notes() == first
+    assert len(mellowchord.mellowchord._melody_candidates) == num_tables
+    for seq in sequences:
+        MelodyGenerator('C', seq, 2)._possible_notes()
+    pairs = {tuple((c.degree, c.chord_type) for c in seq[index:index + 2]) for seq in sequences for index in range(4)}
+    assert len(mellowchord.mellowchord._melody_candidates) == len(pairs)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_gen_melodies_for_files(sequences, sequence_dir, tmp_path, workers):
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    paths = find_chord_sequence_files([sequence_dir])
+    results = list(gen_melodies_for_files(paths, 2, output_dir, workers, max_melodies=300))
+    assert [result.path for result in results] == paths
+    for seq, result in zip(sequences, results):
+        assert result.error is None and result.seconds > 0
+        with open(result.output_path) as f:
+            lines = f.readlines()
+        assert lines == expected_lines(seq, 2)[:300]
+        assert result.num_melodies == len(lines)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_map_in_processes(workers):
+    jobs = list(range(-300, 0))
+    assert list(map_in_processes(abs, jobs, workers)) == [-job for job in jobs]
+    assert list(map_in_processes(abs, [], workers)) == []
+
+
+def test_errors(sequence_dir, tmp_path):
+    bad_path = os.path.join(sequence_dir, 'notes.txt')
+    result = gen_melodies_for_file(bad_path, 1, str(tmp_path))
+    assert result.error and result.output_path is None
+    limited = gen_melodies_for_file(os.path.join(sequence_dir, '00.json'), 3, str(tmp_path), max_melodies=5)
+    assert limited.num_melodies == 5
+    with pytest.raises(InvalidArgumentError):
+        list(gen_melodies_for_files([bad_path], 5, str(tmp_path)))
+    other_dir = tmp_path / 'other'
+    other_dir.mkdir()
+    (other_dir / '00.json').write_text('{}')
+    with pytest.raises(InvalidArgumentError):
+        list(gen_melodies_for_files([os.path.join(sequence_dir, '00.json'), str(other_dir / '00.json')], 1,
+                                    str(tmp_path)))
+
+
+def test_cli(sequences, sequence_dir, tmp_path, capsys):
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    count = melodygen(os.path.join(sequence_dir, '*.json'), 1, output_dir, 0, False, workers=1, max_melodies=10)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 13
+    assert lines[0].startswith(os.path.join(sequence_dir, '00.json') + ': 10 melodies in ')
+    assert lines[-1].startswith(f'Wrote {count} melodies for 12 files to {output_dir} in ')
+    assert count == sum(min(10, len(expected_lines(seq, 1))) for seq in sequences)
+    with pytest.raises(InvalidArgumentError):
+        melodygen(sequence_dir, 1, output_dir, 0, False, ndjson=str(tmp_path / 'out.ndjson'))
@@ -0,0 +1,69 @@
+import json
+from mellowchord.tests.benchmark import benchmark
+from mellowchord.tests.benchmark import BENCHMARKS
+from mellowchord.tests.benchmark import compare_results
+from mellowchord.tests.benchmark import LIMITS
+from mellowchord.tests.benchmark import main
+from mellowchord.tests.benchmark import run_benchmarks
+
+
+def _results(**times):
+    return {'benchmarks': {name: {'min': t, 'median': t, 'mean': t} for name, t in times.items()}}
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(repeat=1, min_time=0)
+    assert set(results['benchmarks']) == set(BENCHMARKS)
+    for stats in results['benchmarks'].values():
+        assert stats['min'] > 0
+        assert stats['min'] <= stats['median']
+    assert results['benchmarks']['chord_sequence_decode[2000]']['mb_per_second'] > 0
+    for name in LIMITS:
+        assert set(LIMITS[name]) <= set(results['benchmarks'][name])
+    json.dumps(results)
+
+
+def test_compare_results():
+    baseline = _results(a=1.0, b=1.0, c=1.0)
+    current = _results(a=1.05, b=1.2, c=0.5, d=9.0)
+    comparison = {name: (change, regressed) for name, _, _, change, regressed in compare_results(baseline, current, 10)}
+    assert set(comparison) == {'a', 'b', 'c'}
+    assert not comparison['a'][1]
+    assert comparison['b'][1]
+    assert round(comparison['b'][0]) == 20
+    assert not comparison['c'][1]
+    assert not any(regressed for _, _, _, _, regressed in compare_results(baseline, current, 25))
+
+
+def test_main(tmp_path):
+    results_path = str(tmp_path / 'results.json')
+    assert main(['run', '-k', 'string_to_chord', '-r', '1', '-t', '0', '-o', results_path]) == 0
+    with open(results_path) as f:
+        results = json.load(f)
+    assert list(results['benchmarks']) == ['string_to_chord']
+    slower = json.loads(json.dumps(results))
+    slower['benchmarks']['string_to_chord']['min'] *= 2
+    slower_path = str(tmp_path / 'slower.json')
+    with open(slower_path, 'w') as f:
+        json.dump(slower, f)
+    assert main(['compare', results_path, results_path]) == 0
+    assert main(['compare', results_path, slower_path, '--threshold', '50']) == 1
+
+
+def test_limits(monkeypatch, capsys):
+    monkeypatch.setattr('mellowchord.tests.benchmark.BENCHMARKS', {})
+    monkeypatch.setattr('mellowchord.tests.benchmark.LIMITS', {})
+    latency = [0.001]
+
+    @benchmark('measured', limits={'latency': 0.002})
+    def _measured():
+        def run():
+            pass
+        run.stats = lambda: {'latency': latency[0]}
+        return run
+    assert main(['run', '-r', '1', '-t', '0']) == 0
+    assert run_benchmarks(repeat=1, min_time=0)['benchmarks']['measured']['over_limits'] == []
+    latency[0] = 0.003
+    assert main(['run', '-r', '1', '-t', '0']) == 1
+    assert 'OVER LIMIT' in capsys.readouterr().out
+    assert run_benchmarks(repeat=1, min_time=0)['benchmarks']['measured']['over_limits'] == ['latency']
@@ -0,0 +1,72 @@
+from mellowchord import ChordMap
+from mellowchord import InvalidArgumentError
+from mellowchord import parse_progression
+from mellowchord import SequenceCatalog
+import pytest
+
+
+def _degrees(seq):
+    return [keyed_chord.degree for keyed_chord in seq]
+
+
+def _contains(seq, degrees):
+    seq_degrees = _degrees(seq)
+    return any(seq_degrees[i:i + len(degrees)] == degrees for i in range(len(seq_degrees)))
+
+
+@pytest.fixture
+def sequences():
+    c_sequences = [('C', seq) for seq in ChordMap('C').gen_sequence('Cmaj', 5)]
+    a_sequences = [('Amin', seq) for seq in ChordMap('Amin').gen_sequence('Fmaj', 5)]
+    yield c_sequences + a_sequences
+
+
+def test_parse_progression():
+    assert parse_progression('IV V I') == [4, 5, 1]
+    assert parse_progression('IV->V->I') == [4, 5, 1]
+    assert parse_progression('ii-V-I') == [2, 5, 1]
+    assert parse_progression('vi') == [6]
+    with pytest.raises(InvalidArgumentError):
+        parse_progression('IV X I')
+    with pytest.raises(InvalidArgumentError):
+        parse_progression('')
+
+
+def test_query(tmp_path, sequences):
+    with SequenceCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        assert catalog.ingest(iter(sequences), batch_size=7) == len(sequences)
+        assert len(catalog) == len(sequences)
+        assert list(catalog.query()) == sequences
+        assert list(catalog.query(key='Amin')) == [s for s in sequences if s[0] == 'Amin']
+        assert list(catalog.query(start='VI', key='Amin')) == [s for s in sequences if s[0] == 'Amin']
+        assert list(catalog.query(start='vi', key='C')) == []
+        for progression in ('IV V I', 'ii V', 'IV', 'I IV V iii', [6, 2, 5, 3, 1]):
+            degrees = parse_progression(progression) if isinstance(progression, str) else progression
+            expected = [s for s in sequences if _contains(s[1], degrees)]
+            assert expected
+            assert list(catalog.query(contains=progression)) == expected
+        assert len(list(catalog.query(contains='IV V I', limit=2))) == 2
+
+
+def test_chord_counts(tmp_path, sequences):
+    with SequenceCatalog(str(tmp_path / 'catalog.db')) as catalog:
+        catalog.ingest(sequences)
+        counts = dict(catalog.chord_counts(key='C'))
+        expected = {}
+        for key, seq in sequences:
+            if key == 'C':
+                for keyed_chord in seq:
+                    expected[keyed_chord.name] = expected.get(keyed_chord.name, 0) + 1
+        assert counts == expected
+
+
+def test_reopen_appends(tmp_path, sequences):
+    path = str(tmp_path / 'catalog.db')
+    with SequenceCatalog(path, max_gram=2) as catalog:
+        catalog.ingest(sequences[:10])
+    with SequenceCatalog(path) as catalog:
+        assert catalog.max_gram == 2
+        catalog.ingest(sequences[10:])
+        assert list(catalog.query()) == sequences
+        degrees = [4, 5, 1]
+        assert list(catalog.query(contains=degrees)) == [s for s in sequences if _contains(s[1], degrees)]
@@ -0,0 +1,134 @@
+from mellowchord import Checkpoint
+from mellowchord import CheckpointError
+from mellowchord import CheckpointWriter
+from mellowchord import Chord
+from mellowchord import chord_sequence_ndjson_line
+from mellowchord import ChordMap
+from mellowchord import EnumerationCursor
+from mellowchord import InvalidArgumentError
+from mellowchord import KeyedChord
+from mellowchord import melody_ndjson_line
+from mellowchord import MelodyGenerator
+from mellowchord import Shard
+from mellowchord.cli import chordgen
+import itertools
+import json
+import pytest
+import random
+
+
+def chord_items(cursor, shard=None):
+    return ChordMap.for_key('C').gen_sequence('Cmaj', 6, shard=shard, cursor=cursor)
+
+
+def melody_items(cursor, shard=None):
+    chord_sequence = [KeyedChord('C', Chord(degree, 'maj')) for degree in (1, 4, 5, 1, 5)]
+    return MelodyGenerator('C', chord_sequence, 1).gen_sequence(shard, cursor)
+
+
+@pytest.mark.parametrize('make_items', [chord_items, melody_items])
+@pytest.mark.parametrize('shard', [None, Shard(1, 3)])
+def test_cursor_resume(make_items, shard):
+    expected = list(make_items(None, shard))
+    rng = random.Random(0)
+    for _ in range(10):
+        cursor = EnumerationCursor()
+        stop = rng.randrange(len(expected) + 1)
+        items = list(itertools.islice(make_items(cursor, shard), stop))
+        saved = EnumerationCursor.from_dict(json.loads(json.dumps(cursor.to_dict())))
+        items.extend(make_items(saved, shard))
+        assert items == expected
+
+
+def run_with_kills(make_items, format_item, tmp_path, every, kills):
+    """Write every item with CheckpointWriter, killing the run after each
+    number of items in kills and resuming, and return the output."""
+    output_path = str(tmp_path / 'out.ndjson')
+    checkpoint_path = str(tmp_path / 'state.json')
+    resume = False
+    for kill in kills + [None]:
+        cursor = EnumerationCursor()
+        writer = CheckpointWriter(output_path, checkpoint_path, {'n': 1}, cursor, resume, every=every)
+        for item in itertools.islice(make_items(cursor), kill):
+            writer.write(format_item(item))
+        if kill is None:
+            writer.close()
+        else:
+            # A hard kill: output since the last checkpoint may or may not
+            # have reached the file, and no final checkpoint is saved
+            writer._file.write('{"partial')
+            writer._file.flush()
+            writer._file.close()
+        resume = True
+    with open(output_path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('make_items,format_item', [
+    (chord_items, lambda seq: chord_sequence_ndjson_line('C', seq)),
+    (melody_items, melody_ndjson_line),
+])
+def test_writer_resume(make_items, format_item, tmp_path):
+    expected = ''.join(format_item(item) for item in make_items(None))
+    assert run_with_kills(make_items, format_item, tmp_path, 7, [20, 3, 50]) == expected
+    rng = random.Random(1)
+    for _ in range(5):
+        kills = [rng.randrange(1, 60) for _ in range(3)]
+        assert run_with_kills(make_items, format_item, tmp_path, rng.randrange(1, 20), kills) == expected
+
+
+def test_writer_saves_on_close(tmp_path):
+    output_path = str(tmp_path / 'out.ndjson')
+    checkpoint_path = str(tmp_path / 'state.json')
+    cursor = EnumerationCursor()
+    with CheckpointWriter(output_path, checkpoint_path, {}, cursor, every=1000) as writer:
+        for item in itertools.islice(chord_items(cursor), 10):
+            writer.write(chord_sequence_ndjson_line('C', item))
+    assert writer.checkpoints_saved == 2
+    checkpoint = Checkpoint.load(checkpoint_path)
+    assert checkpoint.cursor == EnumerationCursor(10)
+    assert checkpoint.output_offset == len(open(output_path, 'rb').read())
+
+
+def test_writer_bad_resume(tmp_path):
+    output_path = str(tmp_path / 'out.ndjson')
+    checkpoint_path = str(tmp_path / 'state.json')
+    with pytest.raises(CheckpointError):
+        CheckpointWriter(output_path, checkpoint_path, {}, EnumerationCursor(), resume=True)
+    with CheckpointWriter(output_path, checkpoint_path, {'num': 6, 'key': 'C'}, EnumerationCursor()) as writer:
+        writer.write('{}\n')
+    with pytest.raises(CheckpointError, match='num'):
+        CheckpointWriter(output_path, checkpoint_path, {'num': 7, 'key': 'C'}, EnumerationCursor(), resume=True)
+    with open(output_path, 'w'):
+        pass
+    with pytest.raises(CheckpointError, match='shorter'):
+        CheckpointWriter(output_path, checkpoint_path, {'num': 6, 'key': 'C'}, EnumerationCursor(), resume=True)
+    with open(checkpoint_path, 'w') as f:
+        f.write('{"version": 1, "params": {}, "cursor": {"position": -1}, "output_offset": 0}')
+    with pytest.raises(CheckpointError):
+        Checkpoint.load(checkpoint_path)
+
+
+@pytest.mark.parametrize('cursor_dict', [None, {}, {'position': -1}, {'position': '3'}, {'position': True}])
+def test_invalid_cursor(cursor_dict):
+    with pytest.raises(InvalidArgumentError):
+        EnumerationCursor.from_dict(cursor_dict)
+
+
+def test_chordgen_resume(tmp_path):
+    output_path = str(tmp_path / 'out.ndjson')
+    checkpoint_path = str(tmp_path / 'state.json')
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 1, False, ndjson=output_path)
+    with open(output_path) as f:
+        expected = f.read()
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 1, False, ndjson=output_path, checkpoint=checkpoint_path)
+    with open(output_path) as f:
+        assert f.read() == expected
+    # Resuming a finished run leaves its output as it is
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 1, False, ndjson=output_path, resume=checkpoint_path)
+    with open(output_path) as f:
+        assert f.read() == expected
+    with pytest.raises(CheckpointError):
+        chordgen('C', 'Cmaj', 6, str(tmp_path), 1, False, ndjson=output_path, resume=checkpoint_path)
+    with pytest.raises(InvalidArgumentError):
+        chordgen('C', 'Cmaj', 5, str(tmp_path), 1, False, checkpoint=checkpoint_path)
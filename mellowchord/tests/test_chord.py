@@ -87,8 +87,9 @@ def test_keyed_chord_with_inversion():
     assert kc.name == 'Cmaj/E'
 
 
-def test_keyed_chord_midi():
-    midi_file = MidiFile('test.mid')
+def test_keyed_chord_midi(tmp_path):
+    path = str(tmp_path / 'test.mid')
+    midi_file = MidiFile(path)
     kc1 = KeyedChord('C', Chord(1, 'maj7'))
     midi_file.add_chord(kc1)
     kc4 = KeyedChord('C', Chord(4, 'maj'))
@@ -101,6 +102,6 @@ def test_keyed_chord_midi():
     midi_file.write()
 
     # Assert that there's only one ALL_SOUNDS_OFF at the end
-    mido_file = mido.MidiFile('test.mid')
+    mido_file = mido.MidiFile(path)
     assert mido_file.tracks[0][-1] == mido.MetaMessage('end_of_track')
     assert mido_file.tracks[0][-2] != MidiFile.ALL_SOUNDS_OFF
@@ -0,0 +1,104 @@
+from mellowchord import Chord
+from mellowchord import ChordMap
+from mellowchord import ChordSequenceCodec
+from mellowchord import KeyedChord
+from mellowchord import keyed_chord_decoder
+from mellowchord import KeyedChordEncoder
+from mellowchord import read_chord_sequence_json
+from mellowchord import read_chord_sequence_ndjson_batches
+from mellowchord import write_chord_sequence_json
+import io
+import itertools
+import json
+import pytest
+
+
+def attributes(seq):
+    return [(chord.key, chord.degree, chord.chord_type, chord.inversion, chord.octave_adjustment, chord.name)
+            for chord in seq]
+
+
+def old_decode(text):
+    sequence_dict = json.loads(text, object_hook=keyed_chord_decoder)
+    return sequence_dict['key'], sequence_dict['seq']
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    sequences = []
+    for key, start in (('C', 'Cmaj'), ('F#min', 'F#min'), ('Bb', 'Bbmaj')):
+        sequences.extend((key, seq) for seq in itertools.islice(ChordMap(key, -1).gen_sequence(start, 6), 50))
+    sequences.append(('Eb', [KeyedChord('Eb', Chord(2, 'min7', 1, 2))]))
+    sequences.append(('C', []))
+    return sequences
+
+
+def test_encode_matches_json(sequences):
+    codec = ChordSequenceCodec()
+    for _ in range(2):
+        for key, seq in sequences:
+            assert codec.encode(key, seq) == json.dumps({'key': key, 'seq': seq}, cls=KeyedChordEncoder)
+            assert codec.encode_line(key, seq) == codec.encode(key, seq) + '\n'
+    with pytest.raises(TypeError):
+        codec.encode('C', [Chord(1, 'maj')])
+
+
+def test_decode_matches_json(sequences):
+    codec = ChordSequenceCodec()
+    for _ in range(2):
+        for key, seq in sequences:
+            text = json.dumps({'key': key, 'seq': seq}, cls=KeyedChordEncoder)
+            decoded_key, decoded_seq = codec.decode(text)
+            assert decoded_key == key
+            assert attributes(decoded_seq) == attributes(seq) == attributes(old_decode(text)[1])
+            assert attributes(codec.decode(text.encode() + b'\n')[1]) == attributes(seq)
+    # Chords are shared between the sequences decoded
+    first = codec.decode(json.dumps({'key': 'C', 'seq': sequences[0][1]}, cls=KeyedChordEncoder))[1]
+    second = codec.decode(json.dumps({'key': 'C', 'seq': sequences[0][1]}, cls=KeyedChordEncoder))[1]
+    assert all(a is b for a, b in zip(first, second))
+
+
+def test_decode_other_layouts(sequences):
+    codec = ChordSequenceCodec()
+    key, seq = sequences[3]
+    chord_dicts = json.loads(json.dumps(seq, cls=KeyedChordEncoder))
+    texts = [json.dumps({'key': key, 'seq': seq}, cls=KeyedChordEncoder, indent=2),
+             json.dumps({'seq': chord_dicts, 'key': key}),
+             json.dumps({'key': key, 'seq': [dict(reversed(list(chord.items()))) for chord in chord_dicts]}),
+             json.dumps({'key': key, 'seq': chord_dicts, 'source': 'x.mid'})]
+    for text in texts:
+        assert attributes(codec.decode(text)[1]) == attributes(seq)
+    # Objects that aren't keyed chords stay dicts, as they always have
+    text = json.dumps({'key': 'C', 'seq': [{'type': 'other', 'degree': 1}]})
+    assert codec.decode(text) == old_decode(text) == ('C', [{'type': 'other', 'degree': 1}])
+    assert codec.decode('{"key": "C\\u266f", "seq": []}') == ('C♯', [])
+    with pytest.raises(ValueError):
+        codec.decode('{"key": "C", "seq": [')
+    with pytest.raises(KeyError):
+        codec.decode('{"seq": []}')
+
+
+def test_max_chords(sequences):
+    codec = ChordSequenceCodec(max_chords=3)
+    for key, seq in sequences:
+        text = codec.encode(key, seq)
+        assert attributes(codec.decode(text)[1]) == attributes(seq)
+    assert len(codec._fragments) == len(codec._chords) == 3
+
+
+def test_ndjson_and_files(sequences, tmp_path):
+    codec = ChordSequenceCodec()
+    text = '\n'.join(codec.encode(key, seq) for key, seq in sequences) + '\n\n'
+    decoded = list(codec.read_lines(io.StringIO(text)))
+    assert [(key, attributes(seq)) for key, seq in decoded] == [(key, attributes(seq)) for key, seq in sequences]
+    batches = list(codec.read_batches(io.StringIO(text), 40))
+    assert [len(batch) for batch in batches] == [40, 40, 40, len(sequences) - 120]
+    assert [(key, attributes(seq)) for batch in batches for key, seq in batch] == \
+        [(key, attributes(seq)) for key, seq in decoded]
+    assert sum(len(batch) for batch in read_chord_sequence_ndjson_batches(io.StringIO(text))) == len(sequences)
+    path = str(tmp_path / 'seq.json')
+    key, seq = sequences[60]
+    write_chord_sequence_json(path, key, seq)
+    with open(path) as f:
+        assert f.read() == json.dumps({'key': key, 'seq': seq}, cls=KeyedChordEncoder)
+    assert attributes(read_chord_sequence_json(path)[1]) == attributes(seq)
@@ -0,0 +1,116 @@
+from mellowchord import ChordMap
+from mellowchord import ComposeBudget
+from mellowchord import Composer
+from mellowchord import InvalidArgumentError
+from mellowchord import MelodyGenerator
+from mellowchord import SequenceArchive
+from mellowchord import string_to_chord
+from mellowchord import TransitionCounts
+from mellowchord.cli import compose
+from mellowchord.compose import EXHAUSTED
+from mellowchord.compose import MAX_RESULTS
+from mellowchord.compose import MAX_SECONDS
+import itertools
+import json
+import pytest
+import random
+import threading
+import time
+
+
+def names(seq):
+    return tuple(chord.name for chord in seq)
+
+
+def test_enumerates_everything():
+    cm = ChordMap('C')
+    composer = Composer(cm, 'Cmaj', 3, 1)
+    expected = [(names(seq), notes) for seq in cm.gen_sequence('Cmaj', 3)
+                for notes in MelodyGenerator('C', seq, 1).gen_sequence()]
+    assert [(names(seq), notes) for seq, notes in composer] == expected
+    assert composer.stop_reason == EXHAUSTED
+    assert composer.num_results == len(expected)
+    assert composer.num_sequences == cm.count_sequences('Cmaj', 3)
+
+
+def test_budget():
+    cm = ChordMap('C')
+    composer = Composer(cm, 'Cmaj', 4, 2, ComposeBudget(max_results=25, max_melodies=3))
+    results = list(composer)
+    assert len(results) == 25 and composer.stop_reason == MAX_RESULTS
+    # Three melodies over each sequence, in order
+    sequences = list(itertools.islice(cm.gen_sequence('Cmaj', 4), 9))
+    assert [names(seq) for seq, _ in results] == [names(seq) for seq in sequences for _ in range(3)][:25]
+    assert results[1][1] == list(itertools.islice(MelodyGenerator('C', sequences[0], 2).gen_sequence(), 2))[1]
+    # Iterating again starts over
+    assert [(names(seq), notes) for seq, notes in composer] == [(names(seq), notes) for seq, notes in results]
+    for bad in ({'max_results': 0}, {'max_seconds': -1}, {'max_melodies': 0}):
+        with pytest.raises(InvalidArgumentError):
+            ComposeBudget(**bad)
+
+
+def test_time_budget_and_bounded_queues():
+    cm = ChordMap('C', -1)
+    # Far too many results to produce in the time
+    composer = Composer(cm, 'Cmaj', 12, 4, ComposeBudget(max_seconds=0.3), queue_size=4)
+    start = time.monotonic()
+    count = 0
+    for _ in composer:
+        count += 1
+        time.sleep(0.001)
+    assert 0.3 <= time.monotonic() - start < 2
+    assert composer.stop_reason == MAX_SECONDS and composer.num_results == count
+    # The chord stage can only get as far ahead as the queues allow
+    assert composer.num_sequences <= 2 + 4
+
+
+def test_stages_stop_when_abandoned():
+    before = threading.active_count()
+    composer = Composer(ChordMap('C', -1), 'Cmaj', 12, 4, queue_size=2)
+    results = iter(composer)
+    next(results)
+    results.close()
+    assert threading.active_count() == before
+
+
+def test_sample():
+    counts = TransitionCounts()
+    counts.add('C', [string_to_chord('Cmaj', 'C'), string_to_chord('Fmaj/C', 'C')])
+    cm = ChordMap('C', -1).weighted(counts)
+    with pytest.raises(InvalidArgumentError):
+        Composer(cm, 'Cmaj', 6, 2, sample=True)
+    budget = ComposeBudget(max_results=200, max_melodies=2)
+    first = [(names(seq), notes) for seq, notes in Composer(cm, 'Cmaj', 6, 2, budget, True, random.Random(5))]
+    assert first == [(names(seq), notes) for seq, notes in Composer(cm, 'Cmaj', 6, 2, budget, True, random.Random(5))]
+    assert len(first) == 200
+    generated = {names(seq) for seq in cm.gen_sequence('Cmaj', 6)}
+    assert all(seq in generated for seq, _ in first)
+    assert len({seq for seq, _ in first}) > 10
+    for seq, notes in itertools.islice(Composer(cm, 'Cmaj', 6, 2, budget, True), 10):
+        assert len(notes) == 12 and notes[0] in seq[0].notes and notes[-1] in seq[-1].notes
+
+
+def test_stage_errors_are_raised():
+    cm = ChordMap('C')
+    with pytest.raises(InvalidArgumentError):
+        Composer(cm, 'Gmin', 3, 1)
+    with pytest.raises(InvalidArgumentError):
+        Composer(cm, 'Cmaj', 3, 5)
+    composer = Composer(cm, 'Cmaj', 0, 1)
+    with pytest.raises(AssertionError):
+        list(composer)
+
+
+def test_cli(tmp_path, capsys):
+    output = str(tmp_path / 'out.ndjson')
+    archive = str(tmp_path / 'out.tar')
+    composer = compose('C', 'Cmaj', 3, 2, output, archive, max_results=10, max_melodies=5)
+    assert 'Wrote 10 melodies over 2 sequences' in capsys.readouterr().out
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 10 == composer.num_results
+    assert lines[0]['key'] == 'C' and len(lines[0]['seq']) == 3 and len(lines[0]['melody']) == 6
+    with SequenceArchive(archive) as reader:
+        assert len(list(reader.names())) == 10
+    with pytest.raises(InvalidArgumentError):
+        compose('C', 'Cmaj', 3, 1)
@@ -0,0 +1,124 @@
+from mellowchord import Chord
+from mellowchord import ChordLibraryWriter
+from mellowchord import ChordMap
+from mellowchord import find_near_duplicates
+from mellowchord import InvalidArgumentError
+from mellowchord import KeyedChord
+from mellowchord import lsh_parameters
+from mellowchord import MinHasher
+from mellowchord import NearDuplicateIndex
+from mellowchord import read_chord_sequence_ndjson
+from mellowchord import write_chord_sequence_ndjson
+from mellowchord.cli import dedupe
+from mellowchord.dedupe import degrees
+from mellowchord.dedupe import signature_similarity
+import itertools
+import pytest
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return [('C', seq) for seq in itertools.islice(ChordMap('C', -1).gen_sequence('Cmaj', 8), 3000)]
+
+
+def test_shingles():
+    hasher = MinHasher(ngram=2)
+    assert hasher.shingles((1, 4, 5)) == frozenset({0o100 | 0o1, 0o100 | 0o14, 0o100 | 0o45, 0o100 | 0o50})
+    assert MinHasher(ngram=9).shingles((1, 4)) == frozenset({0o10140})
+    with pytest.raises(InvalidArgumentError):
+        MinHasher(ngram=10)
+    # Inversions and chord variants have the same degrees
+    assert degrees([KeyedChord('C', Chord(1, 'maj')), KeyedChord('C', Chord(1, 'maj7', 1))]) == (1, 1)
+
+
+def test_lsh_parameters():
+    assert lsh_parameters(128, 0.8) == (16, 8)
+    assert lsh_parameters(128, 1) == (1, 128)
+    for threshold in (0.3, 0.5, 0.7, 0.9):
+        bands, rows = lsh_parameters(128, threshold)
+        assert bands * rows <= 128
+        assert 1 - (1 - threshold ** rows) ** bands >= 0.9
+    with pytest.raises(InvalidArgumentError):
+        lsh_parameters(128, 0)
+
+
+def test_signatures_estimate_similarity():
+    hasher = MinHasher(num_perm=256, seed=3)
+    a = hasher.shingles((1, 4, 5, 1, 6, 2, 5, 1))
+    b = hasher.shingles((1, 4, 5, 1, 6, 4, 5, 1))
+    c = hasher.shingles((2, 3, 7, 3))
+    for x, y in ((a, b), (a, c), (b, c), (a, a)):
+        estimate = signature_similarity(hasher.signature_of_shingles(x), hasher.signature_of_shingles(y))
+        assert abs(estimate - jaccard(x, y)) < 0.1
+    # Another hasher with the same seed gives the same signatures
+    assert MinHasher(num_perm=256, seed=3).signatures([(1, 4, 5)]) == hasher.signatures([(1, 4, 5)])
+    assert MinHasher(num_perm=256, seed=4).signatures([(1, 4, 5)]) != hasher.signatures([(1, 4, 5)])
+
+
+def test_index():
+    hasher = MinHasher()
+    index = NearDuplicateIndex(threshold=0.4)
+    first, same, close, far = hasher.signatures([(1, 4, 5, 1, 6, 2, 5, 1), (1, 4, 5, 1, 6, 2, 5, 1),
+                                                 (1, 4, 5, 1, 6, 4, 5, 1), (2, 3, 7, 3)])
+    assert index.check(first, 'first') is None
+    assert index.check(same, 'same') == ('first', 1.0)
+    assert index.check(close, 'close')[0] == 'first'
+    assert index.check(far, 'far') is None
+    assert len(index) == 2
+    with pytest.raises(InvalidArgumentError):
+        index.add(first[:10], 'short')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_find_near_duplicates(sequences, workers):
+    hasher = MinHasher()
+    results = list(find_near_duplicates(sequences, 0.7, workers=workers, batch_size=500))
+    assert [result[0] for result in results] == list(range(len(sequences)))
+    assert [(key, seq) for _, key, seq, _, _ in results] == sequences
+    shingles = [hasher.shingles(degrees(seq)) for _, seq in sequences]
+    kept = [index for index, _, _, duplicate_of, _ in results if duplicate_of is None]
+    assert 0 < len(kept) < len(sequences)
+    for index, _, _, duplicate_of, similarity in results:
+        if duplicate_of is not None:
+            assert duplicate_of in kept and duplicate_of < index and similarity >= 0.7
+            assert jaccard(shingles[index], shingles[duplicate_of]) > 0.5
+    # Kept sequences are rarely anywhere near as similar as the threshold
+    close = sum(jaccard(shingles[a], shingles[b]) >= 0.9 for a, b in itertools.combinations(kept, 2))
+    assert close <= len(kept) // 20
+    assert results == list(find_near_duplicates(sequences, 0.7, workers=1))
+
+
+def test_variants_are_duplicates():
+    seq = [KeyedChord('C', Chord(degree, 'maj')) for degree in (1, 4, 5, 1, 6, 2, 5, 1)]
+    variant = list(seq)
+    variant[0] = KeyedChord('C', Chord(1, 'maj7'))
+    variant[3] = KeyedChord('C', Chord(1, 'maj', 1))
+    results = list(find_near_duplicates([('C', seq), ('C', variant)], 0.95))
+    assert results[1][3:] == (0, 1.0)
+
+
+def test_cli(sequences, tmp_path, capsys):
+    ndjson_path = str(tmp_path / 'in.ndjson')
+    with open(ndjson_path, 'w') as f:
+        for key, seq in sequences[:1000]:
+            write_chord_sequence_ndjson(f, key, seq)
+    library_path = str(tmp_path / 'in.mcl')
+    with ChordLibraryWriter(library_path) as writer:
+        for key, seq in sequences[1000:2000]:
+            writer.append(seq)
+    output_path = str(tmp_path / 'out.ndjson')
+    counts = dedupe([ndjson_path, library_path], 0.8, output_path=output_path, show=3, workers=1)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 4
+    assert lines[0].startswith('Sequence ') and ' is like sequence ' in lines[0]
+    assert lines[-1].startswith('Checked 2000 sequences in ')
+    expected = [(key, seq) for _, key, seq, duplicate_of, _ in find_near_duplicates(sequences[:2000], 0.8)
+                if duplicate_of is None]
+    with open(output_path) as f:
+        written = list(read_chord_sequence_ndjson(f))
+    assert [(key, list(map(str, seq))) for key, seq in written] == [(key, list(map(str, seq))) for key, seq in expected]
+    assert counts == {'sequences': 2000, 'duplicates': 2000 - len(expected)}
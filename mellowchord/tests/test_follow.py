@@ -0,0 +1,138 @@
+from mellowchord import ChordFollower
+from mellowchord import ChordMap
+from mellowchord import KeyedChord
+from mellowchord import MellowchordError
+from mellowchord import ScriptedInputPort
+from mellowchord import string_to_chord
+from mellowchord import TransitionCounts
+from mellowchord.cli import follow
+import io
+import itertools
+import mido
+import pytest
+
+
+def press(notes, channel=0):
+    return [mido.Message('note_on', note=note, velocity=70, channel=channel) for note in notes]
+
+
+def release(notes):
+    return [mido.Message('note_off', note=note) for note in notes]
+
+
+def play(*chords):
+    messages = []
+    for notes in chords:
+        messages += press(notes) + release(notes)
+    return messages
+
+
+class RecordingPort(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+def test_changes():
+    changes = []
+    output = io.StringIO()
+    follower = ChordFollower('C', output=output, on_change=lambda name, suggestions: changes.append((name, suggestions)))
+    messages = play([60, 64, 67], [60, 64, 67], [53, 57, 60], [55, 59, 62, 65])
+    messages.insert(2, mido.Message('control_change', control=64, value=127))
+    assert follower.run(ScriptedInputPort(messages)) == 4
+    cm = ChordMap('C')
+    assert changes[0] == ('Cmaj', tuple(chord.name for chord in cm.next_chords('Cmaj')))
+    assert changes[1] == ('Fmaj', tuple(chord.name for chord in cm.next_chords('Fmaj')))
+    # The notes of G7 go down one at a time, so G is recognized first
+    assert [name for name, _ in changes[2:]] == ['Gmaj', 'Gdom7']
+    assert changes[3][1] == ()
+    assert output.getvalue().splitlines() == ['Cmaj -> Fmaj/C Gmaj/D Fmaj', 'Fmaj -> Cmaj Cmaj/E Cmaj/G Dmin Gmaj',
+                                              'Gmaj -> Cmaj Emin Amin', 'Gdom7 (not in map)']
+    assert follower.current_chord == 'Gdom7'
+    assert follower.num_messages == len(messages)
+
+
+def test_held_notes():
+    follower = ChordFollower('Amin')
+    handled = [follower.handle(message) for message in press([57, 60])]
+    assert handled == [False, False] and follower.current_chord is None
+    assert follower.handle(press([64])[0]) and follower.current_chord == 'Amin'
+    # Letting go leaves C E, then nothing, without a change
+    assert not any(follower.handle(message) for message in release([57, 60, 64, 64]))
+    # Percussion and repeated notes are ignored, velocity 0 is a release
+    assert not any(follower.handle(message) for message in press([62, 65, 69], channel=9))
+    assert not any(follower.handle(message) for message in press([62, 65]) + press([65]))
+    assert follower.handle(press([69])[0]) and follower.current_chord == 'Dmin'
+    assert not follower.handle(mido.Message('note_on', note=62, velocity=0))
+    # F A are still held, so C makes F major over C
+    assert follower.handle(press([60])[0]) and follower.current_chord == 'Fmaj/C'
+
+
+def test_weighted_suggestions():
+    counts = TransitionCounts()
+    counts.add('C', [string_to_chord('Cmaj', 'C'), string_to_chord('Fmaj', 'C')])
+    changes = []
+    follower = ChordFollower('C', ChordMap('C').weighted(counts), on_change=lambda *change: changes.append(change))
+    follower.run(ScriptedInputPort(play([60, 64, 67])))
+    assert changes == [('Cmaj', ('Fmaj', 'Fmaj/C', 'Gmaj/D'))]
+
+
+def test_play_suggestion():
+    output_port = RecordingPort()
+    follower = ChordFollower('C', output_port=output_port)
+    follower.run(ScriptedInputPort(play([60, 64, 67], [53, 57, 60])))
+    sent = [(message.type, message.note) for message in output_port.messages]
+    f_over_c = [note.midi_note() for note in KeyedChord('C', string_to_chord('Fmaj/C', 'C')).adjusted_notes.values()]
+    c = [note.midi_note() for note in KeyedChord('C', string_to_chord('Cmaj', 'C')).adjusted_notes.values()]
+    assert sent == ([('note_on', note) for note in f_over_c] + [('note_off', note) for note in f_over_c] +
+                    [('note_on', note) for note in c] + [('note_off', note) for note in c])
+
+
+def test_no_keyed_chords_on_hot_path(monkeypatch):
+    follower = ChordFollower('C', output=io.StringIO())
+
+    def forbidden(*args):
+        raise AssertionError('KeyedChord made while following')
+    monkeypatch.setattr(KeyedChord, '__init__', forbidden)
+    assert follower.run(ScriptedInputPort(play([60, 64, 67], [57, 60, 64], [53, 57, 60], [55, 59, 62]))) == 4
+
+
+def test_latency():
+    # Every reading of the clock is one tick after the one before, so each
+    # change takes exactly one tick from receiving to reporting
+    readings = itertools.count()
+    follower = ChordFollower('C', output=io.StringIO(), clock=lambda: next(readings))
+    chords = ([60, 64, 67], [57, 60, 64], [53, 57, 60], [55, 59, 62], [52, 55, 59], [50, 53, 57])
+    follower.run(ScriptedInputPort(play(*chords) * 500))
+    assert follower.num_changes == len(follower.latencies) == 3000
+    assert set(follower.latencies) == {1}
+    assert follower.latency_percentile(0.5) == follower.latency_percentile(0.99) == 1
+    assert ChordFollower('C').latency_percentile(0.5) is None
+
+
+def test_cli(monkeypatch, capsys):
+    monkeypatch.setattr(mido, 'open_input', lambda name=None: ScriptedInputPort(play([60, 64, 67]), name=name))
+    follow('C', 'keyboard', None, None)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Following chords in C on keyboard, Ctrl-C to stop'
+    assert lines[1] == 'Cmaj -> Fmaj/C Gmaj/D Fmaj'
+    assert lines[2].startswith('1 chord changes, latency p50 ')
+
+    def no_backend(name=None):
+        raise ImportError('no backend')
+    # The input port is closed if the output port can't be opened
+    ports = []
+
+    def open_input(name=None):
+        ports.append(ScriptedInputPort(play([60, 64, 67]), name=name))
+        return ports[-1]
+    monkeypatch.setattr(mido, 'open_input', open_input)
+    monkeypatch.setattr(mido, 'open_output', no_backend)
+    with pytest.raises(MellowchordError):
+        follow('C', 'keyboard', 'synth', None)
+    assert len(ports) == 1 and ports[0].closed
+    monkeypatch.setattr(mido, 'open_input', no_backend)
+    with pytest.raises(MellowchordError):
+        follow('C', None, None, None)
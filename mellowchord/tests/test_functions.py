@@ -1,9 +1,12 @@
+import io
 import json
 from mellowchord import _split_bass
 from mellowchord import apply_inversion
 from mellowchord import Chord
+from mellowchord import chord_numeral
 from mellowchord import ChordMap
 from mellowchord import ChordParseError
+from mellowchord import chords_types_are_equal
 from mellowchord import IM, IM_3, IM_5, IM7
 from mellowchord import iim, iiim, IVM, IVM_1, VM, VM_2, vim
 from mellowchord import KeyedChord
@@ -20,6 +23,8 @@ from mellowchord import validate_key
 from mellowchord import validate_start
 from mellowchord import write_chord_sequence_json
 from mellowchord import read_chord_sequence_json
+from mellowchord import read_chord_sequence_ndjson
+from mellowchord import write_chord_sequence_ndjson
 import musthe
 import pytest
 from tempfile import mkstemp
@@ -203,3 +208,38 @@ def test_json_write_read():
     key_out, seq_out = read_chord_sequence_json(temp_file_path)
     assert key_out == 'D'
     assert seq_out == [kc1, kc4, kc5]
+
+
+def test_ndjson_write_read():
+    kc1 = KeyedChord('D', Chord(1, 'maj'))
+    kc4 = KeyedChord('D', Chord(4, 'maj'))
+    kc5 = KeyedChord('Amin', Chord(5, 'min'))
+    f = io.StringIO()
+    write_chord_sequence_ndjson(f, 'D', [kc1, kc4])
+    write_chord_sequence_ndjson(f, 'Amin', [kc5])
+    f.seek(0)
+    assert list(read_chord_sequence_ndjson(f)) == [('D', [kc1, kc4]), ('Amin', [kc5])]
+
+
+def test_chord_numeral():
+    assert chord_numeral(4, 'maj') == 'IV'
+    assert chord_numeral(6, 'min') == 'vi'
+    assert chord_numeral(2, 'm7') == 'ii'
+    assert Chord(5, 'dom7').numeral == 'V'
+
+
+def test_chords_types_are_equal():
+    assert chords_types_are_equal('maj', 'maj')
+    assert chords_types_are_equal('M', 'maj')
+    assert chords_types_are_equal('dim7', 'dim7')
+    assert chords_types_are_equal('7aug5', '7#5')
+    assert not chords_types_are_equal('maj', 'min')
+    assert Chord(7, 'dim7') == Chord(7, 'dim7')
+
+
+def test_slash_chord_names():
+    for degree in range(1, 8):
+        for inversion in (1, 2):
+            chord = Chord(degree, 'maj', inversion)
+            assert string_to_chord(chord.name) == chord
+    assert Chord(5, 'maj', inversion=1).name == 'Vmaj/7'
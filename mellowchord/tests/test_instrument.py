@@ -0,0 +1,108 @@
+import json
+from mellowchord import ChordMap
+from mellowchord import instrumented
+from mellowchord import MelodyGenerator
+from mellowchord import profiler
+from mellowchord import RecentSamples
+from mellowchord import string_to_chord
+import os
+from pathlib import Path
+import pytest
+import subprocess
+import sys
+
+
+@pytest.fixture
+def profiling():
+    profiler.reset()
+    profiler.enable(report_at_exit=False)
+    yield profiler
+    profiler.disable()
+    profiler.reset()
+
+
+def test_disabled_records_nothing():
+    profiler.reset()
+    string_to_chord('Cmaj', 'C')
+    for seq in ChordMap('C').gen_sequence('Cmaj', 3):
+        pass
+    assert profiler.summary() == {}
+
+
+def test_enabled_records_stages(profiling):
+    string_to_chord('Cmaj', 'C')
+    cm = ChordMap('C')
+    seqs = list(cm.gen_sequence('Cmaj', 3))
+    for notes in MelodyGenerator('C', seqs[0], 1).gen_sequence():
+        pass
+    summary = profiling.summary()
+    assert summary['ChordMap.gen_sequence']['calls'] == 1
+    assert summary['MelodyGenerator.gen_sequence']['calls'] == 1
+    assert summary['string_to_chord']['calls'] >= 2
+    assert summary['scale_from_key_string']['calls'] > 0
+    for stats in summary.values():
+        assert stats['total'] > 0
+        assert stats['p50'] <= stats['p99']
+    assert 'ChordMap.gen_sequence' in profiling.format_summary()
+
+
+def test_abandoned_generator_recorded(profiling):
+    gen = ChordMap('C').gen_sequence('Cmaj', 4)
+    next(gen)
+    gen.close()
+    assert profiling.summary()['ChordMap.gen_sequence']['calls'] == 1
+
+
+def test_instrumented_exceptions(profiling):
+    @instrumented('test.failing')
+    def failing():
+        raise ValueError()
+    with pytest.raises(ValueError):
+        failing()
+    assert profiling.summary()['test.failing']['calls'] == 1
+
+
+def test_summary_percentiles(profiling):
+    stage = profiling.stage('test.samples')
+    for sample in (0.4, 0.1, 0.3, 0.2):
+        stage.record(sample)
+    # By nearest rank, as RecentSamples.percentile
+    summary = profiling.summary()['test.samples']
+    assert summary['p50'] == 0.2
+    assert summary['p99'] == 0.4
+
+
+def test_dump_json(profiling, tmp_path, capsys):
+    string_to_chord('Cmaj', 'C')
+    json_path = str(tmp_path / 'profile.json')
+    profiling.dump(json_path=json_path)
+    assert 'string_to_chord' in capsys.readouterr().err
+    with open(json_path) as f:
+        assert json.load(f)['string_to_chord']['calls'] == 1
+
+
+def test_environment_variable(tmp_path):
+    json_path = str(tmp_path / 'profile.json')
+    env = dict(os.environ, MELLOWCHORD_PROFILE=json_path)
+    result = subprocess.run([sys.executable, '-c', 'import mellowchord; mellowchord.string_to_chord("Cmaj", "C")'],
+                            cwd=str(Path(__file__).resolve().parents[2]),
+                            env=env,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    assert 'string_to_chord' in result.stderr
+    with open(json_path) as f:
+        assert json.load(f)['string_to_chord']['calls'] == 1
+
+
+def test_recent_samples():
+    samples = RecentSamples(maxlen=4)
+    assert samples.percentile(0.5) is None
+    for sample in (9, 3, 1, 2, 4):
+        samples.append(sample)
+    # Only the last four are kept
+    assert len(samples) == 4 and list(samples) == [3, 1, 2, 4]
+    assert samples.percentile(0) == 1
+    assert samples.percentile(0.5) == 2
+    assert samples.percentile(0.99) == samples.percentile(1) == 4
@@ -0,0 +1,117 @@
+from mellowchord import Chord
+from mellowchord import ChordLibrary
+from mellowchord import ChordLibraryWriter
+from mellowchord import ChordMap
+from mellowchord import InvalidArgumentError
+from mellowchord import json_to_library
+from mellowchord import KeyedChord
+from mellowchord import library_to_json
+from mellowchord import LibraryFormatError
+from mellowchord import read_chord_sequence_json
+from mellowchord import slice_library
+from mellowchord import write_chord_sequence_json
+from mellowchord import write_library
+import os
+import pytest
+
+
+def _names(seq):
+    return [str(keyed_chord) for keyed_chord in seq]
+
+
+def test_fixed_width_round_trip(tmp_path):
+    library_path = str(tmp_path / 'c.mcl')
+    seqs = list(ChordMap('C', octave_adjustment=-1).gen_sequence('Cmaj', 4))
+    assert write_library(library_path, seqs) == len(seqs)
+    assert os.path.getsize(library_path) < 100 + len(seqs) * 4 * 4 + 200
+    with ChordLibrary(library_path) as library:
+        assert len(library) == len(seqs)
+        assert library.chords_per_record == 4
+        for index, seq in enumerate(seqs):
+            assert library[index] == seq
+        assert library[-1] == seqs[-1]
+        assert library[1:3] == seqs[1:3]
+        assert library.key_of(0) == 'C'
+        with pytest.raises(IndexError):
+            library[len(seqs)]
+
+
+def test_variable_width_round_trip(tmp_path):
+    library_path = str(tmp_path / 'mixed.mcl')
+    seqs = [[KeyedChord('C', Chord(1, 'maj')), KeyedChord('C', Chord(4, 'maj'))],
+            [KeyedChord('C', Chord(1, 'maj')), KeyedChord('C', Chord(5, 'maj'))],
+            [KeyedChord('Amin', Chord(1, 'min', inversion=2, octave_adjustment=-1))],
+            [KeyedChord('Bb', Chord(1, 'maj7')), KeyedChord('Bb', Chord(2, 'min')), KeyedChord('Bb', Chord(5, 'maj'))]]
+    write_library(library_path, seqs)
+    with ChordLibrary(library_path) as library:
+        assert library.chords_per_record is None
+        assert list(library) == seqs
+        assert library.key_of(2) == 'Amin'
+        assert library[2][0].octave_adjustment == -1
+        assert library[2][0].inversion == 2
+
+
+def test_slice_library(tmp_path):
+    library_path = str(tmp_path / 'c.mcl')
+    sliced_path = str(tmp_path / 'sliced.mcl')
+    seqs = list(ChordMap('D').gen_sequence('Dmaj', 3))
+    write_library(library_path, seqs)
+    assert slice_library(library_path, sliced_path, 2, 5) == 3
+    with ChordLibrary(sliced_path) as library:
+        assert list(library) == seqs[2:5]
+
+
+def test_json_conversion(tmp_path):
+    json_paths = []
+    for index, seq in enumerate(ChordMap('G').gen_sequence('Gmaj', 3)):
+        json_path = str(tmp_path / f'{index}.json')
+        write_chord_sequence_json(json_path, 'G', seq)
+        json_paths.append(json_path)
+    library_path = str(tmp_path / 'g.mcl')
+    assert json_to_library(json_paths, library_path) == len(json_paths)
+    export_dir = tmp_path / 'export'
+    export_dir.mkdir()
+    exported = library_to_json(library_path, str(export_dir))
+    assert len(exported) == len(json_paths)
+    for json_path, exported_path in zip(json_paths, exported):
+        assert read_chord_sequence_json(exported_path) == read_chord_sequence_json(json_path)
+
+
+def test_empty_sequence_rejected(tmp_path):
+    with ChordLibraryWriter(str(tmp_path / 'empty.mcl')) as writer:
+        with pytest.raises(InvalidArgumentError):
+            writer.append([])
+    with ChordLibrary(str(tmp_path / 'empty.mcl')) as library:
+        assert len(library) == 0
+
+
+def test_not_a_library(tmp_path):
+    bad_path = tmp_path / 'bad.mcl'
+    bad_path.write_bytes(b'x' * 200)
+    with pytest.raises(LibraryFormatError):
+        ChordLibrary(str(bad_path))
+    bad_path.write_bytes(b'x')
+    with pytest.raises(LibraryFormatError):
+        ChordLibrary(str(bad_path))
+
+
+def test_corrupt_tables(tmp_path, monkeypatch):
+    path = str(tmp_path / 'corrupt.mcl')
+    with ChordLibraryWriter(path) as writer:
+        writer.append([KeyedChord('C', Chord(1, 'maj'))])
+    with open(path, 'rb') as f:
+        data = f.read()
+    tables = data[data.rindex(b'{'):]
+    files = []
+
+    def recording_open(*args, **kwargs):
+        files.append(open(*args, **kwargs))
+        return files[-1]
+    monkeypatch.setattr('mellowchord.library.open', recording_open, raising=False)
+    # Not JSON, not UTF-8, and JSON without the tables
+    for bad_tables in (b'{' + b' ' * (len(tables) - 1), b'\xff' * len(tables), b'[' + b' ' * (len(tables) - 2) + b']'):
+        with open(path, 'wb') as f:
+            f.write(data[:-len(tables)] + bad_tables)
+        with pytest.raises(LibraryFormatError):
+            ChordLibrary(path)
+    assert len(files) == 3 and all(f.closed for f in files)
@@ -1,5 +1,8 @@
 from mellowchord import chord_in
 from mellowchord import ChordMap
+from mellowchord import FrozenMapError
+from mellowchord import InvalidArgumentError
+from mellowchord import Shard
 from mellowchord import IM, IM_3, IM_5, IM7
 from mellowchord import iim
 from mellowchord import iiim
@@ -7,6 +10,10 @@ from mellowchord import IVM, IVM_1
 from mellowchord import VM, VM_2
 from mellowchord import vim
 from mellowchord import IIM, IIIM, VIM, VIIM
+import itertools
+import pytest
+import threading
+import tracemalloc
 
 
 def test_map():
@@ -96,3 +103,149 @@ def test_gen_sequence():
         assert str(seq[0]) == 'Cmaj'
         assert str(seq[1]) in ('Fmaj', 'Fmaj/C', 'Gmaj/D')
         assert str(seq[2]) in ('Gmaj', 'Dmin', 'Cmaj/G', 'Cmaj/E', 'Cmaj', 'Cmaj7')
+
+
+def test_gen_sequence_repeatable():
+    cm = ChordMap('C')
+    first_run = [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 4)]
+    assert len(first_run) > 0
+    assert len(first_run) == len(set(tuple(seq) for seq in first_run))
+    second_run = [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 4)]
+    assert first_run == second_run
+
+
+def test_gen_sequence_abandoned():
+    cm = ChordMap('C')
+    gen = cm.gen_sequence('Cmaj', 4)
+    next(gen)
+    del gen
+    for seq in cm.gen_sequence('Cmaj', 4):
+        assert len(seq) == 4
+
+
+def test_gen_sequence_single_chord():
+    cm = ChordMap('C')
+    assert [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 1)] == [['Cmaj']]
+
+
+def test_gen_sequence_dedupe_window():
+    cm = ChordMap('C')
+    plain = [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 5)]
+    deduped = [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 5, dedupe_window=8)]
+    assert plain == deduped
+
+
+def test_gen_sequence_memory():
+    cm = ChordMap('C')
+    for seq in cm.gen_sequence('Cmaj', 6):
+        pass
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(5):
+            for seq in cm.gen_sequence('Cmaj', 6, dedupe_window=16):
+                pass
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert current - baseline < 64 * 1024
+    assert peak - baseline < 1024 * 1024
+
+
+@pytest.fixture
+def empty_map_cache():
+    ChordMap.clear_cache()
+    yield
+    ChordMap.clear_cache()
+
+
+def test_for_key_shared(empty_map_cache):
+    cm = ChordMap.for_key('C')
+    assert ChordMap.for_key('C') is cm
+    assert ChordMap.for_key('C', -1) is not cm
+    assert ChordMap.for_key('Amin') is not cm
+    assert cm.frozen
+    assert [[str(c) for c in seq] for seq in cm.gen_sequence('Cmaj', 5)] == \
+        [[str(c) for c in seq] for seq in ChordMap('C').gen_sequence('Cmaj', 5)]
+
+
+def test_frozen_map_rejects_mutation(empty_map_cache):
+    cm = ChordMap.for_key('C')
+    with pytest.raises(FrozenMapError):
+        cm.key = 'D'
+    node = cm._g.nodes[0]
+    with pytest.raises(FrozenMapError):
+        cm._g.add_edge(node, node)
+    with pytest.raises(AttributeError):
+        node.chords.append(IM7)
+    assert not ChordMap('C').frozen
+
+
+def test_for_key_eviction(empty_map_cache, monkeypatch):
+    monkeypatch.setattr(ChordMap, 'cache_size', 2)
+    c_map = ChordMap.for_key('C')
+    ChordMap.for_key('D')
+    ChordMap.for_key('C')
+    ChordMap.for_key('E')
+    assert ChordMap.for_key('C') is c_map
+    assert len(ChordMap._cache) == 2
+    assert ('D', 0) not in ChordMap._cache
+
+
+def test_warm_cache(empty_map_cache):
+    ChordMap.warm_cache(octave_adjustments=(0, -1))
+    assert len(ChordMap._cache) == 48
+    assert ChordMap.for_key('F#min', -1).frozen
+
+
+def test_for_key_threads(empty_map_cache):
+    expected = [[str(c) for c in seq] for seq in ChordMap('G').gen_sequence('Gmaj', 6)]
+    results = []
+
+    def worker():
+        cm = ChordMap.for_key('G')
+        results.append([[str(c) for c in seq] for seq in cm.gen_sequence('Gmaj', 6)])
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 8
+
+
+def test_shard_parse():
+    assert Shard.parse('0/1') == Shard(0, 1)
+    assert Shard.parse(' 3 / 8') == Shard(3, 8)
+    assert str(Shard(3, 8)) == '3/8'
+    assert [Shard(index, 3).range(10) for index in range(3)] == [(0, 3), (3, 6), (6, 10)]
+    for spec in ('1', '1/1', '-1/2', '2/0', 'a/b', '1/2/3'):
+        with pytest.raises(InvalidArgumentError):
+            Shard.parse(spec)
+
+
+@pytest.mark.parametrize('key,start', [('C', 'Cmaj'), ('C', 'Gmaj/D'), ('Amin', 'Amin'), ('C', 'Bmaj')])
+@pytest.mark.parametrize('num_chords', [1, 2, 5, 8])
+@pytest.mark.parametrize('count', [1, 2, 3, 7, 64])
+def test_gen_chord_sequence_shards(key, start, num_chords, count):
+    cm = ChordMap.for_key(key)
+    sequences = list(cm.gen_chord_sequence(start, num_chords))
+    shards = [list(cm.gen_chord_sequence(start, num_chords, Shard(index, count))) for index in range(count)]
+    # Shards are contiguous runs of the unsharded output, so putting them
+    # together in order gives it back exactly, with no overlap
+    assert list(itertools.chain(*shards)) == sequences
+    assert max(len(shard) for shard in shards) - min(len(shard) for shard in shards) <= 1
+
+
+def test_gen_sequence_shards():
+    cm = ChordMap('C')
+    sequences = list(cm.gen_sequence('Cmaj', 5))
+    assert [seq for index in range(4) for seq in cm.gen_sequence('Cmaj', 5, shard=Shard(index, 4))] == sequences
+
+
+def test_shards_skip_subtrees():
+    cm = ChordMap.for_key('C')
+    count = cm.count_sequences(IM, 30)
+    assert count > 10 ** 12
+    sequence = next(cm.gen_chord_sequence(IM, 30, Shard(99, 100)))
+    assert len(sequence) == 30
+    assert len(list(cm.gen_chord_sequence(IM, 30, Shard(count - 1, count)))) == 1
@@ -0,0 +1,136 @@
+from mellowchord import BUILTIN_CHORD_MAP
+from mellowchord import Chord
+from mellowchord import ChordMap
+from mellowchord import ChordMapFormatError
+from mellowchord import IM, IM7, IVM, IVM_1, VM, VM_2
+from mellowchord import parse_map_chord
+from mellowchord import Shard
+from mellowchord.tests.maps import large_definition
+from mellowchord.tests.maps import SMALL_MAP
+import itertools
+import json
+import pytest
+
+
+@pytest.fixture(scope='module')
+def large_map():
+    return ChordMap(definition=large_definition())
+
+
+def test_parse_map_chord():
+    assert parse_map_chord('I') == Chord(1, 'maj')
+    assert parse_map_chord('ii') == Chord(2, 'min')
+    assert parse_map_chord('V7') == Chord(5, 'dom7')
+    assert parse_map_chord('IVmaj/1') == IVM_1
+    assert parse_map_chord('Vmaj/7') == Chord(5, 'maj', inversion=1)
+    assert parse_map_chord('viidim/4') == Chord(7, 'dim', inversion=2)
+    assert parse_map_chord('Isus4') == Chord(1, 'sus4')
+    for chord_string in ('VIII', 'Xmaj', 'Imaj9', 'IV/2', 'Iv', 'Cmaj', 7):
+        with pytest.raises(ChordMapFormatError):
+            parse_map_chord(chord_string)
+
+
+def test_builtin_definition():
+    for key in ('C', 'Amin'):
+        from_definition = ChordMap(key, definition=BUILTIN_CHORD_MAP)
+        assert list(from_definition.gen_sequence(ChordMap(key).chord_strings[0], 5)) ==\
+            list(ChordMap(key).gen_sequence(ChordMap(key).chord_strings[0], 5))
+    assert [node.name for node in ChordMap('Amin')._g][:3] == ['i', 'i/3', 'i/5']
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / 'small.json'
+    path.write_text(json.dumps(SMALL_MAP))
+    cm = ChordMap.from_file(str(path), 'C')
+    assert cm.next_chords(IM, all_variants=True) == cm.next_chords(IM7, all_variants=True)
+    assert [str(c) for c in cm.next_chords('Cmaj', all_variants=True)] == ['Fmaj', 'Gmaj', 'Gdom7']
+    assert [str(c) for c in cm.next_chords('Gdom7')] == ['Cmaj']
+    # A single section map is used for minor keys too
+    assert len(ChordMap.from_file(str(path), 'Amin')._g) == 4
+
+
+@pytest.mark.parametrize('definition', [
+    [],
+    {'version': 2, 'nodes': {'I': ['I']}},
+    {'nodes': {}},
+    {'nodes': {'I': []}},
+    {'nodes': {'I': 'I'}},
+    {'nodes': {'I': ['I', 'Imaj']}},
+    {'nodes': {'I': ['I']}, 'edges': [['I', 'V']]},
+    {'nodes': {'I': ['I']}, 'edges': [['I']]},
+    {'nodes': {'I': ['I']}, 'edges': [['I', 'I'], ['I', 'I']]},
+    {'nodes': {'I': ['I']}, 'extra': 1},
+    {'major': {'nodes': {'I': ['I']}}},
+    {'major': {'nodes': {'I': ['I']}}, 'minor': {'nodes': {'i': ['i']}, 'edge': []}},
+])
+def test_invalid_definition(definition):
+    with pytest.raises(ChordMapFormatError):
+        ChordMap(definition=definition)
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text('{"nodes": {"I": ["I"], "I": ["Imaj7"]}}')
+    with pytest.raises(ChordMapFormatError):
+        ChordMap.from_file(str(path))
+    path.write_text('{"nodes": ')
+    with pytest.raises(ChordMapFormatError):
+        ChordMap.from_file(str(path))
+
+
+def test_chord_in_several_nodes():
+    definition = {'nodes': {'I': ['I'], 'IV': ['IV'], 'V': ['V'], 'I again': ['Imaj7', 'I']},
+                  'edges': [['I', 'IV'], ['I again', 'V'], ['I again', 'IV'], ['IV', 'I again'], ['V', 'I']]}
+    cm = ChordMap(definition=definition)
+    assert cm.next_chords(IM) == [IVM, VM]
+    assert cm.next_chords(IM7) == [VM, IVM]
+    assert cm.next_chords(IVM, all_variants=True) == [IM7, IM]
+    assert cm.count_sequences(IM, 3) == sum(1 for _ in cm.gen_chord_sequence(IM, 3)) == 3
+    assert len(set(cm.gen_chord_sequence(IM, 6))) == cm.count_sequences(IM, 6)
+
+
+def test_count_sequences():
+    for key in ('C', 'Amin'):
+        cm = ChordMap(key)
+        for node in cm._g:
+            for num_chords in range(1, 7):
+                assert cm.count_sequences(node.primary, num_chords) ==\
+                    sum(1 for _ in cm.gen_chord_sequence(node.primary, num_chords))
+    assert ChordMap('C').count_sequences('Cmaj', 9) == sum(1 for _ in ChordMap('C').gen_sequence('Cmaj', 9))
+    cm = ChordMap.for_key('C')
+    assert cm.count_sequences(VM_2, 5) == sum(1 for _ in cm.gen_chord_sequence(VM_2, 5))
+
+
+# How long these take is checked by the chord_map_from_definition[500]
+# and *_large_map benchmarks
+def test_large_map_build():
+    definition = large_definition()
+    cm = ChordMap(definition=definition)
+    cm.freeze()
+    assert len(cm._g) == 500
+    assert cm._g.num_edges == len(definition['edges']) == 3000
+
+
+def test_large_map_next_chords(large_map):
+    for chord in large_map._successor_table():
+        assert large_map.next_chords(chord, all_variants=True)
+
+
+def test_large_map_enumeration(large_map):
+    start = large_map._g.nodes[0].primary
+    sequences = list(large_map.gen_chord_sequence(start, 3))
+    assert len(sequences) == len(set(sequences)) == large_map.count_sequences(start, 3)
+    assert sum(1 for _ in itertools.islice(large_map.gen_chord_sequence(start, 8), 100000)) == 100000
+
+
+def test_large_map_count(large_map):
+    start = large_map._g.nodes[0].primary
+    assert large_map.count_sequences(start, 20) > 10 ** 30
+
+
+def test_large_map_shards(large_map):
+    start = large_map._g.nodes[0].primary
+    sequences = list(large_map.gen_chord_sequence(start, 3))
+    shards = [list(large_map.gen_chord_sequence(start, 3, Shard(index, 16))) for index in range(16)]
+    assert list(itertools.chain(*shards)) == sequences
+    assert len(next(large_map.gen_chord_sequence(start, 20, Shard(15, 16)))) == 20
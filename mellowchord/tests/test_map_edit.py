@@ -0,0 +1,125 @@
+from mellowchord import Chord
+from mellowchord import ChordMap
+from mellowchord import ConcurrentModificationError
+from mellowchord import FrozenMapError
+from mellowchord import InvalidArgumentError
+from mellowchord import TransitionCounts
+from mellowchord.tests.maps import large_definition
+from mellowchord.tests.maps import SMALL_MAP
+import copy
+import itertools
+import pytest
+import random
+
+
+def assert_same_as_rebuilt(cm, start, num_chords=4):
+    rebuilt = ChordMap(cm.key, cm.octave_adjustment, cm.to_definition())
+    assert cm._successor_table() == rebuilt._successor_table()
+    assert list(cm._successor_table()) == list(rebuilt._successor_table())
+    assert list(cm.gen_chord_sequence(start, num_chords)) == list(rebuilt.gen_chord_sequence(start, num_chords))
+    assert cm.count_sequences(start, num_chords) == rebuilt.count_sequences(start, num_chords)
+    assert [str(chord) for chord in cm.next_chords(start, all_variants=True)] == \
+        [str(chord) for chord in rebuilt.next_chords(start, all_variants=True)]
+
+
+def test_edits():
+    cm = ChordMap('C', definition=copy.deepcopy(SMALL_MAP))
+    # Fill the caches, so the edits have something to invalidate
+    assert cm.count_sequences('Cmaj', 4) == 20
+    list(cm.gen_sequence('Cmaj', 4))
+    assert cm.version == 0
+    cm.add_node('ii', ['ii', 'iimin7'])
+    cm.add_edge('I', 'ii')
+    cm.add_edge('ii', 'V')
+    assert_same_as_rebuilt(cm, 'Cmaj')
+    cm.add_variant('IV', Chord(4, 'maj7'))
+    cm.add_variant('V/2', 'V7')
+    assert_same_as_rebuilt(cm, 'Cmaj')
+    assert 'Fmaj7' in cm.chord_strings
+    cm.remove_variant('V', 'V7')
+    cm.remove_edge('IV', 'I')
+    assert_same_as_rebuilt(cm, 'Cmaj')
+    cm.remove_node('IV')
+    assert [node.name for node in cm._g] == ['I', 'V', 'V/2', 'ii']
+    assert_same_as_rebuilt(cm, 'Cmaj')
+    assert_same_as_rebuilt(cm, 'Dmin')
+    assert cm.version == 8
+    assert cm.definition is None
+    assert cm.to_definition() == {'version': 1,
+                                  'nodes': {'I': ['Imaj', 'Imaj7'], 'V': ['Vmaj'], 'V/2': ['Vmaj/2', 'V7'],
+                                            'ii': ['iimin', 'iimin7']},
+                                  'edges': [['I', 'V'], ['I', 'ii'], ['V', 'I'], ['V/2', 'I'], ['ii', 'V']]}
+
+
+def test_bad_edits():
+    cm = ChordMap('C', definition=copy.deepcopy(SMALL_MAP))
+    for edit in (lambda: cm.add_node('I', ['I']), lambda: cm.add_node('X', []), lambda: cm.add_node('X', ['I', 'I']),
+                 lambda: cm.remove_node('X'), lambda: cm.add_edge('I', 'IV'), lambda: cm.add_edge('I', 'X'),
+                 lambda: cm.remove_edge('IV', 'V'), lambda: cm.add_variant('I', 'Imaj7'),
+                 lambda: cm.remove_variant('IV', 'I'), lambda: cm.remove_variant('IV', 'IV')):
+        with pytest.raises(InvalidArgumentError):
+            edit()
+    assert cm.version == 0
+    cm.freeze()
+    for edit in (lambda: cm.add_node('ii', ['ii']), lambda: cm.remove_node('I'), lambda: cm.add_edge('IV', 'V'),
+                 lambda: cm.remove_edge('I', 'IV'), lambda: cm.add_variant('I', 'I/3'),
+                 lambda: cm.remove_variant('I', 'Imaj7')):
+        with pytest.raises(FrozenMapError):
+            edit()
+
+
+def test_concurrent_modification():
+    cm = ChordMap('C', definition=copy.deepcopy(SMALL_MAP))
+    sequences = cm.gen_sequence('Cmaj', 4)
+    next(sequences)
+    cm.add_edge('IV', 'V')
+    with pytest.raises(ConcurrentModificationError):
+        next(sequences)
+    samples = cm.sample_sequences('Cmaj', 4, rng=random.Random(0))
+    next(samples)
+    cm.remove_edge('IV', 'V')
+    with pytest.raises(ConcurrentModificationError):
+        next(samples)
+    # A generator started after the edit is fine
+    assert len(list(cm.gen_sequence('Cmaj', 4))) == cm.count_sequences('Cmaj', 4) == 20
+
+
+def test_weighted_copy_is_independent():
+    cm = ChordMap('C', definition=copy.deepcopy(SMALL_MAP))
+    weighted = cm.weighted(TransitionCounts())
+    sequences = list(weighted.gen_chord_sequence('Cmaj', 4))
+    cm.add_variant('I', 'I/3')
+    cm.remove_variant('V', 'V7')
+    assert list(weighted.gen_chord_sequence('Cmaj', 4)) == sequences
+    assert_same_as_rebuilt(cm, 'Cmaj')
+
+
+def test_random_edits_large_map():
+    rng = random.Random(1)
+    cm = ChordMap(definition=large_definition(100, 4))
+    start = cm._g.nodes[0].primary
+    pool = [Chord(degree, chord_type) for degree in range(1, 8) for chord_type in ('maj', 'min', 'dom7')]
+    for step in range(200):
+        cm.count_sequences(start, 4)
+        names = [node.name for node in cm._g]
+        name = rng.choice(names)
+        node = cm._g.node_named(name)
+        successors = {successor.name for successor in cm._g.successors(node)}
+        edit = rng.randrange(6)
+        if edit == 0:
+            cm.add_node(f'new{step}', rng.sample(pool, 2))
+        elif edit == 1 and name != 'n0':
+            cm.remove_node(name)
+        elif edit == 2:
+            cm.add_edge(name, rng.choice([other for other in names if other not in successors]))
+        elif edit == 3 and successors:
+            cm.remove_edge(name, rng.choice(sorted(successors)))
+        elif edit == 4:
+            cm.add_variant(name, rng.choice([chord for chord in pool if chord not in node.chords]))
+        elif edit == 5 and len(node.chords) > 1:
+            cm.remove_variant(name, rng.choice(node.chords))
+        if step % 20 == 0:
+            assert_same_as_rebuilt(cm, start, 3)
+    assert_same_as_rebuilt(cm, start, 3)
+    assert sum(1 for _ in itertools.islice(cm.gen_chord_sequence(start, 6), 1000)) == \
+        min(1000, cm.count_sequences(start, 6))
@@ -0,0 +1,121 @@
+from mellowchord import ChordMap
+from mellowchord import ChordMapFormatError
+from mellowchord import mapcache
+from mellowchord.mapcache import artifact_digest
+from mellowchord.mapcache import cache_dir
+from mellowchord.mapcache import cached_chord_map
+from mellowchord.mapcache import MapArtifactError
+from mellowchord.mapcache import read_artifact
+from mellowchord.tests.maps import large_definition
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def definition_path(tmp_path):
+    path = tmp_path / 'map.json'
+    path.write_text(json.dumps(large_definition(100, 4)))
+    return str(path)
+
+
+def artifacts(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.mcm'))
+
+
+def assert_same_map(cm1, cm2):
+    assert [node.name for node in cm1._g] == [node.name for node in cm2._g]
+    assert [node.chords for node in cm1._g] == [node.chords for node in cm2._g]
+    assert [[s.name for s in cm1._g.successors(node)] for node in cm1._g] ==\
+        [[s.name for s in cm2._g.successors(node)] for node in cm2._g]
+    assert cm1._successor_table() == cm2._successor_table()
+    if cm1.key:
+        assert sorted(cm1.chord_strings) == sorted(cm2.chord_strings)
+    assert cm1.key == cm2.key and cm1.definition == cm2.definition
+
+
+def test_cache_dir(monkeypatch, tmp_path):
+    assert cache_dir() == os.environ['MELLOWCHORD_CACHE_DIR']
+    monkeypatch.delenv('MELLOWCHORD_CACHE_DIR')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert cache_dir() == os.path.join(str(tmp_path), 'mellowchord')
+    monkeypatch.delenv('XDG_CACHE_HOME')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert cache_dir() == os.path.join(str(tmp_path), '.cache', 'mellowchord')
+
+
+def test_warm_load(definition_path, map_cache_dir, monkeypatch):
+    compiled = ChordMap.from_file(definition_path, 'Eb', cache=False)
+    cold = ChordMap.from_file(definition_path, 'Eb')
+    assert len(artifacts(map_cache_dir)) == 1
+    assert_same_map(compiled, cold)
+
+    def fail(*args):
+        raise AssertionError('map was compiled again')
+    monkeypatch.setattr(mapcache, 'chord_map_definition_from_json', fail)
+    warm = ChordMap.from_file(definition_path, 'Eb', octave_adjustment=-1)
+    assert_same_map(compiled, warm)
+    assert warm.octave_adjustment == -1 and not warm.frozen
+    start = compiled._g.nodes[0].primary
+    assert list(warm.gen_chord_sequence(start, 4)) == list(compiled.gen_chord_sequence(start, 4))
+    frozen = cached_chord_map(definition_path, 'Eb', freeze=True)
+    assert frozen.frozen
+    assert frozen._successor_cache == compiled._successor_table()
+
+
+def test_artifact_per_key(definition_path, map_cache_dir):
+    for key in (None, 'C', 'Amin'):
+        assert_same_map(ChordMap.from_file(definition_path, key), ChordMap.from_file(definition_path, key, cache=False))
+    assert len(artifacts(map_cache_dir)) == 3
+
+
+def test_stale_artifacts(definition_path, map_cache_dir, monkeypatch):
+    ChordMap.from_file(definition_path, 'C')
+    [first] = artifacts(map_cache_dir)
+    with open(definition_path, 'w') as f:
+        json.dump(large_definition(100, 4, seed=1), f)
+    cm = ChordMap.from_file(definition_path, 'C')
+    [second] = artifacts(map_cache_dir)
+    assert second != first
+    assert_same_map(cm, ChordMap.from_file(definition_path, 'C', cache=False))
+    monkeypatch.setattr(mapcache, '__version__', '99.0.0')
+    ChordMap.from_file(definition_path, 'C')
+    [third] = artifacts(map_cache_dir)
+    assert third != second
+
+
+def test_damaged_artifact(definition_path, map_cache_dir):
+    ChordMap.from_file(definition_path, 'C')
+    [name] = artifacts(map_cache_dir)
+    path = os.path.join(map_cache_dir, name)
+    size = os.path.getsize(path)
+    digest = artifact_digest(open(definition_path, 'rb').read(), 'C')
+    with pytest.raises(MapArtifactError):
+        read_artifact(path, artifact_digest(b'other', 'C'))
+    with open(path, 'r+b') as f:
+        f.truncate(size - 10)
+    with pytest.raises(MapArtifactError):
+        read_artifact(path, digest)
+    assert_same_map(ChordMap.from_file(definition_path, 'C'), ChordMap.from_file(definition_path, 'C', cache=False))
+    assert os.path.getsize(path) == size
+    with open(path, 'wb') as f:
+        f.write(b'not an artifact')
+    with pytest.raises(MapArtifactError):
+        read_artifact(path)
+    ChordMap.from_file(definition_path, 'C')
+    read_artifact(path, digest)
+
+
+def test_unwritable_cache_dir(definition_path, tmp_path, monkeypatch):
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_text('')
+    monkeypatch.setenv('MELLOWCHORD_CACHE_DIR', str(not_a_dir))
+    assert_same_map(ChordMap.from_file(definition_path, 'C'), ChordMap.from_file(definition_path, 'C', cache=False))
+
+
+def test_invalid_definition_not_cached(tmp_path, map_cache_dir):
+    path = tmp_path / 'bad.json'
+    path.write_text('{"nodes": {"I": ["Imaj9"]}}')
+    with pytest.raises(ChordMapFormatError):
+        ChordMap.from_file(str(path))
+    assert artifacts(map_cache_dir) == []
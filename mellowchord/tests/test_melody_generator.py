@@ -1,6 +1,8 @@
 from mellowchord import Chord
 from mellowchord import KeyedChord
 from mellowchord import MelodyGenerator
+from mellowchord import Shard
+import itertools
 import pytest
 
 
@@ -27,3 +29,27 @@ def test_melody_generator(longtests, test_chord_sequence, notes_per_chord):
                 assert notes[x] in test_chord_sequence[this_chord_index].notes
             else:
                 assert notes[x] in test_chord_sequence[this_chord_index].notes + test_chord_sequence[next_chord_index].notes
+
+
+@pytest.mark.parametrize('notes_per_chord', [1, 2, 3])
+@pytest.mark.parametrize('count', [1, 2, 5, 7, 100])
+def test_melody_generator_shards(test_chord_sequence, notes_per_chord, count):
+    mg = MelodyGenerator('C', test_chord_sequence, notes_per_chord)
+    melodies = list(mg.gen_sequence())
+    assert mg.count() == len(melodies)
+    shards = [list(mg.gen_sequence(Shard(index, count))) for index in range(count)]
+    assert list(itertools.chain(*shards)) == melodies
+    assert max(len(shard) for shard in shards) - min(len(shard) for shard in shards) <= 1
+
+
+def test_melody_generator_last_shard(test_chord_sequence):
+    # The last shard of 4 notes per chord starts 3/4 of the way through
+    # over 600 million melodies, so it must not be reached by counting
+    mg = MelodyGenerator('C', test_chord_sequence * 2, 4)
+    assert mg.count() > 10 ** 8
+    index = mg.count() * 3 // 4
+    expected = []
+    for notes in reversed(mg._possible_notes()):
+        index, digit = divmod(index, len(notes))
+        expected.insert(0, notes[digit])
+    assert next(mg.gen_sequence(Shard(3, 4))) == tuple(expected)
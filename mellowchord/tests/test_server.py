@@ -0,0 +1,141 @@
+from mellowchord import ChordMap
+from mellowchord import chord_sequence_ndjson_line
+from mellowchord import gen_sequence_all_keys
+from mellowchord import KeyedChordEncoder
+from mellowchord import MelodyGenerator
+from mellowchord import melody_ndjson_line
+from mellowchord import Shard
+from mellowchord import string_to_keyed_chord
+from mellowchord import write_midi_file
+from mellowchord.server import MellowchordServer
+from mellowchord.tests import loadtest
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import pytest
+import socket
+import threading
+
+
+@pytest.fixture(scope='module')
+def server():
+    """Run a server on a free port with its event loop in a background
+    thread, and return its (host, port)."""
+    loop = asyncio.new_event_loop()
+    render_executor = concurrent.futures.ThreadPoolExecutor(2)
+    mellowchord_server = MellowchordServer(render_executor=render_executor)
+    address = loop.run_until_complete(mellowchord_server.start('127.0.0.1', 0, keys=('C', 'Amin')))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield address
+    asyncio.run_coroutine_threadsafe(mellowchord_server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    render_executor.shutdown()
+
+
+def request(address, method, path, body=None, connection=None):
+    connection = connection or http.client.HTTPConnection(*address, timeout=30)
+    connection.request(method, path, json.dumps(body) if body is not None else None)
+    response = connection.getresponse()
+    return response.status, response.getheader('Content-Type'), response.read()
+
+
+def test_health(server):
+    assert request(server, 'GET', '/health') == (200, 'application/json', b'{"status": "ok"}')
+
+
+def test_chords(server):
+    cm = ChordMap('C', octave_adjustment=-1)
+    expected = ''.join(chord_sequence_ndjson_line('C', seq) for seq in cm.gen_sequence('Cmaj', 6)).encode()
+    status, content_type, body = request(server, 'POST', '/chords', {'key': 'C', 'start': 'Cmaj', 'num': 6})
+    assert (status, content_type) == (200, 'application/x-ndjson')
+    assert body == expected
+    params = {'key': 'C', 'start': 'Cmaj', 'num': 6, 'limit': 5, 'shard': '1/2'}
+    status, _, body = request(server, 'POST', '/chords', params)
+    expected = [chord_sequence_ndjson_line('C', seq) for seq in cm.gen_sequence('Cmaj', 6, shard=Shard(1, 2))]
+    assert body == ''.join(expected[:5]).encode()
+    status, _, body = request(server, 'POST', '/chords', {'key': 'C', 'start': 'Cmaj', 'num': 2, 'all_keys': True})
+    assert len(body.splitlines()) == sum(1 for _ in gen_sequence_all_keys('Cmaj', 2, octave_adjustment=-1))
+
+
+def test_count(server):
+    status, _, body = request(server, 'POST', '/count', {'key': 'Amin', 'start': 'Amin', 'num': 8})
+    assert status == 200
+    assert json.loads(body) == {'count': ChordMap('Amin').count_sequences('Amin', 8)}
+
+
+def test_melodies(server):
+    names = ['Cmaj', 'Fmaj', 'Gmaj']
+    seq = [string_to_keyed_chord(name, 'C', -1) for name in names]
+    expected = ''.join(melody_ndjson_line(notes) for notes in MelodyGenerator('C', seq, 2).gen_sequence()).encode()
+    status, _, body = request(server, 'POST', '/melodies', {'key': 'C', 'seq': names, 'notes_per_chord': 2})
+    assert (status, body) == (200, expected)
+    # Chords can also be given as they appear in /chords output
+    chords = json.loads(json.dumps(seq, cls=KeyedChordEncoder))
+    assert request(server, 'POST', '/melodies', {'key': 'C', 'seq': chords, 'notes_per_chord': 2})[2] == expected
+
+
+def test_midi(server):
+    seq = [string_to_keyed_chord(name, 'C', -1) for name in ('Cmaj', 'Fmaj')]
+    melody = MelodyGenerator('C', seq, 1).gen_sequence()
+    notes = next(melody)
+    params = {'key': 'C', 'seq': ['Cmaj', 'Fmaj'], 'program': 5, 'melody': [n.scientific_notation() for n in notes]}
+    status, content_type, body = request(server, 'POST', '/midi', params)
+    assert (status, content_type) == (200, 'audio/midi')
+    assert body == write_midi_file(seq, notes, None, 5).to_bytes()
+
+
+@pytest.mark.parametrize('method,path,body,status', [
+    ('GET', '/nowhere', None, 404),
+    ('GET', '/chords', None, 405),
+    ('POST', '/chords', [], 400),
+    ('POST', '/chords', {'key': 'C', 'start': 'Cmaj'}, 400),
+    ('POST', '/chords', {'key': 'H', 'start': 'Cmaj', 'num': 3}, 400),
+    ('POST', '/chords', {'key': 'C', 'start': 'Bdim', 'num': 3}, 400),
+    ('POST', '/chords', {'key': 'C', 'start': 'Cmaj', 'num': '3'}, 400),
+    ('POST', '/chords', {'key': 'C', 'start': 'Cmaj', 'num': 3, 'shard': '3/3'}, 400),
+    ('POST', '/count', {'key': 'C', 'start': 'Cmaj', 'num': 0}, 400),
+    ('POST', '/melodies', {'key': 'C', 'seq': ['Cmaj'], 'notes_per_chord': 5}, 400),
+    ('POST', '/melodies', {'key': 'C', 'seq': []}, 400),
+    ('POST', '/midi', {'key': 'C', 'seq': ['Cmaj'], 'melody': ['X9']}, 400),
+    ('POST', '/midi', {'key': 'C', 'seq': ['Cmaj'], 'program': 200}, 400),
+])
+def test_errors(server, method, path, body, status):
+    connection = http.client.HTTPConnection(*server, timeout=30)
+    response_status, content_type, response_body = request(server, method, path, body, connection)
+    assert response_status == status
+    assert content_type == 'application/json'
+    assert 'error' in json.loads(response_body)
+    # The connection is still usable afterwards
+    assert request(server, 'GET', '/health', connection=connection)[0] == 200
+
+
+def test_malformed_request(server):
+    with socket.create_connection(server, timeout=30) as s:
+        s.sendall(b'nonsense\r\n\r\n')
+        assert s.recv(100).startswith(b'HTTP/1.1 400 Bad Request')
+
+
+def test_loadtest(server):
+    results = asyncio.run(loadtest.run_load(*server, requests=40, concurrency=4))
+    assert results['errors'] == 0
+    assert results['total']['requests'] == 40
+    assert set(results['by_request']) == set(loadtest.DEFAULT_MIX)
+    assert results['total']['p50_ms'] <= results['total']['p99_ms'] <= results['total']['max_ms']
+    assert loadtest.percentile([3, 1, 2, 4], 0.5) == 2
+
+
+def test_render_processes():
+    async def scenario():
+        mellowchord_server = MellowchordServer(workers=1)
+        address = await mellowchord_server.start('127.0.0.1', 0, keys=('C',))
+        try:
+            return await loadtest.run_load(*address, requests=4, concurrency=2, mix=('midi', 'chords'))
+        finally:
+            await mellowchord_server.close()
+    results = asyncio.run(scenario())
+    assert results['errors'] == 0
+    assert results['by_request']['midi']['requests'] == 2
@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+
+
+# Cumulative import time budget for "import mellowchord", in milliseconds.
+IMPORT_BUDGET_MS = float(os.environ.get('MELLOWCHORD_IMPORT_BUDGET_MS', 150))
+DEFERRED_MODULES = ('asyncio', 'configargparse', 'mido', 'networkx', 'readchar', 'sqlite3')
+
+
+def _import_times(statement):
+    """Return a dict of module name to cumulative import time in
+    microseconds, as reported by python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=str(Path(__file__).resolve().parents[2]),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| *(\S+)$', line)
+        if m:
+            times[m.group(2)] = int(m.group(1))
+    return times
+
+
+def test_import_defers_heavy_dependencies():
+    times = _import_times('import mellowchord; mellowchord.Chord(1, "maj")')
+    assert 'mellowchord' in times
+    for module in DEFERRED_MODULES:
+        assert module not in times
+
+
+def test_import_time_budget():
+    best = min(_import_times('import mellowchord')['mellowchord'] for _ in range(3))
+    assert best / 1000 < IMPORT_BUDGET_MS
+
+
+def test_main_imported_on_demand():
+    times = _import_times('from mellowchord import main')
+    assert 'mellowchord.cli' in times
+    assert 'configargparse' in times
+    for module in ('mido', 'networkx', 'readchar'):
+        assert module not in times
@@ -0,0 +1,263 @@
+from mellowchord import ChordMap
+from mellowchord import ChordStream
+from mellowchord import ConcurrentModificationError
+from mellowchord import EventRing
+from mellowchord import InvalidArgumentError
+from mellowchord import MellowchordError
+from mellowchord import NullOutputPort
+from mellowchord import StreamError
+from mellowchord import TransitionCounts
+from mellowchord.cli import main
+from mellowchord.cli import stream
+from mellowchord.stream import MELODY_CHANNEL
+from mellowchord.tests.maps import SMALL_MAP
+import copy
+import itertools
+import mido
+import pytest
+import random
+import tracemalloc
+
+
+class SimulatedClock(object):
+    """Clock whose sleeps take no real time, oversleeping by up to jitter
+    seconds."""
+    def __init__(self, jitter=0.0, seed=0):
+        self.now = 0.0
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + self._rng.uniform(0, self.jitter)
+
+
+class RecordingOutputPort(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+def sounding_after(messages):
+    sounding = set()
+    for message in messages:
+        if message.type == 'note_on':
+            assert (message.channel, message.note) not in sounding
+            sounding.add((message.channel, message.note))
+        elif message.type == 'note_off':
+            sounding.discard((message.channel, message.note))
+    return sounding
+
+
+def test_event_ring():
+    ring = EventRing(3)
+    assert len(ring) == 0 and ring.peek_time() is None
+    for step in range(10):
+        ring.push(step, f'a{step}')
+        ring.push(step + 0.5, f'b{step}')
+        assert len(ring) == 2 and ring.peek_time() == step
+        assert ring.pop() == (step, f'a{step}')
+        assert ring.pop() == (step + 0.5, f'b{step}')
+    for step in range(3):
+        ring.push(step, step)
+    with pytest.raises(StreamError):
+        ring.push(3, 3)
+    ring.clear()
+    assert len(ring) == 0
+    with pytest.raises(StreamError):
+        ring.pop()
+
+
+def test_walk():
+    cm = ChordMap('C', definition=copy.deepcopy(SMALL_MAP))
+    chords = [chord.name for chord in itertools.islice(cm.walk('Cmaj', random.Random(0)), 1000)]
+    assert chords[0] == 'Cmaj'
+    for chord, next_chord in zip(chords, chords[1:]):
+        assert next_chord in [successor.name for successor in cm.next_chords(chord, all_variants=True)]
+    assert [chord.name for chord in itertools.islice(cm.walk('Cmaj', random.Random(5)), 50)] == \
+        [chord.name for chord in itertools.islice(cm.walk('Cmaj', random.Random(5)), 50)]
+    # V/2 becomes a dead end, so it is never picked
+    cm.remove_edge('V/2', 'I')
+    chords = [chord.name for chord in itertools.islice(cm.walk('Cmaj', random.Random(0)), 1000)]
+    assert 'Fmaj' in chords and 'Gmaj/D' not in chords
+    with pytest.raises(InvalidArgumentError):
+        next(cm.walk('Gmaj/D'))
+    with pytest.raises(InvalidArgumentError):
+        next(cm.walk('Emin'))
+    walk = cm.walk('Cmaj')
+    next(walk)
+    cm.add_edge('V/2', 'I')
+    with pytest.raises(ConcurrentModificationError):
+        next(walk)
+
+
+def test_weighted_walk():
+    cm = ChordMap.for_key('C')
+    counts = TransitionCounts()
+    counts.add('C', [next(cm.walk('Cmaj')), cm.next_chords('Cmaj')[0]] * 50)
+    weighted = cm.weighted(counts)
+    chords = [chord.name for chord in itertools.islice(weighted.walk('Cmaj', random.Random(0)), 2000)]
+    first_suggestion = cm.next_chords('Cmaj')[0].name
+    after_cmaj = [chords[index + 1] for index in range(len(chords) - 1) if chords[index] == 'Cmaj']
+    assert after_cmaj.count(first_suggestion) > len(after_cmaj) / 2
+
+
+def test_soak():
+    # Over an hour and a half of playback, on a clock that oversleeps
+    clock = SimulatedClock(jitter=0.002)
+    memory = []
+    bars_rendered = [0]
+
+    class Port(object):
+        num_messages = 0
+
+        def send(self, message):
+            self.num_messages += 1
+            if self.num_messages in (20000, 30000):
+                memory.append(tracemalloc.get_traced_memory()[0])
+
+    def on_bar(chord, melody):
+        # Generation stays bars_ahead bars ahead of playback
+        assert bars_rendered[0] * chord_stream.bar_seconds <= clock.now + 4 * chord_stream.bar_seconds
+        bars_rendered[0] += 1
+
+    port = Port()
+    chord_stream = ChordStream(ChordMap.for_key('C', -1), 'Cmaj', port, rng=random.Random(3), on_bar=on_bar,
+                               clock=clock, sleep=clock.sleep)
+    tracemalloc.start()
+    try:
+        assert chord_stream.run(max_bars=3000) == 3000
+    finally:
+        tracemalloc.stop()
+    assert len(memory) == 2 and memory[1] - memory[0] < 16384
+    assert chord_stream.num_bars == bars_rendered[0] == 3000
+    assert chord_stream.num_messages + 2 == port.num_messages
+    assert len(chord_stream.lateness) == 10000
+    # Lateness never builds up, so the last bar ends on time
+    assert chord_stream.max_lateness < 0.0025
+    assert abs(clock.now - 3000 * chord_stream.bar_seconds) < 0.02
+
+
+def test_bars_ahead_and_melodies():
+    clock = SimulatedClock()
+    bars = []
+    port = RecordingOutputPort()
+
+    def on_bar(chord, melody):
+        assert len(bars) * chord_stream.bar_seconds <= clock.now + 3 * chord_stream.bar_seconds
+        bars.append((chord, melody))
+
+    chord_stream = ChordStream(ChordMap.for_key('C', -1), 'Cmaj', port, notes_per_chord=3, bars_ahead=3,
+                               rng=random.Random(2), on_bar=on_bar, clock=clock, sleep=clock.sleep)
+    assert chord_stream.run(max_bars=200) == 200
+    assert len(bars) == 200
+    for (chord, melody), (next_chord, _) in zip(bars, bars[1:]):
+        assert len(melody) == 3
+        assert all(note in chord.notes for note in melody[:-1])
+        assert melody[-1] in chord.notes + next_chord.notes
+    melody_notes = [message.note for message in port.messages
+                    if message.type == 'note_on' and message.channel == MELODY_CHANNEL]
+    assert melody_notes == [note.midi_note() for _, melody in bars for note in melody]
+    assert not sounding_after(port.messages)
+
+
+def test_seed_and_stop():
+    def play(seed, **kwargs):
+        clock = SimulatedClock()
+        port = RecordingOutputPort()
+        chord_stream = ChordStream(ChordMap.for_key('F', -1), 'Fmaj', port, rng=random.Random(seed), clock=clock,
+                                   sleep=clock.sleep)
+        return chord_stream, port, chord_stream.run(**kwargs)
+
+    _, first, _ = play(7, max_bars=100)
+    _, second, _ = play(7, max_bars=100)
+    _, other, _ = play(8, max_bars=100)
+    assert first.messages == second.messages != other.messages
+    assert first.messages[0].type == 'program_change'
+    # Stopping part way through a bar stops the notes playing
+    chord_stream, port, played = play(7, max_seconds=5.1)
+    assert played == 3 and chord_stream.num_bars == 3
+    assert port.messages[-1].type == 'note_off'
+    assert not sounding_after(port.messages)
+    assert port.messages[:30] == first.messages[:30]
+    # The next run carries on the progression
+    assert chord_stream.run(max_bars=1) == 1 and chord_stream.num_bars == 4
+
+
+def test_lateness():
+    # Every sleep overshoots by exactly 1/64 s, so no message is later than
+    # that, and those waited for are exactly that late
+    clock = SimulatedClock()
+
+    def sleep(seconds):
+        clock.now += seconds + 1 / 64
+
+    chord_stream = ChordStream(ChordMap.for_key('C', -1), 'Cmaj', NullOutputPort(), rng=random.Random(0),
+                               clock=clock, sleep=sleep)
+    assert chord_stream.run(max_bars=5) == 5
+    assert chord_stream.output_port.num_messages == chord_stream.num_messages + 2
+    assert len(chord_stream.lateness) == chord_stream.num_messages
+    assert all(0 <= lateness <= 1 / 64 + 1e-9 for lateness in chord_stream.lateness)
+    assert chord_stream.lateness_percentile(0) == 0
+    assert chord_stream.lateness_percentile(0.99) == chord_stream.max_lateness == pytest.approx(1 / 64)
+
+
+def test_bad_arguments():
+    cm = ChordMap.for_key('C', -1)
+    for kwargs in ({'notes_per_chord': 5}, {'bpm': 0}, {'bars_ahead': 0}):
+        with pytest.raises(InvalidArgumentError):
+            ChordStream(cm, 'Cmaj', NullOutputPort(), **kwargs)
+    with pytest.raises(InvalidArgumentError):
+        ChordStream(cm, 'C#dim', NullOutputPort())
+
+
+def test_cli(monkeypatch, capsys):
+    ports = []
+
+    def open_output(name=None):
+        ports.append(NullOutputPort(name))
+        return ports[-1]
+    monkeypatch.setattr(mido, 'open_output', open_output)
+    chord_stream = stream('G', 'Gmaj', 'synth', bpm=2400, seed=1, max_bars=3)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Playing chords in G from Gmaj on synth, Ctrl-C to stop'
+    assert lines[1].startswith('3 bars, ') and ' lateness p50 ' in lines[1]
+    assert chord_stream.num_bars == 3 and ports[0].closed
+    with pytest.raises(InvalidArgumentError):
+        stream('G', 'C#dim', 'synth', max_bars=1)
+
+    def no_backend(name=None):
+        raise ImportError('no backend')
+    monkeypatch.setattr(mido, 'open_output', no_backend)
+    with pytest.raises(MellowchordError):
+        stream('G', 'Gmaj', max_bars=1)
+
+
+def test_main(monkeypatch, tmp_path, capsys):
+    ports = []
+
+    class Port(RecordingOutputPort):
+        name = 'synth'
+
+        def close(self):
+            pass
+
+    def open_output(name=None):
+        ports.append(Port())
+        return ports[-1]
+    monkeypatch.setattr(mido, 'open_output', open_output)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    # The program is mc's own -p option, as it is for every command
+    monkeypatch.setattr('sys.argv', ['mc', '-p', '5', 'stream', 'C', 'Cmaj', '--bpm', '2400', '--bars', '2',
+                                     '--notes_per_chord', '3'])
+    main()
+    assert capsys.readouterr().out.startswith('Playing chords in C from Cmaj on synth')
+    programs = [message.program for message in ports[0].messages if message.type == 'program_change']
+    assert programs == [5, 5]
+    melody_notes = [message for message in ports[0].messages
+                    if message.type == 'note_on' and message.channel == MELODY_CHANNEL]
+    assert len(melody_notes) == 6
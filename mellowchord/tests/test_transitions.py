@@ -0,0 +1,209 @@
+from mellowchord import Chord
+from mellowchord import chord_sequence_ndjson_line
+from mellowchord import ChordMap
+from mellowchord import FrozenMapError
+from mellowchord import InvalidArgumentError
+from mellowchord import string_to_chord
+from mellowchord import train_transition_counts
+from mellowchord import TransitionCounts
+from mellowchord import TransitionCountsError
+from mellowchord import write_chord_sequence_json
+from mellowchord import write_library
+from mellowchord.cli import chordgen
+from mellowchord.cli import train
+from mellowchord.transitions import chord_from_index
+from mellowchord.transitions import chord_index
+from mellowchord.transitions import NUM_CHORDS
+import collections
+import itertools
+import json
+import pickle
+import pytest
+import random
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return list(ChordMap.for_key('C', -1).gen_sequence('Cmaj', 5))
+
+
+def chord_names(seq):
+    return [chord.name for chord in seq]
+
+
+def test_chord_index():
+    indexes = set()
+    for index in range(NUM_CHORDS):
+        chord = chord_from_index(index)
+        assert chord_index(chord.degree, chord.chord_type, chord.inversion) == index
+        indexes.add(index)
+    assert len(indexes) == NUM_CHORDS
+    assert chord_index(5, '7', None) == chord_index(5, 'dom7', None)
+    for bad in ((0, 'maj', None), (1, 'nope', None), (1, 'maj', 3)):
+        with pytest.raises(TransitionCountsError):
+            chord_index(*bad)
+
+
+def test_counts(sequences):
+    counts = TransitionCounts()
+    counts.update(('C', seq) for seq in sequences)
+    counts.add('Amin', [string_to_chord('Amin', 'Amin'), string_to_chord('Emin', 'Amin')])
+    assert counts.num_sequences == len(sequences) + 1
+    assert counts.num_transitions == 4 * len(sequences) + 1
+    expected = collections.Counter((a.name, b.name) for seq in sequences for a, b in zip(seq, seq[1:]))
+    I, IV = Chord(1, 'maj'), Chord(4, 'maj')
+    assert counts.count(I, IV) == expected[('Cmaj', 'Fmaj')]
+    assert counts.count(I, IV, minor=True) == 0
+    assert counts.count(Chord(1, 'min'), Chord(5, 'min'), minor=True) == 1
+    assert counts.start_count(I) == len(sequences)
+    assert counts.probability(Chord(1, 'min'), Chord(5, 'min'), minor=True) == 1
+    assert counts.probability(Chord(7, 'dim'), I) == 0
+    assert sum(n for _, _, n in counts.transitions()) == 4 * len(sequences)
+    assert sum(counts.probability(I, b) for b in {b for a, b, _ in counts.transitions() if a == I}) == \
+        pytest.approx(1)
+
+
+def test_files(sequences, tmp_path):
+    expected = TransitionCounts()
+    expected.update(('C', seq) for seq in sequences)
+    ndjson_path = str(tmp_path / 'corpus.ndjson')
+    with open(ndjson_path, 'w') as f:
+        for seq in sequences:
+            f.write(chord_sequence_ndjson_line('C', seq))
+        f.write('\n')
+    library_path = str(tmp_path / 'corpus.mcl')
+    write_library(library_path, sequences)
+    json_path = str(tmp_path / 'one.json')
+    write_chord_sequence_json(json_path, 'C', sequences[0])
+    for paths in ([ndjson_path], [library_path]):
+        counts = TransitionCounts()
+        assert counts.add_files(paths) == len(sequences)
+        assert counts == expected
+    counts = TransitionCounts()
+    counts.add_files([json_path])
+    single = TransitionCounts()
+    single.add('C', sequences[0])
+    assert counts == single
+    bad_path = str(tmp_path / 'bad.ndjson')
+    with open(bad_path, 'w') as f:
+        f.write(chord_sequence_ndjson_line('C', sequences[0]))
+        f.write('{"key": "C", "seq": [{"degree": 9, "chord_type": "maj", "inversion": null}]}\n')
+    with pytest.raises(TransitionCountsError, match='line 2'):
+        TransitionCounts().add_files([bad_path])
+
+
+def test_merge_and_train(sequences, tmp_path):
+    paths = []
+    for index in range(6):
+        paths.append(str(tmp_path / f'{index}.ndjson'))
+        with open(paths[-1], 'w') as f:
+            for seq in sequences[index::6]:
+                f.write(chord_sequence_ndjson_line('C', seq))
+    expected = TransitionCounts()
+    expected.add_files(paths)
+    merged = TransitionCounts()
+    for path in paths:
+        part = TransitionCounts()
+        part.add_files([path])
+        merged += part
+    assert merged == expected
+    assert (merged.num_sequences, merged.num_transitions) == (expected.num_sequences, expected.num_transitions)
+    assert train_transition_counts(paths, workers=1) == expected
+    assert train_transition_counts(paths, workers=2) == expected
+    assert pickle.loads(pickle.dumps(expected)) == expected
+
+
+def test_save_and_load(sequences, tmp_path):
+    counts = TransitionCounts()
+    counts.update(('C', seq) for seq in sequences)
+    counts.add('Amin', [string_to_chord('Amin', 'Amin'), string_to_chord('Dmin/A', 'Amin')])
+    path = str(tmp_path / 'counts.json')
+    counts.save(path)
+    loaded = TransitionCounts.load(path)
+    assert loaded == counts
+    assert loaded.num_sequences == counts.num_sequences
+    for bad in ('not json', '{"version": 2}', '{"version": 1, "major": {}}'):
+        with open(path, 'w') as f:
+            f.write(bad)
+        with pytest.raises(TransitionCountsError):
+            TransitionCounts.load(path)
+
+
+def test_weighted_order():
+    counts = TransitionCounts()
+    # vi is heard after I twice, V/2 once
+    for names in (['Cmaj', 'Amin'], ['Cmaj', 'Amin'], ['Cmaj', 'Gmaj/D']):
+        counts.add('C', [string_to_chord(name, 'C') for name in names])
+    cm = ChordMap('C')
+    weighted = cm.weighted(counts)
+    assert weighted.frozen
+    with pytest.raises(FrozenMapError):
+        weighted.key = 'D'
+    assert [c.name for c in cm.next_chords('Cmaj')] == ['Fmaj/C', 'Gmaj/D', 'Fmaj']
+    # Amin isn't a successor of I in the map, so only the order of what is
+    # changes
+    assert [c.name for c in weighted.next_chords('Cmaj')] == ['Gmaj/D', 'Fmaj/C', 'Fmaj']
+    assert chord_names(next(weighted.gen_sequence('Cmaj', 2))) == ['Cmaj', 'Gmaj/D']
+    # Every sequence is still produced exactly once, and counts agree
+    unweighted = sorted(tuple(chord_names(seq)) for seq in cm.gen_sequence('Cmaj', 6))
+    assert sorted(tuple(chord_names(seq)) for seq in weighted.gen_sequence('Cmaj', 6)) == unweighted
+    assert weighted.count_sequences('Cmaj', 6) == len(unweighted)
+    assert not cm.frozen
+
+
+def test_sample_sequences():
+    counts = TransitionCounts()
+    for _ in range(9):
+        counts.add('C', [string_to_chord('Cmaj', 'C'), string_to_chord('Fmaj/C', 'C')])
+    weighted = ChordMap('C', -1).weighted(counts, smoothing=1)
+    samples = list(weighted.sample_sequences('Cmaj', 2, count=2000, rng=random.Random(1)))
+    assert len(samples) == 2000
+    seconds = collections.Counter(seq[1].name for seq in samples)
+    # Weights are 10 for IV/1 and 1 for the other two successors
+    assert seconds['Fmaj/C'] / 2000 == pytest.approx(10 / 12, abs=0.03)
+    uniform_samples = ChordMap('C').sample_sequences('Cmaj', 2, 3000, random.Random(2))
+    uniform = collections.Counter(seq[1].name for seq in uniform_samples)
+    assert all(abs(n / 3000 - 1 / 3) < 0.05 for n in uniform.values())
+    generated = {tuple(chord_names(seq)) for seq in ChordMap('C', -1).gen_sequence('Cmaj', 4)}
+    rng = random.Random(3)
+    assert all(tuple(chord_names(seq)) in generated
+               for seq in itertools.islice(weighted.sample_sequences('Cmaj', 4, rng=rng), 200))
+    a = list(weighted.sample_sequences('Cmaj', 5, 10, random.Random(7)))
+    assert a == list(weighted.sample_sequences('Cmaj', 5, 10, random.Random(7)))
+
+
+def test_sample_avoids_dead_ends():
+    definition = {'version': 1, 'major': {
+        'nodes': {'I': ['Imaj'], 'IV': ['IVmaj'], 'V': ['Vmaj']},
+        'edges': [['I', 'IV'], ['I', 'V'], ['V', 'I']]}, 'minor': {'nodes': {'i': ['imin']}}}
+    cm = ChordMap('C', definition=definition)
+    # IV has no successors, so it can only be the last chord
+    assert {tuple(chord_names(seq)) for seq in cm.sample_sequences('Cmaj', 4, 50, random.Random(0))} == \
+        {('Cmaj', 'Gmaj', 'Cmaj', 'Gmaj'), ('Cmaj', 'Gmaj', 'Cmaj', 'Fmaj')}
+    with pytest.raises(InvalidArgumentError):
+        next(cm.sample_sequences('Fmaj', 2))
+
+
+def test_cli(sequences, tmp_path, capsys):
+    corpus = str(tmp_path / 'corpus.ndjson')
+    with open(corpus, 'w') as f:
+        for seq in sequences[:5]:
+            f.write(chord_sequence_ndjson_line('C', seq))
+    weights = str(tmp_path / 'weights.json')
+    counts = train([corpus], weights, 1)
+    assert counts.num_sequences == 5
+    assert 'sequences/s' in capsys.readouterr().out
+    output = str(tmp_path / 'out.ndjson')
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, ndjson=output, weights=weights)
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(sequences)
+    first = [c['degree'] for c in json.loads(lines[0])['seq']]
+    assert first == [c.degree for c in sequences[0]]
+    chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, ndjson=output, weights=weights, sample=7, seed=1)
+    with open(output) as f:
+        assert len(f.read().splitlines()) == 7
+    with pytest.raises(InvalidArgumentError):
+        chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, ndjson=output, sample=7, shard='0/2')
+    with pytest.raises(InvalidArgumentError):
+        chordgen('C', 'Cmaj', 5, str(tmp_path), 0, False, ndjson=output, weights=weights, all_keys=True)
@@ -0,0 +1,73 @@
+from mellowchord import ALL_KEYS
+from mellowchord import Chord
+from mellowchord import ChordMap
+from mellowchord import gen_sequence_all_keys
+from mellowchord import InvalidArgumentError
+from mellowchord import KeyedChord
+from mellowchord import key_is_minor
+from mellowchord import MAJOR_KEYS
+from mellowchord import MINOR_KEYS
+from mellowchord import Shard
+from mellowchord import Transposer
+import pytest
+
+
+def _describe(seq):
+    return [(str(kc), kc.scientific_notation(), kc.key, kc.degree, kc.chord_type, kc.inversion, kc.octave_adjustment)
+            for kc in seq]
+
+
+def test_keys():
+    assert len(ALL_KEYS) == 24
+    assert not any(key_is_minor(key) for key in MAJOR_KEYS)
+    assert all(key_is_minor(key) for key in MINOR_KEYS)
+
+
+@pytest.mark.parametrize('start_key,start', [('C', 'Cmaj'), ('C', 'Dmin'), ('Amin', 'Fmaj'), ('G', 'Gmaj7')])
+def test_matches_per_key_generation(start_key, start):
+    by_key = {}
+    for key, seq in gen_sequence_all_keys(start, 5, start_key=start_key, octave_adjustment=-1):
+        by_key.setdefault(key, []).append(_describe(seq))
+    position = None
+    for node_index, node in enumerate(ChordMap(start_key)._g.nodes):
+        for chord_index, chord in enumerate(node.chords):
+            if KeyedChord(start_key, chord).name == start:
+                position = (node_index, chord_index)
+    assert position is not None
+    node_index, chord_index = position
+    for key in ALL_KEYS:
+        cm = ChordMap(key, octave_adjustment=-1)
+        key_start = cm._g.nodes[node_index].chords[chord_index]
+        expected = [_describe(seq) for seq in cm.gen_sequence(KeyedChord(key, key_start).name, 5)]
+        assert by_key[key] == expected
+
+
+def test_major_only_chord():
+    keys = set(key for key, seq in gen_sequence_all_keys('Emaj', 3, start_key='C'))
+    assert keys == set(MAJOR_KEYS)
+
+
+def test_key_subset_and_order():
+    results = list(gen_sequence_all_keys('Cmaj', 3, keys=['G', 'Dmin', 'F']))
+    assert [key for key, seq in results[:3]] == ['G', 'F', 'G']
+    assert results[-1][0] == 'Dmin'
+
+
+def test_invalid_start():
+    with pytest.raises(InvalidArgumentError):
+        list(gen_sequence_all_keys('Bbmin', 3))
+
+
+def test_transposer_shares_chords():
+    transposer = Transposer()
+    first = transposer.transpose([Chord(1, 'maj'), Chord(4, 'maj')], 'D')
+    second = transposer.transpose([Chord(4, 'maj'), Chord(1, 'maj')], 'D')
+    assert [str(kc) for kc in first] == ['Dmaj', 'Gmaj']
+    assert first[0] is second[1]
+
+
+def test_gen_sequence_all_keys_shards():
+    everything = list(gen_sequence_all_keys('Cmaj', 4))
+    sharded = [item for index in range(5) for item in gen_sequence_all_keys('Cmaj', 4, shard=Shard(index, 5))]
+    assert len(sharded) == len(everything)
+    assert sorted(sharded, key=lambda item: everything.index(item)) == everything
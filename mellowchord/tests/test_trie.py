@@ -0,0 +1,94 @@
+from mellowchord import Chord
+from mellowchord import ChordLibrary
+from mellowchord import ChordMap
+from mellowchord import InvalidArgumentError
+from mellowchord import KeyedChord
+from mellowchord import read_chord_sequence_ndjson
+from mellowchord import SequenceTrie
+from mellowchord import string_to_keyed_chord
+import pytest
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return list(ChordMap.for_key('C').gen_sequence('Cmaj', 7))
+
+
+def names(seqs):
+    return [[kc.name for kc in seq] for seq in seqs]
+
+
+def test_from_enumeration(sequences):
+    trie = SequenceTrie(ChordMap.for_key('C').gen_sequence('Cmaj', 7))
+    assert len(trie) == len(sequences)
+    assert list(trie) == sequences
+    assert all(seq in trie for seq in sequences)
+    # Equal chords that are different objects are found too
+    copy = [string_to_keyed_chord(kc.name, 'C', 0) for kc in sequences[17]]
+    assert copy in trie
+    assert copy[:-1] not in trie
+    assert [KeyedChord('D', Chord(1, 'maj'))] not in trie
+    assert trie.num_nodes < len(sequences) * 2
+
+
+def test_add(sequences):
+    trie = SequenceTrie()
+    assert trie.update(reversed(sequences)) == len(sequences)
+    assert not trie.add(sequences[3])
+    assert trie.update(sequences) == 0
+    assert len(trie) == len(sequences)
+    assert sorted(names(trie)) == sorted(names(sequences))
+    # A sequence can be a prefix of another
+    assert trie.add(sequences[3][:4])
+    assert sequences[3][:4] in trie
+    assert len(trie) == len(sequences) + 1
+    with pytest.raises(InvalidArgumentError):
+        trie.add([])
+
+
+def test_iteration_order():
+    one, four, five, six = (Chord(1, 'maj'), Chord(4, 'maj'), Chord(5, 'maj'), Chord(6, 'min'))
+    trie = SequenceTrie([[one, four], [five, one], [one, six], [one]])
+    # Grouped by prefix, not in the order added
+    assert list(trie) == [[one], [one, four], [one, six], [five, one]]
+
+
+def test_prefix_queries(sequences):
+    trie = SequenceTrie(sequences)
+    for seq in sequences[::50]:
+        for length in range(1, 8):
+            prefix = seq[:length]
+            expected = [s for s in sequences if names([s[:length]]) == names([prefix])]
+            assert list(trie.with_prefix(prefix)) == expected
+            assert trie.count(prefix) == len(expected)
+    assert trie.count() == len(sequences)
+    missing = [string_to_keyed_chord('Cmaj', 'C', 0), string_to_keyed_chord('Bdim', 'C', 0)]
+    assert list(trie.with_prefix(missing)) == []
+    assert trie.count(missing) == 0
+
+
+def test_key_independent_sequences():
+    cm = ChordMap.for_key('C')
+    chord_sequences = list(cm.gen_chord_sequence('Cmaj', 6))
+    trie = SequenceTrie(cm.gen_chord_sequence('Cmaj', 6))
+    assert [tuple(seq) for seq in trie] == chord_sequences
+    assert chord_sequences[-1] in trie
+
+
+def test_memory_report(sequences):
+    report = SequenceTrie(sequences).memory_report()
+    assert report['sequences'] == len(sequences)
+    assert report['trie_bytes_per_sequence'] * 5 < report['list_bytes_per_sequence']
+    assert SequenceTrie().memory_report()['trie_bytes_per_sequence'] == 0.0
+
+
+def test_export(sequences, tmp_path):
+    trie = SequenceTrie(sequences)
+    library_path = str(tmp_path / 'out.mcl')
+    assert trie.export(library_path) == len(sequences)
+    with ChordLibrary(library_path) as library:
+        assert names(library) == names(sequences)
+    ndjson_path = str(tmp_path / 'out.ndjson')
+    assert trie.export(ndjson_path) == len(sequences)
+    with open(ndjson_path) as f:
+        assert names(seq for _, seq in read_chord_sequence_ndjson(f)) == names(sequences)
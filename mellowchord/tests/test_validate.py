@@ -0,0 +1,150 @@
+from mellowchord import ChordMap
+from mellowchord import compose_ndjson_line
+from mellowchord import MelodyGenerator
+from mellowchord import melody_ndjson_line
+from mellowchord import MelodyStreamValidator
+from mellowchord import MelodyValidationError
+from mellowchord import pack_melodies
+from mellowchord import slot_masks
+from mellowchord import validate_melodies
+from mellowchord import write_chord_sequence_json
+from mellowchord.cli import validate
+import io
+import itertools
+import json
+import pytest
+import random
+
+
+@pytest.fixture(scope='module')
+def seq():
+    return next(ChordMap('C', -1).gen_sequence('Cmaj', 4))
+
+
+def first_violation(seq, notes_per_chord, melody):
+    """Check melody note by note, as test_melody_generator does, by pitch
+    class."""
+    for x, note in enumerate(melody):
+        this_chord_index = x // notes_per_chord
+        allowed = list(seq[this_chord_index].notes)
+        if x % notes_per_chord == notes_per_chord - 1 and x % notes_per_chord and this_chord_index < len(seq) - 1:
+            allowed += seq[this_chord_index + 1].notes
+        if note % 12 not in {n.midi_note() % 12 for n in allowed}:
+            return x
+    return None
+
+
+@pytest.mark.parametrize('notes_per_chord', [1, 2, 3, 4])
+def test_generated_melodies_pass(seq, notes_per_chord):
+    masks = slot_masks('C', seq, notes_per_chord)
+    assert len(masks) == len(seq) * notes_per_chord
+    melodies = [[note.midi_note() for note in notes] for notes in
+                itertools.islice(MelodyGenerator('C', seq, notes_per_chord).gen_sequence(), 5000)]
+    result = validate_melodies(masks, melodies)
+    assert len(result) == len(melodies)
+    assert result.num_failed == 0 and list(result.failures()) == []
+    assert result.passed == b'\x01' * len(melodies)
+
+
+@pytest.mark.parametrize('notes_per_chord', [1, 2, 3, 4])
+def test_matches_note_by_note(seq, notes_per_chord):
+    rng = random.Random(notes_per_chord)
+    masks = slot_masks('C', seq, notes_per_chord)
+    generated = list(itertools.islice(MelodyGenerator('C', seq, notes_per_chord).gen_sequence(), 1000))
+    melodies = []
+    for notes in generated:
+        melody = [note.midi_note() for note in notes]
+        # Move about a third of the melodies' notes off by a semitone or
+        # an octave
+        for _ in range(rng.randrange(3)):
+            melody[rng.randrange(len(melody))] += rng.choice((1, -1, 12))
+        melodies.append(melody)
+    result = validate_melodies(masks, pack_melodies(melodies, len(masks)))
+    expected = [first_violation(seq, notes_per_chord, melody) for melody in melodies]
+    assert [result.first_violation(index) for index in range(len(melodies))] == expected
+    assert list(result.failures()) == [(index, slot) for index, slot in enumerate(expected) if slot is not None]
+    assert result.num_failed == sum(slot is not None for slot in expected) > 0
+
+
+def test_long_melodies():
+    # Over 255 slots, slot numbers no longer fit in a byte
+    seq = next(ChordMap('C', -1).gen_sequence('Cmaj', 80))
+    masks = slot_masks('C', seq, 4)
+    melody = [note.midi_note() for note in next(MelodyGenerator('C', seq, 4).gen_sequence())]
+    bad = list(melody)
+    bad[300] += 1
+    result = validate_melodies(masks, [melody, bad, melody])
+    assert list(result.failures()) == [(1, 300)]
+    assert result.first_violation(0) is None and result.first_violation(1) == 300
+
+
+def test_bad_batches(seq):
+    masks = slot_masks('C', seq, 1)
+    with pytest.raises(MelodyValidationError):
+        validate_melodies(masks, b'\x3c' * 5)
+    with pytest.raises(MelodyValidationError):
+        validate_melodies(masks, [[60, 64, 67]])
+    with pytest.raises(MelodyValidationError):
+        validate_melodies(masks, [[60, 65, 67, 300]])
+    with pytest.raises(MelodyValidationError):
+        validate_melodies([], b'')
+    # Bytes that aren't MIDI notes never fit
+    assert validate_melodies(masks, bytes([60, 65, 67, 60 + 128])).first_violation(0) == 3
+
+
+def test_stream_validator(seq):
+    lines = []
+    for other in itertools.islice(ChordMap('C', -1).gen_sequence('Cmaj', 3), 4):
+        for notes in itertools.islice(MelodyGenerator('C', other, 2).gen_sequence(), 30):
+            lines.append(compose_ndjson_line('C', other, notes))
+    validator = MelodyStreamValidator(batch_size=7)
+    assert list(validator.check(io.StringIO(''.join(lines) + '\n'))) == []
+    assert validator.num_checked == 120 and validator.num_failed == 0
+    bad = json.loads(lines[5])
+    bad['melody'][0] = 'C#4'
+    failures = list(validator.check(io.StringIO(lines[0] + json.dumps(bad))))
+    assert [(line_number, slot, note, str(chord)) for line_number, slot, note, chord in failures] == \
+        [(2, 0, 'C#4', 'Cmaj')]
+    melodies = io.StringIO(melody_ndjson_line(next(MelodyGenerator('C', seq, 1).gen_sequence())))
+    with pytest.raises(MelodyValidationError):
+        list(MelodyStreamValidator().check(melodies))
+    melodies.seek(0)
+    assert list(MelodyStreamValidator('C', seq).check(melodies)) == []
+    for bad_line in ('{"melody": ["C4"]}\n', '{"melody": ["H4", "C4", "C4", "C4"]}\n', 'not json\n'):
+        with pytest.raises(MelodyValidationError):
+            list(MelodyStreamValidator('C', seq).check(io.StringIO(bad_line)))
+
+
+def test_stream_validator_bounded_cache():
+    lines = []
+    bad = []
+    for index, other in enumerate(itertools.islice(ChordMap('C', -1).gen_sequence('Cmaj', 4), 50)):
+        for notes in itertools.islice(MelodyGenerator('C', other, 1).gen_sequence(), 3):
+            line = json.loads(compose_ndjson_line('C', other, notes))
+            if index % 7 == 0:
+                line['melody'][1] = 'C#4'
+                bad.append(len(lines) + 1)
+            lines.append(json.dumps(line) + '\n')
+    # Coming back to a sequence whose masks were dropped builds them again
+    text = ''.join(lines + lines[:6])
+    bad += [len(lines) + line_number for line_number in bad if line_number <= 6]
+    bounded = MelodyStreamValidator(batch_size=2, masks_cache_size=2)
+    failures = list(bounded.check(io.StringIO(text)))
+    assert len(bounded._masks) == 2
+    assert failures == list(MelodyStreamValidator(batch_size=2).check(io.StringIO(text)))
+    assert [line_number for line_number, _, _, _ in failures] == bad
+
+
+def test_cli(seq, tmp_path, capsys):
+    chords_path = str(tmp_path / 'seq.json')
+    write_chord_sequence_json(chords_path, 'C', seq)
+    melodies_path = str(tmp_path / 'melodies.ndjson')
+    with open(melodies_path, 'w') as f:
+        for notes in itertools.islice(MelodyGenerator('C', seq, 2).gen_sequence(), 100):
+            f.write(melody_ndjson_line(notes))
+        f.write('{"melody": ["C4", "D4", "F4", "A4", "G4", "B4", "C4", "E4"]}\n')
+    validator = validate([melodies_path], chords_path)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == f'{melodies_path} line 101: note 2 (D4) doesn\'t fit Cmaj'
+    assert lines[1].startswith('Checked 101 melodies in ') and lines[1].endswith(': 1 failed')
+    assert (validator.num_checked, validator.num_failed) == (101, 1)
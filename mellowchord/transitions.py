@@ -0,0 +1,267 @@
+"""Chord transition counts learned from a corpus of chord sequences.
+
+TransitionCounts keeps, for major and for minor keys, a dense matrix of
+how often each key independent chord (degree, chord type and inversion) is
+followed by each other chord, and how often each chord starts a sequence.
+Counting never builds KeyedChords: JSON and NDJSON are read as plain dicts
+and libraries as packed records, so a corpus of any size streams through
+in constant memory.  Counts made by separate workers are merged by adding
+their matrices.
+
+ChordMap.weighted attaches counts to a map for weighted ordering and
+sampling.
+"""
+from array import array
+import json
+import os
+
+import musthe
+
+from .library import ChordLibrary
+from .mellowchord import Chord
+from .mellowchord import key_is_minor
+from .mellowchord import MellowchordError
+from .mellowchord import parse_map_chord
+
+
+TRANSITIONS_FORMAT_VERSION = 1
+CHORD_TYPES = tuple(t for t in musthe.Chord.valid_types if t not in musthe.Chord.aliases)
+_TYPE_INDEX = dict((t, index) for index, t in enumerate(CHORD_TYPES))
+_TYPE_INDEX.update((alias, _TYPE_INDEX[t]) for alias, t in musthe.Chord.aliases.items())
+_INVERSIONS = (None, 1, 2)
+NUM_CHORDS = 7 * len(CHORD_TYPES) * len(_INVERSIONS)
+
+
+class TransitionCountsError(MellowchordError):
+    pass
+
+
+def chord_index(degree, chord_type, inversion):
+    """Return the row of a chord in the transition matrices."""
+    if not 1 <= degree <= 7 or chord_type not in _TYPE_INDEX or inversion not in _INVERSIONS:
+        raise TransitionCountsError(f'Not a chord: degree {degree!r}, type {chord_type!r}, inversion {inversion!r}')
+    return ((degree - 1) * len(CHORD_TYPES) + _TYPE_INDEX[chord_type]) * len(_INVERSIONS) + (inversion or 0)
+
+
+def chord_from_index(index):
+    """Return the Chord in row index of the transition matrices."""
+    index, inversion_index = divmod(index, len(_INVERSIONS))
+    degree_index, type_index = divmod(index, len(CHORD_TYPES))
+    return Chord(degree_index + 1, CHORD_TYPES[type_index], _INVERSIONS[inversion_index])
+
+
+class TransitionCounts(object):
+    """How often each chord follows each other in a corpus, separately
+    for major and minor keys."""
+    _minor_keys = {}
+
+    def __init__(self):
+        self._starts = (array('Q', bytes(8 * NUM_CHORDS)), array('Q', bytes(8 * NUM_CHORDS)))
+        self._transitions = (array('Q', bytes(8 * NUM_CHORDS * NUM_CHORDS)),
+                             array('Q', bytes(8 * NUM_CHORDS * NUM_CHORDS)))
+        self.num_sequences = 0
+        self.num_transitions = 0
+        # Rows of chords as they appear in JSON, by (degree, chord_type,
+        # inversion)
+        self._rows = {}
+
+    @classmethod
+    def _is_minor(cls, key):
+        try:
+            return cls._minor_keys[key]
+        except KeyError:
+            minor = cls._minor_keys[key] = key_is_minor(key)
+            return minor
+
+    def _row(self, degree, chord_type, inversion):
+        attributes = (degree, chord_type, inversion)
+        try:
+            return self._rows[attributes]
+        except KeyError:
+            row = self._rows[attributes] = chord_index(*attributes)
+            return row
+
+    def _add_rows(self, minor, rows):
+        if not rows:
+            return
+        transitions = self._transitions[minor]
+        self._starts[minor][rows[0]] += 1
+        for from_row, to_row in zip(rows, rows[1:]):
+            transitions[from_row * NUM_CHORDS + to_row] += 1
+        self.num_sequences += 1
+        self.num_transitions += len(rows) - 1
+
+    def add(self, key, seq):
+        """Count the transitions of seq, a sequence of KeyedChord or Chord
+        objects in key."""
+        self._add_rows(self._is_minor(key), [self._row(c.degree, c.chord_type, c.inversion) for c in seq])
+
+    def update(self, sequences):
+        """Count every (key, chord_sequence) tuple of sequences."""
+        for key, seq in sequences:
+            self.add(key, seq)
+
+    def _add_json(self, sequence_dict, where):
+        try:
+            rows = [self._row(c['degree'], c['chord_type'], c['inversion']) for c in sequence_dict['seq']]
+            self._add_rows(self._is_minor(sequence_dict['key']), rows)
+        except (KeyError, TypeError, MellowchordError) as e:
+            raise TransitionCountsError(f'{where} is not a chord sequence: {e!r}')
+
+    def _add_library(self, path):
+        with ChordLibrary(path) as library:
+            minor = [self._is_minor(key) for key in library.keys]
+            # Rows by the degree and inversion byte and chord type byte of
+            # packed chords
+            rows = {}
+            for index in range(len(library)):
+                record = library.record_bytes(index)
+                packed = [record[i + 1:i + 3] for i in range(0, len(record), 4)]
+                for chord in packed:
+                    if chord not in rows:
+                        rows[chord] = chord_index(chord[0] >> 4, library.chord_types[chord[1]], chord[0] & 0xf or None)
+                self._add_rows(minor[record[0]], [rows[chord] for chord in packed])
+
+    def add_files(self, paths):
+        """Count the sequences in any mix of chord sequence JSON files,
+        NDJSON streams (.ndjson) and libraries (.mcl), as read_sequences
+        would read them, and return how many there were."""
+        before = self.num_sequences
+        for path in paths:
+            extension = os.path.splitext(path)[1].lower()
+            if extension == '.ndjson':
+                with open(path, 'r') as f:
+                    for line_number, line in enumerate(f, 1):
+                        if line.strip():
+                            self._add_json(json.loads(line), f'{path} line {line_number}')
+            elif extension == '.mcl':
+                self._add_library(path)
+            else:
+                with open(path, 'r') as f:
+                    self._add_json(json.load(f), path)
+        return self.num_sequences - before
+
+    def merge(self, other):
+        """Add the counts of other to these."""
+        for counts, other_counts in zip(self._starts + self._transitions, other._starts + other._transitions):
+            for index, count in enumerate(other_counts):
+                if count:
+                    counts[index] += count
+        self.num_sequences += other.num_sequences
+        self.num_transitions += other.num_transitions
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __eq__(self, other):
+        return (isinstance(other, TransitionCounts) and
+                self._starts == other._starts and self._transitions == other._transitions)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_rows']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rows = {}
+
+    def count(self, from_chord, to_chord, minor=False):
+        """Return how often to_chord followed from_chord."""
+        from_row = self._row(from_chord.degree, from_chord.chord_type, from_chord.inversion)
+        to_row = self._row(to_chord.degree, to_chord.chord_type, to_chord.inversion)
+        return self._transitions[minor][from_row * NUM_CHORDS + to_row]
+
+    def start_count(self, chord, minor=False):
+        """Return how often a sequence started with chord."""
+        return self._starts[minor][self._row(chord.degree, chord.chord_type, chord.inversion)]
+
+    def probability(self, from_chord, to_chord, minor=False):
+        """Return the fraction of the transitions from from_chord that went
+        to to_chord, or 0 if from_chord was never followed by anything."""
+        from_row = self._row(from_chord.degree, from_chord.chord_type, from_chord.inversion) * NUM_CHORDS
+        total = sum(self._transitions[minor][from_row:from_row + NUM_CHORDS])
+        return self.count(from_chord, to_chord, minor) / total if total else 0
+
+    def transitions(self, minor=False):
+        """Generator of (from_chord, to_chord, count) for every transition
+        seen at least once."""
+        for index, count in enumerate(self._transitions[minor]):
+            if count:
+                from_row, to_row = divmod(index, NUM_CHORDS)
+                yield chord_from_index(from_row), chord_from_index(to_row), count
+
+    def to_dict(self):
+        retval = {'version': TRANSITIONS_FORMAT_VERSION,
+                  'num_sequences': self.num_sequences,
+                  'num_transitions': self.num_transitions}
+        for minor, mode in enumerate(('major', 'minor')):
+            retval[mode] = {
+                'starts': [[chord_from_index(row).name, count] for row, count in enumerate(self._starts[minor]) if count],
+                'transitions': [[from_chord.name, to_chord.name, count]
+                                for from_chord, to_chord, count in self.transitions(minor)]}
+        return retval
+
+    @classmethod
+    def from_dict(cls, counts_dict, source='transition counts'):
+        counts = cls()
+        try:
+            if counts_dict['version'] != TRANSITIONS_FORMAT_VERSION:
+                raise TransitionCountsError(f'{source} has unsupported version {counts_dict["version"]!r}')
+            for minor, mode in enumerate(('major', 'minor')):
+                for chord_name, count in counts_dict[mode]['starts']:
+                    chord = parse_map_chord(chord_name)
+                    counts._starts[minor][chord_index(chord.degree, chord.chord_type, chord.inversion)] = count
+                for from_name, to_name, count in counts_dict[mode]['transitions']:
+                    from_chord = parse_map_chord(from_name)
+                    to_chord = parse_map_chord(to_name)
+                    from_row = chord_index(from_chord.degree, from_chord.chord_type, from_chord.inversion)
+                    to_row = chord_index(to_chord.degree, to_chord.chord_type, to_chord.inversion)
+                    counts._transitions[minor][from_row * NUM_CHORDS + to_row] = count
+            counts.num_sequences = counts_dict['num_sequences']
+            counts.num_transitions = counts_dict['num_transitions']
+        except TransitionCountsError:
+            raise
+        except (KeyError, TypeError, ValueError, OverflowError, MellowchordError) as e:
+            raise TransitionCountsError(f'{source} is not a set of transition counts: {e!r}')
+        return counts
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            try:
+                counts_dict = json.load(f)
+            except ValueError as e:
+                raise TransitionCountsError(f'{path} is not JSON: {e}')
+        return cls.from_dict(counts_dict, path)
+
+
+def _count_files(paths):
+    counts = TransitionCounts()
+    counts.add_files(paths)
+    return counts
+
+
+def train_transition_counts(paths, workers=None):
+    """Return the TransitionCounts of every sequence in paths (see
+    TransitionCounts.add_files).  Files are shared out between a pool of
+    workers processes (default one per CPU) unless workers is 1, and their
+    counts merged as they finish."""
+    paths = list(paths)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return _count_files(paths)
+    import concurrent.futures
+    counts = TransitionCounts()
+    # A few chunks per worker keeps them all busy if files differ in size
+    num_chunks = min(len(paths), workers * 4)
+    chunks = [paths[index::num_chunks] for index in range(num_chunks)]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for chunk_counts in pool.map(_count_files, chunks):
+            counts.merge(chunk_counts)
+    return counts
@@ -0,0 +1,88 @@
+"""Generate chord sequences in many keys from one degree-level enumeration.
+
+Chord sequences are the same in every key of a mode, only the KeyedChord
+objects differ.  Sequences are therefore enumerated once per mode as Chord
+tuples and materialized into each key through a per-key table that maps
+each Chord to its KeyedChord, so nothing is re-parsed and the graph is
+not walked again for every key.
+"""
+from .mellowchord import ALL_KEYS
+from .mellowchord import ChordMap
+from .mellowchord import InvalidArgumentError
+from .mellowchord import key_is_minor
+from .mellowchord import sequence_keyed_chord
+from .mellowchord import string_to_chord
+
+
+class Transposer(object):
+    """Materialize key-independent Chord sequences into keys.
+
+    The KeyedChord for each (key, chord) pair is built once, exactly as
+    ChordMap.gen_sequence builds it, and shared by every sequence that
+    uses it.
+    """
+    def __init__(self, octave_adjustment=0):
+        self.octave_adjustment = octave_adjustment
+        self._tables = {}
+
+    def keyed_chord(self, key, chord):
+        table = self._tables.setdefault(key, {})
+        keyed_chord = table.get(chord)
+        if keyed_chord is None:
+            keyed_chord = sequence_keyed_chord(key, chord, self.octave_adjustment)
+            table[chord] = keyed_chord
+        return keyed_chord
+
+    def transpose(self, chord_sequence, key):
+        """Return chord_sequence (Chord objects) as a list of KeyedChord
+        objects in key."""
+        table = self._tables.setdefault(key, {})
+        return [table[chord] if chord in table else self.keyed_chord(key, chord) for chord in chord_sequence]
+
+
+def _chord_position(chord_map, chord):
+    for node_index, node in enumerate(chord_map._g.nodes):
+        if chord in node.chords:
+            return (node_index, node.chords.index(chord))
+    return None
+
+
+def _chord_at_position(chord_map, position):
+    node_index, chord_index = position
+    nodes = chord_map._g.nodes
+    if node_index < len(nodes) and chord_index < len(nodes[node_index].chords):
+        return nodes[node_index].chords[chord_index]
+    return None
+
+
+def gen_sequence_all_keys(start, num_chords, start_key='C', keys=ALL_KEYS, octave_adjustment=0, definition=None,
+                          shard=None):
+    """Generator of (key, sequence) tuples, where each sequence is a list of
+    KeyedChord objects, for every chord sequence in every key in keys.
+
+    start is a chord name in start_key.  In the other keys the sequences
+    start on the chord at the same place in that key's map, so I in a
+    major key corresponds to i in a minor key.  For each key the
+    sequences are the same, in the same order, as
+    ChordMap(key, octave_adjustment, definition).gen_sequence() produces.
+    Output is ordered by sequence, and then by key in the order given.
+
+    If shard (a Shard) is given, the sequences of each mode are sharded as
+    ChordMap.gen_chord_sequence shards them and only those are produced.
+    """
+    source_map = ChordMap(start_key, definition=definition)
+    position = _chord_position(source_map, string_to_chord(start, start_key))
+    if position is None:
+        raise InvalidArgumentError(f'Chord ({start}) not found in map for this key ({start_key})')
+    transposer = Transposer(octave_adjustment)
+    for minor in (False, True):
+        mode_keys = [key for key in keys if key_is_minor(key) == minor]
+        if not mode_keys:
+            continue
+        mode_map = ChordMap(mode_keys[0], definition=definition)
+        mode_start = _chord_at_position(mode_map, position)
+        if mode_start is None:
+            continue
+        for chord_sequence in mode_map.gen_chord_sequence(mode_start, num_chords, shard):
+            for key in mode_keys:
+                yield (key, transposer.transpose(chord_sequence, key))
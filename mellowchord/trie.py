@@ -0,0 +1,245 @@
+"""In-memory set of chord sequences stored as a prefix tree.
+
+Sequences generated from one start chord are paths through the same chord
+map, so most of them share long prefixes with their neighbours.  A
+SequenceTrie stores each distinct prefix once.  Chords are interned to
+integer IDs and the nodes live in flat arrays (chord ID, first child, next
+sibling and a flag marking the end of a sequence), about eleven bytes per
+node, instead of a Python list and its pointers per sequence.
+"""
+import array
+import os
+import sys
+
+from .library import write_library
+from .mellowchord import chord_sequence_ndjson_line
+from .mellowchord import InvalidArgumentError
+from .mellowchord import KeyedChord
+
+
+_MAX_CHORDS = 0x10000
+
+
+def _chord_identity(chord):
+    # KeyedChord defines __eq__ but not __hash__, so it is identified by the
+    # fields its __eq__ compares
+    if isinstance(chord, KeyedChord):
+        return (chord.key, chord.degree, chord.chord_type, chord.inversion, chord.octave_adjustment)
+    return chord
+
+
+class SequenceTrie(object):
+    """A set of chord sequences (of KeyedChord or Chord objects).
+
+    Iteration is depth first: sequences come out grouped by prefix, each
+    before the longer sequences it is a prefix of, and sequences that
+    branch at the same point in the order their branches were first added.
+    So the order sequences were added in is only kept if they were added
+    grouped by prefix, as ChordMap.gen_sequence produces them.
+
+    Adding the sequences of an enumeration in the order they are generated
+    only walks the part of each sequence that differs from the one before,
+    so add is cheap when fed straight from ChordMap.gen_sequence or
+    gen_chord_sequence.  Iterating produces lists of the chord objects
+    first added, shared between sequences.
+    """
+    def __init__(self, sequences=None):
+        self._chords = []
+        self._chord_ids = {}
+        # id() of each chord in self._chords, which are kept alive by it
+        self._ids_by_object = {}
+        # Node 0 is the root.  A child or sibling of 0 means there is none.
+        self._symbol = array.array('H', [0])
+        self._child = array.array('I', [0])
+        self._sibling = array.array('I', [0])
+        self._terminal = bytearray(1)
+        self._count = 0
+        self._length_counts = {}
+        self._last_seq = ()
+        self._last_path = [0]
+        if sequences is not None:
+            self.update(sequences)
+
+    def _chord_id(self, chord):
+        chord_id = self._ids_by_object.get(id(chord))
+        if chord_id is None:
+            identity = _chord_identity(chord)
+            chord_id = self._chord_ids.get(identity)
+            if chord_id is None:
+                if len(self._chords) == _MAX_CHORDS:
+                    raise InvalidArgumentError(f'A SequenceTrie can hold at most {_MAX_CHORDS} distinct chords')
+                chord_id = len(self._chords)
+                self._chord_ids[identity] = chord_id
+                self._chords.append(chord)
+                self._ids_by_object[id(chord)] = chord_id
+        return chord_id
+
+    def _find_child(self, node, chord_id):
+        child = self._child[node]
+        while child and self._symbol[child] != chord_id:
+            child = self._sibling[child]
+        return child
+
+    def _find(self, seq):
+        """Return the node for seq, or None if it is not a prefix of any
+        sequence in the trie."""
+        node = 0
+        for chord in seq:
+            chord_id = self._chord_ids.get(_chord_identity(chord))
+            if chord_id is None:
+                return None
+            node = self._find_child(node, chord_id)
+            if not node:
+                return None
+        return node
+
+    def add(self, seq):
+        """Add a sequence, returning True if it was not already there."""
+        seq = tuple(seq)
+        if not seq:
+            raise InvalidArgumentError('Can\'t store an empty chord sequence')
+        symbol = self._symbol
+        child = self._child
+        sibling = self._sibling
+        last_seq = self._last_seq
+        path = self._last_path
+        common = 0
+        limit = min(len(seq), len(last_seq))
+        while common < limit and seq[common] is last_seq[common]:
+            common += 1
+        del path[common + 1:]
+        node = path[-1]
+        for chord in seq[common:]:
+            chord_id = self._chord_id(chord)
+            previous = 0
+            next_node = child[node]
+            while next_node and symbol[next_node] != chord_id:
+                previous = next_node
+                next_node = sibling[next_node]
+            if not next_node:
+                next_node = len(symbol)
+                symbol.append(chord_id)
+                child.append(0)
+                sibling.append(0)
+                self._terminal.append(0)
+                if previous:
+                    sibling[previous] = next_node
+                else:
+                    child[node] = next_node
+            node = next_node
+            path.append(node)
+        self._last_seq = seq
+        if self._terminal[node]:
+            return False
+        self._terminal[node] = 1
+        self._count += 1
+        self._length_counts[len(seq)] = self._length_counts.get(len(seq), 0) + 1
+        return True
+
+    def update(self, sequences):
+        """Add every sequence from an iterable and return how many were
+        new."""
+        added = 0
+        for seq in sequences:
+            added += self.add(seq)
+        return added
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, seq):
+        node = self._find(seq)
+        return bool(node) and bool(self._terminal[node])
+
+    def _walk(self, node, prefix):
+        chords = self._chords
+        symbol = self._symbol
+        child = self._child
+        sibling = self._sibling
+        terminal = self._terminal
+        path = list(prefix)
+        if node and terminal[node]:
+            yield list(path)
+        stack = [child[node]]
+        while stack:
+            current = stack[-1]
+            if not current:
+                stack.pop()
+                if stack:
+                    path.pop()
+                    stack[-1] = sibling[stack[-1]]
+                continue
+            path.append(chords[symbol[current]])
+            if terminal[current]:
+                yield list(path)
+            stack.append(child[current])
+
+    def __iter__(self):
+        return self._walk(0, ())
+
+    def with_prefix(self, prefix):
+        """Generator of the sequences that start with prefix (including
+        prefix itself, if it is in the trie)."""
+        node = self._find(prefix)
+        if node is None:
+            return iter(())
+        return self._walk(node, [self._chords[self._chord_ids[_chord_identity(chord)]] for chord in prefix])
+
+    def count(self, prefix=()):
+        """Return the number of sequences that start with prefix."""
+        if not prefix:
+            return self._count
+        node = self._find(prefix)
+        if node is None:
+            return 0
+        retval = self._terminal[node]
+        stack = [self._child[node]]
+        while stack:
+            current = stack.pop()
+            while current:
+                retval += self._terminal[current]
+                if self._child[current]:
+                    stack.append(self._child[current])
+                current = self._sibling[current]
+        return retval
+
+    @property
+    def num_nodes(self):
+        """Number of nodes, not counting the root."""
+        return len(self._symbol) - 1
+
+    def memory_usage(self):
+        """Return the number of bytes used by the nodes."""
+        return sum(nodes.itemsize * len(nodes) for nodes in (self._symbol, self._child, self._sibling)) +\
+            len(self._terminal)
+
+    def list_memory_usage(self):
+        """Return the number of bytes the same sequences would take as a
+        list of lists, counting only the lists (not the chords, which are
+        shared either way)."""
+        list_sizes = sum(count * sys.getsizeof([None] * length) for length, count in self._length_counts.items())
+        return sys.getsizeof([None] * self._count) + list_sizes
+
+    def memory_report(self):
+        """Return a dict comparing the memory used by the trie with the
+        list of lists form, in total and per sequence."""
+        trie_bytes = self.memory_usage()
+        list_bytes = self.list_memory_usage()
+        return {'sequences': self._count,
+                'nodes': self.num_nodes,
+                'chords': len(self._chords),
+                'trie_bytes': trie_bytes,
+                'list_bytes': list_bytes,
+                'trie_bytes_per_sequence': trie_bytes / self._count if self._count else 0.0,
+                'list_bytes_per_sequence': list_bytes / self._count if self._count else 0.0}
+
+    def export(self, path):
+        """Write every KeyedChord sequence to path, as a chord library if it
+        ends in .mcl or as NDJSON otherwise, and return how many were
+        written."""
+        if os.path.splitext(path)[1].lower() == '.mcl':
+            return write_library(path, self)
+        with open(path, 'w') as f:
+            for seq in self:
+                f.write(chord_sequence_ndjson_line(seq[0].key, seq))
+        return self._count
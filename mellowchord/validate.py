@@ -0,0 +1,256 @@
+"""Bulk checks that melodies fit their chord sequences.
+
+A melody fits if every note is one MelodyGenerator could have picked in
+its position, judged by pitch class so octaves don't matter.  The notes
+allowed in each position (slot) are kept as a 12-bit mask of pitch
+classes.
+
+validate_melodies checks a whole batch of melodies over one chord
+sequence at a time, packed as bytes of MIDI note numbers, one row per
+melody.  Each slot is one column of the batch.  bytes.translate turns a
+column into one byte per melody: 1 where the note is outside the slot's
+mask, 0 elsewhere.  Read as a big integer, a column then takes a handful
+of bitwise operations to work out which melodies fail first in that slot,
+however many melodies there are.  No Python code runs per note.
+"""
+from array import array
+import collections
+import json
+import sys
+
+import musthe
+
+from .analyze import pitch_class_mask
+from .mellowchord import Chord
+from .mellowchord import KeyedChord
+from .mellowchord import MellowchordError
+from .mellowchord import MelodyGenerator
+
+
+# Melodies checked at once by MelodyStreamValidator
+DEFAULT_BATCH_SIZE = 1 << 16
+# Chord sequences whose masks MelodyStreamValidator keeps
+DEFAULT_MASKS_CACHE_SIZE = 256
+
+
+class MelodyValidationError(MellowchordError):
+    pass
+
+
+def slot_masks(key, chord_sequence, notes_per_chord):
+    """Return the pitch class mask of the notes allowed in each slot of a
+    melody with notes_per_chord notes per chord over chord_sequence."""
+    melody_gen = MelodyGenerator(key, chord_sequence, notes_per_chord)
+    return [pitch_class_mask(note.midi_note() for note in notes) for notes in melody_gen._possible_notes()]
+
+
+def pack_melodies(melodies, num_slots):
+    """Return melodies (sequences of MIDI note numbers, num_slots long) as
+    the rows of a batch for validate_melodies."""
+    packed = bytearray()
+    for index, melody in enumerate(melodies):
+        if len(melody) != num_slots:
+            raise MelodyValidationError(f'Melody {index} has {len(melody)} notes instead of {num_slots}')
+        try:
+            packed.extend(melody)
+        except ValueError:
+            raise MelodyValidationError(f'Melody {index} has a note outside the MIDI range')
+    return bytes(packed)
+
+
+class ValidationResult(object):
+    """Which melodies of a batch passed, and the first slot each failed in.
+
+    passed holds a byte per melody, 1 for pass and 0 for fail.
+    """
+    def __init__(self, passed, first_slots):
+        self.passed = passed
+        # Slot plus 1 of the first note that doesn't fit, or 0
+        self._first_slots = first_slots
+
+    def __len__(self):
+        return len(self.passed)
+
+    @property
+    def num_failed(self):
+        return self.passed.count(0)
+
+    def first_violation(self, index):
+        """Return the first slot of melody index whose note doesn't fit,
+        or None if the melody passed."""
+        return self._first_slots[index] - 1 if self._first_slots[index] else None
+
+    def failures(self):
+        """Generator of (melody index, first slot that doesn't fit) for
+        every melody that failed, in order."""
+        index = self.passed.find(0)
+        while index != -1:
+            yield index, self._first_slots[index] - 1
+            index = self.passed.find(0, index + 1)
+
+
+_violation_tables = {}
+
+
+def _violation_table(mask):
+    # Translates a MIDI note to 1 if its pitch class isn't in mask, and
+    # anything that isn't a MIDI note to 1 too
+    try:
+        return _violation_tables[mask]
+    except KeyError:
+        table = _violation_tables[mask] = bytes(0 if note < 128 and mask >> (note % 12) & 1 else 1
+                                                for note in range(256))
+        return table
+
+
+def validate_melodies(masks, melodies):
+    """Check every melody of a batch against masks (see slot_masks) and
+    return a ValidationResult.  melodies is either rows of MIDI note
+    numbers packed into a bytes-like object (see pack_melodies) or a list
+    of melodies to pack."""
+    num_slots = len(masks)
+    if not num_slots:
+        raise MelodyValidationError('There are no slots to check')
+    if isinstance(melodies, (bytes, bytearray, memoryview)):
+        data = bytes(melodies)
+    else:
+        data = pack_melodies(melodies, num_slots)
+    num_melodies, remainder = divmod(len(data), num_slots)
+    if remainder:
+        raise MelodyValidationError(f'{len(data)} notes is not a whole number of melodies of {num_slots} notes')
+    # Each melody is a lane of the big integers, one byte wide while slot
+    # numbers fit in a byte and two bytes beyond that
+    width = 1 if num_slots < 255 else 2
+    lanes = bytearray(width * num_melodies)
+    failed = 0
+    first_slots = 0
+    for slot, mask in enumerate(masks):
+        column = data[slot::num_slots].translate(_violation_table(mask))
+        if 1 not in column:
+            continue
+        if width == 1:
+            violations = int.from_bytes(column, 'big')
+        else:
+            lanes[width - 1::width] = column
+            violations = int.from_bytes(lanes, 'big')
+        # Lanes are 0 or 1, so multiplying by the slot can't carry into
+        # the next lane, and each failed lane is added to once
+        first = violations & ~failed
+        if first:
+            failed |= violations
+            first_slots += first * (slot + 1)
+    failed_bytes = failed.to_bytes(width * num_melodies, 'big')[width - 1::width]
+    passed = failed_bytes.translate(bytes((1, 0)) + bytes(254))
+    first_slot_array = array('B' if width == 1 else 'H', first_slots.to_bytes(width * num_melodies, 'big'))
+    if width > 1 and sys.byteorder == 'little':
+        first_slot_array.byteswap()
+    return ValidationResult(passed, first_slot_array)
+
+
+class _LineBatch(object):
+    def __init__(self, masks, chords):
+        self.masks = masks
+        self.chords = chords
+        self.rows = bytearray()
+        self.line_numbers = []
+
+
+class MelodyStreamValidator(object):
+    """Checks the melodies of NDJSON streams against their chord sequences.
+
+    Lines are as mc compose writes them (key, seq and melody) or, if key
+    and chord_sequence (KeyedChord objects) are given, as melodygen writes
+    them (melody only).  Melodies over the same chords, one after another,
+    are checked batch_size at a time.  The masks of the last
+    masks_cache_size chord sequences are kept, so streams of any number of
+    different sequences are checked in bounded memory.  num_checked and
+    num_failed count every melody checked so far.
+    """
+    def __init__(self, key=None, chord_sequence=None, batch_size=DEFAULT_BATCH_SIZE,
+                 masks_cache_size=DEFAULT_MASKS_CACHE_SIZE):
+        self.key = key
+        self.chord_sequence = chord_sequence
+        self.batch_size = batch_size
+        self.masks_cache_size = masks_cache_size
+        self.num_checked = 0
+        self.num_failed = 0
+        # MIDI note numbers by scientific notation, and back
+        self._notes = {}
+        self._note_names = {}
+        # (masks, chords) by (key and chord attributes, or None for
+        # chord_sequence, and notes per chord), least recently used first
+        self._masks = collections.OrderedDict()
+
+    def _masks_for(self, line_dict, num_notes, where):
+        if 'seq' in line_dict:
+            key = line_dict['key']
+            chords_id = (key, tuple((c['degree'], c['chord_type'], c['inversion']) for c in line_dict['seq']))
+            num_chords = len(chords_id[1])
+        elif self.chord_sequence is not None:
+            key = self.key
+            chords_id = None
+            num_chords = len(self.chord_sequence)
+        else:
+            raise MelodyValidationError(f'{where} has no chord sequence to check against')
+        notes_per_chord, remainder = divmod(num_notes, num_chords)
+        if remainder or notes_per_chord not in (1, 2, 3, 4):
+            raise MelodyValidationError(f'{where} has {num_notes} notes, which don\'t fit {num_chords} chords')
+        masks_id = (chords_id, notes_per_chord)
+        entry = self._masks.get(masks_id)
+        if entry is not None:
+            self._masks.move_to_end(masks_id)
+            return entry
+        if chords_id is None:
+            chords = list(self.chord_sequence)
+        else:
+            chords = [KeyedChord(key, Chord(*attributes)) for attributes in chords_id[1]]
+        entry = self._masks[masks_id] = (slot_masks(key, chords, notes_per_chord), chords)
+        while len(self._masks) > self.masks_cache_size:
+            self._masks.popitem(last=False)
+        return entry
+
+    def _check(self, batch):
+        result = validate_melodies(batch.masks, batch.rows)
+        num_slots = len(batch.masks)
+        notes_per_chord = num_slots // len(batch.chords)
+        self.num_checked += len(result)
+        self.num_failed += result.num_failed
+        for index, slot in result.failures():
+            note = self._note_names[batch.rows[index * num_slots + slot]]
+            yield batch.line_numbers[index], slot, note, batch.chords[slot // notes_per_chord]
+
+    def check(self, f, source='melodies'):
+        """Generator of (line number, first slot that doesn't fit, its
+        note, the chord over it) for every melody in the open stream f that
+        doesn't fit its chord sequence."""
+        notes = self._notes
+        batch = None
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            where = f'{source} line {line_number}'
+            try:
+                line_dict = json.loads(line)
+                melody = line_dict['melody']
+                masks, chords = self._masks_for(line_dict, len(melody), where)
+                for note in melody:
+                    if note not in notes:
+                        midi_note = notes[note] = musthe.Note(note).midi_note()
+                        self._note_names.setdefault(midi_note, note)
+                row = [notes[note] for note in melody]
+            except MelodyValidationError:
+                raise
+            except (ValueError, KeyError, TypeError, IndexError, AssertionError) as e:
+                raise MelodyValidationError(f'{where} is not a melody: {e!r}')
+            if batch is not None and (batch.masks is not masks or len(batch.line_numbers) >= self.batch_size):
+                yield from self._check(batch)
+                batch = None
+            if batch is None:
+                batch = _LineBatch(masks, chords)
+            try:
+                batch.rows.extend(row)
+            except ValueError:
+                raise MelodyValidationError(f'{where} has a note outside the MIDI range')
+            batch.line_numbers.append(line_number)
+        if batch is not None:
+            yield from self._check(batch)
@@ -16,7 +16,6 @@ setup(
     install_requires=['ConfigArgParse',
                       'mido',
                       'musthe',
-                      'networkx',
                       'readchar'],
     description=get_global("version.py", "__description__"),
     long_description=get_global("version.py", "__description__"),